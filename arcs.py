@@ -0,0 +1,247 @@
+#
+# Title: G-code interpreter program
+# File: arcs.py
+# Description: Segmentation of circular and helical arcs (G02/G03) into
+#   line segments.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# An arc is given by its start and end points and either the offsets of
+# its center from the start point (I, J, K) or its radius (R; a negative
+# radius selects the longer of the two possible arcs). The arc lies in
+# the selected plane; the third axis moves linearly along it (a helix).
+# A start point equal to the end point with center offsets is a full
+# circle.
+#
+# The arc is split into chords so that no chord is further than the
+# tolerance from the true arc: a chord spanning the angle a on radius r
+# deviates r * (1 - cos(a / 2)) from it. The chord points are computed
+# for all angles at once, relative to the start point. Programs repeat
+# the same arcs over and over (patterned holes, corner roundings), so
+# the relative points are cached by the rounded relative geometry and
+# only moved to the start point of every arc.
+#
+# NumPy is used when it is installed; without it the points are computed
+# one by one with the math module.
+#
+
+import math
+import functools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Largest distance of a chord from the arc [mm].
+TOLERANCE = 0.01
+# Largest angle of a chord, even when the tolerance allows more [rad].
+MAX_STEP = math.pi / 2.0
+# Largest allowed difference of the start and end radius [mm].
+RADIUS_ERROR = 0.05
+# Decimals of the relative geometry in the cache keys.
+KEY_DECIMALS = 9
+# Number of cached arcs.
+CACHE_SIZE = 4096
+
+# Axis indices (first, second, linear) of the planes, in (X, Y, Z).
+# Counter-clockwise arcs turn from the first axis towards the second.
+XY = (0, 1, 2)
+ZX = (2, 0, 1)
+YZ = (1, 2, 0)
+
+
+def arc_center(start, end, axes, clockwise, offsets=None, radius=None):
+    """ Finds the center of an arc.
+    Args:
+      start, end (tuple): X, Y, Z of the start and end points.
+      axes (tuple): plane of the arc, XY, ZX or YZ.
+      clockwise (bool): True for G02, False for G03.
+      offsets (tuple): I, J, K offsets of the center from the start
+        point, 0.0 for the ones not given. Used if given.
+      radius (float): radius of the arc, negative for an arc of over
+        180 degrees.
+    Returns:
+      The center as an (X, Y, Z) tuple; the linear axis coordinate is
+      the one of the start point.
+    Raises:
+      ValueError: if the center cannot be found.
+    """
+    a, b, c = axes
+    center = list(start)
+
+    if (offsets is not None):
+        center[a] = start[a] + offsets[a]
+        center[b] = start[b] + offsets[b]
+        return tuple(center)
+
+    if (radius is None):
+        raise ValueError("arc needs a radius or center offsets")
+
+    da = end[a] - start[a]
+    db = end[b] - start[b]
+    chord = math.hypot(da, db)
+    if (chord == 0.0):
+        raise ValueError("radius arc needs an end point different from "
+                         "the start point")
+    half = chord / 2.0
+    if (half > abs(radius) + RADIUS_ERROR):
+        raise ValueError("radius {:.3f} is too small for the end "
+                         "point".format(radius))
+
+    # The center is on the left of the chord for counter-clockwise arcs
+    # of up to 180 degrees, and on the right for the others.
+    height = math.sqrt(max(radius * radius - half * half, 0.0))
+    side = 1.0 if ((not clockwise) != (radius < 0.0)) else -1.0
+    center[a] = start[a] + da / 2.0 - side * height * db / chord
+    center[b] = start[b] + db / 2.0 + side * height * da / chord
+    return tuple(center)
+
+
+def arc_sweep(start, end, center, axes, clockwise):
+    """ Computes the angles and radii of an arc.
+    Args:
+      start, end, center (tuple): X, Y, Z of the points.
+      axes (tuple): plane of the arc, XY, ZX or YZ.
+      clockwise (bool): direction of the arc.
+    Returns:
+      Tuple (start angle, sweep, start radius, end radius); the sweep is
+      negative for clockwise arcs.
+    Raises:
+      ValueError: if the radius is zero or the start and end radius
+        differ by more than RADIUS_ERROR.
+    """
+    a, b, c = axes
+    sa = start[a] - center[a]
+    sb = start[b] - center[b]
+    ea = end[a] - center[a]
+    eb = end[b] - center[b]
+    r0 = math.hypot(sa, sb)
+    r1 = math.hypot(ea, eb)
+    if ((r0 == 0.0) or (r1 == 0.0)):
+        raise ValueError("arc radius is zero")
+    if (abs(r1 - r0) > RADIUS_ERROR):
+        raise ValueError("start and end radius differ ({:.3f} and "
+                         "{:.3f})".format(r0, r1))
+
+    a0 = math.atan2(sb, sa)
+    sweep = math.atan2(eb, ea) - a0
+    # The same start and end point is a full circle.
+    if (clockwise):
+        if (sweep >= -1e-12):
+            sweep -= 2.0 * math.pi
+    elif (sweep <= 1e-12):
+        sweep += 2.0 * math.pi
+
+    return a0, sweep, r0, r1
+
+
+def num_segments(sweep, radius, tolerance=TOLERANCE):
+    """ Returns the number of chords needed for an arc.
+    Args:
+      sweep (float): angle of the arc [rad].
+      radius (float): largest radius of the arc.
+      tolerance (float): largest distance of a chord from the arc.
+    """
+    step = 2.0 * math.acos(max(1.0 - tolerance / radius, -1.0))
+    step = min(step, MAX_STEP)
+    return max(1, int(math.ceil(abs(sweep) / step - 1e-9)))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _relative_points(end, center, axes, clockwise, tolerance):
+    """ Chord end points of an arc starting at the origin (cached).
+    Args:
+      end, center (tuple): rounded X, Y, Z relative to the start point.
+      axes, clockwise, tolerance: see relative_chords().
+    Returns:
+      N x 3 read-only float64 array (a tuple of tuples without NumPy) of
+      the chord end points relative to the start point. The last one is
+      the end point.
+    """
+    start = (0.0, 0.0, 0.0)
+    a0, sweep, r0, r1 = arc_sweep(start, end, center, axes, clockwise)
+    num = num_segments(sweep, max(r0, r1), tolerance)
+    a, b, c = axes
+
+    if (np is None):
+        points = list()
+        for k in range(1, num):
+            t = k / num
+            angle = a0 + sweep * t
+            radius = r0 + (r1 - r0) * t
+            point = [0.0, 0.0, 0.0]
+            point[a] = center[a] + radius * math.cos(angle)
+            point[b] = center[b] + radius * math.sin(angle)
+            point[c] = end[c] * t
+            points.append(tuple(point))
+        points.append(tuple(end))
+        return tuple(points)
+
+    t = np.arange(1, num + 1, dtype=np.float64) / num
+    angle = a0 + sweep * t
+    radius = r0 + (r1 - r0) * t
+    points = np.empty((num, 3))
+    points[:, a] = center[a] + radius * np.cos(angle)
+    points[:, b] = center[b] + radius * np.sin(angle)
+    points[:, c] = end[c] * t
+    points[-1] = end
+    points.flags.writeable = False
+    return points
+
+
+def relative_chords(start, end, center, axes, clockwise,
+                    tolerance=TOLERANCE):
+    """ Splits an arc into chords relative to its start point. The
+    result is cached and shared between calls, so it must not be
+    modified.
+    Args:
+      start, end, center (tuple): X, Y, Z of the points, see
+        arc_center().
+      axes (tuple): plane of the arc, XY, ZX or YZ.
+      clockwise (bool): True for G02, False for G03.
+      tolerance (float): largest distance of a chord from the arc.
+    Returns:
+      N x 3 read-only float64 array (a tuple of tuples without NumPy) of
+      the chord end points relative to the start point; the last one is
+      the end point.
+    Raises:
+      ValueError: if the arc is not valid, see arc_sweep().
+    """
+    x, y, z = start
+    rel_end = (round(end[0] - x, KEY_DECIMALS),
+               round(end[1] - y, KEY_DECIMALS),
+               round(end[2] - z, KEY_DECIMALS))
+    rel_center = (round(center[0] - x, KEY_DECIMALS),
+                  round(center[1] - y, KEY_DECIMALS),
+                  round(center[2] - z, KEY_DECIMALS))
+    return _relative_points(rel_end, rel_center, axes, clockwise, tolerance)
+
+
+def segment_arc(start, end, center, axes, clockwise, tolerance=TOLERANCE):
+    """ Splits an arc into chords.
+    Args:
+      start, end, center, axes, clockwise, tolerance: see
+        relative_chords().
+    Returns:
+      N x 3 float64 array (a list of tuples without NumPy) of the chord
+      end points; the last one is the end point.
+    Raises:
+      ValueError: if the arc is not valid, see arc_sweep().
+    """
+    points = relative_chords(start, end, center, axes, clockwise, tolerance)
+
+    if (np is None):
+        x, y, z = start
+        points = [(x + px, y + py, z + pz) for px, py, pz in points]
+        points[-1] = tuple(end)
+        return points
+
+    points = points + np.asarray(start, dtype=np.float64)
+    points[-1] = end
+    return points
+
+
+def cache_info():
+    """ Returns the hit and miss counts of the arc cache. """
+    return _relative_points.cache_info()
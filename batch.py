@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+#
+# Title: G-code interpreter program
+# File: batch.py
+# Description: Simulates many G-code files in parallel and writes a
+#   summary report.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import concurrent.futures
+
+from main import parse_file
+from block import ParseError
+from interpreter import Interpreter
+from subprogram import Subprograms
+from machineclient import MachineClient
+from sinks import ErrorSink
+
+# File name extensions picked up from directories.
+GCODE_EXTENSIONS = (".gcode", ".nc", ".ngc", ".tap", ".cnc")
+
+
+def main(args):
+    opts = parse_args(args[1:])
+
+    try:
+        files = collect_files(opts.inputs, opts.manifest)
+    except OSError as err:
+        print("Error: {}.".format(err))
+        return 1
+
+    if (len(files) == 0):
+        print("Error: no G-code files found.")
+        return 1
+
+    start = time.perf_counter()
+    results = simulate_files(files, opts.workers)
+    report = make_report(results, time.perf_counter() - start)
+
+    if (opts.output is not None):
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    print(format_summary(report))
+
+    return 0 if (report["summary"]["failed"] == 0) else 2
+
+
+def parse_args(args):
+    """ Parses the command line arguments.
+    Args:
+      args (list): arguments without the program name.
+    Returns:
+      argparse.Namespace with the options.
+    """
+    parser = argparse.ArgumentParser(prog="batch.py",
+        description="Simulates many G-code programs in parallel.")
+    parser.add_argument("inputs", nargs="*",
+        help="G-code files, directories or glob patterns")
+    parser.add_argument("-m", "--manifest",
+        help="text file listing one G-code file per line")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-o", "--output",
+        help="write the full report as JSON into this file")
+
+    return parser.parse_args(args)
+
+
+def collect_files(inputs, manifest=None):
+    """ Gets the list of files to simulate.
+    Args:
+      inputs (list): file names, directories (searched recursively for
+        GCODE_EXTENSIONS) or glob patterns.
+      manifest (str): optional text file with one file name per line.
+        Relative names are relative to the manifest, "#" starts a comment.
+    Returns:
+      A sorted list of unique file names, so the order of the results
+      never depends on the file system or on the workers.
+    Raises:
+      OSError: if the manifest cannot be read.
+    """
+    names = list(inputs)
+
+    if (manifest is not None):
+        base = os.path.dirname(manifest)
+        with open(manifest) as f:
+            for txt_row in f:
+                txt_row = txt_row.split("#", 1)[0].strip()
+                if (len(txt_row) > 0):
+                    names.append(os.path.join(base, txt_row))
+
+    files = set()
+    for name in names:
+        if (os.path.isdir(name)):
+            for root, dirs, dir_files in os.walk(name):
+                for file_name in dir_files:
+                    if (file_name.lower().endswith(GCODE_EXTENSIONS)):
+                        files.add(os.path.join(root, file_name))
+        elif (glob.has_magic(name)):
+            files.update(path for path in glob.glob(name, recursive=True)
+                         if (os.path.isfile(path)))
+        else:
+            files.add(name)
+
+    return sorted(os.path.normpath(name) for name in files)
+
+
+def simulate_file(file_name):
+    """ Simulates one G-code file without any output.
+    Args:
+      file_name (str): G-code file to run.
+    Returns:
+      A dict with the "file", "ok", "errors" (parse and machine errors,
+      and any other exception, which fails only this file),
+      "pgm_num", "num_blocks", "num_commands", the final machine "state"
+      and the run "time" in seconds.
+    """
+    sink = ErrorSink()
+    pgm_data = {"pgm_num": None, "num_commands": 0}
+    errors = list()
+    state = None
+    num_blocks = 0
+    start = time.perf_counter()
+
+    try:
+        # Bytes that are not UTF-8, e.g. in comments, are not worth 
+        # failing the file for; they are replaced like in reader.py.
+        with open(file_name, errors="replace") as f:
+            machine = MachineClient(sink)
+            program = Subprograms(parse_file(f, pgm_data))
+            execute = Interpreter(machine, program).execute
+            for block in program:
+                num_blocks += 1
+                sink.block_begin(num_blocks, block)
+                for cmd in block.commands:
+                    execute(cmd)
+            state = machine.get_state()
+
+    except OSError as err:
+        errors.append(str(err))
+
+    except ParseError as err:
+        errors.append(str(err))
+
+    except Exception as err:
+        # E.g. an OverflowError from a huge number; the other files of
+        # the batch are still run.
+        errors.append("{}: {}".format(type(err).__name__, err))
+
+    errors.extend(sink.errors)
+
+    return {
+        "file": file_name,
+        "ok": (len(errors) == 0),
+        "errors": errors,
+        "pgm_num": pgm_data["pgm_num"],
+        "num_blocks": num_blocks,
+        "num_commands": pgm_data["num_commands"],
+        "state": state,
+        "time": time.perf_counter() - start,
+    }
+
+
+def simulate_files(files, workers=None):
+    """ Simulates files in a process pool.
+    Args:
+      files (list): G-code files to run.
+      workers (int): number of worker processes, None for one per CPU.
+        With 1 the files are run in this process.
+    Returns:
+      The results of simulate_file(), in the same order as files.
+    """
+    if (workers == 1):
+        return [simulate_file(file_name) for file_name in files]
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # map() returns the results in input order whichever worker
+        # finishes first.
+        return list(executor.map(simulate_file, files, chunksize=4))
+
+
+def make_report(results, elapsed):
+    """ Builds the report of a batch run.
+    Args:
+      results (list): results of simulate_file().
+      elapsed (float): wall clock time of the whole batch [s].
+    Returns:
+      A dict with the "summary" and the per-file "results".
+    """
+    summary = {
+        "files": len(results),
+        "failed": sum(1 for result in results if (not result["ok"])),
+        "blocks": sum(result["num_blocks"] for result in results),
+        "commands": sum(result["num_commands"] for result in results),
+        "cpu_time": sum(result["time"] for result in results),
+        "wall_time": elapsed,
+    }
+
+    return {"summary": summary, "results": results}
+
+
+def format_summary(report):
+    """ Formats the summary and the failed files of a report as text. """
+    summary = report["summary"]
+    lines = list()
+
+    for result in report["results"]:
+        if (not result["ok"]):
+            lines.append("FAILED {}:".format(result["file"]))
+            for error in result["errors"]:
+                lines.append("    {}".format(error))
+
+    lines.append("{} files, {} failed, {} blocks, {} commands in {:.2f} s."
+        .format(summary["files"], summary["failed"], summary["blocks"],
+                summary["commands"], summary["wall_time"]))
+
+    return "\n".join(lines)
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
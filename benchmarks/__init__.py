@@ -0,0 +1,11 @@
+"""Benchmarks for the G-code interpreter.
+
+Run the modules from the repository root, e.g.:
+
+    python -m benchmarks.bench_dispatch
+    python -m benchmarks.suite -o results.json
+    python -m benchmarks.suite --compare results.json
+
+The suite generates synthetic programs (see generators.py) and times
+their parse, compile and execute phases.
+"""
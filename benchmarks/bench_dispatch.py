@@ -0,0 +1,177 @@
+#
+# Title: G-code interpreter program
+# File: benchmarks/bench_dispatch.py
+# Description: Command dispatch throughput, old vs. Interpreter.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+import sys
+import time
+
+from block import Opcode, compile_block
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+
+# One pass over these rows gives 16 commands.
+PATTERN = [
+    "G90 G54 G00 X-12.000 Y-12.000",
+    "G01 Z-5.000 F100.",
+    "G01 X110.000 Y-10.000",
+    "G01 Y210.000",
+    "G94 G21 G17",
+    "T01 M06",
+    "S2000 M03",
+    "G00 Z10.000 M09",
+]
+
+
+def generate_blocks(num_commands):
+    """ Compiles a synthetic program of about num_commands commands.
+    Args:
+      num_commands (int): number of commands to generate.
+    Returns:
+      A list of compiled blocks.
+    """
+    blocks = list()
+    count = 0
+    line_num = 0
+    while (count < num_commands):
+        for txt_row in PATTERN:
+            line_num += 1
+            block = compile_block(txt_row, line_num)
+            blocks.append(block)
+            count += len(block)
+
+    return blocks
+
+
+def old_commands(blocks):
+    """ Converts compiled blocks into the command dicts of the dispatch
+    used before the Interpreter: the command word as a string and its
+    parameters (here the compiled Command, which the machine takes now).
+    Args:
+      blocks (list): compiled blocks.
+    Returns:
+      A list of {"cmd": word, "params": Command} dicts.
+    """
+    commands = list()
+    for block in blocks:
+        for cmd in block.commands:
+            if (cmd.op == Opcode.T):
+                word = "T{:02d}".format(cmd.arg)
+            elif (cmd.op == Opcode.S):
+                word = "S{}".format(cmd.arg)
+            else:
+                word = cmd.op.name
+            commands.append({"cmd": word, "params": cmd})
+
+    return commands
+
+
+def execute_command_old(machine, cmd_data):
+    """ The dispatch used before the Interpreter, as it was: both tables
+    are built again for every command, keyed by the command word. """
+    G_COMMANDS = {
+        "G00": machine.rapid_move,
+        "G01": machine.lin_move,
+        "G17": machine.set_plane_xy,
+        "G18": machine.set_plane_zx,
+        "G19": machine.set_plane_yz,
+        "G20": machine.set_unit_inch,
+        "G21": machine.set_unit_mm,
+        "G28": machine.home,
+        "G40": machine.set_cutter_comp_off,
+        "G49": machine.cancel_tool_length_comp,
+        "G54": machine.set_coord_system,
+        "G55": machine.set_coord_system,
+        "G56": machine.set_coord_system,
+        "G57": machine.set_coord_system,
+        "G58": machine.set_coord_system,
+        "G59": machine.set_coord_system,
+        "G80": machine.cancel_canned_cycle,
+        "G90": machine.set_dist_mode_abs,
+        "G91": machine.set_dist_mode_inc,
+        "G93": machine.set_feed_rate_mode_invtime,
+        "G94": machine.set_feed_rate_mode_upmin,
+        "G95": machine.set_feed_rate_mode_uprev,
+    }
+    M_COMMANDS = {
+        "M03": machine.set_spindle_mode_cw,
+        "M04": machine.set_spindle_mode_ccw,
+        "M05": machine.set_spindle_mode_halt,
+        "M06": machine.manual_tool_change,
+        "M07": machine.coolant_on,
+        "M08": machine.coolant_on,
+        "M09": machine.coolant_off,
+        "M30": machine.program_end,
+    }
+    T_COMMAND = machine.change_tool
+    S_COMMAND = machine.set_spindle_speed
+
+    cmd = cmd_data["cmd"]
+    par = cmd_data.get("params")
+    cmd_num = cmd[1 : len(cmd)]
+
+    if (cmd in G_COMMANDS):
+        if ((int(cmd_num) >= 54) and (int(cmd_num) <= 59)):
+            par = int(cmd_num) - 53
+
+        G_COMMANDS[cmd](par)
+        return
+
+    if (cmd in M_COMMANDS):
+        M_COMMANDS[cmd](par)
+        return
+
+    if (cmd[0] == "T"):
+        tool_name = "TOOL #" + cmd_num
+        T_COMMAND(tool_name)
+        return
+
+    if (cmd[0] == "S"):
+        spindle_speed = int( cmd_num )
+        S_COMMAND(spindle_speed)
+        return
+
+
+def quiet_machine():
+    """ Returns a MachineClient whose status messages are discarded, so
+    that the benchmark measures dispatch and not terminal output. """
+    return MachineClient(NullSink())
+
+
+def bench_old(blocks):
+    commands = old_commands(blocks)
+    machine = quiet_machine()
+    start = time.perf_counter()
+    for cmd_data in commands:
+        execute_command_old(machine, cmd_data)
+    return time.perf_counter() - start
+
+
+def bench_new(blocks):
+    interpreter = Interpreter(quiet_machine())
+    start = time.perf_counter()
+    interpreter.run(blocks)
+    return time.perf_counter() - start
+
+
+def main(args):
+    num_commands = int(args[1]) if (len(args) > 1) else 1000000
+    blocks = generate_blocks(num_commands)
+    num_commands = sum(len(block) for block in blocks)
+    print("Program: {} blocks, {} commands".format(len(blocks), num_commands))
+
+    for name, bench in (("before (per-command tables)", bench_old),
+                        ("after (Interpreter)", bench_new)):
+        elapsed = bench(blocks)
+        print("{:<30s} {:8.3f} s {:12,.0f} commands/s"
+            .format(name, elapsed, num_commands / elapsed))
+
+    return 0
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
@@ -0,0 +1,120 @@
+#
+# Title: G-code interpreter program
+# File: benchmarks/bench_reader.py
+# Description: Text file parser vs. memory mapped reader: time and peak
+#   memory.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Every reader runs in a fresh process. The memory reported is the peak
+# resident size of the parse itself: the peak is reset after the imports
+# (through /proc/self/clear_refs on Linux) and the size before the parse
+# is subtracted, so the interpreter and its modules, some 30 MB, do not
+# hide the difference. The pages of a mapped file count in the resident
+# size once touched, so "nodrop" maps the file without releasing the
+# parsed pages, to show the part of the file a reader keeps resident.
+#
+
+import os
+import sys
+import time
+import mmap
+import random
+import resource
+import tempfile
+import subprocess
+
+
+def generate_file(file_name, num_lines):
+    """ Writes a synthetic program of mostly short G01 moves. """
+    rnd = random.Random(1)
+    with open(file_name, "w") as f:
+        f.write("%\nO0001\n(SYNTHETIC TOOLPATH)\nG90 G94 G21 G17\nT01 M06\n")
+        for i in range(num_lines):
+            if (i % 1000 == 0):
+                f.write("(PASS {})\nG00 Z5.000\nS2000 M03\n".format(i))
+            f.write("N{} G01 X{:.3f} Y{:.3f} Z{:.3f}\n".format(i,
+                rnd.uniform(0, 100), rnd.uniform(0, 100), rnd.uniform(-5, 0)))
+        f.write("M30\n%\n")
+
+
+def memory_status():
+    """ Returns the current and the peak resident size [kB], or None for
+    ones not available. """
+    values = {"VmRSS": None, "VmHWM": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                name, sep, value = line.partition(":")
+                if (name in values):
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return values["VmRSS"], values["VmHWM"]
+
+
+def reset_peak():
+    """ Resets the peak resident size of this process, if possible. """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def measure(mode, file_name):
+    """ Parses the file and returns the time [s], the number of blocks
+    and the peak growth of the resident size [kB] during the parse. Run
+    in a fresh process. """
+    from main import parse_file
+    from reader import parse_mapped, parse_buffer
+
+    pgm_data = dict()
+    reset_peak()
+    before, peak = memory_status()
+    if (before is None):
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if (mode == "file"):
+        with open(file_name) as f:
+            num_blocks = sum(1 for block in parse_file(f, pgm_data))
+    elif (mode == "mapped"):
+        num_blocks = sum(1 for block in parse_mapped(file_name, pgm_data))
+    else:
+        with open(file_name, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            num_blocks = sum(1 for block in parse_buffer(mm, pgm_data))
+    elapsed = time.perf_counter() - start
+
+    current, peak = memory_status()
+    if (peak is None):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, num_blocks, peak - before
+
+
+def main(args):
+    if ((len(args) == 4) and (args[1] == "--measure")):
+        print(*measure(args[2], args[3]))
+        return 0
+
+    num_lines = int(args[1]) if (len(args) > 1) else 1000000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, "bench.gcode")
+        generate_file(file_name, num_lines)
+        print("File: {} lines, {:.1f} MB".format(num_lines,
+            os.path.getsize(file_name) / 1e6))
+
+        for mode in ("file", "mapped", "nodrop"):
+            out = subprocess.run([sys.executable, "-m",
+                "benchmarks.bench_reader", "--measure", mode, file_name],
+                check=True, capture_output=True, text=True).stdout.split()
+            print("{:<8s} {:8.3f} s  {:8d} blocks  parse peak RSS {:8d} kB"
+                .format(mode, float(out[0]), int(out[1]), int(out[2])))
+
+    return 0
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+#
+# Title: G-code interpreter program
+# File: benchmarks/generators.py
+# Description: Synthetic G-code programs for the benchmarks.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Every generator writes a complete, valid program of about the given
+# number of lines into a text file object. The programs only depend on
+# the seed, so the same arguments always give the same file.
+#
+
+import random
+
+# Program header: program number, modes, first tool.
+HEADER = ("%\nO1000\n(SYNTHETIC PROGRAM)\nG90 G94 G21 G17 G40 G49 G80\n"
+          "T01 M06\nS2000 M03\nG54 G00 X0.000 Y0.000 Z5.000\n")
+FOOTER = "G00 Z10.000 M09\nG91 G28 Z0.000 M05\nM30\n%\n"
+
+
+def pocketing(f, num_lines, rnd):
+    """ Clearing a pocket: millions of short G01 segments in zigzag
+    passes, stepping down in Z between the layers. """
+    x = y = 0.0
+    z = 0.0
+    step = 0.05
+    direction = 1.0
+    f.write("G01 Z-0.500 F300.\nF1200.\n")
+    for i in range(num_lines):
+        if (i % 2000 == 1999):
+            z -= 0.5
+            f.write("G01 Z{:.3f}\n".format(z))
+            continue
+        if (i % 200 == 199):
+            y += 0.4
+            direction = -direction
+            f.write("G01 Y{:.3f}\n".format(y))
+            continue
+        x += direction * (step + rnd.uniform(0.0, 0.01))
+        f.write("G01 X{:.3f} Y{:.3f}\n".format(x, y + rnd.uniform(-0.01, 0.01)))
+
+
+def comment_heavy(f, num_lines, rnd):
+    """ A program from a CAM post-processor that comments everything:
+    four comment lines for every move. """
+    for i in range(num_lines):
+        if (i % 5 == 4):
+            f.write("G01 X{:.3f} Y{:.3f} F800.\n".format(
+                rnd.uniform(0.0, 200.0), rnd.uniform(0.0, 200.0)))
+        elif (i % 5 == 0):
+            f.write("(OPERATION {} - CONTOUR - TOLERANCE 0.01 - STOCK TO "
+                    "LEAVE 0.2)\n".format(i // 5))
+        else:
+            f.write("({})\n".format("-" * rnd.randint(10, 70)))
+
+
+def long_lines(f, num_lines, rnd):
+    """ Long blocks with a line number and many G and M words each. """
+    for i in range(num_lines):
+        f.write("N{} G17 G21 G90 G94 G40 G49 G80 G54 S{} M03 M08 "
+                "G01 X{:.3f} Y{:.3f} Z{:.3f} F{:.1f}\n".format(
+            (i + 1) * 10, rnd.randint(1000, 12000), rnd.uniform(0.0, 200.0),
+            rnd.uniform(0.0, 200.0), rnd.uniform(-5.0, 0.0),
+            rnd.uniform(100.0, 2000.0)))
+
+
+def tool_changes(f, num_lines, rnd):
+    """ A tool change every few blocks, with spindle and coolant changes
+    and rapid moves around them. """
+    for i in range(num_lines):
+        part = i % 8
+        if (part == 0):
+            f.write("G00 Z50.000 M09\n")
+        elif (part == 1):
+            f.write("M05\n")
+        elif (part == 2):
+            f.write("T{:02d} M06\n".format(rnd.randint(1, 24)))
+        elif (part == 3):
+            f.write("S{} M03\n".format(rnd.randint(1000, 12000)))
+        elif (part == 4):
+            f.write("G00 X{:.3f} Y{:.3f} M08\n".format(
+                rnd.uniform(0.0, 200.0), rnd.uniform(0.0, 200.0)))
+        else:
+            f.write("G01 Z{:.3f} F{:.1f}\n".format(rnd.uniform(-5.0, 0.0),
+                rnd.uniform(100.0, 2000.0)))
+
+
+def hole_pattern(f, num_lines, rnd):
+    """ Circular pockets in a grid: every hole is the same set of G03
+    arcs at another position, followed by rapid moves to the next. """
+    for i in range(num_lines):
+        part = i % 6
+        if (part == 0):
+            f.write("G00 X{:.3f} Y{:.3f}\n".format(
+                (i // 6) % 50 * 20.0 + 5.0, (i // 300) % 50 * 20.0))
+        elif (part == 1):
+            f.write("G01 Z-2.000 F300.\n")
+        elif (part == 2):
+            f.write("G03 X{:.3f} Y{:.3f} I-2.500 J0.000 F800.\n".format(
+                (i // 6) % 50 * 20.0, (i // 300) % 50 * 20.0))
+        elif (part == 3):
+            f.write("G03 I5.000 J0.000\n")
+        elif (part == 4):
+            f.write("G02 X{:.3f} Y{:.3f} R{:.3f}\n".format(
+                (i // 6) % 50 * 20.0 + 5.0, (i // 300) % 50 * 20.0,
+                rnd.choice((2.5, -2.5))))
+        else:
+            f.write("G00 Z5.000\n")
+
+
+def drilling(f, num_lines, rnd):
+    """ A plate of holes in a grid: canned drilling cycles with a new
+    cycle every 1000 holes and bare X/Y positions for the rest. """
+    cycles = ("G81 R2.000 Z-8.000 F200.", "G83 R2.000 Z-15.000 Q3.000 F150.",
+              "G73 R1.000 Z-6.000 Q1.500 F250.", "G82 R2.000 Z-4.000 P0.2 F200.")
+    f.write("G99\n")
+    for i in range(num_lines):
+        x = (i % 200) * 5.0
+        y = (i // 200) % 200 * 5.0 + rnd.uniform(-0.01, 0.01)
+        if (i % 1000 == 0):
+            f.write("{} X{:.3f} Y{:.3f}\n".format(
+                cycles[(i // 1000) % len(cycles)], x, y))
+        else:
+            f.write("X{:.3f} Y{:.3f}\n".format(x, y))
+    f.write("G80\n")
+
+
+# Generators by name.
+GENERATORS = {
+    "pocketing": pocketing,
+    "comment_heavy": comment_heavy,
+    "long_lines": long_lines,
+    "tool_changes": tool_changes,
+    "hole_pattern": hole_pattern,
+    "drilling": drilling,
+}
+
+
+def generate(name, file_name, num_lines, seed=1):
+    """ Writes a synthetic program into a file.
+    Args:
+      name (str): key of GENERATORS.
+      file_name (str): file to write.
+      num_lines (int): approximate number of lines of the program body.
+      seed (int): random seed.
+    """
+    rnd = random.Random(seed)
+    with open(file_name, "w") as f:
+        f.write(HEADER)
+        GENERATORS[name](f, num_lines, rnd)
+        f.write(FOOTER)
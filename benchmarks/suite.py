@@ -0,0 +1,271 @@
+#
+# Title: G-code interpreter program
+# File: benchmarks/suite.py
+# Description: Benchmark suite: parse, compile and execute times of the
+#   synthetic programs, stored as JSON for comparing commits.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Phases, each timed separately (the best of --repeat runs):
+#   "parse": main.parse_file() with block compiling switched off, i.e.
+#     reading the lines and checking the markers, comments and program
+#     number.
+#   "compile": block.compile_block() of the lines with commands.
+#   "execute": main.run_program() of the compiled blocks, without output.
+#   "total": main.parse_file() and main.run_program() together, as a
+#     quiet run of main.py does with a text stream.
+# The garbage collector is off while timing, like in timeit: the compile
+# phase keeps all blocks in memory, and the collections caused by that
+# would be charged to whichever phase happens to trigger them.
+#
+# Usage:
+#   python -m benchmarks.suite [-n LINES] [-r REPEAT] [-o results.json]
+#       [--compare baseline.json] [generator ...]
+#
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import main
+from block import compile_block
+from sinks import NullSink
+from benchmarks.generators import GENERATORS, generate
+
+PHASES = ("parse", "compile", "execute", "total")
+# Relative slowdown reported as a regression by --compare.
+THRESHOLD = 0.10
+
+
+def time_best(func, repeat):
+    """ Runs a function repeat times, without garbage collection.
+    Returns:
+      Tuple (best time [s], result of the last run).
+    """
+    best = None
+    result = None
+    for i in range(repeat):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if ((best is None) or (elapsed < best)):
+            best = elapsed
+
+    return best, result
+
+
+def parse_only(file_name):
+    """ main.parse_file() without compiling the blocks. Returns the
+    stripped lines that would have been compiled. """
+    rows = list()
+
+    def collect(txt_row, line_num=0):
+        rows.append((txt_row, line_num))
+        return None
+
+    original = main.compile_block
+    main.compile_block = collect
+    try:
+        with open(file_name) as f:
+            for block in main.parse_file(f, dict()):
+                pass
+    finally:
+        main.compile_block = original
+
+    return rows
+
+
+def compile_rows(rows):
+    """ Compiles the rows from parse_only(). """
+    blocks = list()
+    for txt_row, line_num in rows:
+        block = compile_block(txt_row, line_num)
+        if (block is not None):
+            blocks.append(block)
+    return blocks
+
+
+def execute_blocks(blocks, num_commands):
+    """ Runs compiled blocks with main.run_program(). """
+    pgm_data = {"pgm_num": 1000, "num_commands": num_commands,
+                "commands": blocks}
+    main.run_program(pgm_data, NullSink())
+
+
+def run_total(file_name):
+    """ Parses and runs a file like main.py does. """
+    pgm_data = dict()
+    with open(file_name) as f:
+        pgm_data["commands"] = main.parse_file(f, pgm_data)
+        main.run_program(pgm_data, NullSink())
+    return pgm_data
+
+
+def bench_file(file_name, repeat):
+    """ Times all phases of one program.
+    Args:
+      file_name (str): G-code file.
+      repeat (int): runs per phase.
+    Returns:
+      A dict with the "lines", "blocks" and "commands" of the program and
+      for every phase its best "time_s" and "us_per_line".
+    """
+    with open(file_name) as f:
+        num_lines = sum(1 for line in f)
+
+    times = dict()
+    times["parse"], rows = time_best(lambda: parse_only(file_name), repeat)
+    times["compile"], blocks = time_best(lambda: compile_rows(rows), repeat)
+    num_commands = sum(len(block) for block in blocks)
+    times["execute"], result = time_best(
+        lambda: execute_blocks(blocks, num_commands), repeat)
+    times["total"], result = time_best(lambda: run_total(file_name), repeat)
+
+    result = {
+        "lines": num_lines,
+        "blocks": len(blocks),
+        "commands": num_commands,
+    }
+    for phase in PHASES:
+        result[phase] = {
+            "time_s": times[phase],
+            "us_per_line": times[phase] / num_lines * 1e6,
+        }
+
+    return result
+
+
+def git_commit():
+    """ Returns the current git commit of the repository, or None. """
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(main.__file__)),
+            capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return out.stdout.strip()
+
+
+def run_suite(names, num_lines, repeat, seed=1):
+    """ Generates the programs and benchmarks them.
+    Args:
+      names (list): generator names.
+      num_lines (int): program size [lines].
+      repeat (int): runs per phase.
+      seed (int): random seed of the generators.
+    Returns:
+      The results as a dict: "meta" describes the run, "results" has
+      the result of bench_file() by generator name.
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in names:
+            file_name = os.path.join(tmp_dir, name + ".gcode")
+            generate(name, file_name, num_lines, seed)
+            results[name] = bench_file(file_name, repeat)
+            os.remove(file_name)
+
+    meta = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "num_lines": num_lines,
+        "repeat": repeat,
+        "seed": seed,
+    }
+
+    return {"meta": meta, "results": results}
+
+
+def format_results(report, baseline=None, threshold=THRESHOLD):
+    """ Formats the results as a text table.
+    Args:
+      report (dict): result of run_suite().
+      baseline (dict): an earlier result of run_suite() to compare to.
+      threshold (float): relative slowdown marked as a regression.
+    Returns:
+      Tuple (text, number of regressions).
+    """
+    lines = ["{:<16s} {:<8s} {:>10s} {:>10s}".format("program", "phase",
+        "time s", "us/line") + ("" if (baseline is None) else
+        " {:>10s} {:>8s}".format("baseline", "change"))]
+    regressions = 0
+
+    for name, result in report["results"].items():
+        for phase in PHASES:
+            entry = result[phase]
+            txt = "{:<16s} {:<8s} {:>10.3f} {:>10.3f}".format(name, phase,
+                entry["time_s"], entry["us_per_line"])
+            old = None
+            if (baseline is not None):
+                old = baseline["results"].get(name, dict()).get(phase)
+            if (old is not None):
+                change = entry["us_per_line"] / old["us_per_line"] - 1.0
+                txt += " {:>10.3f} {:>+7.1f}%".format(old["us_per_line"],
+                                                      change * 100.0)
+                if (change > threshold):
+                    txt += "  REGRESSION"
+                    regressions += 1
+            lines.append(txt)
+
+    return "\n".join(lines), regressions
+
+
+def main_suite(args):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite",
+        description="Times the parse, compile and execute phases of "
+                    "synthetic G-code programs.")
+    parser.add_argument("generators", nargs="*",
+        help="programs to run: {} (default: all)".format(
+            ", ".join(GENERATORS)))
+    parser.add_argument("-n", "--lines", type=int, default=100000,
+        help="size of every program [lines] (default: 100000)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="runs per phase, the best is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=1,
+        help="random seed of the generators (default: 1)")
+    parser.add_argument("-o", "--output",
+        help="write the results as JSON into this file")
+    parser.add_argument("--compare",
+        help="JSON results of an earlier run to compare to")
+    opts = parser.parse_args(args[1:])
+
+    names = opts.generators or list(GENERATORS)
+    for name in names:
+        if (name not in GENERATORS):
+            parser.error("unknown generator '{}'".format(name))
+
+    baseline = None
+    if (opts.compare is not None):
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+
+    report = run_suite(names, opts.lines, opts.repeat, opts.seed)
+
+    if (opts.output is not None):
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    txt, regressions = format_results(report, baseline)
+    print(txt)
+
+    return 0 if (regressions == 0) else 2
+
+
+if (__name__ == '__main__'):
+    sys.exit(main_suite(sys.argv))
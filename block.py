@@ -0,0 +1,530 @@
+#
+# Title: G-code interpreter program
+# File: block.py
+# Description: Compiled representation of G-code blocks.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+import enum
+import struct
+
+
+class ParseError(Exception):
+    """ Raised when the G-code program data is invalid. """
+
+
+class Opcode(enum.IntEnum):
+    """ Numeric codes of the commands understood by the interpreter. """
+    UNKNOWN = 0
+    G00 = 1
+    G01 = 2
+    G17 = 3
+    G18 = 4
+    G19 = 5
+    G20 = 6
+    G21 = 7
+    G28 = 8
+    G40 = 9
+    G49 = 10
+    G54 = 11
+    G55 = 12
+    G56 = 13
+    G57 = 14
+    G58 = 15
+    G59 = 16
+    G80 = 17
+    G90 = 18
+    G91 = 19
+    G93 = 20
+    G94 = 21
+    G95 = 22
+    M03 = 23
+    M04 = 24
+    M05 = 25
+    M06 = 26
+    M07 = 27
+    M08 = 28
+    M09 = 29
+    M30 = 30
+    T = 31
+    S = 32
+    G02 = 33
+    G03 = 34
+    M98 = 35
+    M99 = 36
+    # Program number of a subprogram definition ("O2000").
+    O = 37
+    G43 = 38
+    G10 = 39
+    G73 = 40
+    G81 = 41
+    G82 = 42
+    G83 = 43
+    G85 = 44
+    G89 = 45
+    G98 = 46
+    G99 = 47
+    # Axis words without a command ("X10 Y20"), repeating the active
+    # motion mode.
+    AXES = 48
+
+
+# Command words mapped to opcodes. Both the zero padded ("G01") and the
+# short ("G1") spelling are accepted.
+OPCODES = dict()
+for _op in Opcode:
+    if ((len(_op.name) > 1) and _op.name[1:].isdigit()):
+        OPCODES[_op.name] = _op
+        OPCODES[_op.name[0] + str(int(_op.name[1:]))] = _op
+
+
+class ModalGroup(enum.IntEnum):
+    """ Modal groups of the commands. Only one command of a group can be
+    in effect at a time (see LinuxCNC docs, "Modal Groups"). """
+    NONE = 0
+    MOTION = 1
+    PLANE = 2
+    DISTANCE = 3
+    FEED_MODE = 4
+    UNITS = 5
+    CUTTER_COMP = 6
+    TOOL_LENGTH = 7
+    COORD_SYSTEM = 8
+    STOPPING = 9
+    TOOL_CHANGE = 10
+    SPINDLE = 11
+    COOLANT = 12
+    RETURN_MODE = 13
+
+
+# Modal group of each opcode. Commands missing here are non-modal.
+MODAL_GROUPS = {
+    Opcode.G00: ModalGroup.MOTION,
+    Opcode.G01: ModalGroup.MOTION,
+    Opcode.G02: ModalGroup.MOTION,
+    Opcode.G03: ModalGroup.MOTION,
+    Opcode.G80: ModalGroup.MOTION,
+    Opcode.G73: ModalGroup.MOTION,
+    Opcode.G81: ModalGroup.MOTION,
+    Opcode.G82: ModalGroup.MOTION,
+    Opcode.G83: ModalGroup.MOTION,
+    Opcode.G85: ModalGroup.MOTION,
+    Opcode.G89: ModalGroup.MOTION,
+    Opcode.G17: ModalGroup.PLANE,
+    Opcode.G18: ModalGroup.PLANE,
+    Opcode.G19: ModalGroup.PLANE,
+    Opcode.G90: ModalGroup.DISTANCE,
+    Opcode.G91: ModalGroup.DISTANCE,
+    Opcode.G93: ModalGroup.FEED_MODE,
+    Opcode.G94: ModalGroup.FEED_MODE,
+    Opcode.G95: ModalGroup.FEED_MODE,
+    Opcode.G20: ModalGroup.UNITS,
+    Opcode.G21: ModalGroup.UNITS,
+    Opcode.G40: ModalGroup.CUTTER_COMP,
+    Opcode.G43: ModalGroup.TOOL_LENGTH,
+    Opcode.G49: ModalGroup.TOOL_LENGTH,
+    Opcode.G54: ModalGroup.COORD_SYSTEM,
+    Opcode.G55: ModalGroup.COORD_SYSTEM,
+    Opcode.G56: ModalGroup.COORD_SYSTEM,
+    Opcode.G57: ModalGroup.COORD_SYSTEM,
+    Opcode.G58: ModalGroup.COORD_SYSTEM,
+    Opcode.G59: ModalGroup.COORD_SYSTEM,
+    Opcode.M30: ModalGroup.STOPPING,
+    Opcode.M06: ModalGroup.TOOL_CHANGE,
+    Opcode.M03: ModalGroup.SPINDLE,
+    Opcode.M04: ModalGroup.SPINDLE,
+    Opcode.M05: ModalGroup.SPINDLE,
+    Opcode.M07: ModalGroup.COOLANT,
+    Opcode.M08: ModalGroup.COOLANT,
+    Opcode.M09: ModalGroup.COOLANT,
+    Opcode.G98: ModalGroup.RETURN_MODE,
+    Opcode.G99: ModalGroup.RETURN_MODE,
+}
+
+# Letters starting a command, and the parameter letters of a G command
+# (and of M98).
+COMMAND_CODES = ("G", "T", "S", "M")
+PARAMETER_CODES = ("X", "Y", "Z", "F", "I", "J", "K", "R", "P", "L", "H",
+                   "Q")
+# Axis letters, which start an AXES command when no G command is open.
+AXIS_CODES = ("X", "Y", "Z")
+
+
+class Command:
+    """ A single compiled command.
+    Attributes:
+      op (Opcode): the command.
+      arg: tool number (T), spindle speed (S), program number (O) or the
+        original word of an unknown command, None otherwise.
+      x, y, z, f (float): parameter values, None when not given.
+      i, j, k, r (float): arc center offsets and radius (G02/G03), or
+        the R plane of a canned cycle, None when not given.
+      p, l (float): program number and repeat count (M98), the number
+        and the type of an offset (G10), or the dwell and the repeat
+        count of a canned cycle, None when not given.
+      h (float): tool length offset number (G43), None when not given.
+      q (float): peck depth of a canned cycle (G73, G83), None when not
+        given.
+    """
+    __slots__ = ("op", "arg", "x", "y", "z", "f", "i", "j", "k", "r",
+                 "p", "l", "h", "q")
+
+    def __init__(self, op, arg=None):
+        self.op = op
+        self.arg = arg
+        self.x = None
+        self.y = None
+        self.z = None
+        self.f = None
+        self.i = None
+        self.j = None
+        self.k = None
+        self.r = None
+        self.p = None
+        self.l = None
+        self.h = None
+        self.q = None
+
+
+    def has_params(self):
+        """ Returns True if any of the X, Y, Z and F parameters was given
+        for the command. """
+        return ((self.x is not None) or (self.y is not None)
+            or (self.z is not None) or (self.f is not None))
+
+
+    def has_arc_params(self):
+        """ Returns True if any of the I, J, K and R parameters was given
+        for the command. """
+        return ((self.i is not None) or (self.j is not None)
+            or (self.k is not None) or (self.r is not None))
+
+
+    def __str__(self):
+        if (self.op == Opcode.UNKNOWN):
+            text = self.arg
+        elif (self.op == Opcode.T):
+            text = "T{:02d}".format(self.arg)
+        elif (self.op == Opcode.S):
+            text = "S{}".format(self.arg)
+        elif (self.op == Opcode.O):
+            text = "O{}".format(self.arg)
+        elif (self.op == Opcode.AXES):
+            # Just the words.
+            text = ""
+        else:
+            text = self.op.name
+
+        for name, value in (("X", self.x), ("Y", self.y), ("Z", self.z),
+                            ("I", self.i), ("J", self.j), ("K", self.k),
+                            ("R", self.r), ("F", self.f)):
+            if (value is not None):
+                text += " {}{:.3f}".format(name, value)
+        if (self.q is not None):
+            text += " Q{:.3f}".format(self.q)
+        for name, value in (("P", self.p), ("L", self.l), ("H", self.h)):
+            if (value is not None):
+                text += " {}{:g}".format(name, value)
+
+        return text.lstrip()
+
+
+    def __repr__(self):
+        return "<Command {}>".format(self)
+
+
+class Block:
+    """ A compiled line of G-code.
+    Attributes:
+      line (int): line number in the source file.
+      commands (tuple): Command objects in the order they were written.
+    """
+    __slots__ = ("line", "commands")
+
+    def __init__(self, line, commands):
+        self.line = line
+        self.commands = commands
+
+
+    def __len__(self):
+        return len(self.commands)
+
+
+    def __iter__(self):
+        return iter(self.commands)
+
+
+    def __repr__(self):
+        return "<Block line {}: {}>".format(
+            self.line, " ".join(str(cmd) for cmd in self.commands))
+
+
+def compile_block(txt_row, line_num=0):
+    """ Compiles the commands on a text row into a Block. The numeric
+    values are converted once here, so executing the block does not
+    need to look at the text anymore.
+    Args:
+      txt_row (string): text line to scan for G-code commands.
+      line_num (int): line number of the row in the source file.
+    Returns:
+      A Block, or None if the row has no commands.
+    Raises:
+      ParseError: if a numeric value cannot be converted.
+    """
+    commands = list()
+    last_gcode = None
+
+    for word in txt_row.upper().split():
+        letter = word[0]
+
+        # Line number, unused.
+        if (letter == "N"):
+            continue
+
+        try:
+            # Adding parameters to the last G command (or M98).
+            if (last_gcode is not None):
+                if (letter in PARAMETER_CODES):
+                    value = float(word[1:])
+                    if (letter == "X"):
+                        last_gcode.x = value
+                    elif (letter == "Y"):
+                        last_gcode.y = value
+                    elif (letter == "Z"):
+                        last_gcode.z = value
+                    elif (letter == "F"):
+                        last_gcode.f = value
+                    elif (letter == "I"):
+                        last_gcode.i = value
+                    elif (letter == "J"):
+                        last_gcode.j = value
+                    elif (letter == "K"):
+                        last_gcode.k = value
+                    elif (letter == "R"):
+                        last_gcode.r = value
+                    elif (letter == "P"):
+                        last_gcode.p = value
+                    elif (letter == "H"):
+                        last_gcode.h = value
+                    elif (letter == "Q"):
+                        last_gcode.q = value
+                    else:
+                        last_gcode.l = value
+                    continue
+                else:
+                    last_gcode = None
+
+            if (letter not in COMMAND_CODES):
+                if (letter in AXIS_CODES):
+                    # Axis words without a command: the parameters of an
+                    # AXES command.
+                    value = float(word[1:])
+                    last_gcode = Command(Opcode.AXES)
+                    if (letter == "X"):
+                        last_gcode.x = value
+                    elif (letter == "Y"):
+                        last_gcode.y = value
+                    else:
+                        last_gcode.z = value
+                    commands.append(last_gcode)
+                continue
+
+            if (letter == "T"):
+                cmd = Command(Opcode.T, int(word[1:]))
+            elif (letter == "S"):
+                cmd = Command(Opcode.S, int(word[1:]))
+            else:
+                op = OPCODES.get(word, Opcode.UNKNOWN)
+                cmd = Command(op, word if (op == Opcode.UNKNOWN) else None)
+                if ((letter == "G") or (op == Opcode.M98)):
+                    last_gcode = cmd
+
+        except ValueError:
+            raise ParseError("invalid value '{}' on line {}"
+                .format(word, line_num)) from None
+
+        commands.append(cmd)
+
+    if (len(commands) == 0):
+        return None
+
+    return Block(line_num, tuple(commands))
+
+
+# Packed command record: source line number, opcode, flags, argument and
+# the X, Y, Z, F, I, J, K, R, P, L, H and Q values. Used to pass compiled
+# blocks between processes and to store them on disk.
+RECORD = struct.Struct("<IBHq12d")
+# Version of the packed format. Must be increased whenever the record,
+# the opcodes or the compile rules change, so that stored data from an
+# older version is not used.
+FORMAT_VERSION = 5
+FLAG_X = 0x01
+FLAG_Y = 0x02
+FLAG_Z = 0x04
+FLAG_F = 0x08
+FLAG_ARG = 0x10
+FLAG_I = 0x20
+FLAG_J = 0x40
+FLAG_K = 0x80
+FLAG_R = 0x100
+FLAG_P = 0x200
+FLAG_L = 0x400
+FLAG_H = 0x800
+FLAG_Q = 0x1000
+
+# Opcodes by their value, faster than calling Opcode().
+_OPCODE_LIST = list(Opcode)
+
+
+def pack_blocks(blocks, words=None):
+    """ Packs compiled blocks into RECORD structs, one per command. The
+    commands of a block share the line number of the block.
+    Args:
+      blocks (iterable): compiled Block objects.
+      words (list): list to add the unknown command words to, when 
+        packing a program in parts. A new list if not given.
+    Returns:
+      Tuple (data, words): data is a bytearray of the records and words
+      the list of the unknown command words, the argument of an UNKNOWN
+      record being an index into it.
+    """
+    pack = RECORD.pack
+    data = bytearray()
+    if (words is None):
+        words = list()
+
+    for block in blocks:
+        line = block.line
+        for cmd in block.commands:
+            arg = cmd.arg
+            flags = 0
+            if (cmd.op == Opcode.UNKNOWN):
+                arg = len(words)
+                words.append(cmd.arg)
+            if (arg is None):
+                arg = 0
+            else:
+                flags = FLAG_ARG
+            x = cmd.x
+            if (x is None):
+                x = 0.0
+            else:
+                flags |= FLAG_X
+            y = cmd.y
+            if (y is None):
+                y = 0.0
+            else:
+                flags |= FLAG_Y
+            z = cmd.z
+            if (z is None):
+                z = 0.0
+            else:
+                flags |= FLAG_Z
+            f = cmd.f
+            if (f is None):
+                f = 0.0
+            else:
+                flags |= FLAG_F
+            i = cmd.i
+            if (i is None):
+                i = 0.0
+            else:
+                flags |= FLAG_I
+            j = cmd.j
+            if (j is None):
+                j = 0.0
+            else:
+                flags |= FLAG_J
+            k = cmd.k
+            if (k is None):
+                k = 0.0
+            else:
+                flags |= FLAG_K
+            r = cmd.r
+            if (r is None):
+                r = 0.0
+            else:
+                flags |= FLAG_R
+            p = cmd.p
+            if (p is None):
+                p = 0.0
+            else:
+                flags |= FLAG_P
+            l = cmd.l
+            if (l is None):
+                l = 0.0
+            else:
+                flags |= FLAG_L
+            h = cmd.h
+            if (h is None):
+                h = 0.0
+            else:
+                flags |= FLAG_H
+            q = cmd.q
+            if (q is None):
+                q = 0.0
+            else:
+                flags |= FLAG_Q
+            data += pack(line, cmd.op, flags, arg, x, y, z, f, i, j, k, r,
+                         p, l, h, q)
+
+    return data, words
+
+
+def unpack_blocks(data, words, line_offset=0):
+    """ Rebuilds compiled blocks from packed records.
+    Args:
+      data (bytes-like): records from pack_blocks().
+      words (list): unknown command words from pack_blocks().
+      line_offset (int): added to the line numbers of the records.
+    Yields:
+      Block objects.
+    """
+    opcodes = _OPCODE_LIST
+    unknown = Opcode.UNKNOWN
+    commands = list()
+    cur_line = None
+
+    for line, op, flags, arg, x, y, z, f, i, j, k, r, p, l, h, q in \
+            RECORD.iter_unpack(data):
+        if ((line != cur_line) and (len(commands) > 0)):
+            yield Block(cur_line + line_offset, tuple(commands))
+            commands = list()
+        cur_line = line
+
+        cmd = Command(opcodes[op])
+        if (op == unknown):
+            cmd.arg = words[arg]
+        elif (flags & FLAG_ARG):
+            cmd.arg = arg
+        if (flags & FLAG_X):
+            cmd.x = x
+        if (flags & FLAG_Y):
+            cmd.y = y
+        if (flags & FLAG_Z):
+            cmd.z = z
+        if (flags & FLAG_F):
+            cmd.f = f
+        if (flags > FLAG_ARG):
+            if (flags & FLAG_I):
+                cmd.i = i
+            if (flags & FLAG_J):
+                cmd.j = j
+            if (flags & FLAG_K):
+                cmd.k = k
+            if (flags & FLAG_R):
+                cmd.r = r
+            if (flags & FLAG_P):
+                cmd.p = p
+            if (flags & FLAG_L):
+                cmd.l = l
+            if (flags & FLAG_H):
+                cmd.h = h
+            if (flags & FLAG_Q):
+                cmd.q = q
+        commands.append(cmd)
+
+    if (len(commands) > 0):
+        yield Block(cur_line + line_offset, tuple(commands))
@@ -0,0 +1,380 @@
+#
+# Title: G-code interpreter program
+# File: cache.py
+# Description: On-disk cache of compiled G-code programs.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A compiled program is stored as the packed records of block.pack_blocks()
+# in a file named after the SHA-256 hash of the G-code file content and
+# the packed format version, so an edited file or a changed parser never
+# hits an old entry. The cache file is written while the program is first
+# parsed and only renamed into place when the whole file has been parsed
+# without errors. Later runs read the records through mmap, or, for the
+# batch tools such as the cycle time estimate, as one array.
+#
+# The cache directory is $CNC_SIM_CACHE_DIR, or "cnc-sim" under
+# $XDG_CACHE_HOME (~/.cache by default). The least recently used entries
+# are removed when the directory grows over its size limit.
+#
+# The machine state checkpoints of program.py are kept next to the entry
+# of the same file, under the same key, and evicted with the entries.
+#
+# Cache file layout (little-endian):
+#   header (HEADER), records (RECORD each), unknown words (UTF-8, one per
+#   line).
+#
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+
+from block import RECORD, FORMAT_VERSION, pack_blocks, unpack_blocks
+
+# Magic, format version, program number (-1 for none), number of
+# commands, number of records and the length of the words [bytes].
+HEADER = struct.Struct("<8sIqqqq")
+MAGIC = b"GCODEBIN"
+# Cache file name extension.
+EXTENSION = ".bin"
+# Name extension of the restart checkpoints of a file (see program.py).
+CHECKPOINT_EXTENSION = ".ckpt"
+# Default size limit of the cache directory [bytes].
+MAX_SIZE = 256 * 1024 * 1024
+# Number of blocks packed before they are written to the cache file.
+WRITE_BLOCKS = 4096
+# Read size when hashing the G-code file [bytes].
+HASH_CHUNK = 1024 * 1024
+
+
+def cache_dir():
+    """ Gets the default cache directory, see the top of this file. """
+    path = os.environ.get("CNC_SIM_CACHE_DIR")
+    if (path):
+        return path
+
+    base = os.environ.get("XDG_CACHE_HOME")
+    if (not base):
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "cnc-sim")
+
+
+def file_key(file_name):
+    """ Computes the cache key of a G-code file.
+    Args:
+      file_name (str): G-code file.
+    Returns:
+      The key as a hex string: hash of the content and the format version.
+    """
+    digest = hashlib.sha256()
+    digest.update("cnc-sim:{}:{}:".format(FORMAT_VERSION, RECORD.format)
+                  .encode())
+
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def checkpoint_path(file_name, directory=None):
+    """ Gets the name of the checkpoint file of a G-code file, see
+    Program.load_checkpoints() in program.py.
+    Args:
+      file_name (str): G-code file.
+      directory (str): cache directory, cache_dir() if None.
+    Returns:
+      The path; the file may not exist.
+    """
+    if (directory is None):
+        directory = cache_dir()
+
+    return os.path.join(directory, file_key(file_name) + CHECKPOINT_EXTENSION)
+
+
+def parse_cached(file_name, pgm_data, parse, directory=None,
+                 max_size=MAX_SIZE):
+    """ Yields the compiled blocks of a G-code file from the cache, or
+    parses the file and stores the result in the cache. Works like the
+    parse function given, see parse_file() in main.py.
+    Args:
+      file_name (str): G-code file (must be a regular file).
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+      parse (callable): parse(file_name, pgm_data) giving the blocks on a
+        cache miss, e.g. reader.parse_mapped.
+      directory (str): cache directory, cache_dir() if None.
+      max_size (int): size limit of the cache directory [bytes].
+    Yields:
+      A compiled Block for each line containing commands.
+    Raises:
+      ParseError: if the data markers or the program number are invalid.
+    """
+    if (directory is None):
+        directory = cache_dir()
+
+    path = os.path.join(directory, file_key(file_name) + EXTENSION)
+
+    if (read_header(path) is not None):
+        try:
+            # The mtime of an entry is its last use for the eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        yield from load(path, pgm_data)
+        return
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        # Without a cache directory the program is just parsed.
+        yield from parse(file_name, pgm_data)
+        return
+
+    yield from store(path, parse(file_name, pgm_data), pgm_data)
+    try:
+        evict(directory, max_size)
+    except OSError:
+        pass
+
+
+def read_header(path):
+    """ Reads and checks the header of a cache file.
+    Args:
+      path (str): cache file.
+    Returns:
+      The unpacked HEADER tuple, or None if the file does not exist or is
+      not a valid cache file (e.g. left by an older version).
+    """
+    try:
+        with open(path, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+            size = os.fstat(f.fileno()).st_size
+    except (OSError, struct.error):
+        return None
+
+    magic, version, pgm_num, num_commands, num_records, words_len = header
+    if ((magic != MAGIC) or (version != FORMAT_VERSION)
+            or (HEADER.size + num_records * RECORD.size + words_len != size)):
+        return None
+
+    return header
+
+
+def load(path, pgm_data):
+    """ Reads a compiled program from a cache file.
+    The file must have been checked with read_header().
+    Args:
+      path (str): cache file.
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+    Yields:
+      The compiled Blocks.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, pgm_num, num_commands, num_records, words_len = \
+                HEADER.unpack_from(mm)
+            data_end = HEADER.size + num_records * RECORD.size
+            words = mm[data_end:].decode("utf-8").split("\n")
+            pgm_data["pgm_num"] = None if (pgm_num < 0) else pgm_num
+            pgm_data["num_commands"] = 0
+
+            # The records are unpacked straight from the mapped pages.
+            # The view must be released before the map can be closed.
+            view = memoryview(mm)[HEADER.size:data_end]
+            blocks = unpack_blocks(view, words)
+            try:
+                for block in blocks:
+                    pgm_data["num_commands"] = (pgm_data["num_commands"]
+                                                + len(block))
+                    yield block
+            finally:
+                blocks.close()
+                view.release()
+
+
+def cached_records(file_name, pgm_data, directory=None):
+    """ Gets the packed records of a G-code file from the cache, for the
+    batch tools that work on them directly (see 
+    toolpath.build_toolpath_records()). Nothing is parsed on a miss; the
+    entry is made when the blocks are read through parse_cached().
+    Args:
+      file_name (str): G-code file.
+      pgm_data (dict): the program number and the number of commands are
+        stored here on a hit.
+      directory (str): cache directory, cache_dir() if None.
+    Returns:
+      Tuple (data, words) of the records and the unknown command words,
+      as from block.pack_blocks(), or None if the file is not cached.
+    """
+    if (directory is None):
+        directory = cache_dir()
+
+    path = os.path.join(directory, file_key(file_name) + EXTENSION)
+    if (read_header(path) is None):
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return load_records(path, pgm_data)
+
+
+def load_records(path, pgm_data):
+    """ Reads the packed records of a cache file.
+    The file must have been checked with read_header().
+    Args:
+      path (str): cache file.
+      pgm_data (dict): the program number and the number of commands are
+        stored here.
+    Returns:
+      Tuple (data, words), see cached_records().
+    """
+    with open(path, "rb") as f:
+        magic, version, pgm_num, num_commands, num_records, words_len = \
+            HEADER.unpack(f.read(HEADER.size))
+        data = f.read(num_records * RECORD.size)
+        words = f.read().decode("utf-8").split("\n")
+
+    pgm_data["pgm_num"] = None if (pgm_num < 0) else pgm_num
+    pgm_data["num_commands"] = num_commands
+    return data, words
+
+
+def store(path, blocks, pgm_data):
+    """ Passes the blocks through while writing them into a cache file.
+    The file appears only once all blocks have been read; if the parse
+    fails or the blocks are not read to the end, nothing is stored. A
+    cache file that cannot be written (e.g. a read-only directory or a
+    full disk) is a miss: the blocks are passed on all the same.
+    Args:
+      path (str): cache file to write.
+      blocks (iterable): compiled Blocks, from a parse function filling
+        pgm_data.
+      pgm_data (dict): program data of the parse.
+    Yields:
+      The blocks.
+    """
+    try:
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp",
+                                         dir=os.path.dirname(path))
+        f = os.fdopen(fd, "wb")
+    except OSError:
+        yield from blocks
+        return
+
+    words = list()
+    pending = list()
+    num_records = 0
+
+    try:
+        try:
+            f.write(bytes(HEADER.size))
+        except OSError:
+            f = discard(f, temp_path)
+            temp_path = None
+
+        for block in blocks:
+            if (f is not None):
+                pending.append(block)
+                if (len(pending) >= WRITE_BLOCKS):
+                    data = pack_blocks(pending, words)[0]
+                    pending.clear()
+                    try:
+                        f.write(data)
+                    except OSError:
+                        f = discard(f, temp_path)
+                        temp_path = None
+                    num_records += len(data) // RECORD.size
+            yield block
+
+        if (f is None):
+            return
+
+        try:
+            data = pack_blocks(pending, words)[0]
+            f.write(data)
+            num_records += len(data) // RECORD.size
+
+            words_data = "\n".join(words).encode("utf-8")
+            f.write(words_data)
+            pgm_num = pgm_data.get("pgm_num")
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION,
+                -1 if (pgm_num is None) else pgm_num,
+                pgm_data["num_commands"], num_records, len(words_data)))
+            f.close()
+            f = None
+
+            os.replace(temp_path, path)
+            temp_path = None
+        except OSError:
+            pass
+
+    finally:
+        discard(f, temp_path)
+
+
+def discard(f, temp_path):
+    """ Closes and removes an unfinished cache file, ignoring errors.
+    Args:
+      f (file object): the open file, or None.
+      temp_path (str): the file name, or None.
+    Returns:
+      None, for the file variable of the caller.
+    """
+    if (f is not None):
+        try:
+            f.close()
+        except OSError:
+            pass
+    if (temp_path is not None):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    return None
+
+
+def evict(directory, max_size=MAX_SIZE):
+    """ Removes the least recently used cache files until the cache
+    directory is within its size limit.
+    Args:
+      directory (str): cache directory.
+      max_size (int): size limit [bytes].
+    Returns:
+      The number of files removed.
+    """
+    entries = list()
+    total = 0
+
+    with os.scandir(directory) as it:
+        for entry in it:
+            if (not entry.name.endswith((EXTENSION, CHECKPOINT_EXTENSION))):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    removed = 0
+    entries.sort()
+    for mtime, size, path in entries:
+        if (total <= max_size):
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    return removed
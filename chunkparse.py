@@ -0,0 +1,209 @@
+#
+# Title: G-code interpreter program
+# File: chunkparse.py
+# Description: Parses a large G-code file in parallel worker processes.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The file is memory mapped and split into chunks that end at line
+# boundaries. Every worker compiles the blocks of one chunk and sends
+# them back packed (see block.pack_blocks()), together with what it saw
+# of the data markers. The parent checks those and the program numbers in
+# file order, the same way parse_file() does, and yields the blocks in
+# order while the next chunks are still being parsed.
+#
+
+import os
+import mmap
+import collections
+import concurrent.futures
+
+from block import (ParseError, Opcode, Command, Block, compile_block,
+    pack_blocks, unpack_blocks)
+from linetype import (LINE_EMPTY, LINE_MARKER, LINE_COMMENT, LINE_PROGRAM,
+    classify_text)
+
+# Default size of one chunk [bytes].
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def find_chunks(file_name, chunk_size=CHUNK_SIZE):
+    """ Splits a file into chunks that end at line boundaries.
+    Args:
+      file_name (str): file to split.
+      chunk_size (int): approximate size of a chunk [bytes].
+    Returns:
+      A list of (start, end) byte offsets.
+    """
+    chunks = list()
+
+    with open(file_name, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if (size == 0):
+            return chunks
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while (start < size):
+                end = mm.find(b"\n", min(start + chunk_size, size) - 1)
+                end = size if (end < 0) else end + 1
+                chunks.append((start, end))
+                start = end
+
+    return chunks
+
+
+def parse_chunk(file_name, start, end):
+    """ Compiles the blocks of one chunk. Runs in a worker process.
+    Args:
+      file_name (str): G-code file.
+      start, end (int): byte offsets of the chunk.
+    Returns:
+      A dict with:
+        "num_lines" (int): number of lines in the chunk.
+        "regions" (list): for the parts of the chunk before, between and
+          after its data markers, a (num_data_lines, first_data_line)
+          tuple.
+        "data", "words": the packed blocks.
+        "error" (tuple): (line_num, txt_row) of a line that could not
+          be compiled, which ends the chunk, or None.
+      The line numbers are counted from the start of the chunk.
+    """
+    with open(file_name, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode("utf-8", errors="replace")
+
+    lines = text.split("\n")
+    if (lines[-1] == ""):
+        lines.pop()
+
+    regions = list()
+    num_data = 0
+    first_data = None
+    blocks = list()
+    error = None
+
+    for line_num, txt_row in enumerate(lines, 1):
+        txt_row = txt_row.strip()
+        kind, pgm_num = classify_text(txt_row)
+
+        if (kind == LINE_MARKER):
+            regions.append((num_data, first_data))
+            num_data = 0
+            first_data = None
+            continue
+
+        if ((kind == LINE_EMPTY) or (kind == LINE_COMMENT)):
+            continue
+
+        num_data += 1
+        if (first_data is None):
+            first_data = line_num
+
+        # Program numbers are passed on as O blocks; the consumer keeps
+        # the first one as the program number.
+        if (kind == LINE_PROGRAM):
+            block = Block(line_num, (Command(Opcode.O, pgm_num),))
+        else:
+            try:
+                block = compile_block(txt_row, line_num)
+            except ParseError:
+                # Raised again by the consumer with the line number in
+                # the file.
+                error = (line_num, txt_row)
+                break
+        if (block is not None):
+            blocks.append(block)
+
+    regions.append((num_data, first_data))
+    data, words = pack_blocks(blocks)
+
+    return {
+        "num_lines": len(lines),
+        "regions": regions,
+        "data": bytes(data),
+        "words": words,
+        "error": error,
+    }
+
+
+def parse_file_parallel(file_name, pgm_data, workers=None,
+                        chunk_size=CHUNK_SIZE):
+    """ Parses a G-code file in parallel, see parse_file() in main.py.
+    Only a few chunks per worker are parsed ahead of the consumer, so
+    memory use does not grow with the file size.
+    Args:
+      file_name (str): G-code file (must be a regular file).
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+      workers (int): number of worker processes, None for one per CPU.
+      chunk_size (int): approximate size of a chunk [bytes].
+    Yields:
+      A compiled Block for each line containing commands, in file order.
+    Raises:
+      ParseError: if the data markers or the program number are invalid.
+    """
+    pgm_data["pgm_num"] = None
+    pgm_data["num_commands"] = 0
+    chunks = find_chunks(file_name, chunk_size)
+    markers_seen = 0
+    line_offset = 0
+
+    if (workers is None):
+        workers = os.cpu_count() or 1
+
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    window = 2 * workers
+    pending = collections.deque()
+    next_chunk = 0
+
+    try:
+        while ((next_chunk < len(chunks)) or (len(pending) > 0)):
+            while ((next_chunk < len(chunks))
+                   and (len(pending) < window)):
+                start, end = chunks[next_chunk]
+                pending.append(executor.submit(parse_chunk, file_name,
+                                               start, end))
+                next_chunk += 1
+
+            result = pending.popleft().result()
+
+            # Checking the markers and the program number in file order.
+            for i_region, (num_data, first_data) in \
+                    enumerate(result["regions"]):
+                if (i_region > 0):
+                    markers_seen += 1
+                    if (markers_seen > 2):
+                        raise ParseError("invalid number of data markers "
+                            "(more than 2)")
+                if ((num_data > 0) and (markers_seen != 1)):
+                    raise ParseError("program data found outside of data "
+                        "markers (line {})"
+                        .format(line_offset + first_data))
+
+            for block in unpack_blocks(result["data"], result["words"],
+                                       line_offset):
+                # The first program number is the one of the program, the
+                # later ones start subprogram definitions.
+                if ((pgm_data["pgm_num"] is None)
+                        and (block.commands[0].op == Opcode.O)):
+                    pgm_data["pgm_num"] = block.commands[0].arg
+                    continue
+                pgm_data["num_commands"] = (pgm_data["num_commands"]
+                                            + len(block))
+                yield block
+
+            if (result["error"] is not None):
+                # Compiling the line again raises its ParseError, with
+                # the line number in the file.
+                line_num, txt_row = result["error"]
+                compile_block(txt_row, line_offset + line_num)
+
+            line_offset += result["num_lines"]
+
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    if (markers_seen != 2):
+        raise ParseError("invalid number of data markers ({}, should have 2)"
+            .format(markers_seen))
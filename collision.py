@@ -0,0 +1,319 @@
+#
+# Title: G-code interpreter program
+# File: collision.py
+# Description: Soft limit and fixture collision checks of a toolpath.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The checks are done in batch over the waypoint segments of the toolpath
+# (see toolpath.py), which are exactly the single-axis moves made by
+# MachineClient.move_x(), move_y() and move_z():
+#
+#  - A segment crosses the soft limits when its end point is outside the
+#    allowed box (the box is convex, so a segment from an allowed point
+#    leaves it only if its end point is outside).
+#  - Fixtures and clamps are axis-aligned boxes. They are put into a
+#    uniform grid; every segment is only tested against the boxes in the
+#    grid cells its bounding box overlaps, with a vectorized slab test.
+#
+# The tool is taken to be a point at the controlled position; use the
+# clearance of the configuration to account for the tool radius.
+#
+# Machine configuration file (JSON):
+#   {
+#     "limits": {"min": [x, y, z], "max": [x, y, z]},
+#     "fixtures": [{"name": "vise", "min": [x, y, z], "max": [x, y, z]}],
+#     "clearance": 0.0
+#   }
+# A null limit leaves that side of the axis unlimited.
+#
+# Requires NumPy.
+#
+
+import json
+
+import numpy as np
+
+from toolpath import build_toolpath
+
+AXES = ("X", "Y", "Z")
+# Largest number of grid cells per axis.
+MAX_CELLS = 64
+# Number of segments checked at a time, to bound the memory use.
+CHUNK_SEGMENTS = 1 << 20
+
+
+class FixtureIndex:
+    """ Axis-aligned fixture boxes in a uniform grid.
+    Attributes:
+      lo, hi (K x 3 float64 arrays): box corners.
+      names (list): box names.
+    """
+
+    def __init__(self, lo, hi, names=None):
+        """ Args:
+          lo, hi (K x 3 array-like): minimum and maximum corners of the
+            boxes.
+          names (list): names of the boxes, numbered if not given.
+        """
+        self.lo = np.asarray(lo, dtype=np.float64).reshape(-1, 3)
+        self.hi = np.asarray(hi, dtype=np.float64).reshape(-1, 3)
+        num = len(self.lo)
+        if (names is None):
+            names = ["#{}".format(i + 1) for i in range(num)]
+        self.names = list(names)
+
+        if (num == 0):
+            self.origin = np.zeros(3)
+            self.top = np.zeros(3)
+            self.shape = np.ones(3, dtype=np.int64)
+            self.cell = np.ones(3)
+            self._starts = np.zeros(2, dtype=np.int64)
+            self._boxes = np.empty(0, dtype=np.int64)
+            return
+
+        self.origin = self.lo.min(axis=0)
+        self.top = self.hi.max(axis=0)
+        extent = self.top - self.origin
+
+        # About two cells per box along every axis that has any extent.
+        cells = int(min(MAX_CELLS, max(1, np.ceil(2.0 * num ** (1.0 / 3.0)))))
+        self.shape = np.where(extent > 0.0, cells, 1).astype(np.int64)
+        self.cell = np.where(extent > 0.0, extent / self.shape, 1.0)
+
+        # Cell lists as CSR arrays: the boxes of cell c are
+        # _boxes[_starts[c]:_starts[c + 1]].
+        owner, cell_ids = self._expand(*self.cell_range(self.lo, self.hi))
+        order = np.argsort(cell_ids, kind="stable")
+        self._boxes = owner[order]
+        counts = np.bincount(cell_ids, minlength=int(np.prod(self.shape)))
+        self._starts = np.concatenate(([0], np.cumsum(counts)))
+
+
+    def __len__(self):
+        return len(self.lo)
+
+
+    def cell_range(self, lo, hi):
+        """ Gets the grid cells overlapped by bounding boxes.
+        Args:
+          lo, hi (N x 3 arrays): box corners.
+        Returns:
+          Tuple (first, last) of N x 3 int64 arrays of cell coordinates,
+          clipped to the grid.
+        """
+        last_cell = self.shape - 1
+        first = np.clip(np.floor((lo - self.origin) / self.cell), 0, last_cell)
+        last = np.clip(np.floor((hi - self.origin) / self.cell), 0, last_cell)
+        return first.astype(np.int64), last.astype(np.int64)
+
+
+    def _expand(self, first, last):
+        """ Lists the cells of cell ranges.
+        Returns:
+          Tuple (owner, cell_ids): for every cell of every range the row
+          of the range and the flat cell number.
+        """
+        dims = last - first + 1
+        counts = dims.prod(axis=1)
+        owner = np.repeat(np.arange(len(first)), counts)
+        offsets = np.cumsum(counts) - counts
+        local = np.arange(counts.sum()) - np.repeat(offsets, counts)
+
+        dims = dims[owner]
+        iz = local % dims[:, 2]
+        iy = (local // dims[:, 2]) % dims[:, 1]
+        ix = local // (dims[:, 2] * dims[:, 1])
+        first = first[owner]
+        cell_ids = (((first[:, 0] + ix) * self.shape[1] + first[:, 1] + iy)
+                    * self.shape[2] + first[:, 2] + iz)
+
+        return owner, cell_ids
+
+
+    def candidates(self, lo, hi):
+        """ Finds the boxes that may intersect bounding boxes.
+        Args:
+          lo, hi (N x 3 arrays): bounding box corners.
+        Returns:
+          Tuple (rows, boxes) of int64 arrays: unique pairs of a row of lo
+          and hi and a fixture box sharing a grid cell with it.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if (len(self) == 0):
+            return empty, empty
+
+        inside = np.all((hi >= self.origin) & (lo <= self.top), axis=1)
+        rows = np.flatnonzero(inside)
+        if (len(rows) == 0):
+            return empty, empty
+
+        owner, cell_ids = self._expand(*self.cell_range(lo[rows], hi[rows]))
+        begin = self._starts[cell_ids]
+        counts = self._starts[cell_ids + 1] - begin
+        pair_rows = np.repeat(rows[owner], counts)
+        offsets = np.cumsum(counts) - counts
+        boxes = self._boxes[np.repeat(begin, counts)
+                            + np.arange(counts.sum())
+                            - np.repeat(offsets, counts)]
+
+        # A pair is found once per shared cell.
+        keys = np.unique(pair_rows * len(self) + boxes)
+        return keys // len(self), keys % len(self)
+
+
+def segments_hit_boxes(p0, p1, lo, hi):
+    """ Slab test of segments against boxes, pairwise.
+    Args:
+      p0, p1 (N x 3 arrays): segment start and end points.
+      lo, hi (N x 3 arrays): box corners (closed boxes).
+    Returns:
+      N bool array, True where the segment touches the box.
+    """
+    delta = p1 - p0
+    moving = (delta != 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t0 = (lo - p0) / delta
+        t1 = (hi - p0) / delta
+
+    # An axis the segment does not move along either always or never
+    # overlaps the slab.
+    within = (p0 >= lo) & (p0 <= hi)
+    near = np.where(moving, np.minimum(t0, t1),
+                    np.where(within, -np.inf, np.inf))
+    far = np.where(moving, np.maximum(t0, t1),
+                   np.where(within, np.inf, -np.inf))
+    t_enter = np.maximum(near.max(axis=1), 0.0)
+    t_exit = np.minimum(far.min(axis=1), 1.0)
+
+    return t_enter <= t_exit
+
+
+def check_points(points, limits=None, fixtures=None):
+    """ Checks the waypoint segments of a toolpath.
+    Args:
+      points ((M + 1) x 3 array): waypoints, see toolpath.order_axes().
+      limits (tuple): (min, max) arrays of the soft limits, inf for no
+        limit, or None.
+      fixtures (FixtureIndex): fixture boxes, or None.
+    Returns:
+      A dict of int64 arrays:
+        "limit_segments": segments ending outside the soft limits.
+        "fixture_segments", "fixture_boxes": pairs of a segment and a
+          fixture box it touches, sorted by segment.
+    """
+    ends = points[1:]
+    result = {
+        "limit_segments": np.empty(0, dtype=np.int64),
+        "fixture_segments": np.empty(0, dtype=np.int64),
+        "fixture_boxes": np.empty(0, dtype=np.int64),
+    }
+
+    if (limits is not None):
+        low, high = limits
+        result["limit_segments"] = np.flatnonzero(
+            np.any((ends < low) | (ends > high), axis=1))
+
+    if ((fixtures is not None) and (len(fixtures) > 0)):
+        found_segments = list()
+        found_boxes = list()
+        for first in range(0, len(ends), CHUNK_SEGMENTS):
+            p0 = points[first : first + CHUNK_SEGMENTS]
+            p1 = ends[first : first + CHUNK_SEGMENTS]
+            p0 = p0[:len(p1)]
+            segments, boxes = fixtures.candidates(np.minimum(p0, p1),
+                                                  np.maximum(p0, p1))
+            hit = segments_hit_boxes(p0[segments], p1[segments],
+                                     fixtures.lo[boxes], fixtures.hi[boxes])
+            found_segments.append(segments[hit] + first)
+            found_boxes.append(boxes[hit])
+        if (len(found_segments) > 0):
+            result["fixture_segments"] = np.concatenate(found_segments)
+            result["fixture_boxes"] = np.concatenate(found_boxes)
+
+    return result
+
+
+def load_config(file_name):
+    """ Reads a machine configuration file (see the top of this file).
+    Args:
+      file_name (str): JSON file.
+    Returns:
+      Tuple (limits, fixtures) for check_points(); limits is None if the
+      file has none.
+    Raises:
+      OSError: if the file cannot be read.
+      ValueError: if the file is not valid.
+    """
+    with open(file_name) as f:
+        config = json.load(f)
+
+    return make_config(config)
+
+
+def make_config(config):
+    """ Builds the checks from a configuration dict, see load_config(). """
+    clearance = float(config.get("clearance", 0.0))
+
+    limits = None
+    if (config.get("limits") is not None):
+        low = [-np.inf if (value is None) else float(value)
+               for value in config["limits"].get("min", [None] * 3)]
+        high = [np.inf if (value is None) else float(value)
+                for value in config["limits"].get("max", [None] * 3)]
+        if ((len(low) != 3) or (len(high) != 3)):
+            raise ValueError("soft limits need 3 values (X, Y, Z)")
+        limits = (np.array(low), np.array(high))
+
+    boxes = config.get("fixtures", list())
+    lo = np.array([box["min"] for box in boxes], dtype=np.float64)
+    hi = np.array([box["max"] for box in boxes], dtype=np.float64)
+    if ((lo.size != 3 * len(boxes)) or (hi.size != 3 * len(boxes))):
+        raise ValueError("fixture corners need 3 values (X, Y, Z)")
+    if (len(boxes) > 0):
+        lo, hi = (np.minimum(lo, hi) - clearance,
+                  np.maximum(lo, hi) + clearance)
+    names = [box.get("name", "#{}".format(i + 1))
+             for i, box in enumerate(boxes)]
+
+    return limits, FixtureIndex(lo, hi, names)
+
+
+def check_blocks(blocks, limits=None, fixtures=None,
+                 start=(0.0, 0.0, 0.0)):
+    """ Checks a compiled program.
+    Args:
+      blocks (iterable): compiled Block objects.
+      limits, fixtures: see check_points().
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      A list of (line, message) tuples, one per violation, in the order
+      of the moves.
+    """
+    toolpath = build_toolpath(blocks, start)
+    points = toolpath["points"]
+    result = check_points(points, limits, fixtures)
+    move_line = toolpath["moves"]["line"][toolpath["index"]]
+    found = list()
+
+    def describe(segment):
+        axis = int(np.argmax(np.abs(points[segment + 1] - points[segment])))
+        return (int(move_line[segment]), axis,
+                float(points[segment + 1][axis]))
+
+    for segment in result["limit_segments"]:
+        line, axis, value = describe(segment)
+        end = points[segment + 1]
+        outside = [name for i, name in enumerate(AXES)
+                   if ((end[i] < limits[0][i]) or (end[i] > limits[1][i]))]
+        found.append((segment, line, "move {} to {:.3f} is outside the "
+            "soft limits ({})".format(AXES[axis], value, ", ".join(outside))))
+
+    for segment, box in zip(result["fixture_segments"],
+                            result["fixture_boxes"]):
+        line, axis, value = describe(segment)
+        found.append((segment, line, "move {} to {:.3f} hits fixture "
+            "'{}'".format(AXES[axis], value, fixtures.names[box])))
+
+    found.sort(key=lambda item: item[0])
+    return [(line, message) for segment, line, message in found]
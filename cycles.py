@@ -0,0 +1,240 @@
+#
+# Title: G-code interpreter program
+# File: cycles.py
+# Description: Canned drilling cycles (G73, G81, G82, G83, G85, G89).
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A canned cycle drills a hole at every X/Y position given while it is
+# active: after the cycle command itself, blocks with just axis words
+# ("X10 Y20") drill the next holes, until G80 or another motion command.
+# The words of the cycle are kept between the holes:
+#
+#   R - level the drilling starts from (the R plane), rapid above it.
+#   Z - bottom of the hole.
+#   Q - depth of a peck (G73, G83).
+#   P - dwell at the bottom [s] (G82, G89).
+#   L - number of holes, repeated at the X/Y increments in G91.
+#
+# In incremental mode (G91) R is relative to the Z at the start of the
+# block and Z to the R plane; the holes repeated with L use the same
+# levels. After a hole the tool goes back up to the Z the block started
+# from (G98) or stays at the R plane (G99). Every hole:
+#
+#   1. Rapid up to the R plane, if below it.
+#   2. Rapid to the X/Y position.
+#   3. Rapid down to the R plane.
+#   4. The steps of the cycle from the R plane:
+#        G81: feed to the bottom.
+#        G82: feed to the bottom, dwell.
+#        G83: feed a peck, rapid out to the R plane and back in to
+#             CLEARANCE above the previous peck, repeat to the bottom.
+#        G73: feed a peck, rapid back by CLEARANCE (chip break),
+#             repeat to the bottom.
+#        G85: feed to the bottom, feed out to the R plane.
+#        G89: feed to the bottom, dwell, feed out to the R plane.
+#   5. Rapid to the retract level.
+#
+# The steps of 4. only depend on the cycle, the depth from the R plane
+# to the bottom, the peck and the dwell, not on the hole, so they are
+# made once into a template of Z steps relative to the R plane (cached,
+# like the arcs of arcs.py). The moves of a hole are then the template
+# moved to it: hole_moves() yields them lazily one hole at a time, and
+# expand_batch() makes them for all holes of a template at once with
+# NumPy (see toolpath.py).
+#
+
+import functools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from block import Opcode
+
+# Cycle opcodes.
+CYCLE_OPS = frozenset((Opcode.G73, Opcode.G81, Opcode.G82, Opcode.G83,
+                       Opcode.G85, Opcode.G89))
+# Peck cycles, which need Q.
+PECK_OPS = frozenset((Opcode.G73, Opcode.G83))
+# Distance kept above the previous peck (G83) or backed off to break
+# the chip (G73) [mm].
+CLEARANCE = 0.254
+# Largest number of pecks of a hole.
+MAX_PECKS = 10000
+# Decimals of the template keys.
+KEY_DECIMALS = 9
+# Number of cached templates.
+CACHE_SIZE = 1024
+
+
+def make_template(op, depth, peck=None, dwell=None):
+    """ Makes the steps of a cycle from the R plane (cached).
+    Args:
+      op (Opcode): cycle, one of CYCLE_OPS.
+      depth (float): distance from the R plane down to the bottom [mm].
+      peck (float): depth of a peck [mm] (G73, G83).
+      dwell (float): dwell at the bottom [s] (G82, G89).
+    Returns:
+      A tuple of (dz, rapid, dwell) steps: the Z of the end point
+      relative to the R plane, True for a rapid move and the dwell after
+      it [s]. The tuple is shared, it must not be changed.
+    Raises:
+      ValueError: if the cycle cannot be made.
+    """
+    if (depth < 0.0):
+        raise ValueError("bottom of the hole (Z) above the R plane")
+    if (op in PECK_OPS):
+        if ((peck is None) or (peck <= 0.0)):
+            raise ValueError("peck depth (Q) must be positive")
+        if (depth / peck > MAX_PECKS):
+            raise ValueError("more than {} pecks".format(MAX_PECKS))
+    else:
+        peck = None
+    if (op not in (Opcode.G82, Opcode.G89)):
+        dwell = None
+
+    return _template(op, round(depth, KEY_DECIMALS),
+                     None if (peck is None) else round(peck, KEY_DECIMALS),
+                     None if (dwell is None) else max(0.0, dwell))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _template(op, depth, peck, dwell):
+    """ The steps of make_template(), for rounded arguments. """
+    bottom = -depth
+    if (op == Opcode.G81):
+        return ((bottom, False, 0.0),)
+    if (op == Opcode.G82):
+        return ((bottom, False, dwell or 0.0),)
+    if (op == Opcode.G85):
+        return ((bottom, False, 0.0), (0.0, False, 0.0))
+    if (op == Opcode.G89):
+        return ((bottom, False, dwell or 0.0), (0.0, False, 0.0))
+
+    steps = list()
+    cur = 0.0
+    while (cur > bottom):
+        nxt = max(cur - peck, bottom)
+        if (op == Opcode.G83):
+            if (cur < 0.0):
+                # Back in, to just above the previous peck.
+                steps.append((min(cur + CLEARANCE, 0.0), True, 0.0))
+            steps.append((nxt, False, 0.0))
+            if (nxt > bottom):
+                steps.append((0.0, True, 0.0))
+        else:
+            steps.append((nxt, False, 0.0))
+            if (nxt > bottom):
+                steps.append((min(nxt + CLEARANCE, 0.0), True, 0.0))
+        cur = nxt
+
+    return tuple(steps)
+
+
+def hole_levels(inc, z_start, r, z, scale=1.0, offset=0.0,
+                retract_r=False):
+    """ Computes the levels of the holes of a block in machine
+    coordinates.
+    Args:
+      inc (bool): True in incremental mode.
+      z_start (float): Z at the start of the block.
+      r, z (float): the R and Z words.
+      scale, offset (float): scale and Z offset from program to machine
+        coordinates (see offsets.py).
+      retract_r (bool): True to retract to the R plane (G99), False to
+        the level the block starts from (G98).
+    Returns:
+      Tuple (r_level, bottom, retract) of Z levels.
+    """
+    if (inc):
+        r_level = z_start + r * scale
+        bottom = r_level + z * scale
+    else:
+        r_level = r * scale + offset
+        bottom = z * scale + offset
+    retract = r_level if (retract_r) else max(z_start, r_level)
+
+    return r_level, bottom, retract
+
+
+def hole_moves(start, x, y, r_level, retract, steps):
+    """ Yields the moves of a hole, see the top of this file.
+    Args:
+      start (tuple): X, Y, Z the hole starts from.
+      x, y (float): position of the hole.
+      r_level, retract (float): levels from hole_levels().
+      steps (tuple): template from make_template().
+    Yields:
+      (x, y, z, rapid, dwell) tuples, the end point of every move, True
+      for rapid moves and the dwell after it [s].
+    """
+    x0, y0, z = start
+    if (z < r_level):
+        z = r_level
+        yield (x0, y0, z, True, 0.0)
+    yield (x, y, z, True, 0.0)
+    if (z > r_level):
+        yield (x, y, r_level, True, 0.0)
+    for dz, rapid, dwell in steps:
+        yield (x, y, r_level + dz, rapid, dwell)
+    yield (x, y, retract, True, 0.0)
+
+
+def expand_batch(begins, ends, r_levels, steps, min_move=0.0):
+    """ Makes the moves of many holes of the same template at once, as
+    single-axis moves like MachineClient.cycle_move() makes them: the
+    travel to the hole moves X, then Y. Requires NumPy.
+    Args:
+      begins (N x 3 array): X, Y, Z every hole starts from.
+      ends (N x 3 array): X, Y of the holes and their retract level.
+      r_levels (N array): R plane of every hole.
+      steps (tuple): template from make_template().
+      min_move (float): moves shorter than this are left out, like
+        the moves that hole_moves() leaves out.
+    Returns:
+      Tuple (points, hole, rapid): the end points of the moves (M x 3),
+      the hole of every move (row of begins) and True for the rapid
+      moves.
+    """
+    num = len(begins)
+    dz = np.array([step[0] for step in steps], dtype=np.float64)
+    count = 5 + len(dz)
+    z_travel = np.maximum(begins[:, 2], r_levels)
+
+    # Up to the R plane (if below it), X, Y, down to the R plane (if
+    # above it), the steps and the retract. The moves that are not made
+    # stay in place, and are left out below.
+    points = np.empty((num, count + 1, 3))
+    points[:, 0] = begins
+    points[:, 1, 0:2] = begins[:, 0:2]
+    points[:, 2, 0] = ends[:, 0]
+    points[:, 2, 1] = begins[:, 1]
+    points[:, 3:, 0] = ends[:, 0:1]
+    points[:, 3:, 1] = ends[:, 1:2]
+    points[:, 1:4, 2] = z_travel[:, np.newaxis]
+    points[:, 4, 2] = r_levels
+    points[:, 5:-1, 2] = r_levels[:, np.newaxis] + dz
+    points[:, -1, 2] = ends[:, 2]
+
+    # Every move is along a single axis: its length is the sum.
+    delta = np.abs(np.diff(points, axis=1))
+    delta = delta[:, :, 0] + delta[:, :, 1] + delta[:, :, 2]
+    keep = (delta > 0.0) & (delta >= min_move)
+    rapid = np.ones(count, dtype=bool)
+    rapid[4:-1] = [step[1] for step in steps]
+
+    hole = np.broadcast_to(np.arange(num)[:, np.newaxis], (num, count))
+    return (points[:, 1:][keep], hole[keep],
+            np.broadcast_to(rapid, (num, count))[keep])
+
+
+def template_dwell(steps):
+    """ Returns the total dwell of a template [s]. """
+    return sum(step[2] for step in steps)
+
+
+def cache_info():
+    """ Returns the hit and miss counts of the template cache. """
+    return _template.cache_info()
@@ -0,0 +1,212 @@
+#
+# Title: G-code interpreter program
+# File: cycletime.py
+# Description: Estimates the run time of a G-code program.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The estimate is computed in batch from the toolpath arrays (see
+# toolpath.py): every single-axis move and arc chord is timed with the
+# rapid rate or the feed rate in effect, and each M06 adds a fixed tool
+# change time. The holes of canned cycles are timed step by step, rapid
+# or feed, and their dwells are added.
+# Acceleration is not taken into account.
+#
+# Feed rates are in units per minute (G94) as in standard G-code, per
+# revolution of the spindle (G95) or inverse time (G93: the move takes
+# 1/F minutes). All times are in minutes.
+#
+# Requires NumPy.
+#
+
+import numpy as np
+
+from machineclient import (MOTION_MODE_RAPID, MOTION_MODE_CYCLE,
+    FEED_MODE_INVTIME, FEED_MODE_UPMIN, FEED_MODE_UPREV)
+from toolpath import build_toolpath, build_toolpath_records
+from cycles import template_dwell
+
+# Default rapid traverse rate [units/min].
+RAPID_RATE = 5000.0
+# Default time of one tool change [min].
+TOOL_CHANGE_TIME = 0.1
+# Default number of blocks listed in the report, see format_report().
+TOP_BLOCKS = 10
+
+
+def move_times(toolpath, rapid_rate=RAPID_RATE):
+    """ Computes the length and the duration of every move.
+    Args:
+      toolpath (dict): result of toolpath.build_toolpath().
+      rapid_rate (float): rapid traverse rate [units/min].
+    Returns:
+      Tuple (length, time, no_feed, rapid_length, rapid_time) of arrays,
+      one row per move. no_feed is True for feed moves without a usable
+      feed rate; their feed time is 0. rapid_length and rapid_time are
+      the parts of length and time made at the rapid rate: all of a 
+      rapid move, none of a feed move, and the rapid steps of a canned
+      cycle.
+    """
+    moves = toolpath["moves"]
+    num = len(moves["motion"])
+
+    # The machine moves one axis at a time (arcs along their chords), so
+    # a move is as long as the sum of its steps.
+    steps = np.sqrt(np.square(np.diff(toolpath["points"], axis=0)).sum(axis=1))
+    index = toolpath["index"]
+    length = np.bincount(index, weights=steps, minlength=num)
+    rapid_length = np.bincount(index[toolpath["rapid"]],
+                               weights=steps[toolpath["rapid"]], minlength=num)
+    feed_length = length - rapid_length
+
+    feed = moves["feed"]
+    mode = moves["feed_mode"]
+    rate = np.where(mode == FEED_MODE_UPREV, feed * moves["speed"], feed)
+    # The lengths are in millimetres, the feed rates in program units.
+    scale = moves["transforms"][moves["transform"], 0]
+    cycle = (moves["motion"] == MOTION_MODE_CYCLE)
+    feed_move = (moves["motion"] != MOTION_MODE_RAPID)
+    # Inverse time is not used for canned cycles.
+    invtime = feed_move & ~cycle & (mode == FEED_MODE_INVTIME)
+    per_unit = feed_move & ((mode == FEED_MODE_UPMIN) | (mode == FEED_MODE_UPREV))
+    no_feed = feed_move & ((rate <= 0.0) | ~(invtime | per_unit))
+
+    rapid_time = rapid_length / rapid_rate
+    time = rapid_time.copy()
+    usable = per_unit & ~no_feed
+    time[usable] += feed_length[usable] / (rate[usable] * scale[usable])
+    usable = invtime & ~no_feed
+    time[usable] = 1.0 / rate[usable]
+
+    cycles = moves["cycles"]
+    if (len(cycles["move"]) > 0):
+        dwell = np.array([template_dwell(steps)
+                          for steps in moves["templates"]], dtype=np.float64)
+        np.add.at(time, cycles["move"], dwell[cycles["template"]] / 60.0)
+
+    return length, time, no_feed, rapid_length, rapid_time
+
+
+def estimate(toolpath, rapid_rate=RAPID_RATE,
+             tool_change_time=TOOL_CHANGE_TIME):
+    """ Estimates the run time of a program.
+    Args:
+      toolpath (dict): result of toolpath.build_toolpath().
+      rapid_rate (float): rapid traverse rate [units/min].
+      tool_change_time (float): duration of one M06 [min].
+    Returns:
+      A dict with the times in minutes:
+        "total", "rapid", "feed", "tool_change" (float): totals.
+        "per_tool" (dict): tool number -> {"rapid", "feed",
+          "tool_change", "total"}. Moves before the first M06 are
+          counted for tool 0.
+        "per_block" (array): total time of every block.
+        "block_lines" (array): source line of every block.
+        "rapid_length", "feed_length" (float): travelled distances.
+        "no_feed_moves" (int): feed moves skipped for lack of a feed
+          rate.
+    """
+    moves = toolpath["moves"]
+    length, time, no_feed, rapid_length, rapid_time = move_times(toolpath,
+                                                                 rapid_rate)
+    feed_time = time - rapid_time
+    changes = moves["tool_changes"]
+
+    per_block = np.bincount(moves["block"], weights=time,
+                            minlength=moves["num_blocks"])
+    per_block += np.bincount(changes["block"],
+        minlength=moves["num_blocks"]) * tool_change_time
+
+    per_tool = dict()
+    tools = np.union1d(moves["tool"], changes["tool"])
+    for tool in tools:
+        mask = (moves["tool"] == tool)
+        entry = {
+            "rapid": float(rapid_time[mask].sum()),
+            "feed": float(feed_time[mask].sum()),
+            "tool_change": float(np.count_nonzero(changes["tool"] == tool)
+                                 * tool_change_time),
+        }
+        entry["total"] = entry["rapid"] + entry["feed"] + entry["tool_change"]
+        per_tool[int(tool)] = entry
+
+    result = {
+        "rapid": float(rapid_time.sum()),
+        "feed": float(feed_time.sum()),
+        "tool_change": len(changes["block"]) * tool_change_time,
+        "per_tool": per_tool,
+        "per_block": per_block,
+        "block_lines": moves["block_lines"],
+        "rapid_length": float(rapid_length.sum()),
+        "feed_length": float((length - rapid_length).sum()),
+        "no_feed_moves": int(np.count_nonzero(no_feed)),
+    }
+    result["total"] = result["rapid"] + result["feed"] + result["tool_change"]
+
+    return result
+
+
+def estimate_blocks(blocks, rapid_rate=RAPID_RATE,
+                    tool_change_time=TOOL_CHANGE_TIME):
+    """ Estimates the run time of compiled blocks, see estimate(). """
+    return estimate(build_toolpath(blocks), rapid_rate, tool_change_time)
+
+
+def estimate_records(data, words, rapid_rate=RAPID_RATE,
+                     tool_change_time=TOOL_CHANGE_TIME):
+    """ Estimates the run time of a packed program, see estimate() and
+    cache.cached_records(). """
+    return estimate(build_toolpath_records(data, words), rapid_rate,
+                    tool_change_time)
+
+
+def format_minutes(minutes):
+    """ Formats a time given in minutes as "h:mm:ss.s". """
+    hours, seconds = divmod(minutes * 60.0, 3600.0)
+    mins, seconds = divmod(seconds, 60.0)
+    return "{:d}:{:02d}:{:04.1f}".format(int(hours), int(mins), seconds)
+
+
+def format_report(result, top_blocks=TOP_BLOCKS):
+    """ Formats the result of estimate() as text.
+    Args:
+      result (dict): result of estimate().
+      top_blocks (int): number of the slowest blocks listed, -1 for all
+        blocks in program order.
+    Returns:
+      The report as a string.
+    """
+    lines = [
+        "Estimated cycle time: {}".format(format_minutes(result["total"])),
+        "  rapid moves:  {} ({:.3f} units)".format(
+            format_minutes(result["rapid"]), result["rapid_length"]),
+        "  feed moves:   {} ({:.3f} units)".format(
+            format_minutes(result["feed"]), result["feed_length"]),
+        "  tool changes: {}".format(format_minutes(result["tool_change"])),
+    ]
+    if (result["no_feed_moves"] > 0):
+        lines.append("  Warning: {} feed moves without a feed rate."
+            .format(result["no_feed_moves"]))
+
+    lines.append("Per tool:")
+    for tool, entry in sorted(result["per_tool"].items()):
+        lines.append("  T{:02d}: {} (rapid {}, feed {}, change {})".format(
+            tool, format_minutes(entry["total"]),
+            format_minutes(entry["rapid"]), format_minutes(entry["feed"]),
+            format_minutes(entry["tool_change"])))
+
+    per_block = result["per_block"]
+    if (top_blocks < 0):
+        lines.append("Per block:")
+        order = np.arange(len(per_block))
+    else:
+        lines.append("Slowest blocks:")
+        # Stable, so equal times are listed in program order.
+        order = np.argsort(-per_block, kind="stable")[:top_blocks]
+    total = result["total"]
+    for i in order.tolist():
+        lines.append("  block {} (line {}): {} ({:.1f} %)".format(i + 1,
+            result["block_lines"][i], format_minutes(per_block[i]),
+            100.0 * per_block[i] / total if (total > 0.0) else 0.0))
+
+    return "\n".join(lines)
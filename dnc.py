@@ -0,0 +1,352 @@
+#!/usr/bin/python3
+
+#
+# Title: G-code interpreter program
+# File: dnc.py
+# Description: Runs G-code drip-fed over an asyncio stream (DNC).
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# run_stream() reads G-code lines from an asyncio.StreamReader, e.g. a
+# TCP connection or a serial port wrapped into a stream, and executes
+# every block as soon as its line has arrived. The machine messages are
+# written downstream to an asyncio.StreamWriter in any output format of
+# sinks.py, and the writer is drained after every block, so a slow
+# receiver slows down the run instead of filling up memory.
+#
+# All buffers are bounded: the reader by its line length limit, the
+# compiled blocks waiting to run by the queue size and the output by the
+# sink buffer and the high-water mark of the writer. The exception is a
+# call of a subprogram defined later in the program: the blocks up to the
+# definition are read ahead and kept until the call has run.
+#
+# Run as a program, the file is drip-fed through a local TCP socket to
+# a simulator server and the machine events sent back are printed.
+#
+
+import gc
+import sys
+import asyncio
+import argparse
+import collections
+
+from block import ParseError, Opcode, Command, Block, compile_block
+from interpreter import Interpreter
+from subprogram import Subprograms
+from machineclient import MachineClient
+from linetype import (LINE_EMPTY, LINE_MARKER, LINE_COMMENT, LINE_PROGRAM,
+    classify_text)
+from sinks import FORMATS
+
+# Default number of compiled blocks waiting to be run.
+QUEUE_SIZE = 64
+# Default limit of the length of a G-code line [bytes].
+LINE_LIMIT = 64 * 1024
+
+
+class WriterStream:
+    """ Text stream interface for an asyncio.StreamWriter, so that the
+    sinks of sinks.py can write into it. The text is passed on to the
+    transport as is; waiting for it to be sent is up to the caller
+    (StreamWriter.drain()).
+    """
+
+    def __init__(self, writer, encoding="utf-8"):
+        """ Args:
+          writer (asyncio.StreamWriter): output stream.
+          encoding (str): text encoding.
+        """
+        self._writer = writer
+        self._encoding = encoding
+
+
+    def write(self, txt):
+        if (not self._writer.is_closing()):
+            self._writer.write(txt.encode(self._encoding))
+
+
+    def flush(self):
+        pass
+
+
+async def parse_stream(reader, pgm_data):
+    """ Reads G-code lines from a stream and yields the code blocks as
+    soon as their line has arrived. Follows the rules of parse_file() in
+    main.py.
+    Args:
+      reader (asyncio.StreamReader): G-code input.
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+    Yields:
+      A compiled Block for each line containing commands.
+    Raises:
+      ParseError: if the data markers or the program number are invalid,
+        or a line is too long for the reader.
+    """
+    markers_seen = 0
+    line_num = 0
+    pgm_data["pgm_num"] = None
+    pgm_data["num_commands"] = 0
+
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise ParseError("line {} is too long".format(line_num + 1)) \
+                from None
+
+        if (len(line) == 0):
+            break
+
+        line_num += 1
+        txt_row = line.decode("utf-8", errors="replace").strip()
+        kind, pgm_num = classify_text(txt_row)
+
+        # Valid G-code has exactly two data markers around the program.
+        if (kind == LINE_MARKER):
+            markers_seen += 1
+            if (markers_seen > 2):
+                raise ParseError("invalid number of data markers "
+                    "(more than 2)")
+            # Nothing may follow the end marker, so the program is done
+            # even if the sender keeps the connection open.
+            if (markers_seen == 2):
+                break
+            continue
+
+        # Empty and comment lines are skipped.
+        if ((kind == LINE_EMPTY) or (kind == LINE_COMMENT)):
+            continue
+
+        if (markers_seen != 1):
+            raise ParseError("program data found outside of data markers")
+
+        # Storing the program number. The later ones start subprogram
+        # definitions.
+        if (kind == LINE_PROGRAM):
+            if (pgm_data["pgm_num"] is None):
+                pgm_data["pgm_num"] = pgm_num
+                continue
+
+            block = Block(line_num, (Command(Opcode.O, pgm_num),))
+        else:
+            # Compiling all commands.
+            block = compile_block(txt_row, line_num)
+
+        if (block is not None):
+            pgm_data["num_commands"] = pgm_data["num_commands"] + len(block)
+            yield block
+
+    if (markers_seen != 2):
+        raise ParseError("invalid number of data markers ({}, should have 2)"
+            .format(markers_seen))
+
+
+async def run_stream(reader, sink, writer=None, queue_size=QUEUE_SIZE):
+    """ Simulates a program read from a stream, see run_program() in
+    main.py. The input is read and compiled in a separate task, so the
+    next lines are received while a block is running.
+    Args:
+      reader (asyncio.StreamReader): G-code input.
+      sink (object): output sink for all messages (see sinks.py).
+      writer (asyncio.StreamWriter): stream the sink writes into, if
+        any. It is drained after every block.
+      queue_size (int): maximum number of compiled blocks waiting to run.
+    Returns:
+      The program data dict ("pgm_num", "num_commands").
+    Raises:
+      ParseError: if the program is invalid. The blocks before the error
+        have been run.
+    """
+    pgm_data = dict()
+    queue = asyncio.Queue(queue_size)
+
+    async def produce():
+        try:
+            async for block in parse_stream(reader, pgm_data):
+                await queue.put(block)
+        finally:
+            await queue.put(None)
+
+    program = Subprograms()
+    pgm_data["subprograms"] = program.bodies
+
+    async def main_blocks():
+        # The blocks of the main program. A block is held back until the
+        # subprograms it calls have been received.
+        pending = collections.deque()
+        end = False
+        while True:
+            if (len(pending) > 0):
+                block = pending.popleft()
+            elif (end):
+                return
+            else:
+                block = await queue.get()
+                if (block is None):
+                    program.close()
+                    return
+                if (program.feed(block)):
+                    continue
+
+            while ((not end) and (program.missing((block,)) is not None)):
+                ahead = await queue.get()
+                if (ahead is None):
+                    program.close()
+                    end = True
+                elif (not program.feed(ahead)):
+                    pending.append(ahead)
+
+            yield block
+
+    producer = asyncio.ensure_future(produce())
+    execute = Interpreter(MachineClient(sink), program).execute
+    i_block = 1
+
+    try:
+        async for block in main_blocks():
+            if (i_block == 1):
+                sink.info("Now running the G-code program #{}.",
+                    pgm_data["pgm_num"])
+                sink.info("")
+
+            sink.block_begin(i_block, block)
+
+            for command in block.commands:
+                sink.command(command)
+                execute(command)
+
+            sink.block_end(i_block, block)
+            i_block = i_block + 1
+
+            if (writer is not None):
+                sink.flush()
+                await writer.drain()
+
+        # Raises the parse error, if there was one.
+        await producer
+
+    finally:
+        producer.cancel()
+
+    sink.info("Program #{} finished (total {} commands).",
+        pgm_data.get("pgm_num"), pgm_data["num_commands"])
+    sink.flush()
+    if (writer is not None):
+        await writer.drain()
+
+    return pgm_data
+
+
+async def serve_connection(reader, writer, output_format="jsonl",
+                           queue_size=QUEUE_SIZE):
+    """ Runs one program received over a connection and sends the machine
+    messages back over the same connection.
+    Args:
+      reader, writer: the connection, as given by asyncio.start_server().
+      output_format (str): key of sinks.FORMATS.
+      queue_size (int): see run_stream().
+    """
+    sink = FORMATS[output_format](WriterStream(writer))
+
+    try:
+        await run_stream(reader, sink, writer, queue_size)
+    except ParseError as err:
+        sink.info("Error: {}.", err)
+
+    # The interpreter refers to itself through its handlers, so the
+    # machine of the run is only shut down by the garbage collector.
+    gc.collect()
+
+    try:
+        # Also sends the messages of the machine shutting down.
+        sink.flush()
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def drip_feed(file_name, port, host="127.0.0.1", delay=0.0,
+                    output=None):
+    """ Sends a G-code file to a simulator line by line and writes what
+    comes back to the output.
+    Args:
+      file_name (str): G-code file to send.
+      port (int): port of the simulator server.
+      host (str): address of the simulator server.
+      delay (float): pause after every line [s].
+      output (file object): where to write the received messages,
+        standard output if None.
+    """
+    if (output is None):
+        output = sys.stdout
+
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def send():
+        with open(file_name, "rb") as f:
+            for line in f:
+                writer.write(line)
+                await writer.drain()
+                if (delay > 0.0):
+                    await asyncio.sleep(delay)
+        writer.write_eof()
+
+    sender = asyncio.ensure_future(send())
+    try:
+        while True:
+            line = await reader.readline()
+            if (len(line) == 0):
+                break
+            output.write(line.decode("utf-8", errors="replace"))
+    finally:
+        sender.cancel()
+        writer.close()
+
+    output.flush()
+
+
+async def demo(opts):
+    """ Starts a local simulator server and drip-feeds a file to it. """
+    async def handle(reader, writer):
+        await serve_connection(reader, writer, opts.format, opts.queue)
+
+    server = await asyncio.start_server(handle, opts.host, opts.port,
+                                        limit=LINE_LIMIT)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        await drip_feed(opts.file, port, opts.host, opts.delay)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="dnc.py",
+        description="Drip-feeds a G-code file to the simulator through a "
+                    "local TCP socket.")
+    parser.add_argument("file", help="G-code file to send")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="text",
+        help="output format (default: text)")
+    parser.add_argument("--host", default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=0,
+        help="port to listen on (default: any free port)")
+    parser.add_argument("--delay", type=float, default=0.0,
+        help="pause after every sent line [s]")
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE,
+        help="compiled blocks buffered ahead of the machine "
+             "(default: {})".format(QUEUE_SIZE))
+    opts = parser.parse_args(args[1:])
+
+    try:
+        asyncio.run(demo(opts))
+    except OSError as err:
+        print("Error: {}.".format(err))
+        return 1
+
+    return 0
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
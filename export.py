@@ -0,0 +1,408 @@
+#
+# Title: G-code interpreter program
+# File: export.py
+# Description: Columnar export of the toolpath of a program run.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A writer is set as the recorder of a MachineClient (set_recorder()). It
+# gets every position change: the axis moves of move_x(), move_y() and
+# move_z() and the chords of the arcs. Every change is a row of the
+# columns:
+#
+#   "x", "y", "z" (float64): position after the change.
+#   "motion" (int8): MOTION_MODE_* of machineclient.py.
+#   "feed" (float64): feed rate in effect.
+#   "tool" (int32): index of the tool name in the "tools" list of the
+#     metadata.
+#   "block" (int64): running number of the main program block (for
+#     subprograms, the block of the call), set by run_program().
+#   "line" (int64): source line of that block.
+#
+# The rows are collected as tuples, which is the cheapest for the run,
+# and turned into typed column arrays a chunk of CHUNK_ROWS rows at a
+# time, every column written out in one bulk write. Formats:
+#
+#   "bin": a single little-endian file: HEADER, the chunks (the columns
+#     of a chunk one after another, each padded to 8 bytes) and the
+#     metadata as JSON at the end. The header gives the place of the
+#     metadata, and the metadata the offsets of every column of every
+#     chunk, so a reader maps the file and uses the columns in place.
+#   "npy": a directory with a NumPy .npy file per column and chunk
+#     ("x.000000.npy", ...) and the metadata in "meta.json". The files
+#     are written without NumPy and can be loaded with
+#     numpy.load(mmap_mode="r").
+#
+# ToolpathReader reads both. With NumPy the columns are arrays on top of
+# the mapped file; without it, memoryviews.
+#
+
+import os
+import sys
+import mmap
+import json
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Magic, format version, offset and length of the metadata [bytes].
+HEADER = struct.Struct("<8sIIqq")
+MAGIC = b"CNCPATH\x00"
+VERSION = 1
+# Number of rows collected before they are written.
+CHUNK_ROWS = 65536
+# Columns: name, array type code and NumPy type (little-endian).
+COLUMNS = (
+    ("x", "d", "<f8"),
+    ("y", "d", "<f8"),
+    ("z", "d", "<f8"),
+    ("motion", "b", "|i1"),
+    ("feed", "d", "<f8"),
+    ("tool", "i", "<i4"),
+    ("block", "q", "<i8"),
+    ("line", "q", "<i8"),
+)
+# Alignment of the columns in the binary format [bytes].
+ALIGN = 8
+# Name of the metadata file of the npy format.
+META_FILE = "meta.json"
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+class ToolpathWriter:
+    """ Collects the position changes of a run into columns. Subclasses
+    write the chunks in their format.
+    Attributes:
+      rows (int): number of rows recorded.
+      tools (list): tool names, indexed by the "tool" column.
+    """
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        """ Args:
+          path (str): output file or directory.
+          chunk_rows (int): rows collected before they are written.
+        """
+        self.path = path
+        self.rows = 0
+        self.tools = list()
+        self._chunk_rows = max(1, chunk_rows)
+        self._chunks = list()
+        self._tool_ids = dict()
+        self._tool_name = None
+        self._tool_id = 0
+        self._block = 0
+        self._line = 0
+        self._rows = list()
+
+
+    def set_block(self, num, line):
+        """ Sets the block of the following rows.
+        Args:
+          num (int): running number of the block.
+          line (int): source line of the block.
+        """
+        self._block = num
+        self._line = line
+
+
+    def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+        """ Adds a row, see MachineClient.set_recorder(). """
+        if (tool_name != self._tool_name):
+            tool_id = self._tool_ids.get(tool_name)
+            if (tool_id is None):
+                tool_id = len(self.tools)
+                self._tool_ids[tool_name] = tool_id
+                self.tools.append(tool_name)
+            self._tool_name = tool_name
+            self._tool_id = tool_id
+
+        rows = self._rows
+        rows.append((x, y, z, motion_mode, feed_rate, self._tool_id,
+                     self._block, self._line))
+        if (len(rows) >= self._chunk_rows):
+            self.flush()
+
+
+    def flush(self):
+        """ Writes out the collected rows as a chunk. """
+        num = len(self._rows)
+        if (num == 0):
+            return
+
+        columns = [array(code, values) for (name, code, dtype), values
+                   in zip(COLUMNS, zip(*self._rows))]
+        self._rows.clear()
+        if (sys.byteorder != "little"):
+            for column in columns:
+                column.byteswap()
+        self._chunks.append(self._write_chunk(columns, num))
+        self.rows += num
+
+
+    def close(self, **info):
+        """ Writes out the rest of the rows and the metadata.
+        Args:
+          info: additional metadata, e.g. the program number.
+        """
+        self.flush()
+        meta = {
+            "version": VERSION,
+            "rows": self.rows,
+            "columns": [[name, dtype] for name, code, dtype in COLUMNS],
+            "tools": self.tools,
+            "chunks": self._chunks,
+        }
+        meta.update(info)
+        self._finish(meta)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _write_chunk(self, columns, num):
+        """ Writes the columns of a chunk.
+        Returns:
+          Metadata of the chunk (JSON compatible).
+        """
+        raise NotImplementedError
+
+
+    def _finish(self, meta):
+        """ Writes the metadata and closes the output. """
+        raise NotImplementedError
+
+
+class BinaryWriter(ToolpathWriter):
+    """ Writes the "bin" format, see the top of this file. """
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        super().__init__(path, chunk_rows)
+        self._file = open(path, "wb")
+        self._file.write(bytes(HEADER.size))
+        self._offset = HEADER.size
+
+
+    def _write_chunk(self, columns, num):
+        offsets = list()
+        for column in columns:
+            offsets.append(self._offset)
+            self._file.write(column)
+            size = len(column) * column.itemsize
+            pad = -size % ALIGN
+            if (pad > 0):
+                self._file.write(bytes(pad))
+            self._offset += size + pad
+
+        return {"rows": num, "offsets": offsets}
+
+
+    def _finish(self, meta):
+        data = json.dumps(meta).encode("utf-8")
+        self._file.write(data)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, self._offset,
+                                     len(data)))
+        self._file.close()
+
+
+class NpyWriter(ToolpathWriter):
+    """ Writes the "npy" format, see the top of this file. """
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        super().__init__(path, chunk_rows)
+        os.makedirs(path, exist_ok=True)
+
+
+    def _write_chunk(self, columns, num):
+        index = len(self._chunks)
+        files = list()
+        for (name, code, dtype), column in zip(COLUMNS, columns):
+            file_name = "{}.{:06d}.npy".format(name, index)
+            with open(os.path.join(self.path, file_name), "wb") as f:
+                f.write(npy_header(dtype, num))
+                f.write(column)
+            files.append(file_name)
+
+        return {"rows": num, "files": files}
+
+
+    def _finish(self, meta):
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(meta, f)
+            f.write("\n")
+
+
+def npy_header(dtype, num):
+    """ Makes the header of a version 1.0 .npy file of a 1-D array.
+    Args:
+      dtype (str): NumPy type, e.g. "<f8".
+      num (int): number of items.
+    Returns:
+      The header bytes, padded so that the data is 64-byte aligned.
+    """
+    txt = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}" \
+        .format(dtype, num)
+    size = len(NPY_MAGIC) + 2 + len(txt) + 1
+    txt += " " * (-size % 64) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(txt)) + txt.encode("latin1")
+
+
+# Output formats by name.
+FORMATS = {
+    "bin": BinaryWriter,
+    "npy": NpyWriter,
+}
+
+
+class ToolpathReader:
+    """ Reads an exported toolpath in either format. The column data is
+    not copied or parsed: the file is mapped and the columns point into
+    it, so the reader must stay open while they are used.
+    Attributes:
+      meta (dict): metadata of the file (see ToolpathWriter.close()).
+      rows (int): number of rows.
+      tools (list): tool names, indexed by the "tool" column.
+    """
+
+    def __init__(self, path):
+        """ Args:
+          path (str): "bin" file or "npy" directory.
+        Raises:
+          OSError: if the file cannot be read.
+          ValueError: if it is not an exported toolpath.
+        """
+        self.path = path
+        self._maps = list()
+        self._files = list()
+
+        if (os.path.isdir(path)):
+            with open(os.path.join(path, META_FILE)) as f:
+                self.meta = json.load(f)
+        else:
+            try:
+                self.meta = self._open_bin(path)
+            except BaseException:
+                # The file and the map are not left open.
+                self.close()
+                raise
+
+        self.rows = self.meta["rows"]
+        self.tools = self.meta["tools"]
+        self._names = [name for name, dtype in self.meta["columns"]]
+        self._dtypes = dict(self.meta["columns"])
+
+
+    def _open_bin(self, path):
+        """ Maps a "bin" file and returns its metadata. """
+        f = open(path, "rb")
+        self._files.append(f)
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file.
+            raise ValueError("not a toolpath file") from None
+        self._maps.append(mm)
+        try:
+            magic, version, flags, offset, length = HEADER.unpack_from(mm)
+        except struct.error:
+            raise ValueError("not a toolpath file") from None
+        if ((magic != MAGIC) or (version != VERSION)):
+            raise ValueError("not a toolpath file (version {})"
+                             .format(VERSION))
+
+        return json.loads(mm[offset : offset + length].decode("utf-8"))
+
+
+    def chunks(self, name):
+        """ Returns the data of a column chunk by chunk.
+        Args:
+          name (str): column name.
+        Returns:
+          A list of NumPy arrays, or memoryviews without NumPy.
+        """
+        index = self._names.index(name)
+        dtype = self._dtypes[name]
+        parts = list()
+        for chunk in self.meta["chunks"]:
+            num = chunk["rows"]
+            if ("files" in chunk):
+                part = self._map_npy(chunk["files"][index], dtype, num)
+            else:
+                offset = chunk["offsets"][index]
+                part = self._view(self._maps[0], offset, dtype, num)
+            parts.append(part)
+
+        return parts
+
+
+    def column(self, name):
+        """ Returns the data of a column as one array: a view of the file
+        if there is only one chunk, otherwise a copy of the chunks.
+        Requires NumPy.
+        """
+        parts = self.chunks(name)
+        if (len(parts) == 1):
+            return parts[0]
+        if (len(parts) == 0):
+            return np.empty(0, dtype=self._dtypes[name])
+        return np.concatenate(parts)
+
+
+    def close(self):
+        """ Releases the mapped files. Arrays from the reader must not be
+        used after this. """
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                # Still used by an array, freed with it.
+                pass
+        for f in self._files:
+            f.close()
+        self._maps.clear()
+        self._files.clear()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _map_npy(self, file_name, dtype, num):
+        """ Maps the data of an .npy file written by NpyWriter. """
+        f = open(os.path.join(self.path, file_name), "rb")
+        self._files.append(f)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        length = struct.unpack_from("<H", mm, len(NPY_MAGIC))[0]
+        return self._view(mm, len(NPY_MAGIC) + 2 + length, dtype, num)
+
+
+    def _view(self, mm, offset, dtype, num):
+        """ Returns num items of a type from a mapped file. """
+        if (np is not None):
+            return np.frombuffer(mm, dtype=dtype, count=num, offset=offset)
+
+        code = dtype_code(dtype)
+        size = array(code).itemsize
+        return memoryview(mm)[offset : offset + num * size].cast(code)
+
+
+def dtype_code(dtype):
+    """ Returns the array type code of a NumPy type of COLUMNS. """
+    for name, code, column_dtype in COLUMNS:
+        if (column_dtype == dtype):
+            return code
+    raise ValueError("unknown column type {}".format(dtype))
@@ -0,0 +1,254 @@
+#
+# Title: G-code interpreter program
+# File: interpreter.py
+# Description: Executes compiled G-code blocks with a MachineClient.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+from machineclient import MachineClient
+from block import Opcode, ModalGroup, MODAL_GROUPS, OPCODES
+from subprogram import Subprograms, MAX_DEPTH, call_params
+
+
+class Interpreter:
+    """ Runs compiled commands on a MachineClient.
+    The dispatch table from opcodes to machine handlers is built once on
+    construction. The coordinate system numbers of G54-G59 are bound into
+    their handlers there, so executing a command is a single list lookup.
+    The active command of every modal group is kept in self.modal.
+    Subprogram calls (M98) run the bodies found in self.subprograms.
+    """
+
+    def __init__(self, machine=None, subprograms=None, replay=False):
+        """ Builds the dispatch table.
+        Args:
+          machine (MachineClient): machine to run the commands with. A
+            new one is created if not given.
+          subprograms (Subprograms): subprogram definitions of the
+            program (see subprogram.py). Set by run() if not given.
+          replay (bool): if True, calls of incremental subprograms are
+            replayed from the net displacement of an earlier run of the
+            body where possible. There is no status output for the
+            replayed calls, so this is only for quiet runs (the calls
+            of a body that gave errors are not replayed).
+        """
+        if (machine is None):
+            machine = MachineClient()
+
+        self.machine = machine
+        self.subprograms = subprograms
+        self.replay = replay
+        # Number of subprogram calls in progress.
+        self._depth = 0
+        # Handler and modal group of every opcode, indexed by the opcode.
+        self._handlers = [None] * len(Opcode)
+        self._groups = [ModalGroup.NONE] * len(Opcode)
+        # Handlers registered for words that have no opcode.
+        self._extra = dict()
+        # Active opcode of every modal group, indexed by the group.
+        self.modal = [None] * len(ModalGroup)
+
+        m = machine
+        self.register(Opcode.G00, m.rapid_move)
+        self.register(Opcode.G01, m.lin_move)
+        self.register(Opcode.G02, m.arc_move_cw)
+        self.register(Opcode.G03, m.arc_move_ccw)
+        self.register(Opcode.G17, m.set_plane_xy)
+        self.register(Opcode.G18, m.set_plane_zx)
+        self.register(Opcode.G19, m.set_plane_yz)
+        self.register(Opcode.G20, m.set_unit_inch)
+        self.register(Opcode.G21, m.set_unit_mm)
+        self.register(Opcode.G10, m.set_offset)
+        self.register(Opcode.G28, m.home)
+        self.register(Opcode.G40, m.set_cutter_comp_off)
+        self.register(Opcode.G43, m.set_tool_length_comp)
+        self.register(Opcode.G49, m.cancel_tool_length_comp)
+        self.register(Opcode.G80, m.cancel_canned_cycle)
+        self.register(Opcode.G73, m.canned_cycle)
+        self.register(Opcode.G81, m.canned_cycle)
+        self.register(Opcode.G82, m.canned_cycle)
+        self.register(Opcode.G83, m.canned_cycle)
+        self.register(Opcode.G85, m.canned_cycle)
+        self.register(Opcode.G89, m.canned_cycle)
+        self.register(Opcode.G90, m.set_dist_mode_abs)
+        self.register(Opcode.G91, m.set_dist_mode_inc)
+        self.register(Opcode.G93, m.set_feed_rate_mode_invtime)
+        self.register(Opcode.G94, m.set_feed_rate_mode_upmin)
+        self.register(Opcode.G95, m.set_feed_rate_mode_uprev)
+        self.register(Opcode.G98, m.set_return_mode_initial)
+        self.register(Opcode.G99, m.set_return_mode_r)
+        self.register(Opcode.M03, m.set_spindle_mode_cw)
+        self.register(Opcode.M04, m.set_spindle_mode_ccw)
+        self.register(Opcode.M05, m.set_spindle_mode_halt)
+        self.register(Opcode.M06, m.manual_tool_change)
+        self.register(Opcode.M07, m.coolant_on)
+        self.register(Opcode.M08, m.coolant_on)
+        self.register(Opcode.M09, m.coolant_off)
+        self.register(Opcode.M30, m.program_end)
+        self.register(Opcode.AXES, m.repeat_motion)
+        self.register(Opcode.M98, self.call_subprogram)
+        self.register(Opcode.M99, self.return_subprogram)
+        self.register(Opcode.T,
+            lambda cmd: m.change_tool("TOOL #{:02d}".format(cmd.arg)))
+        self.register(Opcode.S, lambda cmd: m.set_spindle_speed(cmd.arg))
+
+        # G54 selects coordinate system #1, G55 #2 and so on.
+        for num in range(1, 7):
+            self.register(Opcode.G54 + num - 1,
+                lambda cmd, num=num: m.set_coord_system(num))
+
+
+    def register(self, code, handler, group=None):
+        """ Registers a handler for a command. Replaces any previous
+        handler of the command.
+        Args:
+          code (Opcode or str): opcode or command word (e.g. "G04").
+            Words without an opcode are looked up only when an unknown
+            command is executed, so they do not slow down the others.
+          handler (callable): called with the compiled Command.
+          group (ModalGroup): modal group of the command. Defaults to
+            the group of the opcode.
+        """
+        if (isinstance(code, str)):
+            code = OPCODES.get(code.upper(), code.upper())
+
+        if (isinstance(code, str)):
+            if (group is None):
+                group = ModalGroup.NONE
+            self._extra[code] = (handler, group)
+            return
+
+        if (group is None):
+            group = MODAL_GROUPS.get(code, ModalGroup.NONE)
+
+        self._handlers[code] = handler
+        self._groups[code] = group
+
+
+    def execute(self, cmd):
+        """ Executes a compiled G-code command with the machine.
+        Args:
+          cmd (Command): compiled command and its parameters.
+        """
+        op = cmd.op
+        handler = self._handlers[op]
+
+        if (handler is None):
+            if (op != Opcode.UNKNOWN):
+                return
+
+            entry = self._extra.get(cmd.arg)
+            if (entry is None):
+                return
+
+            handler, group = entry
+            self.modal[group] = cmd.arg
+            handler(cmd)
+            return
+
+        self.modal[self._groups[op]] = op
+        handler(cmd)
+
+
+    def call_subprogram(self, cmd):
+        """ Runs a subprogram (M98 P<program number> L<repeat count>).
+        Args:
+          cmd (Command): the M98 command.
+        """
+        m = self.machine
+        num, count = call_params(cmd)
+        body = None
+        if ((num is not None) and (self.subprograms is not None)):
+            body = self.subprograms.get(num)
+
+        if (body is None):
+            m.statusprint("call_subprogram(): Error, subprogram O{} not "
+                          "found.", num)
+            return
+        if (self._depth >= MAX_DEPTH):
+            m.statusprint("call_subprogram(): Error, more than {} nested "
+                          "subprogram calls.", MAX_DEPTH)
+            return
+
+        # An incremental body ends up displaced by the same amount and in
+        # the same state every time it is started in the same state.
+        replay = (self.replay and m.is_incremental()
+                  and self.subprograms.is_relative(num))
+        replays = self.subprograms.replays
+
+        self._depth += 1
+        try:
+            for i in range(count):
+                if (replay):
+                    key = (num, m.modal_snapshot(), tuple(self.modal))
+                    entry = replays.get(key)
+                    if (entry is not None):
+                        (dx, dy, dz), state, modal = entry
+                        x, y, z = m.get_position()
+                        m.restore(state)
+                        m.set_position(x + dx, y + dy, z + dz)
+                        self.modal[:] = modal
+                        continue
+                    x0, y0, z0 = m.get_position()
+                    errors = m.error_count()
+
+                m.statusprint("Running subprogram O{} ({}/{}).", num, i + 1,
+                              count)
+                self.run_body(body)
+
+                # A body that gave errors is run again, so that they are
+                # output for every call.
+                if (replay and (m.error_count() == errors)):
+                    x, y, z = m.get_position()
+                    replays[key] = ((x - x0, y - y0, z - z0),
+                                    m.modal_snapshot(), tuple(self.modal))
+        finally:
+            self._depth -= 1
+
+        m.statusprint("Returned from subprogram O{}.", num)
+
+
+    def return_subprogram(self, cmd):
+        """ M99 outside of a subprogram; M99 in a subprogram ends
+        run_body() before it is executed.
+        Args:
+          cmd (Command): the M99 command.
+        """
+        self.machine.statusprint("return_subprogram(): Error, not in a "
+                                 "subprogram.")
+
+
+    def run_body(self, body):
+        """ Executes the commands of a subprogram up to its M99.
+        Args:
+          body (tuple): compiled Block objects of the subprogram.
+        """
+        execute = self.execute
+        for block in body:
+            for cmd in block.commands:
+                if (cmd.op == Opcode.M99):
+                    return
+                execute(cmd)
+
+
+    def run(self, blocks):
+        """ Executes all commands of the given blocks.
+        Args:
+          blocks (iterable): compiled Block objects. Subprogram
+            definitions among them are not run but called.
+        Returns:
+          The number of commands executed.
+        """
+        execute = self.execute
+        num_commands = 0
+        if (not isinstance(blocks, Subprograms)):
+            blocks = Subprograms(blocks)
+        self.subprograms = blocks
+
+        for block in blocks:
+            for cmd in block.commands:
+                execute(cmd)
+            num_commands += len(block.commands)
+
+        return num_commands
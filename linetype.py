@@ -0,0 +1,132 @@
+#
+# Title: G-code interpreter program
+# File: linetype.py
+# Description: The rules for the data markers, comment lines and program
+#   numbers of a G-code file.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Every parser (parse_file() in main.py, reader.py, chunkparse.py, dnc.py
+# and the scan of program.py) first sorts a line into one of the kinds
+# below and only compiles the code lines. The rules are kept here, so a
+# file gives the same program whichever way it is read, and the program
+# cache, which keys on the file content only, stays valid for all of them:
+#
+#   empty     no words
+#   marker    the first word starts with "%"
+#   comment   the first word starts with "(" and the last one ends with ")"
+#   program   a single word "O<number>" with a number greater than 0
+#   code      anything else
+#
+# The words are separated by whitespace, so "O 5" is not a program
+# number but a code line without commands. The rules work on bytes; the
+# text lines of parse_file() are encoded first.
+#
+
+import re
+
+# Whitespace separated word.
+TOKEN = re.compile(rb"\S+")
+
+# Byte values of the characters of interest. Letters are compared in
+# upper case: a lower case letter & CASE_MASK gives the upper case one.
+CASE_MASK = 0xDF
+MARKER = ord("%")
+COMMENT_BEGIN = ord("(")
+COMMENT_END = ord(")")
+LETTER_O = ord("O")
+# First bytes of the first word of the lines that can be something else
+# than code. The rest are code lines, which the parsers can take as such
+# without calling classify().
+LEAD_BYTES = frozenset((MARKER, COMMENT_BEGIN, LETTER_O, LETTER_O | 0x20))
+
+# Kinds of lines.
+LINE_EMPTY = 0
+LINE_MARKER = 1
+LINE_COMMENT = 2
+LINE_PROGRAM = 3
+LINE_CODE = 4
+
+# Returned by get_program_number() for lines without a program number.
+NO_PROGRAM = -9999
+
+
+def classify(buf, start=0, end=None):
+    """ Finds out the kind of a line of G-code.
+    Args:
+      buf (bytes-like): G-code text.
+      start, end (int): offsets of the line in buf, the whole of buf by
+        default.
+    Returns:
+      Tuple (kind, pgm_num): one of the LINE_* kinds and, for a
+      LINE_PROGRAM, the program number (None for the others).
+    """
+    if (end is None):
+        end = len(buf)
+    tokens = TOKEN.finditer(buf, start, end)
+    first = next(tokens, None)
+    if (first is None):
+        return LINE_EMPTY, None
+
+    char = buf[first.start()]
+    if (char == MARKER):
+        return LINE_MARKER, None
+
+    if (char == COMMENT_BEGIN):
+        last = first
+        for last in tokens:
+            pass
+        if (buf[last.end() - 1] == COMMENT_END):
+            return LINE_COMMENT, None
+        return LINE_CODE, None
+
+    if (((char & CASE_MASK) == LETTER_O) and (first.end() - first.start() > 1)
+            and (next(tokens, None) is None)):
+        try:
+            pgm_num = int(buf[first.start() + 1 : first.end()])
+        except ValueError:
+            return LINE_CODE, None
+        if (pgm_num > 0):
+            return LINE_PROGRAM, pgm_num
+
+    return LINE_CODE, None
+
+
+def classify_text(txt_row):
+    """ Finds out the kind of a line of G-code text, see classify(). """
+    return classify(txt_row.encode("utf-8", errors="replace"))
+
+
+def is_marker(txt_row):
+    """ Determines if the text line contains a program data marker.
+    Args:
+      txt_row (string): text line to check.
+    Returns:
+      True if this text row is a program data marker, False if not.
+    """
+    return (classify_text(txt_row)[0] == LINE_MARKER)
+
+
+def is_comment(txt_row):
+    """ Determines if the current line of text is a comment line.
+    Args:
+      txt_row (string): text line to check.
+    Returns:
+      True when the text line is empty or a comment line, False if not.
+    """
+    return (classify_text(txt_row)[0] in (LINE_EMPTY, LINE_COMMENT))
+
+
+def get_program_number(txt_row):
+    """ Checks if the current line of text contains a program
+    definition.
+    Args:
+      txt_row (string): text line to check.
+    Returns:
+      The program number, or NO_PROGRAM if the line is not one.
+    """
+    kind, pgm_num = classify_text(txt_row)
+    if (kind != LINE_PROGRAM):
+        return NO_PROGRAM
+
+    return pgm_num
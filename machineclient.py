@@ -6,6 +6,11 @@
 # Date: 2022-02-01
 # 
 
+from sinks import TextSink
+from arcs import arc_center, relative_chords, XY, ZX, YZ
+from offsets import OffsetTable, INCH
+from cycles import CYCLE_OPS, make_template, hole_levels, hole_moves
+
 # Constant value definitions for parameters.
 UNDEFINED = 0
 PLANE_XY = 1
@@ -26,6 +31,11 @@ DIST_MODE_INC = 15
 FEED_MODE_INVTIME = 16
 FEED_MODE_UPMIN = 17
 FEED_MODE_UPREV = 18
+MOTION_MODE_ARC_CW = 19
+MOTION_MODE_ARC_CCW = 20
+MOTION_MODE_CYCLE = 21
+RETURN_MODE_INITIAL = 22
+RETURN_MODE_R = 23
 
 # Descriptive texts for the parameters.
 NAMES = [
@@ -35,32 +45,91 @@ NAMES = [
 "RAPID", "LINEAR",
 "MILLIMETRES", "INCHES",
 "ABSOLUTE","INCREMENTAL",
-"INVERSE TIME", "UNITS/MIN", "UNITS/REV"
+"INVERSE TIME", "UNITS/MIN", "UNITS/REV",
+"CLOCKWISE ARC", "COUNTER-CLOCKWISE ARC",
+"CANNED CYCLE", "INITIAL LEVEL", "R LEVEL"
 ]
 
+# Unit names of the positions, by the unit of measure: the positions are
+# machine coordinates, which are in millimetres also when the program is
+# in inches (see offsets.py).
+POSITION_UNITS = {UNDEFINED: NAMES[UNDEFINED], UNIT_MM: NAMES[UNIT_MM],
+                  UNIT_INCH: NAMES[UNIT_MM]}
+
+# Axes of the arcs in every plane (see arcs.py). Arcs are in the X/Y
+# plane until a plane is selected.
+PLANE_AXES = {UNDEFINED: XY, PLANE_XY: XY, PLANE_ZX: ZX, PLANE_YZ: YZ}
+
 class MachineClient:
-    # Selected plane (XY, ZX, YZ, UV, WU, VW)
-    _plane = UNDEFINED
-    # Current position of the cutter.
-    _pos = {"x": 0.0, "y": 0.0, "z": 0.0}
-    # Selected tool name.
-    _tool_name = ""
-    # Spindle state.
-    _spindle_params = {"is_active": False, "speed": 0, "mode": UNDEFINED}
-    # Feed rate settings.
-    _feed_rate_params = {"rate": 0, "mode": UNDEFINED}
-    # Coolant state.
-    _coolant_on = False
-    # Unit of measure (mm, inch).
-    _unit = UNDEFINED
-    # Distance mode (absolute, incremental)
-    _dist_mode = UNDEFINED
-    # Motion mode (linear, rapid).
-    _motion_mode = UNDEFINED
+    """ Simulated CNC machine. The state is kept in slots of the 
+    instance, so every machine is independent and cheap to create, and
+    the whole state can be saved and put back with snapshot() and 
+    restore().
+    """
     
+    __slots__ = (
+        "_sink",
+        # Receiver of the position changes (see export.py), or None.
+        "_recorder",
+        # Motion planner of the moves (see planner.py), or None.
+        "_planner",
+        # Work and tool length offsets and units (see offsets.py), and
+        # their transform from program to machine coordinates.
+        "_offsets", "_transform",
+        # Selected plane (XY, ZX, YZ, UV, WU, VW)
+        "_plane",
+        # Current position of the cutter in machine coordinates.
+        "_x", "_y", "_z",
+        # Selected tool name.
+        "_tool_name",
+        # Spindle state.
+        "_spindle_on", "_spindle_speed", "_spindle_mode",
+        # Feed rate settings.
+        "_feed_rate", "_feed_mode",
+        # Coolant state.
+        "_coolant_on",
+        # Unit of measure (mm, inch).
+        "_unit",
+        # Distance mode (absolute, incremental)
+        "_dist_mode",
+        # Motion mode (rapid, linear, clockwise or counter-clockwise arc,
+        # canned cycle).
+        "_motion_mode",
+        # Canned cycle return mode (initial level, R level).
+        "_return_mode",
+        # Active canned cycle: (opcode, R, Z, Q, P) words as written,
+        # None when no cycle is active (see cycles.py).
+        "_cycle",
+    )
     
-    def __init__(self):
-        """ Displays a message on MachineClient construction. """
+    
+    def __init__(self, sink=None):
+        """ Displays a message on MachineClient construction. 
+        Args:
+          sink (object): output sink for the status messages (see 
+            sinks.py). Text to standard output if not given.
+        """
+        self._sink = TextSink() if (sink is None) else sink
+        self._recorder = None
+        self._planner = None
+        self._offsets = OffsetTable()
+        self._transform = self._offsets.transform
+        self._plane = UNDEFINED
+        self._x = 0.0
+        self._y = 0.0
+        self._z = 0.0
+        self._tool_name = ""
+        self._spindle_on = False
+        self._spindle_speed = 0
+        self._spindle_mode = UNDEFINED
+        self._feed_rate = 0
+        self._feed_mode = UNDEFINED
+        self._coolant_on = False
+        self._unit = UNDEFINED
+        self._dist_mode = UNDEFINED
+        self._motion_mode = UNDEFINED
+        self._return_mode = UNDEFINED
+        self._cycle = None
         self.statusprint("CNC machine initializing.")
         
         
@@ -69,60 +138,290 @@ class MachineClient:
         self.statusprint("CNC machine shutting down.")
         
         
-    def rapid_move(self, params):
+    def rapid_move(self, cmd):
         """ Switches the machine into rapid movement mode and optionally
         performs a rapid move.
         Args:
-          params (dict): coordinates of the movement.
+          cmd (Command): compiled command with the coordinates of the 
+            movement.
         """
         self._motion_mode = MOTION_MODE_RAPID
+        self._cycle = None
         
-        if (params is None):
-            self.statusprint("Setting motion mode to {}".format(NAMES[self._motion_mode]))
+        if ((cmd is None) or (not cmd.has_params())):
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
             return
         
-        new_x = self._pos["x"]
-        new_y = self._pos["y"]
-        new_z = self._pos["z"]
-        
-        for par in params:
-            if (par[0] == "X"):
-                new_x = float(par[1 : len(par)])
-            if (par[0] == "Y"):
-                new_y = float(par[1 : len(par)])
-            if (par[0] == "Z"):
-                new_z = float(par[1 : len(par)])
+        self.move(*self.target(cmd))
         
-        self.move(new_x, new_y, new_z)
         
-        
-    def lin_move(self, params):
+    def lin_move(self, cmd):
         """ Switches the machine into linear movement mode and 
         optionally performs a linear move with the current feed rate.
         Args:
-          params (dict): coordinates of the movement.
+          cmd (Command): compiled command with the coordinates of the 
+            movement.
         """
         self._motion_mode = MOTION_MODE_LINEAR
+        self._cycle = None
+        
+        if ((cmd is None) or (not cmd.has_params())):
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
+            return
+        
+        if (cmd.f is not None):
+            self.set_feed_rate(cmd.f)
+        
+        self.move(*self.target(cmd))
+        
+        
+    def arc_move_cw(self, cmd):
+        """ Switches the machine into clockwise arc mode and optionally
+        performs a clockwise arc with the current feed rate.
+        Args:
+          cmd (Command): compiled command with the end point and the
+            center offsets or radius of the arc.
+        """
+        self.arc_move(cmd, True)
+        
+        
+    def arc_move_ccw(self, cmd):
+        """ Switches the machine into counter-clockwise arc mode and 
+        optionally performs a counter-clockwise arc with the current feed
+        rate.
+        Args:
+          cmd (Command): compiled command with the end point and the
+            center offsets or radius of the arc.
+        """
+        self.arc_move(cmd, False)
+        
+        
+    def arc_move(self, cmd, clockwise):
+        """ Performs an arc in the selected plane as a series of linear
+        moves within arcs.TOLERANCE of the arc. The axis outside the
+        plane moves linearly along the arc.
+        Args:
+          cmd (Command): compiled command with the end point (X, Y, Z)
+            and the center offsets (I, J, K) or radius (R) of the arc.
+            The center offsets are always relative to the start point.
+          clockwise (bool): direction of the arc.
+        """
+        self._motion_mode = (MOTION_MODE_ARC_CW if (clockwise) 
+                             else MOTION_MODE_ARC_CCW)
+        self._cycle = None
+        
+        if ((cmd is None) or 
+                ((not cmd.has_params()) and (not cmd.has_arc_params()))):
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
+            return
+        
+        if (cmd.f is not None):
+            self.set_feed_rate(cmd.f)
+        
+        if ((cmd.x is None) and (cmd.y is None) and (cmd.z is None)
+                and (not cmd.has_arc_params())):
+            # Feed rate only.
+            return
+        
+        x, y, z = self.target(cmd)
+        if (self._dist_mode == DIST_MODE_INC):
+            end = (self._x + x, self._y + y, self._z + z)
+        elif (self._dist_mode == DIST_MODE_ABS):
+            end = (x, y, z)
+        else:
+            self.statusprint("arc_move(): Error, distance mode not set.")
+            return
+        
+        start = (self._x, self._y, self._z)
+        axes = PLANE_AXES.get(self._plane, XY)
+        # Center offsets and radius are lengths: only scaled.
+        scale = self._transform[0]
+        offsets = None
+        if ((cmd.i is not None) or (cmd.j is not None) 
+                or (cmd.k is not None)):
+            offsets = (0.0 if (cmd.i is None) else cmd.i * scale,
+                       0.0 if (cmd.j is None) else cmd.j * scale,
+                       0.0 if (cmd.k is None) else cmd.k * scale)
+        radius = None if (cmd.r is None) else cmd.r * scale
+        try:
+            center = arc_center(start, end, axes, clockwise, offsets, radius)
+            chords = relative_chords(start, end, center, axes, clockwise)
+        except ValueError as e:
+            self.statusprint("arc_move(): Error, {}.", e)
+            return
         
-        if (params is None):
-            self.statusprint("Setting motion mode to {}".format(NAMES[self._motion_mode]))
+        if (not isinstance(chords, tuple)):
+            chords = chords.tolist()
+        unit = POSITION_UNITS[self._unit]
+        self.statusprint("Moving along {} to X={:.3f} Y={:.3f} Z={:.3f} "
+            "around X={:.3f} Y={:.3f} Z={:.3f} in {} segments [{}].",
+            NAMES[self._motion_mode], end[0], end[1], end[2], 
+            center[0], center[1], center[2], len(chords), unit)
+        self.statusprint("Using feed rate F={:.3f} {}", self._feed_rate, 
+            NAMES[self._feed_mode])
+        
+        # One status per chord: the sink is called directly, as arcs can
+        # have hundreds of them.
+        status = self._sink.status
+        recorder = self._recorder
+        planner = self._planner
+        feed = self._feed_rate / 60.0 * scale
+        x0, y0, z0 = start
+        for dx, dy, dz in chords:
+            status("Moving to X={:.3f} Y={:.3f} Z={:.3f} [{}].",
+                   (x0 + dx, y0 + dy, z0 + dz, unit))
+            if (recorder is not None):
+                recorder.record(x0 + dx, y0 + dy, z0 + dz, 
+                                self._motion_mode, self._feed_rate,
+                                self._tool_name)
+            if (planner is not None):
+                planner.add(x0 + dx, y0 + dy, z0 + dz, False, feed, True)
+        self._x, self._y, self._z = end
+        
+
+    def canned_cycle(self, cmd):
+        """ Switches the machine into a canned drilling cycle (G73, G81,
+        G82, G83, G85 or G89) and drills a hole (see cycles.py). The R, Z,
+        Q and P words are kept for the following holes until another
+        motion command or G80.
+        Args:
+          cmd (Command): compiled cycle command with the position of the
+            hole and the words of the cycle, or axis words (AXES) with
+            the position of the next hole.
+        """
+        op = cmd.op
+        old = self._cycle
+        if (op not in CYCLE_OPS):
+            op = old[0]
+        if (old is None):
+            old = (op, None, None, None, None)
+        self._cycle = (op,
+                       old[1] if (cmd.r is None) else cmd.r,
+                       old[2] if (cmd.z is None) else cmd.z,
+                       old[3] if (cmd.q is None) else cmd.q,
+                       old[4] if (cmd.p is None) else cmd.p)
+        
+        if (self._motion_mode != MOTION_MODE_CYCLE):
+            self._motion_mode = MOTION_MODE_CYCLE
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
+        
+        if (cmd.f is not None):
+            self.set_feed_rate(cmd.f)
+        
+        self.drill(cmd)
+        
+        
+    def drill(self, cmd):
+        """ Drills the holes of a canned cycle block: one at the position
+        of the block, or L holes at its X/Y increments in incremental 
+        mode. The levels of the cycle are computed once for the block.
+        Args:
+          cmd (Command): compiled command with the position of the hole
+            and the L word.
+        """
+        op, r, z, q, p = self._cycle
+        if ((r is None) or (z is None)):
+            self.statusprint("drill(): Error, R and Z of the cycle not set.")
             return
+        if (self._dist_mode == UNDEFINED):
+            self.statusprint("drill(): Error, distance mode not set.")
+            return
+        
+        inc = (self._dist_mode == DIST_MODE_INC)
+        scale, off_x, off_y, off_z = self._transform
+        depth = (-z if (inc) else r - z) * scale
+        try:
+            steps = make_template(op, depth, 
+                                  None if (q is None) else q * scale, p)
+        except ValueError as e:
+            self.statusprint("drill(): Error, {}.", e)
+            return
+        
+        r_level, bottom, retract = hole_levels(inc, self._z, r, z, scale,
+            off_z, self._return_mode == RETURN_MODE_R)
+        unit = POSITION_UNITS[self._unit]
+        repeats = 1 if (cmd.l is None) else int(cmd.l)
+        for n in range(repeats):
+            if (inc):
+                x = self._x if (cmd.x is None) else self._x + cmd.x * scale
+                y = self._y if (cmd.y is None) else self._y + cmd.y * scale
+            else:
+                x = self._x if (cmd.x is None) else cmd.x * scale + off_x
+                y = self._y if (cmd.y is None) else cmd.y * scale + off_y
+            self.statusprint("Drilling {} at X={:.3f} Y={:.3f} from "
+                "R={:.3f} to Z={:.3f} [{}].", op.name, x, y, r_level, 
+                bottom, unit)
+            for x1, y1, z1, rapid, dwell in hole_moves(
+                    (self._x, self._y, self._z), x, y, r_level, retract, 
+                    steps):
+                self.cycle_move(x1, y1, z1, rapid, dwell)
+        
+        
+    def cycle_move(self, x, y, z, rapid, dwell):
+        """ Makes a move of a canned cycle: X, then Y, then Z.
+        Args:
+          x, y, z (float): end point [mm].
+          rapid (bool): True for a rapid move, False for the feed rate.
+          dwell (float): dwell after the move [s].
+        """
+        if (abs(x - self._x) >= 0.001):
+            self.move_x(x)
+        if (abs(y - self._y) >= 0.001):
+            self.move_y(y)
+        if (abs(z - self._z) >= 0.001):
+            self.move_z(z)
+        if (self._planner is not None):
+            self.plan_move(rapid)
+            if (dwell > 0.0):
+                self._planner.dwell(dwell)
+        if (dwell > 0.0):
+            self.statusprint("Dwelling {:.3f} s.", dwell)
+        
         
-        new_x = self._pos["x"]
-        new_y = self._pos["y"]
-        new_z = self._pos["z"]
+    def repeat_motion(self, cmd):
+        """ Runs axis words without a command ("X10 Y20") in the 
+        current motion mode: a move, an arc or the next hole of a canned
+        cycle.
+        Args:
+          cmd (Command): compiled AXES command.
+        """
+        mode = self._motion_mode
+        if (mode == MOTION_MODE_RAPID):
+            self.rapid_move(cmd)
+        elif (mode == MOTION_MODE_LINEAR):
+            self.lin_move(cmd)
+        elif (mode == MOTION_MODE_ARC_CW):
+            self.arc_move(cmd, True)
+        elif (mode == MOTION_MODE_ARC_CCW):
+            self.arc_move(cmd, False)
+        elif (mode == MOTION_MODE_CYCLE):
+            self.canned_cycle(cmd)
+        else:
+            self.statusprint("repeat_motion(): Error, motion mode not set.")
+        
+        
+    def target(self, cmd):
+        """ Gets the move() arguments for the coordinates of a command,
+        in machine coordinates: the coordinates given are transformed 
+        with the active offsets and units (see offsets.py), incremental
+        ones only scaled. Axes that are not given keep their position: 
+        in absolute mode their current coordinate is used, in 
+        incremental mode zero.
+        Args:
+          cmd (Command): compiled command with the coordinates.
+        Returns:
+          (x, y, z) tuple for move().
+        """
+        scale, off_x, off_y, off_z = self._transform
+        if (self._dist_mode == DIST_MODE_INC):
+            return (0.0 if (cmd.x is None) else cmd.x * scale,
+                    0.0 if (cmd.y is None) else cmd.y * scale,
+                    0.0 if (cmd.z is None) else cmd.z * scale)
         
-        for par in params:
-            if (par[0] == "F"):
-                self.set_feed_rate( float(par[1 : len(par)]) )
-            if (par[0] == "X"):
-                new_x = float(par[1 : len(par)])
-            if (par[0] == "Y"):
-                new_y = float(par[1 : len(par)])
-            if (par[0] == "Z"):
-                new_z = float(par[1 : len(par)])
+        return (self._x if (cmd.x is None) else cmd.x * scale + off_x,
+                self._y if (cmd.y is None) else cmd.y * scale + off_y,
+                self._z if (cmd.z is None) else cmd.z * scale + off_z)
         
-        self.move(new_x, new_y, new_z)
         
     def set_plane_xy(self, dummy={}):
         """ Sets the plane to X/Y mode.
@@ -130,7 +429,7 @@ class MachineClient:
           dummy (dict) unused
         """
         self._plane = PLANE_XY
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
     
     
     def set_plane_zx(self, dummy={}):
@@ -139,7 +438,7 @@ class MachineClient:
           dummy (dict) unused
         """
         self._plane = PLANE_ZX
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
     
     
     def set_plane_yz(self, dummy={}):
@@ -148,7 +447,7 @@ class MachineClient:
           dummy (dict) unused
         """
         self._plane = PLANE_YZ
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
         
         
     def set_unit_mm(self, dummy={}):
@@ -157,8 +456,10 @@ class MachineClient:
           dummy (dict) unused
         """
         self._unit = UNIT_MM
-        self.statusprint("Unit of measure set to {}"
-            .format(NAMES[self._unit]))
+        self._offsets.set_units(1.0)
+        self._transform = self._offsets.transform
+        self.statusprint("Unit of measure set to {}",
+            NAMES[self._unit])
     
     
     def set_unit_inch(self, dummy={}):
@@ -167,8 +468,10 @@ class MachineClient:
           dummy (dict) unused
         """
         self._unit = UNIT_INCH
-        self.statusprint("Unit of measure set to {}"
-            .format(NAMES[self._unit]))
+        self._offsets.set_units(INCH)
+        self._transform = self._offsets.transform
+        self.statusprint("Unit of measure set to {}",
+            NAMES[self._unit])
     
     
     def set_cutter_comp_off(self, dummy={}):
@@ -185,8 +488,50 @@ class MachineClient:
         Args:
           dummy (dict) unused
         """
+        self._offsets.set_tool_offset(None)
+        self._transform = self._offsets.transform
         self.statusprint("Tool length compensation CANCELED")
-        #No implementation
+        
+        
+    def set_tool_length_comp(self, cmd):
+        """ Turns tool length compensation on: Z moves are offset by the
+        tool length offset of the H word (see offsets.py). Axis words 
+        make a move with the offset.
+        Args:
+          cmd (Command): compiled G43 with the H word.
+        """
+        if ((cmd.h is None) or (cmd.h < 0)):
+            self.statusprint("set_tool_length_comp(): Error, tool length "
+                             "offset number (H) missing.")
+            return
+        
+        num = int(cmd.h)
+        self._offsets.set_tool_offset(num)
+        self._transform = self._offsets.transform
+        self.statusprint("Tool length compensation ON, H{:02d} = {:.3f} [{}]",
+            num, self._offsets.tool_length(num), NAMES[UNIT_MM])
+        
+        # "G43 H01 Z5.0": the move in the current motion mode, with the
+        # offset.
+        if ((cmd.x is not None) or (cmd.y is not None) 
+                or (cmd.z is not None)):
+            self.move(*self.target(cmd))
+        
+        
+    def set_offset(self, cmd):
+        """ Sets a work offset or a tool length offset (G10, see
+        offsets.py).
+        Args:
+          cmd (Command): compiled G10 with the L, P and axis words.
+        """
+        try:
+            self._offsets.set_from(cmd)
+        except ValueError as e:
+            self.statusprint("set_offset(): Error, {}.", e)
+            return
+        
+        self._transform = self._offsets.transform
+        self.statusprint("Offset set: {}", cmd)
         
         
     def cancel_canned_cycle(self, dummy={}):
@@ -194,8 +539,31 @@ class MachineClient:
         Args:
           dummy (dict) unused
         """
+        self._cycle = None
+        if (self._motion_mode == MOTION_MODE_CYCLE):
+            self._motion_mode = UNDEFINED
         self.statusprint("Canned cycles CANCELED")
-        #No implementation
+        
+        
+    def set_return_mode_initial(self, dummy={}):
+        """ Sets canned cycles to retract to the level they started 
+        from (G98).
+        Args:
+          dummy (dict) unused
+        """
+        self._return_mode = RETURN_MODE_INITIAL
+        self.statusprint("Canned cycle return mode set to {}",
+            NAMES[self._return_mode])
+        
+        
+    def set_return_mode_r(self, dummy={}):
+        """ Sets canned cycles to retract to the R level (G99).
+        Args:
+          dummy (dict) unused
+        """
+        self._return_mode = RETURN_MODE_R
+        self.statusprint("Canned cycle return mode set to {}",
+            NAMES[self._return_mode])
         
         
     def set_feed_rate_mode_upmin(self, dummy={}):
@@ -203,9 +571,9 @@ class MachineClient:
         Args:
           dummy (dict) unused
         """
-        self._feed_rate_params["mode"] = FEED_MODE_UPMIN
-        self.statusprint("Feed rate mode set to {}"
-            .format(NAMES[self._feed_rate_params["mode"]]))
+        self._feed_mode = FEED_MODE_UPMIN
+        self.statusprint("Feed rate mode set to {}",
+            NAMES[self._feed_mode])
         
         
     def set_feed_rate_mode_invtime(self, dummy={}):
@@ -213,9 +581,9 @@ class MachineClient:
         Args:
           dummy (dict) unused
         """
-        self._feed_rate_params["mode"] = FEED_MODE_INVTIME
-        self.statusprint("Feed rate mode set to {}"
-            .format(NAMES[self._feed_rate_params["mode"]]))
+        self._feed_mode = FEED_MODE_INVTIME
+        self.statusprint("Feed rate mode set to {}",
+            NAMES[self._feed_mode])
         
     
     def set_feed_rate_mode_uprev(self, dummy={}):
@@ -223,12 +591,11 @@ class MachineClient:
         Args:
           dummy (dict) unused
         """
-        self._feed_rate_params["mode"] = FEED_MODE_UPREV
-        self.statusprint("Feed rate mode set to UNITS/REVOLUTION"
-            .format(self._feed_rate_params["mode"]))
+        self._feed_mode = FEED_MODE_UPREV
+        self.statusprint("Feed rate mode set to UNITS/REVOLUTION")
         
         
-    def home(self, params):
+    def home(self, cmd):
         """ Moves machine to home position. 
         According to http://linuxcnc.org/docs/html/gcode/g-code.html#gcode:g28-g28.1
         
@@ -240,37 +607,40 @@ class MachineClient:
         In this toy code it is assumed that parameters 5161-5166 are 
         programmed to contain the home position (x=0.0; y=0.0; z=0.0) 
         Only the specified axes will move into their home positions.
+        Args:
+          cmd (Command): compiled command with the axes to home.
         """
         # Moving the specified axes (if any).
+        scale, off_x, off_y, off_z = self._transform
         if (self._motion_mode == DIST_MODE_INC):
-            for par in params:
-                amount = float( par[1 : len(par)] )
-                if (par[0] == "X"):
-                    self.move_x(self._pos["x"] + amount)
-                if (par[0] == "Y"):
-                    self.move_y(self._pos["y"] + amount)
-                if (par[0] == "Z"):
-                    self.move_z(self._pos["z"] + amount)
+            if (cmd.x is not None):
+                self.move_x(self._x + cmd.x * scale)
+            if (cmd.y is not None):
+                self.move_y(self._y + cmd.y * scale)
+            if (cmd.z is not None):
+                self.move_z(self._z + cmd.z * scale)
                     
         elif (self._motion_mode == DIST_MODE_ABS):
-            for par in params:
-                amount = float( par[1 : len(par)] )
-                if (par[0] == "X"):
-                    self.move_x(amount)
-                if (par[0] == "Y"):
-                    self.move_y(amount)
-                if (par[0] == "Z"):
-                    self.move_z(amount)
-        
-        # Homing.
+            if (cmd.x is not None):
+                self.move_x(cmd.x * scale + off_x)
+            if (cmd.y is not None):
+                self.move_y(cmd.y * scale + off_y)
+            if (cmd.z is not None):
+                self.move_z(cmd.z * scale + off_z)
+        
+        if (self._planner is not None):
+            self.plan_move(True)
+        
+        # Homing, to the machine origin.
         self.statusprint("Moving selected axes to home.")
-        for par in params:
-            if (par[0] == "Z"):
-                self.move_z(0.0)
-            if (par[0] == "X"):
-                self.move_x(0.0)
-            if (par[0] == "Y"):
-                self.move_y(0.0)
+        if (cmd.z is not None):
+            self.move_z(0.0)
+        if (cmd.x is not None):
+            self.move_x(0.0)
+        if (cmd.y is not None):
+            self.move_y(0.0)
+        if (self._planner is not None):
+            self.plan_move(True)
     
     
     def move(self, x, y, z):
@@ -281,9 +651,9 @@ class MachineClient:
         z (float): Z axis absolute value [mm]
         """
         if (self._dist_mode == DIST_MODE_INC):
-            new_x = self._pos["x"] + x
-            new_y = self._pos["y"] + y
-            new_z = self._pos["z"] + z
+            new_x = self._x + x
+            new_y = self._y + y
+            new_z = self._z + z
             
         elif (self._dist_mode == DIST_MODE_ABS):
             new_x = x
@@ -294,31 +664,34 @@ class MachineClient:
             self.statusprint("move(): Error, distance mode not set.")
             return
         
-        self.statusprint("Moving to X={:.3f} Y={:.3f} Z={:.3f} [{}]."
-            .format(new_x, new_y, new_z, NAMES[self._unit]))
+        self.statusprint("Moving to X={:.3f} Y={:.3f} Z={:.3f} [{}].",
+            new_x, new_y, new_z, POSITION_UNITS[self._unit])
         
         if (self._motion_mode == MOTION_MODE_LINEAR):
-            rate = self._feed_rate_params["rate"]
-            mode = self._feed_rate_params["mode"]
-            self.statusprint("Using feed rate F={:.3f} {}".format(rate, NAMES[mode]))
+            rate = self._feed_rate
+            mode = self._feed_mode
+            self.statusprint("Using feed rate F={:.3f} {}", rate, NAMES[mode])
             
-        if (new_z >= self._pos["z"]):
+        if (new_z >= self._z):
             # Mill bit must raise before changing position.
-            if (abs(new_z - self._pos["z"]) >= 0.001):
+            if (abs(new_z - self._z) >= 0.001):
                 self.move_z(new_z)
-            if (abs(new_x - self._pos["x"]) >= 0.001):
+            if (abs(new_x - self._x) >= 0.001):
                 self.move_x(new_x)
-            if (abs(new_y - self._pos["y"]) >= 0.001):
+            if (abs(new_y - self._y) >= 0.001):
                 self.move_y(new_y)
             
         else:
             # Head must move into position before lowering the mill bit.
-            if (abs(new_x - self._pos["x"]) >= 0.001):
+            if (abs(new_x - self._x) >= 0.001):
                 self.move_x(new_x)
-            if (abs(new_y - self._pos["y"]) >= 0.001):
+            if (abs(new_y - self._y) >= 0.001):
                 self.move_y(new_y)
-            if (abs(new_z - self._pos["z"]) >= 0.001):
+            if (abs(new_z - self._z) >= 0.001):
                 self.move_z(new_z)
+        
+        if (self._planner is not None):
+            self.plan_move()
 
 
     def move_x(self, value):
@@ -327,9 +700,12 @@ class MachineClient:
         Args:
         value (float): Axis absolute value [mm]
         """        
-        self.statusprint("Moving X to {:.3f} [{}]."
-            .format(value, NAMES[self._unit]))
-        self._pos["x"] = value
+        self.statusprint("Moving X to {:.3f} [{}].",
+            value, POSITION_UNITS[self._unit])
+        self._x = value
+        if (self._recorder is not None):
+            self._recorder.record(self._x, self._y, self._z, 
+                self._motion_mode, self._feed_rate, self._tool_name)
 
 
     def move_y(self, value):
@@ -338,9 +714,12 @@ class MachineClient:
         Args:
         value(float): Axis absolute value [mm]
         """
-        self.statusprint("Moving Y to {:.3f} [{}]."
-            .format(value, NAMES[self._unit]))
-        self._pos["y"] = value
+        self.statusprint("Moving Y to {:.3f} [{}].",
+            value, POSITION_UNITS[self._unit])
+        self._y = value
+        if (self._recorder is not None):
+            self._recorder.record(self._x, self._y, self._z, 
+                self._motion_mode, self._feed_rate, self._tool_name)
         
         
     def move_z(self, value):
@@ -349,9 +728,12 @@ class MachineClient:
         Args:
         value (float): Axis absolute value [mm]
         """
-        self.statusprint("Moving Z to {:.3f} [{}]."
-            .format(value, NAMES[self._unit]))
-        self._pos["z"] = value
+        self.statusprint("Moving Z to {:.3f} [{}].",
+            value, POSITION_UNITS[self._unit])
+        self._z = value
+        if (self._recorder is not None):
+            self._recorder.record(self._x, self._y, self._z, 
+                self._motion_mode, self._feed_rate, self._tool_name)
     
     
     def set_feed_rate(self, value):
@@ -359,13 +741,13 @@ class MachineClient:
         Args:
         value (float): Feed rate [mm/s]
         """
-        if (self._feed_rate_params["mode"] == UNDEFINED):
+        if (self._feed_mode == UNDEFINED):
             self.statusprint("set_feed_rate(): Error, unknown feed rate mode.")
             return
         
         # "Official" CNC feed rate is units/min
-        elif (self._feed_rate_params["mode"] == FEED_MODE_UPMIN):
-            self._feed_rate_params["rate"] = value * 60.0
+        elif (self._feed_mode == FEED_MODE_UPMIN):
+            self._feed_rate = value * 60.0
         
         # TODO: other feed rate modes?
         else:
@@ -382,8 +764,8 @@ class MachineClient:
             self.statusprint("set_spindle_speed(): Error, speed must be non-negative.")
             return
         
-        self._spindle_params["speed"] = value
-        self.statusprint("Using spindle speed {} [rpm].".format(value))
+        self._spindle_speed = value
+        self.statusprint("Using spindle speed {} [rpm].", value)
 
 
     def set_spindle_mode_cw(self, dummy={}):
@@ -391,11 +773,11 @@ class MachineClient:
         Args:
           dummy (dict): unused
         """
-        self._spindle_params["mode"] = SPINDLE_MODE_CW
-        self._spindle_params["state"] = True
+        self._spindle_mode = SPINDLE_MODE_CW
+        self._spindle_on = True
         
-        self.statusprint("Setting spindle mode to {}"
-            .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+            NAMES[self._spindle_mode])
 
     
     def set_spindle_mode_ccw(self, dummy={}):
@@ -403,11 +785,11 @@ class MachineClient:
         Args:
           dummy (dict): unused
         """
-        self._spindle_params["mode"] = SPINDLE_MODE_CCW
-        self._spindle_params["state"] = True
+        self._spindle_mode = SPINDLE_MODE_CCW
+        self._spindle_on = True
         
-        self.statusprint("Setting spindle mode to {}"
-            .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+            NAMES[self._spindle_mode])
 
         
     def set_spindle_mode_halt(self, dummy={}):
@@ -415,11 +797,11 @@ class MachineClient:
         Args:
           dummy (dict): unused
         """
-        self._spindle_params["mode"] = SPINDLE_MODE_HALT
-        self._spindle_params["state"] = False
+        self._spindle_mode = SPINDLE_MODE_HALT
+        self._spindle_on = False
         
-        self.statusprint("Setting spindle mode to {}"
-            .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+            NAMES[self._spindle_mode])
 
         
     def set_dist_mode_abs(self, dummy={}):
@@ -428,8 +810,8 @@ class MachineClient:
           dummy (dict): unused
         """
         self._dist_mode = DIST_MODE_ABS
-        self.statusprint("Setting distance mode to {}"
-            .format(NAMES[self._dist_mode]))
+        self.statusprint("Setting distance mode to {}",
+            NAMES[self._dist_mode])
         
         
     def set_dist_mode_inc(self, dummy={}):
@@ -438,8 +820,8 @@ class MachineClient:
           dummy (dict): unused
         """
         self._dist_mode = DIST_MODE_INC
-        self.statusprint("Setting distance mode to {}"
-            .format(NAMES[self._dist_mode]))
+        self.statusprint("Setting distance mode to {}",
+            NAMES[self._dist_mode])
         
         
     def set_coord_system(self, num):
@@ -447,8 +829,9 @@ class MachineClient:
         Args:
           num (int) number of the coordinate system to use.
         """
-        self.statusprint("Selecting coordinate system #{}".format(num))
-        # not implemented.
+        self._offsets.select(num)
+        self._transform = self._offsets.transform
+        self.statusprint("Selecting coordinate system #{}", num)
         
         
     def change_tool(self, tool_name):
@@ -457,7 +840,7 @@ class MachineClient:
         tool_name (str): Tool name.
         """
         self._tool_name = tool_name
-        self.statusprint("Changing tool '{:s}'.".format(self._tool_name))
+        self.statusprint("Changing tool '{:s}'.", self._tool_name)
         
 
     def manual_tool_change(self, dummy={}):
@@ -465,7 +848,7 @@ class MachineClient:
         Args:
           dummy (dict): unused
         """
-        self.statusprint("Manual tool change to '{}' requested".format(self._tool_name))
+        self.statusprint("Manual tool change to '{}' requested", self._tool_name)
         
         
     def coolant_on(self, dummy={}):
@@ -474,7 +857,7 @@ class MachineClient:
           dummy (dict): unused
         """
         self.statusprint("Coolant turned on.")
-        _coolant_on = True
+        self._coolant_on = True
     
     
     def coolant_off(self, dummy={}):
@@ -483,7 +866,7 @@ class MachineClient:
           dummy (dict): unused
         """
         self.statusprint("Coolant turned off.")
-        _coolant_on = False
+        self._coolant_on = False
 
 
     def program_end(self, dummy={}):
@@ -516,25 +899,140 @@ class MachineClient:
         self.coolant_off()              # 10
         
     
-    def statusprint(self, message):
-        """ Prints machine status messages to standard output.
+    def get_state(self):
+        """ Returns the current machine state.
+        Returns:
+          A dict of plain values (names instead of the numeric constants)
+          that can be compared, pickled and written as JSON.
+        """
+        return {
+            "pos": {"x": self._x, "y": self._y, "z": self._z},
+            "plane": NAMES[self._plane],
+            "tool": self._tool_name,
+            "spindle_on": self._spindle_on,
+            "spindle_speed": self._spindle_speed,
+            "spindle_mode": NAMES[self._spindle_mode],
+            "feed_rate": self._feed_rate,
+            "feed_rate_mode": NAMES[self._feed_mode],
+            "coolant_on": self._coolant_on,
+            "unit": NAMES[self._unit],
+            "dist_mode": NAMES[self._dist_mode],
+            "motion_mode": NAMES[self._motion_mode],
+            "return_mode": NAMES[self._return_mode],
+            "canned_cycle": (None if (self._cycle is None)
+                             else self._cycle[0].name),
+            "coord_system": self._offsets.coord_system,
+            "tool_length_offset": self._offsets.tool_offset,
+        }
+        
+    
+    def snapshot(self):
+        """ Saves the machine state, e.g. at a block boundary.
+        Returns:
+          An immutable tuple of plain values, for restore(). Snapshots 
+          can be kept, shared between machines and pickled.
+        """
+        return (self._plane, self._x, self._y, self._z, self._tool_name,
+                self._spindle_on, self._spindle_speed, self._spindle_mode,
+                self._feed_rate, self._feed_mode, self._coolant_on, 
+                self._unit, self._dist_mode, self._motion_mode,
+                self._return_mode, self._cycle, self._offsets.snapshot())
+        
+        
+    def restore(self, snapshot):
+        """ Puts back a saved machine state. No status is output.
         Args:
-          message (str): message to print.
+          snapshot (tuple): result of snapshot() of this or another 
+            machine.
         """
-        print(4*"-" + "> ", end="")
-        print(message)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        (self._plane, self._x, self._y, self._z, self._tool_name,
+         self._spindle_on, self._spindle_speed, self._spindle_mode,
+         self._feed_rate, self._feed_mode, self._coolant_on, 
+         self._unit, self._dist_mode, self._motion_mode, 
+         self._return_mode, self._cycle, offsets) = snapshot
+        self._offsets.restore(offsets)
+        self._transform = self._offsets.transform
+        
+    
+    def modal_snapshot(self):
+        """ Saves the machine state without the position.
+        Returns:
+          A snapshot() of the machine as if it was at the origin: equal 
+          for machines in the same modes wherever they are.
+        """
+        return (self._plane, 0.0, 0.0, 0.0, self._tool_name,
+                self._spindle_on, self._spindle_speed, self._spindle_mode,
+                self._feed_rate, self._feed_mode, self._coolant_on, 
+                self._unit, self._dist_mode, self._motion_mode,
+                self._return_mode, self._cycle, self._offsets.snapshot())
+        
+        
+    def get_position(self):
+        """ Returns the current (x, y, z) position. """
+        return (self._x, self._y, self._z)
+        
+        
+    def set_position(self, x, y, z):
+        """ Puts the machine into a position without moving it or any 
+        status output, e.g. when replaying a subprogram.
+        Args:
+          x, y, z (float): the position.
+        """
+        self._x = x
+        self._y = y
+        self._z = z
+        
+        
+    def error_count(self):
+        """ Returns the number of error messages output so far by a quiet
+        sink (see sinks.py). """
+        return self._sink.num_errors
+        
+        
+    def is_incremental(self):
+        """ Returns True if the machine is in incremental distance mode. """
+        return (self._dist_mode == DIST_MODE_INC)
+        
+    
+    def set_recorder(self, recorder):
+        """ Sets the receiver of every position change.
+        Args:
+          recorder (object): its record(x, y, z, motion_mode, feed_rate,
+            tool_name) is called after every axis move and arc chord
+            (see export.py). None to stop recording.
+        """
+        self._recorder = recorder
+        
+        
+    def set_planner(self, planner):
+        """ Sets the motion planner of the moves.
+        Args:
+          planner (Planner): gets the end point of every move and arc
+            chord as a straight segment (see planner.py). None to stop
+            planning.
+        """
+        self._planner = planner
+        
+        
+    def plan_move(self, rapid=None):
+        """ Passes the move to the current position to the planner.
+        Args:
+          rapid (bool): True for a rapid move; by default, as in the 
+            motion mode.
+        """
+        if (rapid is None):
+            rapid = (self._motion_mode == MOTION_MODE_RAPID)
+        # The planner takes the programmed F value (units/min) in 
+        # millimetres; set_feed_rate() keeps it times 60.
+        self._planner.add(self._x, self._y, self._z, rapid, 
+                          self._feed_rate / 60.0 * self._transform[0])
+        
+    
+    def statusprint(self, message, *args):
+        """ Passes a machine status message to the output sink. The
+        message is formatted only if the sink outputs it.
+        Args:
+          message (str): message, or format string of the message.
+          args: arguments for the format string.
+        """
+        self._sink.status(message, args)
@@ -8,317 +8,559 @@
 # Date: 2022-02-01
 # 
 
+import os
 import sys 
 import pdb
+import argparse
+import functools
+import contextlib
 from machineclient import MachineClient as MC
+from block import ParseError, Opcode, Command, Block, compile_block
+from interpreter import Interpreter
+from subprogram import Subprograms
+from validator import ERROR, validate_blocks, format_problems
+from reader import parse_mapped
+from linetype import (LINE_EMPTY, LINE_MARKER, LINE_COMMENT, LINE_PROGRAM,
+    classify_text)
+from cache import parse_cached, cached_records
+from sinks import FORMATS, NullSink, QuietSink, TextSink
+import planner
 
 def main(args):
     pgm_data = dict()
+    opts = parse_args(args[1:])
     
-    if (len(args) != 2):
-        show_usage()
-        return 1
+    if (opts.quiet):
+        sink = QuietSink()
+    else:
+        sink = FORMATS[opts.format]()
+    
+    sink.info("args: {}", args)
     
-    print("args:", args)
+    profiler = None
+    if (opts.profile):
+        profiler = start_profiler()
     
     try:
-        with open(args[1]) as f:
-            parse_file(f, pgm_data)
+        if (opts.start is not None):
+            status = restart_program(opts, sink, profiler)
+        
+        elif (not os.path.isfile(opts.file)):
+            # Standard input, pipes and such are read as text streams.
+            with open_input(opts.file) as f:
+                pgm_data["commands"] = parse_file(f, pgm_data)
+                status = process_program(opts, pgm_data, sink, profiler)
+        
+        else:
+            if (opts.jobs is not None):
+                from chunkparse import parse_file_parallel
+                parse = functools.partial(parse_file_parallel, 
+                    workers=opts.jobs or None)
+            else:
+                parse = parse_mapped
+            
+            if (opts.no_cache):
+                pgm_data["commands"] = parse(opts.file, pgm_data)
+            else:
+                if (opts.estimate):
+                    # The estimate works on the packed records as such.
+                    pgm_data["records"] = cached_records(opts.file, 
+                        pgm_data)
+                pgm_data["commands"] = parse_cached(opts.file, pgm_data, 
+                    parse)
+            status = process_program(opts, pgm_data, sink, profiler)
             
     except OSError as err:
+        sink.flush()
         print("Error: {}.".format(err))
         return 1
     
-    run_program(pgm_data)
+    except ParseError as err:
+        sink.flush()
+        print("Error: {}.".format(err))
+        return 1
     
-    return 0
+    except ValueError as err:
+        # Invalid machine configuration.
+        sink.flush()
+        print("Error: {}.".format(err))
+        return 1
+    
+    finally:
+        sink.close()
+        if (profiler is not None):
+            profiler.restore()
+            if (opts.profile_format == "json"):
+                print(profiler.format_json(), file=sys.stderr)
+            else:
+                print(profiler.format_table(), file=sys.stderr)
+    
+    return status
 
 
-def run_program(pgm_data):
-    """ Simulates a run of a simple CNC machine with a given program.
+def parse_args(args):
+    """ Parses the command line arguments.
     Args:
-      pgm_data (dict): Dictionary containing the G-code commands.
+      args (list): arguments without the program name.
     Returns:
-      (none)
+      argparse.Namespace with the options.
     """
-    machine = MC()
-    print("Now running the G-code program #{} (total {} commands)."
-        .format(pgm_data["pgm_num"], pgm_data["num_commands"]))
-    print("")
-    i_block = 1
-    for block in pgm_data["commands"]:
-        print("Executing code block #{} ({} command"
-            .format(i_block, len(block)), end="")
-        
-        if (len(block) == 1):
-            print("):")
-        else:
-            print("s):")
-            
-        print("-" * 50)
-        
-        for command in block:
-            print(command)
-            #machine.execute_command(command)
-            execute_command(machine, command)
-        
-        print("-" * 50)
-        print("")
-        i_block = i_block + 1
+    parser = argparse.ArgumentParser(prog="main.py",
+        description="Simulates a CNC machine running a G-code program.")
+    parser.add_argument("file",
+        help='G-code file to run, "-" reads standard input')
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="do not output anything but errors (the machine errors "
+             "with their line numbers)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="text",
+        help="output format (default: text)")
+    parser.add_argument("-j", "--jobs", type=int, nargs="?", const=0,
+        help="parse the file in parallel with this many worker processes "
+             "(default: one per CPU)")
+    parser.add_argument("--estimate", action="store_true",
+        help="estimate the cycle time instead of running (needs NumPy)")
+    parser.add_argument("--top-blocks", type=int, metavar="N",
+        help="number of the slowest blocks listed by --estimate, -1 lists "
+             "the time of every block (default: 10)")
+    parser.add_argument("--plan", action="store_true",
+        help="run the program quietly through the acceleration-aware "
+             "motion planner, which follows straight lines instead of "
+             "moving one axis at a time, and report the cycle time (see "
+             "planner.py)")
+    parser.add_argument("--acceleration", type=float, 
+        default=planner.ACCELERATION, metavar="A",
+        help="acceleration of the axes for --plan [units/s^2] "
+             "(default: {})".format(planner.ACCELERATION))
+    parser.add_argument("--feed-override", type=float, default=100.0, 
+        metavar="PCT", help="feed rate override for --plan [%%] "
+                            "(default: 100)")
+    parser.add_argument("--rapid-override", type=float, default=100.0, 
+        metavar="PCT", help="rapid rate override for --plan [%%] "
+                            "(default: 100)")
+    parser.add_argument("--collisions", metavar="CONFIG",
+        help="check the toolpath against the soft limits and fixtures of "
+             "a machine configuration file instead of running (needs "
+             "NumPy, see collision.py)")
+    parser.add_argument("--export", metavar="PATH",
+        help="run the program and write every position change into a "
+             "columnar file (see export.py)")
+    parser.add_argument("--export-format", choices=("bin", "npy"),
+        default="bin", help="format of --export: a single binary file "
+                            "or a directory of .npy files (default: bin)")
+    parser.add_argument("--check", action="store_true",
+        help="check the modal state of the program instead of running "
+             "(see validator.py)")
+    parser.add_argument("--start", metavar="BLOCK",
+        help="run the program from a block on, in the state the blocks "
+             "before it leave: a block number as in the output, or a line "
+             "number as N<number> (see program.py)")
+    parser.add_argument("--no-cache", action="store_true",
+        help="always parse the file, do not use or update the compiled "
+             "program cache or the restart checkpoints of --start")
+    parser.add_argument("--profile", action="store_true",
+        help="measure the time and the allocations of the parser and "
+             "the machine functions and write a report to standard error")
+    parser.add_argument("--profile-format", choices=("table", "json"),
+        default="table", help="format of the profile report "
+                              "(default: table)")
+    
+    opts = parser.parse_args(args)
+    if ((opts.start is not None) and (opts.file == "-")):
+        parser.error("--start does not work with standard input")
+    
+    return opts
 
 
-def execute_command(machine, cmd_data):
-    """ Executes a G-code command with the CNC machine.
+def process_program(opts, pgm_data, sink, profiler=None):
+    """ Runs the program, or does what the options ask for instead.
     Args:
-      machine (object): instance of the MachineClient class.
-      cmd_data (dict): command and (optionally) its parameters with
-        the following structure.
-              cmd_data: {
-                  "cmd": "<command>",
-                  "params": ["par1", ..., "parN-1", "parN"]
-              }
+      opts (argparse.Namespace): command line options.
+      pgm_data (dict): Dictionary containing the G-code commands.
+      sink (object): output sink for all messages.
+      profiler (Profiler): if given, the run is instrumented with it.
     Returns:
-      (nothing)
+      The exit status: 3 if collisions were found, 4 if the check found
+      errors, 0 otherwise.
     """
-    G_COMMANDS = {
-        "G00": machine.rapid_move,
-        "G01": machine.lin_move,
-        "G17": machine.set_plane_xy,
-        "G18": machine.set_plane_zx,
-        "G19": machine.set_plane_yz,
-        "G20": machine.set_unit_inch,
-        "G21": machine.set_unit_mm,
-        "G28": machine.home,
-        "G40": machine.set_cutter_comp_off,
-        "G49": machine.cancel_tool_length_comp,
-        "G54": machine.set_coord_system,
-        "G55": machine.set_coord_system,
-        "G56": machine.set_coord_system,
-        "G57": machine.set_coord_system,
-        "G58": machine.set_coord_system,
-        "G59": machine.set_coord_system,
-        "G80": machine.cancel_canned_cycle,
-        "G90": machine.set_dist_mode_abs,
-        "G91": machine.set_dist_mode_inc,
-        "G93": machine.set_feed_rate_mode_invtime,
-        "G94": machine.set_feed_rate_mode_upmin,
-        "G95": machine.set_feed_rate_mode_uprev,
-    }
-    M_COMMANDS = {
-        "M03": machine.set_spindle_mode_cw,
-        "M04": machine.set_spindle_mode_ccw,
-        "M05": machine.set_spindle_mode_halt,
-        "M06": machine.manual_tool_change,
-        "M07": machine.coolant_on,
-        "M08": machine.coolant_on,
-        "M09": machine.coolant_off,
-        "M30": machine.program_end,
-    }
-    T_COMMAND = machine.change_tool
-    S_COMMAND = machine.set_spindle_speed
+    if (profiler is not None):
+        pgm_data["commands"] = profiler.wrap_iter(pgm_data["commands"], 
+            "parse")
     
-    cmd = cmd_data["cmd"]
-    par = cmd_data.get("params")
-    cmd_num = cmd[1 : len(cmd)]
-        
-    if (cmd in G_COMMANDS):
-        if ((int(cmd_num) >= 54) and (int(cmd_num) <= 59)):
-            par = int(cmd_num) - 53
-            
-        G_COMMANDS[cmd](par)
-        return
+    if (opts.collisions is not None):
+        if (check_collisions(pgm_data, sink, opts.collisions) > 0):
+            return 3
+    elif (opts.check):
+        if (check_program(pgm_data, sink) > 0):
+            return 4
+    elif (opts.estimate):
+        estimate_program(pgm_data, sink, opts.top_blocks)
+    elif (opts.plan):
+        plan_program(pgm_data, sink, profiler, opts)
+    elif (opts.export is not None):
+        export_program(pgm_data, sink, profiler, opts.export, 
+            opts.export_format)
+    else:
+        run_program(pgm_data, sink, profiler)
     
-    if (cmd in M_COMMANDS):
-        M_COMMANDS[cmd](par)
-        return
+    return 0
+
+
+def start_profiler():
+    """ Creates a Profiler and instruments the block compilers with it.
+    The profiler is only imported when used, so normal runs are not 
+    affected at all.
+    Returns:
+      The Profiler.
+    """
+    from profiler import Profiler
+    import reader
     
-    if (cmd[0] == "T"):
-        tool_name = "TOOL #" + cmd_num
-        T_COMMAND(tool_name)
-        return
-        
-    if (cmd[0] == "S"):
-        spindle_speed = int( cmd_num )
-        S_COMMAND(spindle_speed)
-        return
-        
+    profiler = Profiler()
+    # This module may be running as __main__, so it is patched through
+    # sys.modules rather than by importing it.
+    profiler.patch(sys.modules[__name__], "compile_block")
+    profiler.patch(reader, "compile_tokens")
+    
+    return profiler
 
-def parse_file(f_obj, pgm_data):
-    """ Reads a text file containing rows of G-code commands.
+
+def open_input(file_name):
+    """ Opens the G-code input for reading. 
     Args:
-      f_obj (file object): text file object returned from open().
-      cmds (dict): G-code commands and their parameters are placed here.
+      file_name (str): path of the G-code file, or "-" for standard input.
+    Returns:
+      A context manager giving a text file object.
+    """
+    if (file_name == "-"):
+        return contextlib.nullcontext(sys.stdin)
+    
+    return open(file_name)
+
+
+def run_program(pgm_data, sink=None, profiler=None, recorder=None,
+                motion_planner=None):
+    """ Simulates a run of a simple CNC machine with a given program.
+    The blocks are executed as soon as they are available, so a block 
+    stream from parse_file() starts running before the whole file has 
+    been read. Subprogram definitions are read ahead when called (see 
+    subprogram.py).
+    Args:
+      pgm_data (dict): Dictionary containing the G-code commands. The 
+        compiled subprogram bodies are stored here as "subprograms".
+      sink (object): output sink for all messages (see sinks.py). Text
+        to standard output if not given.
+      profiler (Profiler): if given, the machine and the interpreter are
+        instrumented with it (see profiler.py).
+      recorder (ToolpathWriter): if given, receives every position change
+        of the machine with the block it is made in (see export.py).
+      motion_planner (Planner): if given, gets every move of the machine
+        (see planner.py). It is not flushed.
     Returns:
       (none)
     """
-    line_num = 0
-    #pdb.set_trace()
-    # Checking if valid data markers exist.
-    if (not check_markers(f_obj)):
-        return
+    if (sink is None):
+        sink = TextSink()
     
-    pgm_data["commands"] = list()
-    pgm_data["num_commands"] = 0
+    machine = MC(sink)
+    if (profiler is not None):
+        profiler.instrument_machine(machine)
+    if (recorder is not None):
+        machine.set_recorder(recorder)
+    if (motion_planner is not None):
+        machine.set_planner(motion_planner)
     
-    for txt_row in f_obj:
-        txt_row = txt_row.strip()
-        
-        # Comment lines are skipped.
-        if (is_comment(txt_row)):
-            continue
-        
-        # Storing the program number.
-        pgm_num = get_program_number(txt_row)
-        if (pgm_num > 0):
-            if (pgm_data.get("pgm_num") is not None):
-                print("Error: multiple program numbers found.")
-                return
-                
-            pgm_data["pgm_num"] = pgm_num
-            continue
-        
-        # Getting all commands.
-        get_commands(txt_row, pgm_data)
+    program = Subprograms(pgm_data["commands"])
+    pgm_data["subprograms"] = program.bodies
+    # Replayed subprogram calls skip the moves, which the recorder and
+    # the planner need.
+    replay = (sink.quiet and (recorder is None) 
+              and (motion_planner is None))
+    interpreter = Interpreter(machine, program, replay=replay)
+    execute = interpreter.execute
+    if (profiler is not None):
+        execute = profiler.wrap_execute(execute)
+    i_block = 1
+    for block in program:
+        if (i_block == 1):
+            sink.info("Now running the G-code program #{}.",
+                pgm_data["pgm_num"])
+            sink.info("")
+            
+        sink.block_begin(i_block, block)
+        if (recorder is not None):
+            recorder.set_block(i_block, block.line)
         
+        for command in block.commands:
+            sink.command(command)
+            execute(command)
         
+        sink.block_end(i_block, block)
+        i_block = i_block + 1
+    
+    sink.info("Program #{} finished (total {} commands).",
+        pgm_data.get("pgm_num"), pgm_data["num_commands"])
+
 
-def get_commands(txt_row, pgm_data):
-    """Gets all commands from the text row and stores them into a 
-    dictionary given as a parameter.
+def restart_program(opts, sink, profiler=None):
+    """ Runs a program from a block on, without running the blocks before
+    it with the machine (see program.py).
     Args:
-      txt_row (string): text line to scan for G-code commands.
-      pgm_data (dict): commands (and their parameters) are stored here.
+      opts (argparse.Namespace): command line options with the file and
+        the block to start from.
+      sink (object): output sink for all messages.
+      profiler (Profiler): see run_program().
+    Returns:
+      The exit status, 0.
+    Raises:
+      OSError, ParseError: if the program cannot be read.
+      ValueError: if there is no such block.
     """
-    command_codes = ["G", "T", "S", "M"]
-    parameter_codes = ["X", "Y", "Z", "F"]
-    parts = txt_row.upper().split()
-    i = 0
-    gcode_seen = False
-    codes = list()
-    num_commands = 0
+    from program import Program
+    from cache import checkpoint_path, evict
     
-    while (i < len(parts)):
-        # Line number, unused.
-        if (parts[i][0] == "N"):
-            i = i + 1
-            continue
+    with Program(opts.file) as program:
+        index = find_block(program, opts.start)
+        # The checkpoints of the machine state are kept next to the 
+        # program cache entry, so later restarts need not run the blocks
+        # before them again.
+        checkpoints = None
+        if (not opts.no_cache):
+            checkpoints = checkpoint_path(opts.file)
+            program.load_checkpoints(checkpoints)
+        machine = MC(sink)
+        if (profiler is not None):
+            profiler.instrument_machine(machine)
+        interpreter = program.restart(index, machine, replay=sink.quiet)
+        if ((checkpoints is not None) 
+                and program.save_checkpoints(checkpoints)):
+            try:
+                evict(os.path.dirname(checkpoints))
+            except OSError:
+                pass
+        execute = interpreter.execute
+        blocks = program.blocks(index)
+        if (profiler is not None):
+            execute = profiler.wrap_execute(execute)
+            blocks = profiler.wrap_iter(blocks, "parse")
         
-        # Adding parameters to the last command.
-        if (gcode_seen):
-            if (parts[i][0] in parameter_codes):
-                if (codes[len(codes) - 1].get("params") is None):
-                    codes[len(codes) - 1]["params"] = list()
-                    
-                codes[len(codes) - 1]["params"].append(parts[i])
-                i = i + 1
-                continue
-            else:
-                gcode_seen = False
+        sink.info("Now running the G-code program #{} from block {} "
+            "(line {}).", program.pgm_num, index + 1, program.line(index))
+        sink.info("")
+        num_commands = 0
+        for i_block, block in enumerate(blocks, index + 1):
+            sink.block_begin(i_block, block)
+            for command in block.commands:
+                sink.command(command)
+                execute(command)
+            sink.block_end(i_block, block)
+            num_commands += len(block.commands)
         
-        # Command
-        if (parts[i][0] in command_codes):
-            if (parts[i][0] == "G"):
-                gcode_seen = True
-            
-            code = dict()
-            code["cmd"] = parts[i]
-            #code["params"] = list()
-            codes.append(code)
-            num_commands = num_commands + 1
-            
-        i = i + 1
+        sink.info("Program #{} finished ({} commands from block {}).",
+            program.pgm_num, num_commands, index + 1)
     
-    if (len(codes) > 0):
-        pgm_data["commands"].append(codes)
-        pgm_data["num_commands"] = pgm_data["num_commands"] + num_commands
+    return 0
 
 
-def check_markers(f_obj):
-    """ Scans the G-code for program data begin/end markers. 
-    Valid G-code program file should have two such markers. 
+def find_block(program, text):
+    """ Finds the block to start a program from.
     Args:
-      f_obj(file object): G-code text file to check.
+      program (Program): the program.
+      text (str): block number from 1, or "N" and a line number.
     Returns:
-      True if valid number of data markers were found, False otherwise.
+      Index of the block.
+    Raises:
+      ValueError: if there is no such block.
     """
-    markers_seen = 0
-    
-    # Counting all data markers. Valid G-code should have two.
-    for txt_row in f_obj:
-        txt_row = txt_row.strip()
-        
-        if (is_marker(txt_row)):
-            markers_seen += 1
+    try:
+        if (text[:1] in ("N", "n")):
+            index = program.find(int(text[1:]))
+        else:
+            index = int(text) - 1
+    except ValueError:
+        index = None
     
-    if (markers_seen != 2):
-        print("Error: invalid number of data markers ({}, should have 2)"
-              .format(markers_seen))
-        #return False
+    if ((index is None) or (index < 0) or (index >= len(program))):
+        raise ValueError("block {} not found".format(text))
     
-    f_obj.seek(0)
-    return (markers_seen == 2)
+    return index
+
 
-def is_marker(txt_row):
-    """ Determines if the text line contains a program data marker, 
-    which is just a single "%" character.
+def export_program(pgm_data, sink, profiler, path, fmt):
+    """ Runs a program and writes its toolpath into a file.
     Args:
-      txt_row (string): text line to check.
+      pgm_data (dict): Dictionary containing the G-code commands.
+      sink (object): output sink for all messages.
+      profiler (Profiler): see run_program().
+      path (str): output file ("bin") or directory ("npy").
+      fmt (str): output format, a key of export.FORMATS.
     Returns:
-      True if this text row is a program data marker, False if not.
+      (none)
+    Raises:
+      OSError: if the output cannot be written.
     """
-    if (len(txt_row) < 1):
-        return False
+    from export import FORMATS as EXPORT_FORMATS
     
-    if (txt_row[0] == "%"):
-        return True
-    
-    return False
-        
+    writer = EXPORT_FORMATS[fmt](path)
+    try:
+        run_program(pgm_data, sink, profiler, writer)
+    finally:
+        writer.close(program=pgm_data.get("pgm_num"))
+
 
-def is_comment(txt_row):
-    """ Tries to determine if the current line of text is a comment line.
+def plan_program(pgm_data, sink, profiler, opts):
+    """ Runs a program quietly through the motion planner and reports its
+    cycle time with acceleration.
     Args:
-      txt_row (string): text line to check.
+      pgm_data (dict): Dictionary containing the G-code commands.
+      sink (object): output sink for the report.
+      profiler (Profiler): see run_program().
+      opts (argparse.Namespace): command line options with the 
+        acceleration and the overrides.
     Returns:
-      True when the text line is considered a comment line, False if not.
+      (none)
     """
-    if (len(txt_row) < 1):
-        return True
-        
-    if ((txt_row[0] == '(') and (txt_row[len(txt_row) - 1] == ')')):
-        return True
-    else:
-        return False
+    motion_planner = planner.Planner(acceleration=opts.acceleration,
+        feed_override=opts.feed_override / 100.0,
+        rapid_override=opts.rapid_override / 100.0)
+    run_program(pgm_data, NullSink(), profiler, 
+                motion_planner=motion_planner)
+    motion_planner.flush()
+    sink.info("Program #{} ({} commands):", pgm_data["pgm_num"], 
+        pgm_data["num_commands"])
+    sink.info(planner.format_report(motion_planner))
+
+
+def estimate_program(pgm_data, sink, top_blocks=None):
+    """ Estimates the cycle time of a program without running it.
+    Args:
+      pgm_data (dict): Dictionary containing the G-code commands, and
+        the packed "records" of the program cache if they were found.
+      sink (object): output sink for the report.
+      top_blocks (int): number of the slowest blocks listed, see
+        cycletime.format_report(); its default if None.
+    Returns:
+      (none)
+    """
+    # NumPy is optional, so the estimator is only imported when used.
+    from cycletime import estimate_blocks, estimate_records, format_report
     
+    if (pgm_data.get("records") is not None):
+        result = estimate_records(*pgm_data["records"])
+    else:
+        result = estimate_blocks(pgm_data["commands"])
+    sink.info("Program #{} ({} commands):", pgm_data["pgm_num"], 
+        pgm_data["num_commands"])
+    if (top_blocks is None):
+        sink.info(format_report(result))
+    else:
+        sink.info(format_report(result, top_blocks))
 
-def get_program_number(txt_row):
-    """ Checks if the current line of text contains a program 
-    definition.
+
+def check_collisions(pgm_data, sink, config_file):
+    """ Checks the toolpath of a program against the soft limits and the
+    fixtures of a machine, without running it.
     Args:
-      txt_row (string): text line to check.
+      pgm_data (dict): Dictionary containing the G-code commands.
+      sink (object): output sink for the report.
+      config_file (str): machine configuration file (see collision.py).
     Returns:
-      An integer number. If program number cannot be found, or is 
-      invalid in some way, a large negative number is returned.
+      The number of violations found.
+    Raises:
+      OSError, ValueError: if the configuration cannot be read.
     """
-    num = -9999
-    len_txt = len(txt_row)
+    # NumPy is optional, so the checker is only imported when used.
+    from collision import load_config, check_blocks
+    
+    limits, fixtures = load_config(config_file)
+    found = check_blocks(pgm_data["commands"], limits, fixtures)
+    
+    sink.info("Program #{} ({} commands): {} collision{}.", 
+        pgm_data["pgm_num"], pgm_data["num_commands"], len(found),
+        "" if (len(found) == 1) else "s")
+    for line, message in found:
+        sink.info("line {}: {}", line, message)
     
-    if (len_txt < 2):
-        return num
+    return len(found)
+
+
+def check_program(pgm_data, sink):
+    """ Checks the modal state of a program without running it.
+    Args:
+      pgm_data (dict): Dictionary containing the G-code commands.
+      sink (object): output sink for the report.
+    Returns:
+      The number of errors found.
+    """
+    found = validate_blocks(pgm_data["commands"])
+    errors = sum(1 for line, kind, message in found if (kind == ERROR))
     
-    if (txt_row[0] == "O"):
-        numeric_part = txt_row[1:len_txt]
-        try:
-            conv_num = int(numeric_part)
-            num = conv_num
-        except ValueError:
-            pass
+    sink.info("Program #{} ({} commands): {} error{}, {} warning{}.", 
+        pgm_data["pgm_num"], pgm_data["num_commands"], errors,
+        "" if (errors == 1) else "s", len(found) - errors,
+        "" if (len(found) - errors == 1) else "s")
+    for txt in format_problems(found):
+        sink.info("{}", txt)
     
-    return num
+    return errors
 
-def show_usage():
-    print('Error: G-code file missing.')
-    print('Usage: ./main.py <filename>')
+
+def parse_file(f_obj, pgm_data):
+    """ Reads rows of G-code commands in a single forward pass and yields
+    the code blocks as soon as they are read.
+    The data markers and the program number are validated on the fly, 
+    so the input does not have to be seekable (pipes and standard input
+    work too) and only the current block is kept in memory.
+    Args:
+      f_obj (file object): text file object returned from open().
+      pgm_data (dict): the program number and the running count of 
+        commands are stored here.
+    Yields:
+      A compiled Block for each line containing commands.
+    Raises:
+      ParseError: if the data markers or the program number are invalid.
+    """
+    markers_seen = 0
+    pgm_data["pgm_num"] = None
+    pgm_data["num_commands"] = 0
+    
+    for line_num, txt_row in enumerate(f_obj, 1):
+        txt_row = txt_row.strip()
+        kind, pgm_num = classify_text(txt_row)
+        
+        # Valid G-code has exactly two data markers around the program.
+        if (kind == LINE_MARKER):
+            markers_seen += 1
+            if (markers_seen > 2):
+                raise ParseError("invalid number of data markers "
+                    "(more than 2)")
+            continue
+        
+        # Empty and comment lines are skipped.
+        if ((kind == LINE_EMPTY) or (kind == LINE_COMMENT)):
+            continue
+        
+        if (markers_seen != 1):
+            raise ParseError("program data found outside of data markers")
+        
+        # Storing the program number. The later ones start subprogram
+        # definitions (see subprogram.py).
+        if (kind == LINE_PROGRAM):
+            if (pgm_data["pgm_num"] is None):
+                pgm_data["pgm_num"] = pgm_num
+                continue
+            
+            block = Block(line_num, (Command(Opcode.O, pgm_num),))
+        else:
+            # Compiling all commands.
+            block = compile_block(txt_row, line_num)
+        
+        if (block is not None):
+            pgm_data["num_commands"] = pgm_data["num_commands"] + len(block)
+            yield block
+    
+    if (markers_seen != 2):
+        raise ParseError("invalid number of data markers ({}, should have 2)"
+            .format(markers_seen))
 
 
 if (__name__ == '__main__'):
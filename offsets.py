@@ -0,0 +1,183 @@
+#
+# Title: G-code interpreter program
+# File: offsets.py
+# Description: Work offsets, tool length offsets and units of the moves.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The coordinates of a program are turned into machine coordinates
+# (millimetres) by the active work offset (G54-G59), the active tool
+# length offset (G43 H, cancelled by G49) and the units (G20/G21):
+#
+#   machine = scale * program + offset
+#
+# where scale is 1 or 25.4 and the offset is the work offset plus the
+# tool length along Z. The offsets are kept in millimetres.
+#
+# Whenever one of them changes, OffsetTable folds them into a single
+# transform, a (scale, x, y, z) tuple, so a move is transformed with one
+# multiply and add per axis however many offsets are active. Incremental
+# moves, arc center offsets and radii are only scaled. apply_batch() does
+# the same to whole arrays of moves (see toolpath.py), every move with
+# the transform in effect when it was made.
+#
+# The offset tables are set by the program with G10:
+#
+#   G10 L2 P<n> X Y Z - work offset of coordinate system n (1 = G54 ...
+#                       6 = G59, 0 = the active one). Axes not given are
+#                       kept.
+#   G10 L1 P<h> Z     - tool length offset number h.
+#
+# The values are in the current units. Tool length offsets that are not
+# set are zero.
+#
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Millimetres per inch.
+INCH = 25.4
+# Number of work coordinate systems (G54-G59).
+NUM_COORD_SYSTEMS = 6
+# Transform with no offsets in millimetres.
+IDENTITY = (1.0, 0.0, 0.0, 0.0)
+
+
+class OffsetTable:
+    """ The work and tool length offsets and the units of a machine, see
+    the top of this file.
+    Attributes:
+      transform (tuple): (scale, x, y, z) transform of the active
+        offsets and units, kept up to date.
+      coord_system (int): active coordinate system, 1 (G54) to 6 (G59).
+      tool_offset (int): active tool length offset number, None if tool
+        length compensation is off.
+    """
+
+    def __init__(self):
+        self.coord_system = 1
+        self.tool_offset = None
+        self._scale = 1.0
+        self._work = [(0.0, 0.0, 0.0)] * NUM_COORD_SYSTEMS
+        self._tools = dict()
+        self.transform = IDENTITY
+
+
+    def set_units(self, scale):
+        """ Sets the scale of the program units.
+        Args:
+          scale (float): millimetres per unit, 1.0 or INCH.
+        """
+        self._scale = scale
+        self._update()
+
+
+    def select(self, num):
+        """ Selects a work coordinate system.
+        Args:
+          num (int): 1 (G54) to 6 (G59).
+        """
+        self.coord_system = num
+        self._update()
+
+
+    def set_tool_offset(self, num):
+        """ Turns tool length compensation on (G43).
+        Args:
+          num (int): tool length offset number (H), None to turn it off
+            (G49).
+        """
+        self.tool_offset = num
+        self._update()
+
+
+    def tool_length(self, num):
+        """ Returns a tool length offset [mm], zero if not set. """
+        return self._tools.get(num, 0.0)
+
+
+    def work_offset(self, num):
+        """ Returns the (x, y, z) work offset [mm] of a coordinate
+        system. """
+        return self._work[num - 1]
+
+
+    def set_from(self, cmd):
+        """ Sets an offset from a G10 command.
+        Args:
+          cmd (Command): compiled G10 with the L, P and axis words in the
+            current units.
+        Raises:
+          ValueError: if the command is not valid.
+        """
+        if ((cmd.l is None) or (cmd.p is None)):
+            raise ValueError("G10 needs L and P")
+        num = int(cmd.p)
+        scale = self._scale
+
+        if (cmd.l == 2):
+            if (num == 0):
+                num = self.coord_system
+            if ((num < 1) or (num > NUM_COORD_SYSTEMS)):
+                raise ValueError("no coordinate system P{}".format(num))
+            x, y, z = self._work[num - 1]
+            self._work[num - 1] = (x if (cmd.x is None) else cmd.x * scale,
+                                   y if (cmd.y is None) else cmd.y * scale,
+                                   z if (cmd.z is None) else cmd.z * scale)
+
+        elif (cmd.l == 1):
+            if (num < 0):
+                raise ValueError("no tool length offset P{}".format(num))
+            if (cmd.z is not None):
+                self._tools[num] = cmd.z * scale
+
+        else:
+            raise ValueError("G10 L{:g} not implemented".format(cmd.l))
+
+        self._update()
+
+
+    def snapshot(self):
+        """ Saves the offsets.
+        Returns:
+          An immutable tuple for restore().
+        """
+        return (self.coord_system, self.tool_offset, self._scale,
+                tuple(self._work), tuple(sorted(self._tools.items())))
+
+
+    def restore(self, snapshot):
+        """ Puts back offsets saved with snapshot(). """
+        (self.coord_system, self.tool_offset, self._scale, work,
+         tools) = snapshot
+        self._work = list(work)
+        self._tools = dict(tools)
+        self._update()
+
+
+    def _update(self):
+        """ Folds the active offsets into the transform. """
+        x, y, z = self._work[self.coord_system - 1]
+        if (self.tool_offset is not None):
+            z += self._tools.get(self.tool_offset, 0.0)
+        self.transform = (self._scale, x, y, z)
+
+
+def apply_batch(xyz, inc, transforms, index):
+    """ Transforms the coordinates of moves into machine coordinates.
+    Requires NumPy.
+    Args:
+      xyz (N x 3 array): coordinates of the moves, NaN if not given.
+      inc (N bool array): True for incremental moves, which are only
+        scaled.
+      transforms (K x 4 array): (scale, x, y, z) transforms.
+      index (N int array): transform of every move.
+    Returns:
+      N x 3 float64 array, NaN where xyz is NaN.
+    """
+    table = np.asarray(transforms, dtype=np.float64).reshape(-1, 4)
+    used = table[index]
+    offset = np.where(inc[:, np.newaxis], 0.0, used[:, 1:])
+    return xyz * used[:, :1] + offset
@@ -0,0 +1,322 @@
+#
+# Title: G-code interpreter program
+# File: planner.py
+# Description: Acceleration-aware motion planner with lookahead.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The planner times the moves of a program the way the motion planner of
+# a real controller runs them: every straight segment (a G00/G01 move or
+# an arc chord) has a trapezoidal speed profile, accelerating from its
+# entry speed up to its nominal speed (the feed rate, or the rapid rate,
+# scaled by the override) and decelerating to the entry speed of the
+# next segment. Short segments never reach their nominal speed, so for
+# finishing programs made of many short segments the time is limited by
+# the acceleration rather than by the feed rate.
+#
+# The speed at the junction of two segments is limited by the angle
+# between them with the junction deviation model (as in Grbl): the
+# machine may cut the corner within the deviation at the centripetal
+# acceleration limit. Straight continuations keep the speed, reversals
+# stop.
+#
+# The segments wait in a ring buffer of "lookahead" segments. Every new
+# segment is planned to end at a stop, and the entry speeds of the
+# segments before it are raised backwards (reverse pass) and then
+# limited by the acceleration forwards (forward pass). Segments whose
+# entry speed can no longer change are marked planned, so the passes
+# only cover the segments after them: the work per segment is constant
+# on average. When the buffer is full, the oldest segment is executed
+# (timed) with the entry speed of the next one as its exit speed.
+#
+# The planner follows the straight line of every move, as a controller
+# does, not the axis by axis moves of MachineClient.move() that the
+# simulator runs and cycletime.py measures. A diagonal move is shorter on
+# a straight line, so for programs of many diagonal moves (pocketing,
+# contours) the planned time can be below the estimate of cycletime.py
+# even though the acceleration only adds time. The length of the moves
+# on the axis by axis path is kept too ("axis_distance"), and the report
+# gives both. Times are in minutes, like in cycletime.py; the
+# acceleration is in units/s^2.
+#
+
+import math
+
+# Default acceleration of the axes [units/s^2].
+ACCELERATION = 500.0
+# Default junction deviation [units].
+JUNCTION_DEVIATION = 0.01
+# Default number of segments in the lookahead buffer.
+LOOKAHEAD = 32
+# Default rapid traverse rate [units/min], as in cycletime.py.
+RAPID_RATE = 5000.0
+# Segments shorter than this are ignored [units].
+MIN_LENGTH = 1e-6
+
+
+class Planner:
+    """ Lookahead motion planner, see the top of this file.
+    Attributes:
+      feed_override, rapid_override (float): scale of the feed rate and
+        of the rapid rate of the segments added after setting them.
+      time (float): duration of the executed segments [min].
+      rapid_time, feed_time (float): the same for the rapid and the feed
+        segments.
+      dwell_time (float): time spent standing still in dwells [min],
+        included in time.
+      distance (float): length of the executed segments [units].
+      axis_distance (float): length of the same moves one axis at a
+        time, as MachineClient runs them and cycletime.py measures them
+        (arc chords are straight in both) [units].
+      segments (int): number of executed segments.
+      no_feed (int): feed segments skipped for having no feed rate.
+    """
+
+    def __init__(self, acceleration=ACCELERATION,
+                 junction_deviation=JUNCTION_DEVIATION, lookahead=LOOKAHEAD,
+                 rapid_rate=RAPID_RATE, feed_override=1.0,
+                 rapid_override=1.0, start=(0.0, 0.0, 0.0)):
+        """ Args:
+          acceleration (float): acceleration of the axes [units/s^2].
+          junction_deviation (float): see the top of this file [units].
+          lookahead (int): size of the segment buffer, at least 2.
+          rapid_rate (float): rapid traverse rate [units/min].
+          feed_override, rapid_override (float): speed scales.
+          start (tuple): X, Y, Z position before the first segment.
+        """
+        # Internally speeds are in units/s and times in seconds.
+        self._accel2 = 2.0 * acceleration
+        self._junction = acceleration * junction_deviation
+        self.rapid_rate = rapid_rate
+        self.feed_override = feed_override
+        self.rapid_override = rapid_override
+        self.time = 0.0
+        self.rapid_time = 0.0
+        self.feed_time = 0.0
+        self.dwell_time = 0.0
+        self.distance = 0.0
+        self.axis_distance = 0.0
+        self.segments = 0
+        self.no_feed = 0
+
+        size = max(2, lookahead)
+        self._size = size
+        # Ring buffer of the segments: length, rapid flag, and the
+        # squares of the nominal speed, of the largest and of the planned
+        # entry speed.
+        self._length = [0.0] * size
+        self._rapid = [False] * size
+        self._nominal2 = [0.0] * size
+        self._max_entry2 = [0.0] * size
+        self._entry2 = [0.0] * size
+        self._tail = 0
+        self._count = 0
+        # Index from the tail of the last segment whose entry speed is
+        # final. The entry speed of the tail is the exit speed of the
+        # segment executed before it, so it is always final.
+        self._planned = 0
+
+        self._pos = tuple(start)
+        # Direction and nominal speed of the last segment added, None
+        # when the machine is at a stop.
+        self._unit = None
+        self._last_nominal2 = 0.0
+
+
+    def add(self, x, y, z, rapid, feed, chord=False):
+        """ Adds a straight segment from the previous end point.
+        Args:
+          x, y, z (float): end point.
+          rapid (bool): True for a rapid move.
+          feed (float): feed rate [units/min], unused for rapid moves.
+          chord (bool): True for an arc chord, which MachineClient also
+            runs on a straight line (see axis_distance).
+        """
+        x0, y0, z0 = self._pos
+        dx = x - x0
+        dy = y - y0
+        dz = z - z0
+        length = math.sqrt(dx * dx + dy * dy + dz * dz)
+        if (length < MIN_LENGTH):
+            return
+        self._pos = (x, y, z)
+
+        if (rapid):
+            nominal = self.rapid_rate * self.rapid_override / 60.0
+        else:
+            nominal = feed * self.feed_override / 60.0
+        if (nominal <= 0.0):
+            # The machine cannot make the move; it starts from a stop.
+            self.flush()
+            self.no_feed += 1
+            self._unit = None
+            return
+        nominal2 = nominal * nominal
+        if (chord):
+            self.axis_distance += length
+        else:
+            self.axis_distance += abs(dx) + abs(dy) + abs(dz)
+
+        ux = dx / length
+        uy = dy / length
+        uz = dz / length
+        unit = self._unit
+        if (unit is None):
+            max_entry2 = 0.0
+        else:
+            # Cosine of the angle between the directions: -1 straight on,
+            # 1 reversing.
+            cos_theta = -(ux * unit[0] + uy * unit[1] + uz * unit[2])
+            if (cos_theta > 0.999999):
+                max_entry2 = 0.0
+            elif (cos_theta < -0.999999):
+                max_entry2 = min(nominal2, self._last_nominal2)
+            else:
+                sin_half = math.sqrt(0.5 * (1.0 - cos_theta))
+                max_entry2 = min(nominal2, self._last_nominal2,
+                                 self._junction * sin_half / (1.0 - sin_half))
+        self._unit = (ux, uy, uz)
+        self._last_nominal2 = nominal2
+
+        if (self._count == self._size):
+            self._execute()
+
+        i = (self._tail + self._count) % self._size
+        self._length[i] = length
+        self._rapid[i] = rapid
+        self._nominal2[i] = nominal2
+        self._max_entry2[i] = max_entry2
+        self._entry2[i] = 0.0
+        self._count += 1
+        self._recalculate()
+
+
+    def flush(self):
+        """ Executes all buffered segments, the last one ending at a
+        stop, e.g. at the end of the program. """
+        while (self._count > 0):
+            self._execute()
+        self._unit = None
+
+
+    def dwell(self, seconds):
+        """ Stops the machine for a time, e.g. at the bottom of a hole.
+        The segments before it end at a stop.
+        Args:
+          seconds (float): duration of the dwell [s].
+        """
+        self.flush()
+        minutes = seconds / 60.0
+        self.time += minutes
+        self.dwell_time += minutes
+
+
+    def _recalculate(self):
+        """ Replans the entry speeds of the segments that are not planned
+        yet, the newest one ending at a stop. """
+        size = self._size
+        tail = self._tail
+        length = self._length
+        max_entry2 = self._max_entry2
+        entry2 = self._entry2
+        accel2 = self._accel2
+        count = self._count
+
+        # Reverse pass, down to the last planned segment.
+        i = (tail + count - 1) % size
+        entry2[i] = min(max_entry2[i], accel2 * length[i])
+        next_entry2 = entry2[i]
+        for k in range(count - 2, self._planned, -1):
+            i = (tail + k) % size
+            if (entry2[i] != max_entry2[i]):
+                entry2[i] = min(max_entry2[i],
+                                next_entry2 + accel2 * length[i])
+            next_entry2 = entry2[i]
+
+        # Forward pass.
+        planned = self._planned
+        for k in range(planned, count - 1):
+            i = (tail + k) % size
+            j = (tail + k + 1) % size
+            reachable2 = entry2[i] + accel2 * length[i]
+            if (reachable2 < entry2[j]):
+                # Accelerating all the way: nothing after can change
+                # this segment.
+                entry2[j] = reachable2
+                planned = k + 1
+            if (entry2[j] == max_entry2[j]):
+                planned = k + 1
+        self._planned = planned
+
+
+    def _execute(self):
+        """ Times the oldest segment and removes it from the buffer. """
+        size = self._size
+        i = self._tail
+        length = self._length[i]
+        v0 = math.sqrt(self._entry2[i])
+        if (self._count > 1):
+            v1 = math.sqrt(self._entry2[(i + 1) % size])
+        else:
+            v1 = 0.0
+        nominal2 = self._nominal2[i]
+        accel = self._accel2 / 2.0
+
+        # Trapezoid: accelerate to the nominal speed, cruise, decelerate
+        # to the exit speed; a triangle if there is no room to cruise.
+        accel_dist = (nominal2 - v0 * v0) / self._accel2
+        decel_dist = (nominal2 - v1 * v1) / self._accel2
+        if (accel_dist + decel_dist <= length):
+            nominal = math.sqrt(nominal2)
+            seconds = ((nominal - v0) / accel + (nominal - v1) / accel
+                       + (length - accel_dist - decel_dist) / nominal)
+        else:
+            peak = math.sqrt(max(0.5 * (self._accel2 * length
+                                        + v0 * v0 + v1 * v1),
+                                 v0 * v0, v1 * v1))
+            seconds = (peak - v0) / accel + (peak - v1) / accel
+
+        minutes = seconds / 60.0
+        self.time += minutes
+        if (self._rapid[i]):
+            self.rapid_time += minutes
+        else:
+            self.feed_time += minutes
+        self.distance += length
+        self.segments += 1
+
+        self._tail = (i + 1) % size
+        self._count -= 1
+        if (self._planned > 0):
+            self._planned -= 1
+
+
+def format_minutes(minutes):
+    """ Formats a time in minutes as h:mm:ss.s. """
+    seconds = minutes * 60.0
+    hours = int(seconds // 3600)
+    seconds -= hours * 3600
+    mins = int(seconds // 60)
+    return "{}:{:02d}:{:04.1f}".format(hours, mins, seconds - mins * 60)
+
+
+def format_report(planner):
+    """ Formats the times of a flushed planner as text. """
+    lines = [
+        "Planned cycle time: {}".format(format_minutes(planner.time)),
+        "  rapid segments:  {}".format(format_minutes(planner.rapid_time)),
+        "  feed segments:   {}".format(format_minutes(planner.feed_time)),
+    ]
+    if (planner.dwell_time > 0.0):
+        lines.append("  dwells:          {}".format(
+            format_minutes(planner.dwell_time)))
+    lines += [
+        "  {} segments, {:.3f} units on straight lines".format(
+            planner.segments, planner.distance),
+        "  ({:.3f} units one axis at a time, as --estimate measures "
+        "them)".format(planner.axis_distance),
+    ]
+    if (planner.no_feed > 0):
+        lines.append("  {} feed moves without a feed rate were not "
+                     "timed".format(planner.no_feed))
+    return "\n".join(lines)
@@ -0,0 +1,300 @@
+#
+# Title: G-code interpreter program
+# File: profiler.py
+# Description: Opt-in instrumentation of the parse and execute paths.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A Profiler wraps the functions of interest into timing wrappers that
+# record the duration of every call and the change in the number of
+# memory blocks allocated by Python during it (sys.getallocatedblocks()).
+# Nothing is wrapped unless profiling is asked for, so a normal run has
+# no overhead at all.
+#
+# The durations are inclusive: the time of move() contains the time of
+# the move_x() calls made by it, and so on. The allocation counts are net
+# counts, freed blocks are subtracted.
+#
+# The durations are not kept one by one but counted into a fixed-size
+# histogram of logarithmic buckets, SUB_BUCKETS to every power of two, so
+# the memory used does not grow with the length of the program. The
+# percentiles are read from the buckets and are within 1/(2*SUB_BUCKETS)
+# of the exact ones; the total, the mean and the maximum are exact.
+#
+
+import sys
+import time
+import json
+import functools
+
+# MachineClient methods that are not instrumented: they are not called
+# while a program runs.
+SKIP_METHODS = frozenset(("get_state", "snapshot", "restore"))
+# Histogram buckets per power of two (a power of two), and the number of
+# buckets, enough for any 64-bit duration [ns]: durations below
+# 2 * SUB_BUCKETS have a bucket each, the rest share one with the
+# durations that have the same SUB_BITS + 1 leading bits.
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+NUM_BUCKETS = (65 - SUB_BITS) * SUB_BUCKETS
+
+
+class Stats:
+    """ Measurements of one instrumented function.
+    Attributes:
+      calls (int): number of calls.
+      total (int): total duration of the calls [ns].
+      longest (int): duration of the longest call [ns].
+      counts (list): number of calls by duration bucket, see record().
+      allocs (int): net number of memory blocks allocated by the calls.
+    """
+
+    __slots__ = ("calls", "total", "longest", "counts", "allocs")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0
+        self.longest = 0
+        self.counts = [0] * NUM_BUCKETS
+        self.allocs = 0
+
+
+    def record(self, duration):
+        """ Counts a call.
+        Args:
+          duration (int): duration of the call [ns], not negative.
+        """
+        if (duration < 2 * SUB_BUCKETS):
+            self.counts[duration] += 1
+        else:
+            shift = duration.bit_length() - SUB_BITS - 1
+            self.counts[(shift << SUB_BITS) + (duration >> shift)] += 1
+        self.calls += 1
+        self.total += duration
+        if (duration > self.longest):
+            self.longest = duration
+
+
+    def percentile(self, percent):
+        """ Nearest-rank percentile of the call durations, from the
+        histogram: the middle of the bucket of the rank, at most the
+        longest duration.
+        Args:
+          percent (float): percentile, 0-100.
+        Returns:
+          The duration [ns], 0 if there are no calls.
+        """
+        if (self.calls == 0):
+            return 0
+
+        rank = int(round(percent / 100.0 * (self.calls - 1)))
+        if (rank == self.calls - 1):
+            return self.longest
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if (seen > rank):
+                break
+
+        if (bucket < 2 * SUB_BUCKETS):
+            return bucket
+        shift = (bucket >> SUB_BITS) - 1
+        low = (bucket - (shift << SUB_BITS)) << shift
+        return min(low + ((1 << shift) - 1) / 2.0, self.longest)
+
+
+    def summary(self):
+        """ Returns a dict of the calls, the total time [s] and the mean,
+        median, 99th percentile and maximum time of a call [us], and the
+        net allocated memory blocks. """
+        num = self.calls
+        if (num == 0):
+            return {"calls": 0, "total_s": 0.0, "mean_us": 0.0,
+                    "p50_us": 0.0, "p99_us": 0.0, "max_us": 0.0,
+                    "alloc_blocks": self.allocs}
+
+        return {
+            "calls": num,
+            "total_s": self.total / 1e9,
+            "mean_us": self.total / num / 1e3,
+            "p50_us": self.percentile(50) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "max_us": self.longest / 1e3,
+            "alloc_blocks": self.allocs,
+        }
+
+
+class Profiler:
+    """ Collects call statistics of instrumented functions by name. """
+
+    def __init__(self):
+        self.stats = dict()
+        # (object, attribute name, original value) of the patches.
+        self._patches = list()
+
+
+    def get_stats(self, name):
+        """ Returns the Stats of a name, creating them if needed. """
+        stats = self.stats.get(name)
+        if (stats is None):
+            stats = self.stats[name] = Stats()
+        return stats
+
+
+    def wrap(self, func, name):
+        """ Returns a timing wrapper of a function.
+        Args:
+          func (callable): function to instrument.
+          name (str): name of the statistics of the calls.
+        Returns:
+          The wrapper, with the signature of func.
+        """
+        stats = self.get_stats(name)
+        record = stats.record
+        clock = time.perf_counter_ns
+        blocks = sys.getallocatedblocks
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            allocated = blocks()
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(clock() - start)
+                stats.allocs += blocks() - allocated
+
+        return wrapper
+
+
+    def wrap_iter(self, iterable, name):
+        """ Times getting every item of an iterable, e.g. the blocks of a
+        parser generator.
+        Args:
+          iterable (iterable): items to pass through.
+          name (str): name of the statistics.
+        Yields:
+          The items of iterable.
+        """
+        stats = self.get_stats(name)
+        record = stats.record
+        clock = time.perf_counter_ns
+        blocks = sys.getallocatedblocks
+        iterator = iter(iterable)
+
+        while True:
+            allocated = blocks()
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                record(clock() - start)
+                stats.allocs += blocks() - allocated
+            yield item
+
+
+    def wrap_execute(self, execute):
+        """ Instruments Interpreter.execute(), both in total ("execute")
+        and per command ("execute G01" and so on).
+        Args:
+          execute (callable): bound execute() of an Interpreter.
+        Returns:
+          The instrumented execute function.
+        """
+        execute = self.wrap(execute, "execute")
+        get_stats = self.get_stats
+        clock = time.perf_counter_ns
+        blocks = sys.getallocatedblocks
+        by_op = dict()
+
+        def execute_command(cmd):
+            stats = by_op.get(cmd.op)
+            if (stats is None):
+                stats = by_op[cmd.op] = get_stats("execute " + cmd.op.name)
+            allocated = blocks()
+            start = clock()
+            try:
+                return execute(cmd)
+            finally:
+                stats.record(clock() - start)
+                stats.allocs += blocks() - allocated
+
+        return execute_command
+
+
+    def patch(self, obj, attr, name=None):
+        """ Replaces a function attribute of a module or class with its
+        timing wrapper, until restore() is called.
+        Args:
+          obj (object): module or class.
+          attr (str): name of the function attribute.
+          name (str): name of the statistics, attr if not given.
+        """
+        func = getattr(obj, attr)
+        self._patches.append((obj, attr, func))
+        setattr(obj, attr, self.wrap(func, attr if (name is None) else name))
+
+
+    def restore(self):
+        """ Removes all patches made with patch(). """
+        while (len(self._patches) > 0):
+            obj, attr, func = self._patches.pop()
+            setattr(obj, attr, func)
+
+
+    def instrument_machine(self, machine):
+        """ Instruments all handlers of a machine (statistics named like
+        "MachineClient.move"). Calls between the handlers, e.g. move()
+        calling move_x(), are measured too. Must be done before the
+        machine is given to an Interpreter.
+        Args:
+          machine (MachineClient): machine to instrument. Other machines
+            of the same class are not affected.
+        """
+        cls = type(machine)
+        names = dict()
+        for klass in reversed(cls.__mro__[:-1]):
+            for attr, value in vars(klass).items():
+                if ((not attr.startswith("_")) and callable(value)
+                        and (attr not in SKIP_METHODS)):
+                    names[attr] = value
+
+        methods = {attr: self.wrap(func, cls.__name__ + "." + attr)
+                   for attr, func in names.items()}
+        # The machine keeps its state in slots, so the wrappers go into a
+        # subclass without any slots of its own, which makes the machine's
+        # class swappable.
+        methods["__slots__"] = ()
+        machine.__class__ = type("Profiled" + cls.__name__, (cls,), methods)
+
+
+    def summary(self):
+        """ Returns the summaries of the statistics by name, sorted by
+        the total time. Functions that were never called are left out.
+        """
+        summaries = [(name, stats.summary())
+                     for name, stats in self.stats.items()
+                     if (stats.calls > 0)]
+        summaries.sort(key=lambda item: -item[1]["total_s"])
+        return dict(summaries)
+
+
+    def format_table(self):
+        """ Formats the statistics as a text table. """
+        lines = ["{:<40s} {:>9s} {:>10s} {:>9s} {:>9s} {:>9s} {:>10s}".format(
+            "name", "calls", "total ms", "mean us", "p50 us", "p99 us",
+            "allocs")]
+        for name, entry in self.summary().items():
+            lines.append("{:<40s} {:>9d} {:>10.3f} {:>9.2f} {:>9.2f} "
+                "{:>9.2f} {:>10d}".format(name, entry["calls"],
+                    entry["total_s"] * 1e3, entry["mean_us"],
+                    entry["p50_us"], entry["p99_us"],
+                    entry["alloc_blocks"]))
+        return "\n".join(lines)
+
+
+    def format_json(self):
+        """ Formats the statistics as JSON. """
+        return json.dumps(self.summary(), indent=2)
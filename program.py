@@ -0,0 +1,471 @@
+#
+# Title: G-code interpreter program
+# File: program.py
+# Description: Random access to the blocks of a G-code file.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The parsers of main.py and reader.py turn a file into a stream of
+# blocks that can only be run from the start. A Program opens a file for
+# random access instead:
+#
+#   program = Program("part.gcode")
+#   program[0]             first block of the main program
+#   program[-1]            the last one
+#   program[10:20]         a list of blocks
+#   program.find(120)      index of the block with line number N120
+#   program.restart(i)     an Interpreter in the state before block i
+#
+# Opening the file scans it once, through mmap, for the offset and the
+# source line of every block of the main program and for the N numbers.
+# The lines are not compiled then: a block is compiled from its bytes
+# (see reader.compile_tokens()) when it is asked for, and the last
+# CACHE_SIZE blocks asked for are kept. Only the subprogram definitions
+# are compiled in the scan, as the calls need them (see subprogram.py).
+#
+# A restart in the middle of the program needs the machine state (the
+# position, the modes, the tool, the offsets) that the blocks before it
+# leave. It is found by running them quietly, with the calls of
+# incremental subprograms replayed, from the nearest checkpoint. The
+# checkpoints are taken every INTERVAL blocks the first time the blocks
+# are run this way, so later restarts run at most INTERVAL blocks before
+# the block they start from. save_checkpoints() keeps them in a file
+# (main.py puts it next to the program cache entry of the file, see
+# cache.checkpoint_path()), so later runs start from them too.
+#
+
+import re
+import os
+import mmap
+import array
+import bisect
+import pickle
+import tempfile
+import collections
+
+from block import (Opcode, ParseError, Command, Block, COMMAND_CODES,
+    AXIS_CODES)
+from reader import LETTER_N, compile_tokens
+from linetype import (TOKEN, CASE_MASK, LEAD_BYTES, LINE_MARKER, LINE_COMMENT,
+    LINE_PROGRAM, LINE_CODE, classify)
+from interpreter import Interpreter
+from subprogram import Subprograms
+from machineclient import MachineClient
+from sinks import NullSink
+
+# One line, with its first word (group 1) and the first byte of the
+# second word (group 2).
+LINE = re.compile(rb"[ \t\r]*([^ \t\r\n]*)[ \t\r]*([^ \t\r\n]?)[^\n]*\n?")
+# First letters of the words that always make a block: commands and
+# axis words (see compile_tokens()).
+BLOCK_LETTERS = frozenset(ord(letter) for letter in COMMAND_CODES + AXIS_CODES)
+# Number of compiled blocks kept.
+CACHE_SIZE = 4096
+# Number of blocks between the checkpoints of the machine state.
+INTERVAL = 256
+# Version of the checkpoint files, to be changed with the layout of
+# MachineClient.snapshot() or Interpreter.modal.
+CHECKPOINT_VERSION = 1
+
+CacheInfo = collections.namedtuple("CacheInfo",
+    ("hits", "misses", "maxsize", "currsize"))
+
+
+class Program:
+    """ A G-code file opened for random access to its blocks. Indexing,
+    slicing and iterating give the compiled blocks of the main program.
+    Attributes:
+      file_name (str): the G-code file.
+      pgm_num (int): number of the main program.
+      subprograms (Subprograms): the subprogram definitions of the file.
+      cache_size (int): number of compiled blocks kept.
+      interval (int): number of blocks between checkpoints.
+    """
+
+    def __init__(self, file_name, cache_size=CACHE_SIZE, interval=INTERVAL):
+        """ Opens and scans a file.
+        Args:
+          file_name (str): G-code file (must be a regular file).
+          cache_size (int): number of compiled blocks kept.
+          interval (int): number of blocks between the checkpoints of the
+            machine state; smaller restarts faster, at the cost of memory.
+        Raises:
+          OSError: if the file cannot be read.
+          ParseError: if the data markers or the program number are
+            invalid, or a subprogram definition cannot be compiled.
+        """
+        self.file_name = file_name
+        self.pgm_num = None
+        self.subprograms = Subprograms()
+        self.cache_size = max(1, cache_size)
+        self.interval = max(1, interval)
+        # Offset of the first word and the source line of every block.
+        self._offsets = array.array("q")
+        self._lines = array.array("q")
+        # Index of the first block with an N number, by the number.
+        self._numbers = dict()
+        self._cache = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        # Machine snapshot and modal commands before every interval-th
+        # block, see state().
+        initial = Interpreter(MachineClient(NullSink()))
+        self._checkpoints = [(initial.machine.snapshot(),
+                              tuple(initial.modal))]
+        # Number of checkpoints in the checkpoint file.
+        self._saved = 1
+
+        self._file = open(file_name, "rb")
+        self._map = None
+        try:
+            if (os.fstat(self._file.fileno()).st_size == 0):
+                self._buf = b""
+            else:
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+                self._buf = self._map
+            self._scan()
+        except BaseException:
+            self.close()
+            raise
+
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+    def __getitem__(self, index):
+        """ Gets a block, or a list of blocks for a slice.
+        Args:
+          index (int or slice): index of the block in the main program,
+            from 0. Negative indices count from the end.
+        Raises:
+          IndexError: if there is no such block.
+          ParseError: if a numeric value of the block cannot be converted.
+        """
+        if (isinstance(index, slice)):
+            return [self._block(i) for i in range(len(self))[index]]
+
+        if (index < 0):
+            index += len(self)
+        if ((index < 0) or (index >= len(self))):
+            raise IndexError("block index out of range")
+
+        return self._block(index)
+
+
+    def __iter__(self):
+        return self.blocks()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def blocks(self, start=0, stop=None):
+        """ Compiles blocks one after another. The blocks are not kept,
+        so a long run does not push the others out of the cache.
+        Args:
+          start (int): index of the first block.
+          stop (int): index after the last block, the end by default.
+        Yields:
+          The compiled blocks.
+        """
+        compile_line = self._compile
+        offsets = self._offsets
+        lines = self._lines
+        if (stop is None):
+            stop = len(self)
+
+        for i in range(start, stop):
+            yield compile_line(offsets[i], lines[i])
+
+
+    def find(self, number):
+        """ Finds a block by its line number (the N word).
+        Args:
+          number (int): the line number.
+        Returns:
+          Index of the first block with the number, or None.
+        """
+        return self._numbers.get(number)
+
+
+    def line(self, index):
+        """ Returns the source line number of a block. """
+        return self._lines[index]
+
+
+    def index_of_line(self, line_num):
+        """ Finds the first block at or after a source line.
+        Args:
+          line_num (int): line number in the file, from 1.
+        Returns:
+          Index of the block, len(self) if there are none.
+        """
+        return bisect.bisect_left(self._lines, line_num)
+
+
+    def state(self, index):
+        """ Gets the machine state before a block, running the blocks
+        from the previous checkpoint quietly.
+        Args:
+          index (int): index of the block, len(self) for the end.
+        Returns:
+          Tuple (MachineClient.snapshot(), modal commands of the
+          Interpreter).
+        Raises:
+          IndexError: if there is no such block.
+          ParseError: if a block on the way cannot be compiled.
+        """
+        if ((index < 0) or (index > len(self))):
+            raise IndexError("block index out of range")
+
+        interval = self.interval
+        checkpoints = self._checkpoints
+        first = min(index // interval, len(checkpoints) - 1) * interval
+        snapshot, modal = checkpoints[first // interval]
+        if (first == index):
+            return snapshot, modal
+
+        machine = MachineClient(NullSink())
+        machine.restore(snapshot)
+        interpreter = Interpreter(machine, self.subprograms, replay=True)
+        interpreter.modal[:] = modal
+        execute = interpreter.execute
+
+        for i, block in enumerate(self.blocks(first, index), first):
+            if ((i % interval == 0) and (i // interval == len(checkpoints))):
+                checkpoints.append((machine.snapshot(),
+                                    tuple(interpreter.modal)))
+            for cmd in block.commands:
+                execute(cmd)
+
+        state = (machine.snapshot(), tuple(interpreter.modal))
+        if ((index % interval == 0)
+                and (index // interval == len(checkpoints))):
+            checkpoints.append(state)
+        return state
+
+
+    def restart(self, index, machine=None, replay=False):
+        """ Prepares a run from a block on, in the state the blocks before
+        it leave (see state()).
+        Args:
+          index (int): index of the block to start from.
+          machine (MachineClient): machine to run with; its state is
+            replaced. A new one with text output if not given.
+          replay (bool): see Interpreter.
+        Returns:
+          An Interpreter with the machine, ready to run blocks(index).
+        Raises:
+          IndexError, ParseError: see state().
+        """
+        snapshot, modal = self.state(index)
+        if (machine is None):
+            machine = MachineClient()
+        machine.restore(snapshot)
+        interpreter = Interpreter(machine, self.subprograms, replay=replay)
+        interpreter.modal[:] = modal
+
+        return interpreter
+
+
+    def load_checkpoints(self, path):
+        """ Takes the checkpoints saved by save_checkpoints() for a file
+        with the same content, if there are more of them than now.
+        Args:
+          path (str): checkpoint file.
+        Returns:
+          True if the checkpoints were taken, False if the file does not
+          exist or is not valid for this program.
+        """
+        try:
+            with open(path, "rb") as f:
+                version, interval, checkpoints = pickle.load(f)
+        except Exception:
+            # Missing, or written by another version.
+            return False
+
+        if ((version != CHECKPOINT_VERSION) or (interval != self.interval)
+                or (not isinstance(checkpoints, list))
+                or (len(checkpoints) <= len(self._checkpoints))
+                or ((len(checkpoints) - 1) * interval > len(self))):
+            return False
+
+        self._checkpoints = checkpoints
+        self._saved = len(checkpoints)
+        return True
+
+
+    def save_checkpoints(self, path):
+        """ Writes the checkpoints into a file, if there are new ones.
+        The file is replaced as a whole, and errors in writing it are
+        ignored: it only saves time.
+        Args:
+          path (str): checkpoint file, e.g. cache.checkpoint_path() of
+            the G-code file.
+        Returns:
+          True if the file was written.
+        """
+        if (len(self._checkpoints) <= self._saved):
+            return False
+
+        temp_path = None
+        try:
+            directory = os.path.dirname(path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((CHECKPOINT_VERSION, self.interval,
+                             self._checkpoints), f, 
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            temp_path = None
+        except OSError:
+            return False
+        finally:
+            if (temp_path is not None):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+        self._saved = len(self._checkpoints)
+        return True
+
+
+    def cache_info(self):
+        """ Returns the hit and miss counts of the block cache. """
+        return CacheInfo(self._hits, self._misses, self.cache_size,
+                         len(self._cache))
+
+
+    def close(self):
+        """ Releases the file. Blocks cannot be compiled after this, but
+        the ones already compiled stay valid. """
+        self._buf = b""
+        if (self._map is not None):
+            try:
+                self._map.close()
+            except BufferError:
+                # Still used by the matches of a failed scan, freed with
+                # them.
+                pass
+            self._map = None
+        if (self._file is not None):
+            self._file.close()
+            self._file = None
+
+
+    def _block(self, index):
+        """ Gets a block through the cache. """
+        cache = self._cache
+        block = cache.get(index)
+        if (block is not None):
+            cache.move_to_end(index)
+            self._hits += 1
+            return block
+
+        self._misses += 1
+        block = self._compile(self._offsets[index], self._lines[index])
+        cache[index] = block
+        if (len(cache) > self.cache_size):
+            cache.popitem(last=False)
+        return block
+
+
+    def _compile(self, offset, line_num):
+        """ Compiles the line of a block from the offset of its first
+        word. """
+        buf = self._buf
+        end = buf.find(b"\n", offset)
+        if (end < 0):
+            end = len(buf)
+        tokens = TOKEN.finditer(buf, offset, end)
+
+        return compile_tokens(buf, next(tokens), tokens, line_num)
+
+
+    def _scan(self):
+        """ Finds the blocks of the main program and compiles the
+        subprogram definitions, following the rules of linetype.py and
+        reader.parse_buffer(). """
+        buf = self._buf
+        subprograms = self.subprograms
+        offsets = self._offsets
+        lines = self._lines
+        numbers = self._numbers
+        block_letters = BLOCK_LETTERS
+        markers_seen = 0
+        line_num = 0
+
+        for line in LINE.finditer(buf):
+            line_num += 1
+            word, second = line.group(1, 2)
+            # Empty lines are skipped.
+            if (len(word) == 0):
+                continue
+
+            # Data markers, comment lines and program numbers, see
+            # linetype.py.
+            char = word[0]
+            start = line.start(1)
+            kind = LINE_CODE
+            if (char in LEAD_BYTES):
+                kind, pgm_num = classify(buf, start, line.end())
+                if (kind == LINE_MARKER):
+                    markers_seen += 1
+                    if (markers_seen > 2):
+                        raise ParseError("invalid number of data markers "
+                            "(more than 2)")
+                    continue
+                if (kind == LINE_COMMENT):
+                    continue
+
+            if (markers_seen != 1):
+                raise ParseError("program data found outside of data "
+                    "markers")
+
+            if (kind == LINE_PROGRAM):
+                if (self.pgm_num is None):
+                    self.pgm_num = pgm_num
+                else:
+                    subprograms.feed(Block(line_num,
+                        (Command(Opcode.O, pgm_num),)))
+                continue
+
+            letter = char & CASE_MASK
+            if (subprograms.in_definition()):
+                block = self._compile(start, line_num)
+                if (block is not None):
+                    subprograms.feed(block)
+                continue
+
+            # Lines that do not start with a command or an axis word
+            # (after a line number) are blocks only if they have one
+            # later on.
+            if (letter == LETTER_N):
+                if (((len(second) == 0)
+                        or ((second[0] & CASE_MASK) not in block_letters))
+                        and (self._compile(start, line_num) is None)):
+                    continue
+                try:
+                    numbers.setdefault(int(word[1:]), len(offsets))
+                except ValueError:
+                    pass
+            elif ((letter not in block_letters)
+                    and (self._compile(start, line_num) is None)):
+                continue
+
+            offsets.append(start)
+            lines.append(line_num)
+
+        if (markers_seen != 2):
+            raise ParseError("invalid number of data markers ({}, should "
+                "have 2)".format(markers_seen))
+        subprograms.close()
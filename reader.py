@@ -0,0 +1,312 @@
+#
+# Title: G-code interpreter program
+# File: reader.py
+# Description: Memory mapped G-code reader.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# parse_mapped() does the same as parse_file() in main.py, but reads the
+# file through mmap and finds the words directly in the mapped bytes
+# with regular expressions. No string is created for a line, and there
+# are no strip(), upper() or split() copies: letters are compared
+# case-insensitively as byte values, and the bytes of a number are
+# sliced out and converted only when the compiled block keeps the value
+# (line numbers, comments and ignored words are never converted).
+#
+
+import os
+import re
+import mmap
+
+from block import (Opcode, OPCODES, ParseError, Command, Block,
+    COMMAND_CODES, PARAMETER_CODES, AXIS_CODES)
+from linetype import (TOKEN, CASE_MASK, LEAD_BYTES, LINE_MARKER, LINE_COMMENT,
+    LINE_PROGRAM, LINE_CODE, classify)
+
+# Number of a parameter word.
+_NUM = rb"([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))"
+# One line of G-code. Lines with just a G00/G01 and its parameters in
+# X, Y, Z, F order (optionally after a line number) are by far the most
+# common ones in large programs, so those are matched with their values
+# (groups 1-5) in one go. All other lines are matched as a whole (group
+# 6) and handled word by word.
+LINE = re.compile(
+    rb"[ \t]*(?:(?:[Nn][0-9]+[ \t]+)?[Gg]0?([01])"
+    rb"(?:[ \t]+[Xx]" + _NUM + rb")?"
+    rb"(?:[ \t]+[Yy]" + _NUM + rb")?"
+    rb"(?:[ \t]+[Zz]" + _NUM + rb")?"
+    rb"(?:[ \t]+[Ff]" + _NUM + rb")?"
+    rb"[ \t\r]*(?=\n|\Z)|([^\n]*))\n?")
+# How often release() is called in parse_buffer() (a power of two - 1):
+# every 1024 lines, some 40 kB of a typical toolpath, which is about the
+# part of the file that stays resident while parsing.
+RELEASE_LINES = 0x3FF
+# Opcodes of the G00/G01 lines by the digit matched.
+MOVES = {b"0": Opcode.G00, b"1": Opcode.G01}
+
+# Byte values of the letters of interest, compared in upper case (see
+# linetype.CASE_MASK).
+LETTER_N = ord("N")
+LETTER_T = ord("T")
+LETTER_S = ord("S")
+LETTER_G = ord("G")
+LETTER_X = ord("X")
+LETTER_Y = ord("Y")
+LETTER_Z = ord("Z")
+LETTER_F = ord("F")
+LETTER_I = ord("I")
+LETTER_J = ord("J")
+LETTER_K = ord("K")
+LETTER_R = ord("R")
+LETTER_P = ord("P")
+LETTER_H = ord("H")
+LETTER_Q = ord("Q")
+COMMANDS = frozenset(ord(letter) for letter in COMMAND_CODES)
+PARAMETERS = frozenset(ord(letter) for letter in PARAMETER_CODES)
+AXES = frozenset(ord(letter) for letter in AXIS_CODES)
+
+# G and M opcodes by letter and by the bytes of the number.
+CODES = dict()
+for _word, _op in OPCODES.items():
+    if (_word[0] in ("G", "M")):
+        CODES.setdefault(ord(_word[0]), dict())[_word[1:].encode()] = _op
+
+
+def parse_mapped(file_name, pgm_data):
+    """ Reads a G-code file through mmap in a single forward pass and
+    yields the code blocks as soon as they are read. See parse_file()
+    in main.py.
+    Args:
+      file_name (str): G-code file (must be a regular file).
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+    Yields:
+      A compiled Block for each line containing commands.
+    Raises:
+      ParseError: if the data markers or the program number are invalid.
+    """
+    with open(file_name, "rb") as f:
+        if (os.fstat(f.fileno()).st_size == 0):
+            yield from parse_buffer(b"", pgm_data)
+            return
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            release = None
+            if (hasattr(mm, "madvise")):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+                released = [0]
+
+                # The pages already parsed are dropped from the process,
+                # so that the resident size does not grow with the file.
+                def release(offset):
+                    offset -= offset % mmap.PAGESIZE
+                    if (offset > released[0]):
+                        mm.madvise(mmap.MADV_DONTNEED, released[0],
+                                   offset - released[0])
+                        released[0] = offset
+
+            yield from parse_buffer(mm, pgm_data, release)
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # After a ParseError the matches in its traceback still
+                # use the map; it is freed with them, and the ParseError
+                # is passed on.
+                pass
+
+
+def parse_buffer(buf, pgm_data, release=None):
+    """ Parses G-code from a bytes-like buffer, see parse_mapped().
+    Args:
+      buf (bytes-like): G-code text.
+      pgm_data (dict): the program number and the running count of
+        commands are stored here.
+      release (callable): if given, called now and then with the offset
+        up to which the buffer has been parsed.
+    Yields:
+      A compiled Block for each line containing commands.
+    """
+    finditer = TOKEN.finditer
+    moves = MOVES
+    markers_seen = 0
+    line_num = 0
+    pgm_data["pgm_num"] = None
+    pgm_data["num_commands"] = 0
+
+    for line in LINE.finditer(buf):
+        line_num += 1
+        if (((line_num & RELEASE_LINES) == 0) and (release is not None)):
+            release(line.start())
+
+        gcode = line.group(1)
+
+        if (gcode is not None):
+            if (markers_seen != 1):
+                raise ParseError("program data found outside of data "
+                    "markers")
+            cmd = Command(moves[gcode])
+            x, y, z, f = line.group(2, 3, 4, 5)
+            if (x is not None):
+                cmd.x = float(x)
+            if (y is not None):
+                cmd.y = float(y)
+            if (z is not None):
+                cmd.z = float(z)
+            if (f is not None):
+                cmd.f = float(f)
+            pgm_data["num_commands"] = pgm_data["num_commands"] + 1
+            yield Block(line_num, (cmd,))
+            continue
+
+        start, end = line.span(6)
+        tokens = finditer(buf, start, end)
+        first = next(tokens, None)
+        # Empty lines are skipped.
+        if (first is None):
+            continue
+
+        # Data markers, comment lines and program numbers, see 
+        # linetype.py.
+        kind = LINE_CODE
+        if (buf[first.start()] in LEAD_BYTES):
+            kind, pgm_num = classify(buf, start, end)
+
+            # Valid G-code has exactly two data markers around the program.
+            if (kind == LINE_MARKER):
+                markers_seen += 1
+                if (markers_seen > 2):
+                    raise ParseError("invalid number of data markers "
+                        "(more than 2)")
+                continue
+
+            # Comment lines are skipped.
+            if (kind == LINE_COMMENT):
+                continue
+
+        if (markers_seen != 1):
+            raise ParseError("program data found outside of data markers")
+
+        # Storing the program number. The later ones start subprogram
+        # definitions.
+        if (kind == LINE_PROGRAM):
+            if (pgm_data["pgm_num"] is None):
+                pgm_data["pgm_num"] = pgm_num
+                continue
+            block = Block(line_num, (Command(Opcode.O, pgm_num),))
+        else:
+            # Compiling all commands.
+            block = compile_tokens(buf, first, tokens, line_num)
+        if (block is not None):
+            pgm_data["num_commands"] = pgm_data["num_commands"] + len(block)
+            yield block
+
+    if (markers_seen != 2):
+        raise ParseError("invalid number of data markers ({}, should have 2)"
+            .format(markers_seen))
+
+
+def compile_tokens(buf, first, tokens, line_num):
+    """ Compiles the words of a line into a Block. This is the bytes
+    counterpart of block.compile_block() and follows the same rules.
+    Args:
+      buf (bytes-like): G-code text.
+      first (re.Match): the first word of the line.
+      tokens (iterator): the rest of the words of the line.
+      line_num (int): line number of the row in the source file.
+    Returns:
+      A Block, or None if the row has no commands.
+    Raises:
+      ParseError: if a numeric value cannot be converted.
+    """
+    commands = list()
+    last_gcode = None
+    match = first
+
+    while (match is not None):
+        word_start = match.start()
+        word_end = match.end()
+        letter = buf[word_start] & CASE_MASK
+
+        # Line number, unused.
+        if (letter == LETTER_N):
+            match = next(tokens, None)
+            continue
+
+        try:
+            # Adding parameters to the last G command (or M98).
+            if (last_gcode is not None):
+                if (letter in PARAMETERS):
+                    value = float(buf[word_start + 1 : word_end])
+                    if (letter == LETTER_X):
+                        last_gcode.x = value
+                    elif (letter == LETTER_Y):
+                        last_gcode.y = value
+                    elif (letter == LETTER_Z):
+                        last_gcode.z = value
+                    elif (letter == LETTER_F):
+                        last_gcode.f = value
+                    elif (letter == LETTER_I):
+                        last_gcode.i = value
+                    elif (letter == LETTER_J):
+                        last_gcode.j = value
+                    elif (letter == LETTER_K):
+                        last_gcode.k = value
+                    elif (letter == LETTER_R):
+                        last_gcode.r = value
+                    elif (letter == LETTER_P):
+                        last_gcode.p = value
+                    elif (letter == LETTER_H):
+                        last_gcode.h = value
+                    elif (letter == LETTER_Q):
+                        last_gcode.q = value
+                    else:
+                        last_gcode.l = value
+                    match = next(tokens, None)
+                    continue
+                else:
+                    last_gcode = None
+
+            if (letter in COMMANDS):
+                number = buf[word_start + 1 : word_end]
+                if (letter == LETTER_T):
+                    cmd = Command(Opcode.T, int(number))
+                elif (letter == LETTER_S):
+                    cmd = Command(Opcode.S, int(number))
+                else:
+                    op = CODES[letter].get(number)
+                    if (op is None):
+                        word = bytes(buf[word_start : word_end])
+                        cmd = Command(Opcode.UNKNOWN,
+                            word.decode("utf-8", errors="replace").upper())
+                    else:
+                        cmd = Command(op)
+                    if ((letter == LETTER_G) or (op == Opcode.M98)):
+                        last_gcode = cmd
+                commands.append(cmd)
+            elif (letter in AXES):
+                # Axis words without a command: the parameters of an
+                # AXES command.
+                value = float(buf[word_start + 1 : word_end])
+                last_gcode = Command(Opcode.AXES)
+                if (letter == LETTER_X):
+                    last_gcode.x = value
+                elif (letter == LETTER_Y):
+                    last_gcode.y = value
+                else:
+                    last_gcode.z = value
+                commands.append(last_gcode)
+
+        except ValueError:
+            word = bytes(buf[word_start : word_end])
+            raise ParseError("invalid value '{}' on line {}"
+                .format(word.decode("utf-8", errors="replace").upper(),
+                        line_num)) from None
+
+        match = next(tokens, None)
+
+    if (len(commands) == 0):
+        return None
+
+    return Block(line_num, tuple(commands))
@@ -0,0 +1,543 @@
+#!/usr/bin/python3
+
+#
+# Title: G-code interpreter program
+# File: resim.py
+# Description: Incremental re-simulation of a program after edits.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A Session keeps a simulated program in memory: its source lines, the
+# compiled block and the machine messages of every line, and checkpoints
+# of the machine state (position, units, distance, motion and feed mode,
+# tool, spindle, coolant and the active modal commands) taken every
+# "interval" blocks.
+#
+# When lines are changed, the run is resumed from the last checkpoint
+# before the first changed line, with only the changed lines compiled
+# again. After the last changed line the state is compared to the
+# checkpoints of the previous run (the ones after the change, moved by
+# the number of added or removed lines). Once the state equals one of
+# them, the rest of the program runs exactly as before and its messages
+# and checkpoints are kept. A change that moves everything after it,
+# e.g. an incremental move, runs to the end of the program.
+#
+# Changes to the data markers, the program numbers or a subprogram
+# definition may change the whole run, so they simulate the whole
+# program again.
+#
+# Run as a program, the file is watched and simulated again whenever it
+# is saved, printing how much had to be run.
+#
+
+import os
+import sys
+import time
+import bisect
+import difflib
+import argparse
+
+from block import ParseError, Opcode, compile_block
+from interpreter import Interpreter
+from subprogram import Subprograms
+from machineclient import MachineClient
+from main import parse_file
+from linetype import is_marker, is_comment, get_program_number
+from sinks import NullSink
+
+# Default number of blocks between checkpoints.
+INTERVAL = 256
+# Lines compared at a time when looking for the changed lines.
+COMPARE_CHUNK = 4096
+# Largest number of lines compared with difflib.
+DIFF_LIMIT = 20000
+
+
+class LineSink(NullSink):
+    """ Collects the machine status messages of every source line.
+    Attributes:
+      outputs (list): list of (template, args) tuples of every line by
+        line index, None for the lines without messages.
+      index (int): index of the line being run.
+    """
+
+    quiet = False
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.index = 0
+
+
+    def status(self, template, args):
+        messages = self.outputs[self.index]
+        if (messages is None):
+            messages = list()
+            self.outputs[self.index] = messages
+        messages.append((template, args))
+
+
+class Session:
+    """ A program kept simulated across edits.
+    Attributes:
+      lines (list): source lines of the program.
+      blocks (list): compiled main program Block of every line, None for
+        the other lines. The line numbers of the blocks are the ones they
+        were compiled with.
+      outputs (list): machine messages of every line, see LineSink.
+      pgm_data (dict): program number, number of commands and the
+        compiled subprogram bodies ("subprograms") of the last full run.
+      interval (int): number of blocks between checkpoints.
+    """
+
+    def __init__(self, lines, interval=INTERVAL):
+        """ Simulates the first version of a program.
+        Args:
+          lines (iterable): text lines of the program.
+          interval (int): number of blocks between checkpoints; smaller
+            resumes closer to a change, at the cost of memory.
+        Raises:
+          ParseError: if the program is not valid.
+        """
+        self.interval = max(1, interval)
+        self.lines = list()
+        self.blocks = list()
+        self.outputs = list()
+        self.pgm_data = dict()
+        self.machine = None
+        self.interpreter = None
+        self._sink = None
+        # Checkpoints: line indices, and the machine snapshot and the
+        # modal commands before running those lines.
+        self._cp_lines = list()
+        self._cp_states = list()
+        # Machine snapshot and modal commands at the end of the program.
+        self._final = None
+        # Line indices of the data markers.
+        self._markers = (0, 0)
+        # First and last line index of every subprogram definition.
+        self._definitions = list()
+        self.run(lines)
+
+
+    def run(self, lines):
+        """ Simulates a whole program, replacing the previous one.
+        Args:
+          lines (iterable): text lines of the program.
+        Returns:
+          See replace().
+        Raises:
+          ParseError: if the program is not valid. The session is left
+            as it was.
+        """
+        lines = list(lines)
+        pgm_data = dict()
+        parsed = list(parse_file(lines, pgm_data))
+
+        markers = [index for index, txt in enumerate(lines)
+                   if (is_marker(txt.strip()))]
+        blocks = [None] * len(lines)
+        program = Subprograms()
+        definitions = list()
+        closed = list()
+        for block in parsed:
+            index = block.line - 1
+            if (not program.feed(block)):
+                blocks[index] = block
+            elif (block.commands[0].op == Opcode.O):
+                definitions.append([index, index])
+                closed.append(False)
+            else:
+                definitions[-1][1] = index
+                closed[-1] = any(cmd.op == Opcode.M99 for cmd in block)
+        program.close()
+
+        # A definition without M99 goes on up to the next one.
+        for i, definition in enumerate(definitions):
+            if (not closed[i]):
+                definition[1] = (markers[1] - 1 if (i == len(definitions) - 1)
+                                 else definitions[i + 1][0] - 1)
+
+        pgm_data["subprograms"] = program.bodies
+        self.pgm_data = pgm_data
+        self.lines = lines
+        self.blocks = blocks
+        # A new list, so that messages of the old machine (shutting down)
+        # do not end up in it.
+        self.outputs = [None] * len(lines)
+        self._sink = LineSink(self.outputs)
+        self._markers = (markers[0], markers[1])
+        self._definitions = [tuple(definition) for definition in definitions]
+
+        self.machine = MachineClient(self._sink)
+        self.interpreter = Interpreter(self.machine, program)
+        self._cp_lines[:] = [0]
+        self._cp_states[:] = [self._state()]
+        end, converged = self._simulate(0)
+        self._final = self._state()
+
+        return {"resumed": 1, "stopped": end + 1, "executed": end,
+                "converged": False}
+
+
+    def replace(self, line, count, new_lines):
+        """ Changes lines of the program and simulates it again from the
+        last checkpoint before the change, until the run converges with
+        the previous one.
+        Args:
+          line (int): number of the first changed line (from 1), like
+            the start line of a diff hunk.
+          count (int): number of lines removed there, 0 for inserting.
+          new_lines (iterable): text lines put in their place.
+        Returns:
+          A dict: "resumed" and "stopped" are the numbers of the first
+          line run and of the line where the run stopped (one past the
+          last line if it ran to the end), "executed" the number of lines
+          in between and "converged" True if the rest of the previous run
+          was kept.
+        Raises:
+          ValueError: if the lines are not in the program.
+          ParseError: if a new line is not valid. The session is left
+            as it was.
+        """
+        first = line - 1
+        last = first + count
+        new_lines = list(new_lines)
+        if ((first < 0) or (count < 0) or (last > len(self.lines))):
+            raise ValueError("lines {}-{} are not in the program".format(
+                line, line + count - 1))
+
+        if ((count == 0) and (len(new_lines) == 0)):
+            return {"resumed": line, "stopped": line, "executed": 0,
+                    "converged": True}
+
+        if (self._needs_full_run(first, last, new_lines)):
+            return self.run(self.lines[:first] + new_lines
+                            + self.lines[last:])
+
+        # Compiling first, so that an invalid line changes nothing.
+        new_blocks = list()
+        for i, txt in enumerate(new_lines):
+            txt = txt.strip()
+            block = None
+            if (not is_comment(txt)):
+                block = compile_block(txt, first + i + 1)
+            new_blocks.append(block)
+
+        delta = len(new_lines) - count
+        cp_lines = self._cp_lines
+        cp_states = self._cp_states
+        k = bisect.bisect_right(cp_lines, first) - 1
+        t = bisect.bisect_left(cp_lines, last)
+        tail_lines = [index + delta for index in cp_lines[t:]]
+        tail_states = cp_states[t:]
+        start = cp_lines[k]
+        snapshot, modal = cp_states[k]
+        del cp_lines[k + 1:]
+        del cp_states[k + 1:]
+
+        self.lines[first:last] = new_lines
+        self.blocks[first:last] = new_blocks
+        self.outputs[first:last] = [None] * len(new_lines)
+        self._markers = (self._markers[0], self._markers[1] + delta)
+        self._definitions = [(d0 + delta, d1 + delta) if (d0 >= last)
+                             else (d0, d1) for d0, d1 in self._definitions]
+
+        self.machine.restore(snapshot)
+        self.interpreter.modal[:] = modal
+        end, converged = self._simulate(start, tail_lines, tail_states)
+        if (not converged):
+            self._final = self._state()
+
+        return {"resumed": start + 1, "stopped": end + 1,
+                "executed": end - start, "converged": converged}
+
+
+    def update(self, new_lines):
+        """ Changes the program into a new version, simulating again only
+        what the changed lines affect. Every changed part (see
+        diff_hunks()) is handled with replace(), from the first to the
+        last.
+        Args:
+          new_lines (iterable): text lines of the new version.
+        Returns:
+          See replace(); "resumed" is the first line run for the first
+          change, "stopped" and "converged" are those of the last change
+          and "executed" is the total.
+        Raises:
+          ParseError: if a changed line is not valid. The changes before
+            it have been made.
+        """
+        if (not isinstance(new_lines, list)):
+            new_lines = list(new_lines)
+
+        result = {"resumed": None, "stopped": None, "executed": 0,
+                  "converged": True}
+        shift = 0
+        for index, count, lines in diff_hunks(self.lines, new_lines):
+            done = self.replace(index + shift + 1, count, lines)
+            shift += len(lines) - count
+            if (result["resumed"] is None):
+                result["resumed"] = done["resumed"]
+            result["stopped"] = done["stopped"]
+            result["executed"] += done["executed"]
+            result["converged"] = done["converged"]
+
+        if (result["resumed"] is None):
+            result["resumed"] = result["stopped"] = len(self.lines) + 1
+        return result
+
+
+    def state(self):
+        """ Returns the machine state at the end of the program, see
+        MachineClient.get_state(). """
+        machine = MachineClient(NullSink())
+        machine.restore(self._final[0])
+        return machine.get_state()
+
+
+    def messages(self, errors_only=False):
+        """ Returns the machine messages of the program.
+        Args:
+          errors_only (bool): if True, only the error messages.
+        Returns:
+          A list of (line number, text) tuples in the order of the lines.
+        """
+        found = list()
+        for index, messages in enumerate(self.outputs):
+            if (messages is None):
+                continue
+            for template, args in messages:
+                if ((not errors_only) or ("Error" in template)):
+                    found.append((index + 1, template.format(*args)))
+
+        return found
+
+
+    def _state(self):
+        """ Returns the checkpoint of the current machine state. """
+        return (self.machine.snapshot(), tuple(self.interpreter.modal))
+
+
+    def _needs_full_run(self, first, last, new_lines):
+        """ Tells if changing lines first...last - 1 may affect more than
+        the main program blocks after them. """
+        if ((first <= self._markers[0]) or (last > self._markers[1])):
+            return True
+
+        for d0, d1 in self._definitions:
+            if ((first <= d1) and (max(last, first + 1) > d0)):
+                return True
+
+        for txt in self.lines[first:last] + new_lines:
+            txt = txt.strip()
+            if (is_marker(txt) or (get_program_number(txt) > 0)):
+                return True
+
+        return False
+
+
+    def _simulate(self, start, tail_lines=(), tail_states=()):
+        """ Runs the main program from a line on, taking checkpoints.
+        Args:
+          start (int): index of the first line to run. The machine must
+            be in the state of the last checkpoint, taken at this line.
+          tail_lines, tail_states (list): checkpoints of the previous run
+            after the changed lines. The run stops at the first of them
+            it reaches in the same state, and they are kept from there on.
+        Returns:
+          Tuple (index of the line the run stopped at, True if it stopped
+          at a checkpoint of the previous run).
+        """
+        execute = self.interpreter.execute
+        state = self._state
+        sink = self._sink
+        blocks = self.blocks
+        outputs = self.outputs
+        cp_lines = self._cp_lines
+        cp_states = self._cp_states
+        interval = self.interval
+
+        j = 0
+        next_tail = tail_lines[0] if (len(tail_lines) > 0) else -1
+        num_blocks = 0
+        for index in range(start, len(blocks)):
+            block = blocks[index]
+            if (block is None):
+                continue
+
+            if (index >= next_tail >= 0):
+                while ((j < len(tail_lines)) and (tail_lines[j] < index)):
+                    j += 1
+                if ((j < len(tail_lines)) and (tail_lines[j] == index)):
+                    if (state() == tail_states[j]):
+                        cp_lines.extend(tail_lines[j:])
+                        cp_states.extend(tail_states[j:])
+                        return index, True
+                    j += 1
+                next_tail = tail_lines[j] if (j < len(tail_lines)) else -1
+
+            if (num_blocks >= interval):
+                cp_lines.append(index)
+                cp_states.append(state())
+                num_blocks = 0
+
+            sink.index = index
+            outputs[index] = None
+            for cmd in block.commands:
+                execute(cmd)
+            num_blocks += 1
+
+        return len(blocks), False
+
+
+def diff_hunks(old, new):
+    """ Finds the changed parts between two versions of a program. The
+    equal lines at the start and the end are skipped in chunks. Changed
+    lines in between are found line by line when the line counts match,
+    with difflib when the rest is at most DIFF_LIMIT lines, and are
+    taken as one part otherwise.
+    Args:
+      old, new (list): text lines of the versions.
+    Returns:
+      A list of (index, count, lines) tuples in the order of the lines:
+      count lines of old from index on were replaced with lines.
+    """
+    num = min(len(old), len(new))
+    prefix = common_prefix(old, new, num)
+    suffix = common_suffix(old, new, num - prefix)
+    old_end = len(old) - suffix
+    new_end = len(new) - suffix
+
+    if (old_end == new_end):
+        hunks = list()
+        index = prefix
+        while (index < old_end):
+            index += common_prefix(old, new, old_end - index, index)
+            end = index
+            while ((end < old_end) and (old[end] != new[end])):
+                end += 1
+            if (end > index):
+                hunks.append((index, end - index, new[index:end]))
+            index = end
+        return hunks
+
+    if (max(old_end, new_end) - prefix <= DIFF_LIMIT):
+        matcher = difflib.SequenceMatcher(None, old[prefix:old_end],
+                                          new[prefix:new_end], autojunk=False)
+        return [(prefix + i1, i2 - i1, new[prefix + j1 : prefix + j2])
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+                if (tag != "equal")]
+
+    return [(prefix, old_end - prefix, new[prefix:new_end])]
+
+
+def common_prefix(a, b, num, start=0):
+    """ Returns the number of equal items of two lists from an index on,
+    at most num. Whole chunks are compared at a time. """
+    prefix = start
+    end = start + num
+    while ((prefix + COMPARE_CHUNK <= end)
+           and (a[prefix : prefix + COMPARE_CHUNK]
+                == b[prefix : prefix + COMPARE_CHUNK])):
+        prefix += COMPARE_CHUNK
+
+    while ((prefix < end) and (a[prefix] == b[prefix])):
+        prefix += 1
+
+    return prefix - start
+
+
+def common_suffix(a, b, num):
+    """ Returns the number of equal items at the end of two lists, at
+    most num. """
+    suffix = 0
+    end_a = len(a)
+    end_b = len(b)
+    while ((suffix + COMPARE_CHUNK <= num)
+           and (a[end_a - suffix - COMPARE_CHUNK : end_a - suffix]
+                == b[end_b - suffix - COMPARE_CHUNK : end_b - suffix])):
+        suffix += COMPARE_CHUNK
+
+    while ((suffix < num)
+           and (a[end_a - suffix - 1] == b[end_b - suffix - 1])):
+        suffix += 1
+
+    return suffix
+
+
+def read_lines(file_name):
+    """ Reads the lines of a file. """
+    with open(file_name) as f:
+        return f.readlines()
+
+
+def watch(file_name, interval, poll):
+    """ Simulates a file again every time it is modified, until
+    interrupted.
+    Args:
+      file_name (str): G-code file.
+      interval (int): blocks between checkpoints.
+      poll (float): time between checks of the file [s].
+    """
+    start = time.perf_counter()
+    lines = read_lines(file_name)
+    session = Session(lines, interval)
+    report(session, {"resumed": 1, "stopped": len(lines) + 1,
+                     "executed": len(lines), "converged": False}, start)
+    mtime = os.stat(file_name).st_mtime_ns
+
+    while True:
+        time.sleep(poll)
+        try:
+            modified = os.stat(file_name).st_mtime_ns
+            if (modified == mtime):
+                continue
+            mtime = modified
+            lines = read_lines(file_name)
+            start = time.perf_counter()
+            result = session.update(lines)
+        except (OSError, ParseError) as err:
+            print("Error: {}.".format(err))
+            continue
+        report(session, result, start)
+
+
+def report(session, result, start):
+    """ Prints the result of a (re-)simulation. """
+    elapsed = time.perf_counter() - start
+    print("Ran lines {}-{} ({} lines) in {:.1f} ms, {}.".format(
+        result["resumed"], result["stopped"] - 1, result["executed"],
+        elapsed * 1000.0, "converged with the previous run"
+        if (result["converged"]) else "to the end"))
+    pos = session.state()["pos"]
+    print("End position X{:.3f} Y{:.3f} Z{:.3f}.".format(pos["x"], pos["y"],
+                                                       pos["z"]))
+    for line, message in session.messages(errors_only=True):
+        print("line {}: {}".format(line, message))
+    sys.stdout.flush()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="resim.py",
+        description="Simulates a G-code file again every time it is "
+                    "saved, running only what the changes affect.")
+    parser.add_argument("file", help="G-code file to watch")
+    parser.add_argument("-i", "--interval", type=int, default=INTERVAL,
+        help="blocks between checkpoints (default: {})".format(INTERVAL))
+    parser.add_argument("--poll", type=float, default=0.2,
+        help="time between checks of the file [s] (default: 0.2)")
+    opts = parser.parse_args(args[1:])
+
+    try:
+        watch(opts.file, opts.interval, opts.poll)
+    except (OSError, ParseError) as err:
+        print("Error: {}.".format(err))
+        return 1
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
@@ -0,0 +1,268 @@
+#
+# Title: G-code interpreter program
+# File: sinks.py
+# Description: Output sinks for the messages of a simulated program run.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Messages are passed to the sinks as a format string and its arguments.
+# The text is only formatted by sinks that actually output it, so a run
+# with the NullSink does no string formatting at all.
+#
+
+import sys
+import json
+
+
+class NullSink:
+    """ Discards all output.
+    Attributes:
+      quiet (bool): True if the sink discards the machine status
+        messages, so that the run may skip work that only produces them
+        (see subprogram.py).
+      num_errors (int): number of machine error messages output so far
+        by a quiet sink that outputs them.
+    """
+
+    quiet = True
+    num_errors = 0
+
+    def info(self, template, *args):
+        """ Program level message (e.g. program start). """
+        pass
+
+
+    def status(self, template, args):
+        """ Machine status message.
+        Args:
+          template (str): format string of the message.
+          args (tuple): arguments for the format string.
+        """
+        pass
+
+
+    def block_begin(self, num, block):
+        """ Start of a code block.
+        Args:
+          num (int): running number of the block.
+          block (Block): the compiled block.
+        """
+        pass
+
+
+    def command(self, cmd):
+        """ A command is about to be executed. """
+        pass
+
+
+    def block_end(self, num, block):
+        """ End of a code block. """
+        pass
+
+
+    def flush(self):
+        """ Writes out any buffered output. """
+        pass
+
+
+    def close(self):
+        """ Flushes the sink. Messages received after closing are written
+        out immediately. """
+        pass
+
+
+class TextSink(NullSink):
+    """ Human readable text output. Lines are collected into a buffer
+    and written out in bulk. """
+
+    quiet = False
+
+    def __init__(self, stream=None, buffer_lines=256):
+        """ Args:
+          stream (file object): output stream, standard output if None.
+          buffer_lines (int): number of lines to collect before writing.
+        """
+        self._stream = sys.stdout if (stream is None) else stream
+        self._limit = max(1, buffer_lines)
+        self._lines = list()
+
+
+    def _write(self, txt):
+        self._lines.append(txt)
+        if (len(self._lines) >= self._limit):
+            self.flush()
+
+
+    def info(self, template, *args):
+        self._write(template.format(*args) + "\n")
+
+
+    def status(self, template, args):
+        self._write(4*"-" + "> " + template.format(*args) + "\n")
+
+
+    def block_begin(self, num, block):
+        self._write("Executing code block #{} ({} command{}):\n{}\n"
+            .format(num, len(block), "" if (len(block) == 1) else "s",
+                    "-" * 50))
+
+
+    def command(self, cmd):
+        self._write(str(cmd) + "\n")
+
+
+    def block_end(self, num, block):
+        self._write("-" * 50 + "\n\n")
+
+
+    def flush(self):
+        if (len(self._lines) > 0):
+            self._stream.write("".join(self._lines))
+            self._lines.clear()
+        self._stream.flush()
+
+
+    def close(self):
+        self.flush()
+        self._limit = 1
+
+
+class JsonLinesSink(TextSink):
+    """ Structured output, one JSON object per line. Every object has an
+    "event" field: "info", "status", "block", "command" or "block_end".
+    """
+
+    def _event(self, obj):
+        self._write(json.dumps(obj) + "\n")
+
+
+    def info(self, template, *args):
+        self._event({"event": "info", "text": template.format(*args)})
+
+
+    def status(self, template, args):
+        self._event({"event": "status", "text": template.format(*args)})
+
+
+    def block_begin(self, num, block):
+        self._event({"event": "block", "num": num, "line": block.line,
+                     "commands": len(block)})
+
+
+    def command(self, cmd):
+        self._event({"event": "command", "cmd": str(cmd)})
+
+
+    def block_end(self, num, block):
+        self._event({"event": "block_end", "num": num})
+
+
+class EventListSink(NullSink):
+    """ Keeps the events in memory, unformatted.
+    Attributes:
+      events (list): (kind, data) tuples. For "info" and "status" data
+        is a (template, args) tuple, for "block" and "block_end" it is
+        a (num, block) tuple and for "command" the Command itself.
+    """
+
+    quiet = False
+
+    def __init__(self):
+        self.events = list()
+
+
+    def info(self, template, *args):
+        self.events.append(("info", (template, args)))
+
+
+    def status(self, template, args):
+        self.events.append(("status", (template, args)))
+
+
+    def block_begin(self, num, block):
+        self.events.append(("block", (num, block)))
+
+
+    def command(self, cmd):
+        self.events.append(("command", cmd))
+
+
+    def block_end(self, num, block):
+        self.events.append(("block_end", (num, block)))
+
+
+    def messages(self):
+        """ Returns the formatted texts of the info and status messages.
+        """
+        return [data[0].format(*data[1]) for kind, data in self.events
+                if (kind in ("info", "status"))]
+
+
+class ErrorSink(NullSink):
+    """ Keeps only the machine error messages.
+    Attributes:
+      errors (list): formatted error messages, prefixed with the source
+        line number of the block when known.
+    """
+
+    quiet = False
+
+    def __init__(self):
+        self.errors = list()
+        self._line = None
+
+
+    def block_begin(self, num, block):
+        self._line = block.line
+
+
+    def status(self, template, args):
+        if ("Error" in template):
+            txt = template.format(*args)
+            if (self._line is not None):
+                txt = "line {}: {}".format(self._line, txt)
+            self.errors.append(txt)
+
+
+class QuietSink(TextSink):
+    """ Text output of the machine error messages only, each prefixed
+    with the source line number of its block in the main program. Quiet:
+    the other messages are not formatted. """
+
+    quiet = True
+
+    def __init__(self, stream=None, buffer_lines=256):
+        """ Args: see TextSink. """
+        super().__init__(stream, buffer_lines)
+        self.num_errors = 0
+        self._line = None
+
+
+    def info(self, template, *args):
+        pass
+
+
+    def status(self, template, args):
+        if ("Error" in template):
+            self.num_errors += 1
+            self._write("{}> line {}: {}\n".format(4*"-", self._line,
+                                                   template.format(*args)))
+
+
+    def block_begin(self, num, block):
+        self._line = block.line
+
+
+    def command(self, cmd):
+        pass
+
+
+    def block_end(self, num, block):
+        pass
+
+
+# Sinks selectable from the command line.
+FORMATS = {
+    "text": TextSink,
+    "jsonl": JsonLinesSink,
+}
@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+#
+# Title: G-code interpreter program
+# File: stock.py
+# Description: Material removal simulation on a Z heightmap.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The stock is a block whose top surface is kept as a grid of Z heights
+# (a dexel heightmap). Every feed segment of the toolpath (G01, the
+# chords of G02/G03 and the feed steps of canned cycles) is cut into it
+# with a flat end mill of the diameter of the tool in use: every grid
+# point within the tool radius of the segment (in XY) is lowered to the
+# height of the segment there.
+#
+# The cuts are rasterized in batch: the grid points under the footprint
+# of every segment are listed with array operations, and the lowest cut
+# of each point is applied per tile. The heightmap is split into square
+# tiles that are only allocated when first cut, and the segments are
+# processed in chunks, so memory stays bounded for large grids and long
+# programs.
+#
+# Exact for horizontal moves and plunges. For other moves the height is
+# taken at the point of the segment closest to the grid point.
+#
+# Requires NumPy.
+#
+# Stock configuration file (JSON):
+#   {
+#     "origin": [x, y], "size": [width, depth], "resolution": 0.5,
+#     "top": 0.0,
+#     "tools": {"1": 10.0, "2": 6.0}, "default_diameter": 6.0,
+#     "tile": 256
+#   }
+# "tools" gives the diameters by tool number.
+#
+
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from main import parse_file
+from block import ParseError
+from toolpath import build_toolpath
+
+# Default tile size [grid points].
+TILE = 256
+# Largest number of (segment, grid point) pairs handled at a time.
+MAX_PAIRS = 1 << 20
+
+
+class Stock:
+    """ Heightmap of the stock top surface, in tiles.
+    Attributes:
+      origin (tuple): X, Y of the first grid point.
+      resolution (float): grid spacing.
+      shape (tuple): number of grid points along Y and X (rows, columns).
+      top (float): Z of the uncut top surface.
+    """
+
+    def __init__(self, origin, size, resolution, top=0.0, tile=TILE):
+        """ Args:
+          origin (tuple): X, Y of the corner of the stock.
+          size (tuple): width (X) and depth (Y) of the stock.
+          resolution (float): grid spacing.
+          top (float): Z of the top surface.
+          tile (int): tile size [grid points].
+        """
+        if (resolution <= 0.0):
+            raise ValueError("resolution must be positive")
+
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.resolution = float(resolution)
+        self.shape = (int(np.floor(size[1] / resolution)) + 1,
+                      int(np.floor(size[0] / resolution)) + 1)
+        self.top = float(top)
+        self.tile = int(tile)
+        self._tiles_x = -(-self.shape[1] // self.tile)
+        # Allocated tiles by tile number (row * tiles per row + column).
+        self._tiles = dict()
+
+
+    def _get_tile(self, num):
+        """ Returns a tile, allocating it at the top height. """
+        heights = self._tiles.get(num)
+        if (heights is None):
+            heights = np.full(self.tile * self.tile, self.top,
+                              dtype=np.float32)
+            self._tiles[num] = heights
+        return heights
+
+
+    def cut(self, p0, p1, radius):
+        """ Cuts segments into the stock.
+        Args:
+          p0, p1 (N x 3 arrays): segment start and end points.
+          radius (N array or float): tool radius of every segment.
+        Returns:
+          The number of grid point updates made.
+        """
+        p0 = np.asarray(p0, dtype=np.float64).reshape(-1, 3)
+        p1 = np.asarray(p1, dtype=np.float64).reshape(-1, 3)
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64),
+                                 (len(p0),))
+
+        # Grid cells of the footprint bounding boxes, clipped to the stock.
+        res = self.resolution
+        ox, oy = self.origin
+        low_x = np.minimum(p0[:, 0], p1[:, 0]) - radius
+        high_x = np.maximum(p0[:, 0], p1[:, 0]) + radius
+        low_y = np.minimum(p0[:, 1], p1[:, 1]) - radius
+        high_y = np.maximum(p0[:, 1], p1[:, 1]) + radius
+        col0 = np.maximum(np.ceil((low_x - ox) / res), 0).astype(np.int64)
+        col1 = np.minimum(np.floor((high_x - ox) / res),
+                          self.shape[1] - 1).astype(np.int64)
+        row0 = np.maximum(np.ceil((low_y - oy) / res), 0).astype(np.int64)
+        row1 = np.minimum(np.floor((high_y - oy) / res),
+                          self.shape[0] - 1).astype(np.int64)
+        cols = np.maximum(col1 - col0 + 1, 0)
+        rows = np.maximum(row1 - row0 + 1, 0)
+        counts = cols * rows
+
+        # Chunks of segments with at most MAX_PAIRS grid points in total
+        # (a single larger segment makes a chunk of its own).
+        ends = np.cumsum(counts)
+        updates = 0
+        first = 0
+        while (first < len(p0)):
+            base = ends[first] - counts[first]
+            last = int(np.searchsorted(ends, base + MAX_PAIRS, side="right"))
+            last = max(last, first + 1)
+            chunk = slice(first, last)
+            updates += self._cut_chunk(p0[chunk], p1[chunk], radius[chunk],
+                row0[chunk], col0[chunk], rows[chunk], cols[chunk],
+                counts[chunk])
+            first = last
+
+        return updates
+
+
+    def _cut_chunk(self, p0, p1, radius, row0, col0, rows, cols, counts):
+        """ Cuts a chunk of segments, see cut(). """
+        total = int(counts.sum())
+        if (total == 0):
+            return 0
+
+        # Per segment values, taken once for every grid point of its
+        # bounding box below. The XY coordinates are relative to the
+        # first grid point of the bounding box.
+        res = self.resolution
+        ax = p0[:, 0] - (self.origin[0] + col0 * res)
+        ay = p0[:, 1] - (self.origin[1] + row0 * res)
+        dx = p1[:, 0] - p0[:, 0]
+        dy = p1[:, 1] - p0[:, 1]
+        dz = p1[:, 2] - p0[:, 2]
+        length2 = dx * dx + dy * dy
+        moving = (length2 > 0.0)
+        inv_length2 = np.divide(1.0, length2, out=np.zeros_like(length2),
+                                where=moving)
+        # A plunge cuts to its lowest point.
+        az = np.where(moving, p0[:, 2], np.minimum(p0[:, 2], p1[:, 2]))
+
+        # One entry per (segment, grid point in its bounding box).
+        owner = np.repeat(np.arange(len(p0), dtype=np.int32), counts)
+        local = np.arange(total, dtype=np.int64)
+        local -= np.repeat(np.cumsum(counts) - counts, counts)
+        width = cols[owner]
+        row_in = local // width
+        col_in = local - row_in * width
+
+        # Closest point of the segment in XY.
+        px = col_in * res - ax[owner]
+        py = row_in * res - ay[owner]
+        sx = dx[owner]
+        sy = dy[owner]
+        t = (px * sx + py * sy) * inv_length2[owner]
+        np.clip(t, 0.0, 1.0, out=t)
+        ex = t * sx - px
+        ey = t * sy - py
+        inside = (ex * ex + ey * ey <= (radius * radius)[owner])
+
+        owner = owner[inside]
+        z = (az[owner] + t[inside] * dz[owner]).astype(np.float32)
+        row = row0[owner] + row_in[inside]
+        col = col0[owner] + col_in[inside]
+
+        # Applying the cuts tile by tile.
+        tile = self.tile
+        tile_num = (row // tile) * self._tiles_x + col // tile
+        offset = (row % tile) * tile + col % tile
+        order = np.argsort(tile_num, kind="stable")
+        tile_num = tile_num[order]
+        bounds = np.flatnonzero(np.diff(tile_num)) + 1
+        starts = np.concatenate(([0], bounds))
+        stops = np.concatenate((bounds, [len(tile_num)]))
+        for start, stop in zip(starts, stops):
+            if (start == stop):
+                continue
+            select = order[start:stop]
+            np.minimum.at(self._get_tile(int(tile_num[start])),
+                          offset[select], z[select])
+
+        return len(z)
+
+
+    def surface(self):
+        """ Returns the whole heightmap.
+        Returns:
+          rows x columns float32 array of Z heights; row i, column j is
+          the point (origin X + j * resolution, origin Y + i * resolution).
+        """
+        heights = np.full(self.shape, self.top, dtype=np.float32)
+        tile = self.tile
+        for num, values in self._tiles.items():
+            row = (num // self._tiles_x) * tile
+            col = (num % self._tiles_x) * tile
+            block = heights[row : row + tile, col : col + tile]
+            block[...] = values.reshape(tile, tile)[:block.shape[0],
+                                                    :block.shape[1]]
+        return heights
+
+
+    def removed_volume(self):
+        """ Returns the volume of the material removed. """
+        volume = 0.0
+        for values in self._tiles.values():
+            volume += float(np.sum(self.top - values, dtype=np.float64))
+        # Tiles at the edges have points outside the stock; they are
+        # never cut, so they add nothing.
+        return volume * self.resolution * self.resolution
+
+
+def compare_surfaces(surface, expected, tolerance=0.01):
+    """ Compares a simulated surface with the expected one.
+    Args:
+      surface, expected (2D arrays): heightmaps of the same shape.
+      tolerance (float): allowed deviation.
+    Returns:
+      A dict with the "max_deviation", the number of "gouged" points
+      (cut deeper than expected) and "excess" points (material left), and
+      the "deviation" array (surface - expected).
+    """
+    if (np.shape(surface) != np.shape(expected)):
+        raise ValueError("surface shapes differ ({} and {})".format(
+            np.shape(surface), np.shape(expected)))
+
+    deviation = (np.asarray(surface, dtype=np.float64)
+                 - np.asarray(expected, dtype=np.float64))
+    return {
+        "max_deviation": float(np.abs(deviation).max(initial=0.0)),
+        "gouged": int(np.count_nonzero(deviation < -tolerance)),
+        "excess": int(np.count_nonzero(deviation > tolerance)),
+        "deviation": deviation,
+    }
+
+
+def tool_radii(tools, tool_numbers, default_diameter):
+    """ Gets the tool radius of every move.
+    Args:
+      tools (dict): diameters by tool number.
+      tool_numbers (array): tool number of every move.
+      default_diameter (float): diameter of tools not in the table.
+    Returns:
+      Array of radii.
+    """
+    numbers = np.unique(tool_numbers)
+    diameters = np.array([tools.get(int(num), default_diameter)
+                          for num in numbers], dtype=np.float64)
+    return diameters[np.searchsorted(numbers, tool_numbers)] / 2.0
+
+
+def make_stock(config):
+    """ Builds a Stock from a configuration dict (see the top of this
+    file). """
+    return Stock(config["origin"], config["size"], config["resolution"],
+                 config.get("top", 0.0), config.get("tile", TILE))
+
+
+def cut_blocks(stock, blocks, tools=None, default_diameter=6.0,
+               start=(0.0, 0.0, 0.0)):
+    """ Cuts the feed moves of a compiled program into a stock.
+    Args:
+      stock (Stock): the stock.
+      blocks (iterable): compiled Block objects.
+      tools (dict): tool diameters by tool number.
+      default_diameter (float): diameter of tools not in the table.
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      The number of cutting segments.
+    """
+    toolpath = build_toolpath(blocks, start)
+    points = toolpath["points"]
+    index = toolpath["index"]
+    moves = toolpath["moves"]
+
+    cutting = ~toolpath["rapid"]
+    segments = np.flatnonzero(cutting)
+    radius = tool_radii(dict() if (tools is None) else tools,
+                        moves["tool"][index[segments]], default_diameter)
+    stock.cut(points[segments], points[segments + 1], radius)
+
+    return len(segments)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="stock.py",
+        description="Cuts the G01/G02/G03 moves of a G-code program into a "
+                    "heightmap of the stock.")
+    parser.add_argument("file", help="G-code file")
+    parser.add_argument("-c", "--config", required=True,
+        help="stock configuration file (JSON, see stock.py)")
+    parser.add_argument("-o", "--output",
+        help="save the final surface as a .npy file")
+    parser.add_argument("--expected",
+        help="expected surface (.npy) to compare the result with")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+        help="allowed deviation from the expected surface "
+             "(default: 0.01)")
+    opts = parser.parse_args(args[1:])
+
+    try:
+        with open(opts.config) as f:
+            config = json.load(f)
+        stock = make_stock(config)
+        tools = {int(num): float(diameter) for num, diameter
+                 in config.get("tools", dict()).items()}
+
+        with open(opts.file) as f:
+            pgm_data = dict()
+            num_segments = cut_blocks(stock, parse_file(f, pgm_data), tools,
+                config.get("default_diameter", 6.0))
+
+        surface = stock.surface()
+        if (opts.output is not None):
+            np.save(opts.output, surface)
+
+        print("Program #{}: {} cutting moves, removed volume {:.3f}, "
+              "lowest point {:.3f}.".format(pgm_data["pgm_num"],
+                  num_segments, stock.removed_volume(),
+                  float(surface.min(initial=stock.top))))
+
+        if (opts.expected is not None):
+            result = compare_surfaces(surface, np.load(opts.expected),
+                                      opts.tolerance)
+            print("Max deviation {:.4f}, {} gouged and {} excess points."
+                  .format(result["max_deviation"], result["gouged"],
+                          result["excess"]))
+            if ((result["gouged"] > 0) or (result["excess"] > 0)):
+                return 2
+
+    except (OSError, ValueError, KeyError, ParseError) as err:
+        print("Error: {}.".format(err))
+        return 1
+
+    return 0
+
+
+if (__name__ == '__main__'):
+    sys.exit(main(sys.argv))
@@ -0,0 +1,224 @@
+#
+# Title: G-code interpreter program
+# File: subprogram.py
+# Description: Subprogram definitions (O-words) and calls (M98/M99).
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The first program number of a file is the number of the main program.
+# Every later one starts the definition of a subprogram, which runs up
+# to and including the block with M99:
+#
+#   O1000
+#   G91
+#   M98 P2000 L4      (run O2000 four times)
+#   M30
+#   O2000
+#   G01 X10.000 F300.
+#   G01 Y5.000
+#   M99
+#
+# The parsers pass the later program numbers on as O blocks. Subprograms
+# splits the block stream into the main program and the bodies of the
+# definitions. The bodies are kept compiled, so they are parsed only
+# once however many times they are called. Definitions usually follow
+# the main program, so a call to a subprogram that has not been read yet
+# reads ahead in the stream, keeping the main program blocks in between
+# for later.
+#
+# A body that moves only incrementally is the same path wherever it
+# starts. When the machine output is not needed (see the "quiet" sinks),
+# the Interpreter runs such a body once for a machine state and replays
+# the later calls in the same state arithmetically, from the net
+# displacement and the end state recorded in Subprograms.replays.
+#
+
+import collections
+
+from block import Opcode
+
+# Deepest nesting of subprogram calls.
+MAX_DEPTH = 8
+# Commands that make a body depend on where it starts.
+ABSOLUTE_OPS = frozenset((Opcode.G90, Opcode.G28, Opcode.M30))
+
+
+class Subprograms:
+    """ The main program and the subprogram definitions of a block
+    stream. Iterating gives the blocks of the main program.
+    Attributes:
+      bodies (dict): blocks of every defined subprogram by program
+        number, from the block after the O-word up to the one with M99.
+      replays (dict): net displacement and end state of incremental
+        bodies, see Interpreter.call_subprogram().
+    """
+
+    def __init__(self, blocks=None):
+        """ Args:
+          blocks (iterable): compiled Block objects of a program, None if
+            the blocks are given with feed().
+        """
+        self.bodies = dict()
+        self.replays = dict()
+        self._blocks = None if (blocks is None) else iter(blocks)
+        # Main program blocks read ahead of the caller.
+        self._pending = collections.deque()
+        # Number and blocks of the definition being read.
+        self._num = None
+        self._body = None
+        self._relative = dict()
+
+
+    def __iter__(self):
+        pending = self._pending
+        O = Opcode.O
+        while True:
+            while (len(pending) > 0):
+                yield pending.popleft()
+
+            if (self._blocks is None):
+                return
+            for block in self._blocks:
+                # Main program blocks go straight through.
+                if ((self._num is not None) or (block.commands[0].op == O)):
+                    if (self.feed(block)):
+                        continue
+                yield block
+                # The caller read ahead with get().
+                if (len(pending) > 0):
+                    break
+            else:
+                self.close()
+                self._blocks = None
+
+
+    def feed(self, block):
+        """ Sorts out a block of the program.
+        Args:
+          block (Block): next block of the program.
+        Returns:
+          True if the block belongs to a subprogram definition, False if
+          it is a block of the main program.
+        """
+        first = block.commands[0]
+        if (first.op == Opcode.O):
+            # A definition without M99 ends at the next one.
+            self.close()
+            self._num = first.arg
+            self._body = list()
+            return True
+
+        if (self._num is None):
+            return False
+
+        self._body.append(block)
+        for cmd in block.commands:
+            if (cmd.op == Opcode.M99):
+                self.close()
+                break
+        return True
+
+
+    def close(self):
+        """ Ends the definition being read, e.g. at the end of the
+        program. """
+        if (self._num is not None):
+            self.bodies[self._num] = tuple(self._body)
+            self._num = None
+            self._body = None
+
+
+    def in_definition(self):
+        """ Tells if the next block fed belongs to the definition being
+        read. """
+        return (self._num is not None)
+
+
+    def get(self, num):
+        """ Gets the body of a subprogram. Reads ahead in the stream until
+        the definition has been read.
+        Args:
+          num (int): program number.
+        Returns:
+          Tuple of the blocks, or None if there is no such subprogram.
+        """
+        while ((num not in self.bodies) and (self._blocks is not None)):
+            block = next(self._blocks, None)
+            if (block is None):
+                self.close()
+                self._blocks = None
+            elif (not self.feed(block)):
+                self._pending.append(block)
+
+        return self.bodies.get(num)
+
+
+    def missing(self, blocks):
+        """ Finds a subprogram called by blocks, directly or from the
+        bodies they call, that has not been read yet.
+        Args:
+          blocks (iterable): Block objects.
+        Returns:
+          The program number, or None if all are known.
+        """
+        seen = set()
+        stack = [blocks]
+        while (len(stack) > 0):
+            for block in stack.pop():
+                for cmd in block.commands:
+                    if (cmd.op != Opcode.M98):
+                        continue
+                    num, count = call_params(cmd)
+                    if ((num is None) or (num in seen)):
+                        continue
+                    seen.add(num)
+                    body = self.bodies.get(num)
+                    if (body is None):
+                        return num
+                    stack.append(body)
+
+        return None
+
+
+    def is_relative(self, num):
+        """ Tells if a subprogram makes only incremental moves, also in
+        the subprograms it calls, so that run in incremental mode its
+        path does not depend on where it starts.
+        Args:
+          num (int): program number of a read subprogram.
+        Returns:
+          True or False.
+        """
+        relative = self._relative.get(num)
+        if (relative is not None):
+            return relative
+
+        # Recursive calls are not relative.
+        self._relative[num] = False
+        relative = True
+        for block in self.bodies.get(num, ()):
+            for cmd in block.commands:
+                if (cmd.op in ABSOLUTE_OPS):
+                    relative = False
+                elif (cmd.op == Opcode.M98):
+                    called, count = call_params(cmd)
+                    relative = ((called is not None)
+                                and (self.get(called) is not None)
+                                and self.is_relative(called))
+                if (not relative):
+                    break
+            if (not relative):
+                break
+
+        self._relative[num] = relative
+        return relative
+
+
+def call_params(cmd):
+    """ Gets the program number and the repeat count of an M98 command.
+    Returns:
+      Tuple (program number or None, count).
+    """
+    num = None if (cmd.p is None) else int(cmd.p)
+    count = 1 if (cmd.l is None) else int(cmd.l)
+    return num, count
@@ -0,0 +1,7 @@
+"""Reference checks of the batch (NumPy) modules.
+
+The vectorized code is compared with plain, one case at a time versions
+of the same computation. Run from the repository root:
+
+    python -m pytest tests
+"""
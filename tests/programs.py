@@ -0,0 +1,170 @@
+#
+# Title: G-code interpreter program
+# File: tests/programs.py
+# Description: Sample programs and helpers shared by the tests.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+from block import Command
+
+# The example program of the repository.
+MILL = """%
+O0001
+(DIA 20.0 END MILL - NO CUTTER RADIUS COMP USED)
+N1 G00 G17 G21 G40 G49 G80 G94
+N4 T01 M06
+N5 S2000 M03
+N6 G90 G54 G00 X-12.000 Y-12.000
+N9 G01 Z-5.000 F100.
+N10 G01 X-12.000 Y-10.000 F600.
+N11 G01 X110.000
+N12 G01 Y210.000
+N13 G01 X-10.000
+N14 G01 Y-12.000
+N15 G00 Z10.000 M09
+N16 G91 G28 Z0.0 M05
+N18 M30
+%
+"""
+
+# Lines the parsers must agree on: lower case, tabs, CRLF, empty lines,
+# comments, axis words without a command, unknown words and "O 5", which
+# is not a program number.
+MIXED = """%
+o0007
+
+( comment with spaces )
+n10 g90 g21 g17 g94
+G00\tX1.5 Y-2.25 Z.5\r
+G01 X+3 F250
+X4.0 Y5
+G0 X1
+g1 y2 f100
+G01 X1 Y2 Z3 F4 M08
+G55 G04 P2.5 G09
+O 5
+T3 M06 S1200 M04
+G91 G01 X.5 Y-.5
+G90 G02 X11.5 Y1.5 I5 J0 F300
+M98 P0100 L2
+M30
+(END)
+%
+"""
+
+# Subprograms, nested and repeated, incremental and absolute.
+SUBPROGRAMS = """%
+O1000
+G90 G94 G21 G17
+G00 X0 Y0 Z0
+G91
+M98 P2000 L3
+G90 G00 X100
+M98 P3000
+M30
+O2000
+G01 X10.000 F300.
+G01 Y5.000
+M98 P2100 L2
+M99
+O2100
+G02 X2 Y0 R1
+M99
+O3000
+G01 Y1
+M99
+%
+"""
+
+# Canned drilling cycles.
+CYCLES = """%
+O1000
+G21 G17 G90 G94
+T1 M06
+S1000 M03
+G00 X0 Y0 Z10.0
+G98 G81 X10.0 Y10.0 R2.0 Z-5.0 F100.
+X20.0
+Y20.0
+G99 G83 X30.0 Y5.0 R1.0 Z-6.0 Q2.5
+X40.0 F200.
+G82 X50.0 P0.5
+G80
+G00 Z5.0
+G91 G99 G81 X5.0 R-3.0 Z-4.0 L3
+G98 G73 X5.0 Y5.0 R-2.0 Z-6.0 Q1.5 L2
+G89 X5.0 P1.0
+G85 Y-5.0
+G90 G80
+G00 X1 Y1
+M30
+%
+"""
+
+# Work offsets, tool length offsets and units.
+OFFSETS = """%
+O0100
+G21 G90 G94 G17
+G10 L2 P1 X100 Y50 Z-20
+G10 L2 P2 X200
+G10 L1 P3 Z12.5
+G54 G00 X0 Y0 Z5
+G43 H3 Z5
+G01 X10 F300
+G02 X20 Y10 I10 J0
+G55 G00 X0
+G49 Z5
+G20 G00 X1 Y1
+G91 G01 X1 F10
+G90 G21
+G10 L3 P1
+G43 Z0
+M30
+%
+"""
+
+# Arcs in every plane, with radius and center offsets.
+ARCS = """%
+O1001
+G90 G94 G21 G17
+G00 X10 Y0 Z0
+G03 X0 Y10 I-10 J0 F100
+G02 X10 Y0 R-10
+G02 X10 Y0 I-10
+G91 G03 X-10 Y10 R10 Z-1
+G90 G18 G02 X0 Z0 R10
+G19 G03 Y10 Z10 J5 K5
+G17 G01 X5
+M30
+%
+"""
+
+PROGRAMS = {
+    "mill": MILL,
+    "mixed": MIXED,
+    "subprograms": SUBPROGRAMS,
+    "cycles": CYCLES,
+    "offsets": OFFSETS,
+    "arcs": ARCS,
+}
+
+# Attributes of a Command, in the order of Command.__slots__.
+FIELDS = Command.__slots__
+
+
+def block_values(blocks):
+    """ Returns the line numbers and all command values of the blocks,
+    for comparing the output of the parsers. """
+    return [(block.line, [tuple(getattr(cmd, name) for name in FIELDS)
+                          for cmd in block.commands])
+            for block in blocks]
+
+
+def write_program(directory, name, text):
+    """ Writes a G-code file into a directory (a pathlib.Path) and
+    returns its name as a string. The text is written as bytes, so the
+    line ends stay as they are. """
+    path = directory / name
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
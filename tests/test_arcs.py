@@ -0,0 +1,214 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_arcs.py
+# Description: Checks of the arc segmentation of arcs.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Every chord end point must be on the arc, no chord may be further than
+# the tolerance from it, the last point must be the end point as given,
+# and the cached and uncached arcs must be the same.
+#
+
+import math
+
+import pytest
+
+import arcs
+from arcs import (TOLERANCE, MAX_STEP, XY, ZX, YZ, arc_center, arc_sweep,
+    num_segments, relative_chords, segment_arc, cache_info)
+from block import compile_block
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import EventListSink
+
+# (start, end, axes, clockwise, offsets, radius) of valid arcs.
+ARCS = [
+    ((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), XY, False, (-10.0, 0.0, 0.0), None),
+    ((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), XY, False, None, 10.0),
+    ((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), XY, False, None, -10.0),
+    ((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), XY, True, None, 10.0),
+    ((1.0, 2.0, 3.0), (1.0, 2.0, 3.0), XY, True, (0.0, 5.0, 0.0), None),
+    ((0.0, 0.0, 0.0), (4.0, 0.0, -3.0), XY, False, (2.0, 0.0, 0.0), None),
+    ((5.0, 1.0, 0.0), (-5.0, 1.0, 10.0), ZX, True, None, 7.5),
+    ((0.0, 0.0, 0.0), (2.0, 10.0, 10.0), YZ, False, (0.0, 5.0, 5.0), None),
+    ((0.0, 0.0, 0.0), (0.0, 0.0, 0.02), ZX, False, (0.01, 0.0, 0.01), None),
+    ((100.0, 0.0, 0.0), (-100.0, 0.0, 0.0), XY, False, (-100.0, 0.0, 0.0),
+     None),
+]
+
+
+def in_plane(point, center, axes):
+    a, b, c = axes
+    return (point[a] - center[a], point[b] - center[b])
+
+
+@pytest.mark.parametrize("start, end, axes, clockwise, offsets, radius",
+                         ARCS)
+def test_chords_within_tolerance(start, end, axes, clockwise, offsets,
+                                 radius):
+    center = arc_center(start, end, axes, clockwise, offsets, radius)
+    a0, sweep, r0, r1 = arc_sweep(start, end, center, axes, clockwise)
+    points = [tuple(point) for point
+              in segment_arc(start, end, center, axes, clockwise)]
+
+    assert (points[-1] == end)
+    assert (len(points) == num_segments(sweep, max(r0, r1)))
+    previous = start
+    for k, point in enumerate(points, 1):
+        t = k / len(points)
+        da, db = in_plane(point, center, axes)
+        # On the arc, with the radius and the linear axis changing
+        # evenly from the start to the end.
+        assert (math.hypot(da, db) == pytest.approx(r0 + (r1 - r0) * t,
+                                                    abs=1e-9))
+        c = axes[2]
+        assert (point[c] == pytest.approx(start[c] + (end[c] - start[c])
+                                          * t, abs=1e-9))
+        # The chord turns the right way, and its middle is close to the
+        # arc.
+        pa, pb = in_plane(previous, center, axes)
+        turn = pa * db - pb * da
+        assert ((turn < 0.0) if (clockwise) else (turn > 0.0))
+        mid = math.hypot((pa + da) / 2.0, (pb + db) / 2.0)
+        assert (max(r0, r1) - mid <= TOLERANCE + 1e-9)
+        previous = point
+
+    assert ((sweep < 0.0) if (clockwise) else (sweep > 0.0))
+
+
+def test_radius_selects_the_arc():
+    start = (10.0, 0.0, 0.0)
+    end = (0.0, 10.0, 0.0)
+
+    assert (arc_center(start, end, XY, False, radius=10.0)
+            == pytest.approx((0.0, 0.0, 0.0), abs=1e-12))
+    assert (arc_center(start, end, XY, False, radius=-10.0)
+            == pytest.approx((10.0, 10.0, 0.0)))
+    assert (arc_center(start, end, XY, True, radius=10.0)
+            == pytest.approx((10.0, 10.0, 0.0)))
+
+    for radius, clockwise in ((10.0, False), (-10.0, False), (10.0, True)):
+        center = arc_center(start, end, XY, clockwise, radius=radius)
+        sweep = arc_sweep(start, end, center, XY, clockwise)[1]
+        assert (abs(sweep) == pytest.approx(math.pi / 2.0 if (radius > 0.0)
+                                            else 1.5 * math.pi))
+
+
+def test_full_circle():
+    start = (3.0, 0.0, 0.0)
+    center = (0.0, 0.0, 0.0)
+
+    for clockwise in (False, True):
+        sweep = arc_sweep(start, start, center, XY, clockwise)[1]
+        assert (abs(sweep) == pytest.approx(2.0 * math.pi))
+
+
+@pytest.mark.parametrize("end, offsets, radius, message", [
+    ((0.0, 10.0, 0.0), None, None, "radius or center offsets"),
+    ((10.0, 0.0, 0.0), None, 5.0, "end point different"),
+    ((0.0, 10.0, 0.0), None, 5.0, "too small"),
+    ((0.0, 12.0, 0.0), (-10.0, 0.0, 0.0), None, "radius differ"),
+    ((0.0, 10.0, 0.0), (0.0, 0.0, 0.0), None, "radius is zero"),
+])
+def test_invalid_arcs(end, offsets, radius, message):
+    start = (10.0, 0.0, 0.0)
+
+    with pytest.raises(ValueError, match=message):
+        center = arc_center(start, end, XY, False, offsets, radius)
+        segment_arc(start, end, center, XY, False)
+
+
+@pytest.mark.parametrize("radius", [0.001, 0.005, 0.1, 1.0, 10.0, 1000.0])
+def test_num_segments(radius):
+    num = num_segments(2.0 * math.pi, radius)
+    step = 2.0 * math.pi / num
+
+    assert (step <= MAX_STEP + 1e-12)
+    assert (radius * (1.0 - math.cos(step / 2.0)) <= TOLERANCE + 1e-12)
+    if (num > 4):
+        # No more chords than needed.
+        wider = 2.0 * math.pi / (num - 1)
+        assert (radius * (1.0 - math.cos(wider / 2.0)) > TOLERANCE)
+
+
+def test_repeated_arcs_are_cached():
+    relative = relative_chords((0.0, 0.0, 0.0), (7.0, 0.0, 0.0),
+                               (3.5, 0.0, 0.0), XY, True)
+    hits = cache_info().hits
+
+    for x in range(10):
+        start = (x * 20.0, 5.0, -1.0)
+        end = (x * 20.0 + 7.0, 5.0, -1.0)
+        center = (x * 20.0 + 3.5, 5.0, -1.0)
+        assert (relative_chords(start, end, center, XY, True) is relative)
+        points = segment_arc(start, end, center, XY, True)
+        assert (tuple(points[-1]) == end)
+
+    assert (cache_info().hits == hits + 20)
+
+
+def test_without_numpy(monkeypatch):
+    np = pytest.importorskip("numpy")
+    arcs._relative_points.cache_clear()
+    with_numpy = [segment_arc(start, end,
+                              arc_center(start, end, axes, clockwise,
+                                         offsets, radius),
+                              axes, clockwise)
+                  for start, end, axes, clockwise, offsets, radius in ARCS]
+
+    monkeypatch.setattr(arcs, "np", None)
+    arcs._relative_points.cache_clear()
+    try:
+        for points, (start, end, axes, clockwise, offsets, radius) \
+                in zip(with_numpy, ARCS):
+            center = arc_center(start, end, axes, clockwise, offsets, radius)
+            plain = segment_arc(start, end, center, axes, clockwise)
+            assert (isinstance(plain, list))
+            assert (np.allclose(plain, points, rtol=0.0, atol=1e-9))
+            assert (plain[-1] == end)
+    finally:
+        arcs._relative_points.cache_clear()
+
+
+def test_machine_arc():
+    sink = EventListSink()
+    machine = MachineClient(sink)
+    interpreter = Interpreter(machine)
+    for txt_row in ("G21 G90 G94 G17", "G00 X10 Y0",
+                    "G03 X0 Y10 I-10 J0 F100", "G02 X10 Y0 R-10 Z-2"):
+        interpreter.run([compile_block(txt_row)])
+
+    assert (machine.get_position() == (10.0, 0.0, -2.0))
+    chords = [args for template, args in (data for kind, data in sink.events
+                                          if (kind == "status"))
+              if (template.startswith("Moving to"))]
+    # The rapid move, then the chords of both arcs.
+    center = arc_center((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), XY, False,
+                        (-10.0, 0.0, 0.0))
+    expected = segment_arc((10.0, 0.0, 0.0), (0.0, 10.0, 0.0), center, XY,
+                           False)
+    assert (len(chords) > len(expected) + 1)
+    for args, point in zip(chords[1:], expected):
+        assert (args[:3] == pytest.approx(tuple(point), abs=1e-9))
+
+
+@pytest.mark.parametrize("txt_row, message", [
+    ("G02 X5 Y5", "radius or center offsets"),
+    ("G02 X5 Y5 R1", "too small"),
+    ("G02 X5 Y0 I1", "radius differ"),
+])
+def test_machine_arc_errors(txt_row, message):
+    sink = EventListSink()
+    machine = MachineClient(sink)
+    interpreter = Interpreter(machine)
+    interpreter.run([compile_block("G21 G90 G94 G17 F100")])
+    interpreter.run([compile_block(txt_row)])
+
+    errors = [template.format(*args) for kind, (template, args)
+              in sink.events if (kind == "status")
+              and ("Error" in template)]
+    assert (len(errors) == 1)
+    assert (errors[0].startswith("arc_move(): Error, "))
+    assert (message in errors[0])
+    assert (machine.get_position() == (0.0, 0.0, 0.0))
@@ -0,0 +1,129 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_batch.py
+# Description: Checks of the batch simulation of batch.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A batch run in worker processes must give the same results, in the
+# same order, as running the files one by one, and a file that fails in
+# any way must fail only itself.
+#
+
+import io
+import json
+
+import batch
+from batch import collect_files, simulate_file, simulate_files
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+from tests.programs import PROGRAMS, write_program
+
+BROKEN = {
+    "markers.gcode": "O0001\nG00 X1\n%\n",
+    "value.gcode": "%\nO0001\nG01 X1..0\n%\n",
+    "overflow.gcode": "%\nO0001\nM98 P5 L1e400\n%\n",
+    "machine.gcode": "%\nO0001\nG00 X1\n%\n",
+}
+
+
+def without_times(results):
+    return [{key: value for key, value in result.items() if (key != "time")}
+            for result in results]
+
+
+def make_files(tmp_path):
+    files = [write_program(tmp_path, name + ".gcode", text)
+             for name, text in sorted(PROGRAMS.items())]
+    files += [write_program(tmp_path, name, text)
+              for name, text in sorted(BROKEN.items())]
+    return sorted(files)
+
+
+def test_collect_files(tmp_path):
+    (tmp_path / "sub" / "deeper").mkdir(parents=True)
+    for name in ("a.gcode", "b.NC", "notes.txt", "sub/c.ngc",
+                 "sub/deeper/d.tap"):
+        (tmp_path / name).write_text("%\n%\n")
+    manifest = tmp_path / "sub" / "list.txt"
+    manifest.write_text("# programs\n../notes.txt  # not a G-code name\n\n"
+                        "c.ngc\n")
+
+    found = collect_files([str(tmp_path)])
+    assert ([name[len(str(tmp_path)) + 1:] for name in found]
+            == ["a.gcode", "b.NC", "sub/c.ngc", "sub/deeper/d.tap"])
+
+    listed = collect_files([str(tmp_path / "*.gcode")], str(manifest))
+    assert ([name[len(str(tmp_path)) + 1:] for name in listed]
+            == ["a.gcode", "notes.txt", "sub/c.ngc"])
+
+
+def test_result_of_a_program(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    result = simulate_file(file_name)
+
+    machine = MachineClient(NullSink())
+    blocks = list(parse_file(io.StringIO(PROGRAMS["mill"]), dict()))
+    Interpreter(machine).run(blocks)
+
+    assert (result["ok"])
+    assert (result["errors"] == [])
+    assert (result["pgm_num"] == 1)
+    assert (result["num_blocks"] == len(blocks))
+    assert (result["num_commands"] == sum(len(block) for block in blocks))
+    assert (result["state"] == machine.get_state())
+
+
+def test_failed_files_fail_alone(tmp_path):
+    files = make_files(tmp_path)
+    results = {result["file"]: result for result in simulate_files(files, 1)}
+
+    def errors(name):
+        return results[str(tmp_path / name)]["errors"]
+
+    assert ("data markers" in errors("markers.gcode")[0])
+    assert ("X1..0" in errors("value.gcode")[0])
+    assert (errors("overflow.gcode")[0].startswith("OverflowError: "))
+    # A file without a distance mode: the error of the machine, with the
+    # line of the block.
+    assert (errors("machine.gcode")
+            == ["line 3: move(): Error, distance mode not set."])
+    assert (results[str(tmp_path / "mill.gcode")]["ok"])
+
+
+def test_undecodable_bytes(tmp_path):
+    path = tmp_path / "latin1.gcode"
+    path.write_bytes(b"%\nO0001\n(K\xe4rki)\nG90 G00 X1\n%\n")
+
+    result = simulate_file(str(path))
+    assert (result["ok"])
+    assert (result["num_blocks"] == 1)
+
+
+def test_workers_match_serial_run(tmp_path):
+    files = make_files(tmp_path)
+    serial = simulate_files(files, 1)
+    parallel = simulate_files(files, 2)
+
+    assert ([result["file"] for result in parallel] == files)
+    assert (without_times(parallel) == without_times(serial))
+
+
+def test_main_report(tmp_path, capsys):
+    files = make_files(tmp_path)
+    output = tmp_path / "report.json"
+
+    status = batch.main(["batch.py", "-j", "1", "-o", str(output)] + files)
+    assert (status == 2)
+
+    report = json.loads(output.read_text())
+    summary = report["summary"]
+    assert (summary["files"] == len(files))
+    assert (summary["failed"] == sum(1 for result in report["results"]
+                                     if (not result["ok"])))
+    out = capsys.readouterr().out
+    assert (out.count("FAILED ") == summary["failed"])
+
+    assert (batch.main(["batch.py", str(tmp_path / "none" / "*.gcode")]) == 1)
@@ -0,0 +1,91 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_block.py
+# Description: Checks of the compiled blocks of block.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+import io
+
+import pytest
+
+from main import parse_file
+from block import (Opcode, ParseError, compile_block, pack_blocks,
+    unpack_blocks, RECORD)
+from tests.programs import PROGRAMS, block_values
+
+
+def test_parameters_go_to_the_last_g_command():
+    block = compile_block("N10 G90 G01 X1 Y-2.5 Z.5 F100. M08", 7)
+    g90, g01, m08 = block.commands
+
+    assert (block.line == 7)
+    assert ((g90.op, g01.op, m08.op) == (Opcode.G90, Opcode.G01, Opcode.M08))
+    assert (not g90.has_params())
+    assert ((g01.x, g01.y, g01.z, g01.f) == (1.0, -2.5, 0.5, 100.0))
+    assert (not m08.has_params())
+
+
+def test_words_are_case_insensitive():
+    upper = compile_block("G02 X10 Y0 I5 J0 F300 T02 M06", 1)
+    lower = compile_block("g02 x10 y0 i5 j0 f300 t02 m06", 1)
+
+    assert (block_values([lower]) == block_values([upper]))
+
+
+def test_arguments():
+    t, s, m98 = compile_block("T12 S2500 M98 P100 L3").commands
+
+    assert ((t.op, t.arg) == (Opcode.T, 12))
+    assert ((s.op, s.arg) == (Opcode.S, 2500))
+    assert ((m98.op, m98.p, m98.l) == (Opcode.M98, 100.0, 3.0))
+
+
+def test_axis_words_without_a_command():
+    axes, = compile_block("X4 Y5 Z-1").commands
+
+    assert (axes.op == Opcode.AXES)
+    assert ((axes.x, axes.y, axes.z) == (4.0, 5.0, -1.0))
+
+
+def test_unknown_words():
+    g123, m77 = compile_block("G123 X1 m77").commands
+
+    assert ((g123.op, g123.arg, g123.x) == (Opcode.UNKNOWN, "G123", 1.0))
+    assert ((m77.op, m77.arg) == (Opcode.UNKNOWN, "M77"))
+
+
+def test_rows_without_commands():
+    assert (compile_block("") is None)
+    assert (compile_block("N100") is None)
+    assert (compile_block("(COMMENT)") is None)
+
+
+@pytest.mark.parametrize("txt_row", ["G01 X1..0", "G01 XA", "T1.5", "SX"])
+def test_invalid_values(txt_row):
+    with pytest.raises(ParseError, match="on line 12"):
+        compile_block(txt_row, 12)
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_pack_round_trip(name):
+    blocks = list(parse_file(io.StringIO(PROGRAMS[name]), dict()))
+    data, words = pack_blocks(blocks)
+
+    assert (len(data) == RECORD.size * sum(len(block) for block in blocks))
+    assert (block_values(unpack_blocks(data, words)) == block_values(blocks))
+
+    moved = list(unpack_blocks(data, words, line_offset=100))
+    assert ([block.line for block in moved]
+            == [block.line + 100 for block in blocks])
+
+
+def test_pack_in_parts():
+    blocks = [compile_block("G123 X1", 1), compile_block("M77", 2)]
+    data, words = pack_blocks(blocks[:1])
+    more, words = pack_blocks(blocks[1:], words)
+
+    assert (words == ["G123", "M77"])
+    assert (block_values(unpack_blocks(data + more, words))
+            == block_values(blocks))
@@ -0,0 +1,201 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_cache.py
+# Description: Checks of the compiled program cache of cache.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A program read from the cache must give the same blocks, program
+# number and command count as parsing it. A failed, unfinished or
+# unwritable entry must never be used, and never fail the parse.
+#
+
+import io
+import os
+
+import pytest
+
+import cache
+from main import parse_file
+from block import ParseError, pack_blocks
+from reader import parse_mapped
+from cache import (parse_cached, cached_records, checkpoint_path, evict,
+    file_key, EXTENSION)
+from tests.programs import PROGRAMS, block_values, write_program
+
+
+class CountingParse:
+    """ parse_mapped(), counting its calls. """
+
+    def __init__(self):
+        self.calls = 0
+
+
+    def __call__(self, file_name, pgm_data):
+        self.calls += 1
+        return parse_mapped(file_name, pgm_data)
+
+
+def parse_text(text):
+    pgm_data = dict()
+    blocks = block_values(parse_file(io.StringIO(text), pgm_data))
+    return blocks, pgm_data
+
+
+def read_cached(file_name, directory, parse=parse_mapped):
+    pgm_data = dict()
+    blocks = block_values(parse_cached(file_name, pgm_data, parse,
+                                       directory))
+    return blocks, pgm_data
+
+
+def entries(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if (name.endswith(EXTENSION)))
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_hit_gives_the_parsed_blocks(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", PROGRAMS[name])
+    directory = str(tmp_path / "cache")
+    parse = CountingParse()
+    expected = parse_text(PROGRAMS[name])
+
+    assert (read_cached(file_name, directory, parse) == expected)
+    assert (entries(directory) == [file_key(file_name) + EXTENSION])
+    assert (read_cached(file_name, directory, parse) == expected)
+    assert (parse.calls == 1)
+
+
+def test_many_blocks(tmp_path, monkeypatch):
+    # Written in several parts.
+    monkeypatch.setattr(cache, "WRITE_BLOCKS", 3)
+    text = PROGRAMS["mixed"]
+    file_name = write_program(tmp_path, "mixed.gcode", text)
+    directory = str(tmp_path / "cache")
+
+    read_cached(file_name, directory)
+    assert (read_cached(file_name, directory, None) == parse_text(text))
+
+
+def test_edited_file_misses(tmp_path):
+    file_name = write_program(tmp_path, "a.gcode", PROGRAMS["mill"])
+    directory = str(tmp_path / "cache")
+    read_cached(file_name, directory)
+
+    write_program(tmp_path, "a.gcode", PROGRAMS["arcs"])
+    parse = CountingParse()
+    assert (read_cached(file_name, directory, parse)
+            == parse_text(PROGRAMS["arcs"]))
+    assert (parse.calls == 1)
+    assert (len(entries(directory)) == 2)
+
+
+def test_unfinished_read_stores_nothing(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    directory = str(tmp_path / "cache")
+
+    blocks = parse_cached(file_name, dict(), parse_mapped, directory)
+    next(blocks)
+    blocks.close()
+    assert (os.listdir(directory) == [])
+
+
+def test_damaged_entry_is_a_miss(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    directory = str(tmp_path / "cache")
+    read_cached(file_name, directory)
+    path = os.path.join(directory, entries(directory)[0])
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+
+    parse = CountingParse()
+    assert (read_cached(file_name, directory, parse)
+            == parse_text(PROGRAMS["mill"]))
+    assert (parse.calls == 1)
+    assert (read_cached(file_name, directory, None)
+            == parse_text(PROGRAMS["mill"]))
+
+
+class FailingFile:
+    """ A cache file that cannot be written. """
+
+    def __init__(self, fd, mode):
+        os.close(fd)
+
+
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+
+    def close(self):
+        pass
+
+
+def test_write_error_is_a_miss(tmp_path, monkeypatch):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    directory = str(tmp_path / "cache")
+    monkeypatch.setattr(cache.os, "fdopen", FailingFile)
+
+    assert (read_cached(file_name, directory)
+            == parse_text(PROGRAMS["mill"]))
+    assert (os.listdir(directory) == [])
+
+
+def test_no_cache_directory(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    # A file where the directory should be.
+    directory = write_program(tmp_path, "cache", "")
+
+    assert (read_cached(file_name, directory)
+            == parse_text(PROGRAMS["mill"]))
+
+
+def test_parse_error_stores_nothing(tmp_path):
+    file_name = write_program(tmp_path, "bad.gcode",
+                              "%\nO0001\nG00 X1\nG01 X1..0\n%\n")
+    directory = str(tmp_path / "cache")
+
+    with pytest.raises(ParseError):
+        read_cached(file_name, directory)
+    assert (os.listdir(directory) == [])
+
+
+def test_cached_records(tmp_path):
+    file_name = write_program(tmp_path, "mixed.gcode", PROGRAMS["mixed"])
+    directory = str(tmp_path / "cache")
+    assert (cached_records(file_name, dict(), directory) is None)
+
+    read_cached(file_name, directory)
+    pgm_data = dict()
+    data, words = cached_records(file_name, pgm_data, directory)
+
+    expected = dict()
+    packed, packed_words = pack_blocks(parse_file(
+        io.StringIO(PROGRAMS["mixed"]), expected))
+    assert (pgm_data == expected)
+    assert (bytes(data) == bytes(packed))
+    assert (words == packed_words)
+
+
+def test_evict_oldest_first(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    for age, name in enumerate(["new.bin", "mid.ckpt", "old.bin"]):
+        path = directory / name
+        path.write_bytes(bytes(100))
+        os.utime(path, (1000 - age, 1000 - age))
+    (directory / "other.txt").write_bytes(bytes(1000))
+
+    assert (evict(str(directory), 250) == 1)
+    assert (sorted(os.listdir(directory))
+            == ["mid.ckpt", "new.bin", "other.txt"])
+    assert (evict(str(directory), 0) == 2)
+    assert (os.listdir(directory) == ["other.txt"])
+
+
+def test_checkpoint_path(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+
+    assert (checkpoint_path(file_name, "dir")
+            == os.path.join("dir", file_key(file_name) + ".ckpt"))
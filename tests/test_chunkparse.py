@@ -0,0 +1,73 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_chunkparse.py
+# Description: Checks of the parallel parser of chunkparse.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# parse_file_parallel() must give the same blocks, program number and
+# command count as parse_file(), and the same errors, whatever the size
+# of the chunks: the small sizes below put chunk boundaries next to
+# every marker and program number.
+#
+
+import io
+
+import pytest
+
+from main import parse_file
+from block import ParseError
+from chunkparse import find_chunks, parse_file_parallel
+from tests.programs import PROGRAMS, block_values, write_program
+
+
+def parse_text(text):
+    pgm_data = dict()
+    blocks = block_values(parse_file(io.StringIO(text), pgm_data))
+    return blocks, pgm_data
+
+
+@pytest.mark.parametrize("chunk_size", [1, 16, 100, 1 << 20])
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_same_blocks_as_parse_file(tmp_path, name, chunk_size):
+    file_name = write_program(tmp_path, name + ".gcode", PROGRAMS[name])
+    pgm_data = dict()
+    blocks = block_values(parse_file_parallel(file_name, pgm_data, 2,
+                                              chunk_size))
+
+    assert ((blocks, pgm_data) == parse_text(PROGRAMS[name]))
+
+
+def test_chunks_end_at_lines(tmp_path):
+    text = PROGRAMS["mill"]
+    file_name = write_program(tmp_path, "mill.gcode", text)
+    data = text.encode()
+
+    for chunk_size in (1, 10, 64, len(data), 2 * len(data)):
+        chunks = find_chunks(file_name, chunk_size)
+        assert (chunks[0][0] == 0)
+        assert (chunks[-1][1] == len(data))
+        for (start, end), (next_start, next_end) in zip(chunks, chunks[1:]):
+            assert (end == next_start)
+            assert (data[end - 1 : end] == b"\n")
+
+    assert (find_chunks(write_program(tmp_path, "empty.gcode", ""), 10)
+            == [])
+
+
+@pytest.mark.parametrize("text, message", [
+    ("O0001\n%\nG00 X1\n%\n", "outside of data markers (line 1)"),
+    ("%\nO0001\nG00 X1\n%\nG00 X2\n", "outside of data markers (line 5)"),
+    ("%\nO0001\n%\n%\n", "more than 2"),
+    ("%\nO0001\nG00 X1\n", "should have 2"),
+    ("%\nO0001\nG01 X1..0\n%\n", "'X1..0' on line 3"),
+])
+@pytest.mark.parametrize("chunk_size", [1, 1 << 20])
+def test_errors(tmp_path, text, message, chunk_size):
+    file_name = write_program(tmp_path, "bad.gcode", text)
+
+    with pytest.raises(ParseError, match="data markers|on line"):
+        parse_text(text)
+    with pytest.raises(ParseError) as err:
+        list(parse_file_parallel(file_name, dict(), 2, chunk_size))
+    assert (message in str(err.value))
@@ -0,0 +1,177 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_collision.py
+# Description: Brute-force reference checks of collision.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The grid of FixtureIndex must never lose a pair: every segment and box
+# that touch, by an all-pairs clipping test done one pair at a time in
+# plain Python, must come out of check_points(), and nothing else. The
+# boxes and segments are put on the cell boundaries of the grid too, and
+# the segments are checked in chunks of a few segments.
+#
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import collision
+from collision import FixtureIndex, check_points
+
+
+def touches(p0, p1, lo, hi):
+    """ Liang-Barsky clipping of one segment against one closed box. """
+    t_enter = 0.0
+    t_exit = 1.0
+    for axis in range(3):
+        delta = p1[axis] - p0[axis]
+        if (delta == 0.0):
+            if ((p0[axis] < lo[axis]) or (p0[axis] > hi[axis])):
+                return False
+            continue
+        t0 = (lo[axis] - p0[axis]) / delta
+        t1 = (hi[axis] - p0[axis]) / delta
+        t_enter = max(t_enter, min(t0, t1))
+        t_exit = min(t_exit, max(t0, t1))
+    return (t_enter <= t_exit)
+
+
+def reference_pairs(points, lo, hi):
+    """ All (segment, box) pairs that touch, sorted. """
+    return sorted((i, k) for i in range(len(points) - 1)
+                  for k in range(len(lo))
+                  if (touches(points[i], points[i + 1], lo[k], hi[k])))
+
+
+def found_pairs(points, index):
+    result = check_points(points, fixtures=index)
+    return sorted(zip(result["fixture_segments"].tolist(),
+                      result["fixture_boxes"].tolist()))
+
+
+def random_boxes(rng, num):
+    """ Boxes in a 100 x 100 x 20 area. """
+    lo = list()
+    hi = list()
+    for i in range(num):
+        corner = [rng.uniform(0.0, 90.0), rng.uniform(0.0, 90.0),
+                  rng.uniform(-20.0, 0.0)]
+        size = [rng.uniform(0.5, 15.0), rng.uniform(0.5, 15.0),
+                rng.uniform(0.0, 10.0)]
+        lo.append(corner)
+        hi.append([c + s for c, s in zip(corner, size)])
+    return np.array(lo), np.array(hi)
+
+
+def axis_path(rng, num):
+    """ Waypoints moving one axis at a time, like toolpath.order_axes()
+    makes them, partly outside the boxes. """
+    point = [50.0, 50.0, 10.0]
+    points = [list(point)]
+    for i in range(num):
+        axis = rng.randrange(3)
+        if (axis == 2):
+            value = rng.uniform(-25.0, 15.0)
+        else:
+            value = rng.uniform(-10.0, 110.0)
+        point[axis] = value
+        points.append(list(point))
+    return np.array(points)
+
+
+def test_axis_moves_match_all_pairs():
+    rng = random.Random(1)
+    lo, hi = random_boxes(rng, 40)
+    index = FixtureIndex(lo, hi)
+    points = axis_path(rng, 600)
+
+    assert (found_pairs(points, index) == reference_pairs(points, lo, hi))
+
+
+def test_diagonal_moves_match_all_pairs():
+    rng = random.Random(2)
+    lo, hi = random_boxes(rng, 25)
+    index = FixtureIndex(lo, hi)
+    points = np.array([[rng.uniform(-10.0, 110.0), rng.uniform(-10.0, 110.0),
+                        rng.uniform(-25.0, 15.0)] for i in range(400)])
+
+    assert (found_pairs(points, index) == reference_pairs(points, lo, hi))
+
+
+def test_cell_boundaries():
+    # 27 boxes in a 30 x 30 x 30 cube make a grid of 6 x 6 x 6 cells of
+    # 5 units. The box corners and the moves are on multiples of 5, so
+    # they fall exactly on cell faces.
+    rng = random.Random(3)
+    lo = np.array([[rng.randrange(6) * 5.0 for axis in range(3)]
+                   for k in range(27)])
+    hi = lo + np.array([[rng.randint(1, 6) * 5.0 for axis in range(3)]
+                        for k in range(27)])
+    hi = np.minimum(hi, 30.0)
+    lo[0] = 0.0
+    hi[1] = 30.0
+    index = FixtureIndex(lo, hi)
+    assert (list(index.shape) == [6, 6, 6])
+    assert (index.cell.tolist() == [5.0, 5.0, 5.0])
+
+    point = [15.0, 15.0, 15.0]
+    points = [list(point)]
+    for i in range(800):
+        point[rng.randrange(3)] = rng.randrange(-1, 8) * 5.0
+        points.append(list(point))
+    points = np.array(points)
+
+    assert (found_pairs(points, index) == reference_pairs(points, lo, hi))
+
+
+def test_flat_boxes():
+    # No extent along Z: a single layer of cells.
+    rng = random.Random(4)
+    lo, hi = random_boxes(rng, 20)
+    lo[:, 2] = -5.0
+    hi[:, 2] = -5.0
+    index = FixtureIndex(lo, hi)
+    assert (index.shape[2] == 1)
+    points = axis_path(rng, 500)
+    points[::7, 2] = -5.0
+
+    assert (found_pairs(points, index) == reference_pairs(points, lo, hi))
+
+
+def test_csr_lists_every_overlapped_cell():
+    rng = random.Random(5)
+    lo, hi = random_boxes(rng, 30)
+    index = FixtureIndex(lo, hi)
+    first, last = index.cell_range(lo, hi)
+    nx, ny, nz = index.shape.tolist()
+
+    for cell in range(nx * ny * nz):
+        cx, rest = divmod(cell, ny * nz)
+        cy, cz = divmod(rest, nz)
+        expected = [k for k in range(len(lo))
+                    if ((first[k] <= (cx, cy, cz)).all()
+                        and ((cx, cy, cz) <= last[k]).all())]
+        listed = index._boxes[index._starts[cell] : index._starts[cell + 1]]
+        assert (sorted(listed.tolist()) == expected)
+
+
+def test_segment_chunks(monkeypatch):
+    rng = random.Random(6)
+    lo, hi = random_boxes(rng, 30)
+    index = FixtureIndex(lo, hi)
+    points = axis_path(rng, 300)
+    expected = reference_pairs(points, lo, hi)
+
+    for size in (1, 7, 299, 300, 301):
+        monkeypatch.setattr(collision, "CHUNK_SEGMENTS", size)
+        assert (found_pairs(points, index) == expected)
+
+
+def test_no_fixtures():
+    index = FixtureIndex(np.empty((0, 3)), np.empty((0, 3)))
+    points = axis_path(random.Random(7), 10)
+
+    assert (found_pairs(points, index) == [])
@@ -0,0 +1,280 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_cycles.py
+# Description: Checks of the canned drilling cycles of cycles.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The templates and the moves of a hole are worked out by hand; the
+# holes expanded at once must be the moves of the holes one at a time,
+# and the batch toolpath of any cycle program the positions the machine
+# reaches when it drills them.
+#
+
+import random
+
+import pytest
+
+import cycles
+from block import Opcode, compile_block
+from cycles import (CLEARANCE, MAX_PECKS, make_template, hole_levels,
+    hole_moves, expand_batch, template_dwell, cache_info)
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink, EventListSink
+
+
+class Positions:
+    """ Recorder of the positions of a machine. """
+
+    def __init__(self):
+        self.points = [(0.0, 0.0, 0.0)]
+
+
+    def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+        self.points.append((x, y, z))
+
+
+def run(rows, sink=None):
+    recorder = Positions()
+    machine = MachineClient(NullSink() if (sink is None) else sink)
+    machine.set_recorder(recorder)
+    blocks = [compile_block(txt_row, n) for n, txt_row in enumerate(rows, 1)]
+    Interpreter(machine).run([block for block in blocks
+                              if (block is not None)])
+    return recorder.points
+
+
+def random_program(rng, num):
+    """ Cycles of every kind in both distance and return modes, with
+    moves in between. """
+    rows = ["G21 G90 G94 G17 F100", "G00 X0 Y0 Z10"]
+    for i in range(num):
+        r = rng.random()
+        if (r < 0.3):
+            op = rng.choice(("G73", "G81", "G82", "G83", "G85", "G89"))
+            words = [rng.choice(("G90", "G91")), rng.choice(("G98", "G99")),
+                     op, "X{:.1f}".format(rng.uniform(-20, 20)),
+                     "Y{:.1f}".format(rng.uniform(-20, 20))]
+            if (words[0] == "G90"):
+                r_level = rng.uniform(0, 5)
+                words += ["R{:.2f}".format(r_level),
+                          "Z{:.2f}".format(r_level - rng.uniform(0, 8))]
+            else:
+                words += ["R{:.2f}".format(rng.uniform(-4, 2)),
+                          "Z{:.2f}".format(-rng.uniform(0, 8)),
+                          "L{}".format(rng.randint(1, 3))]
+            words += ["Q{:.2f}".format(rng.uniform(0.3, 3)),
+                      "P{:.1f}".format(rng.uniform(0, 2))]
+            rows.append(" ".join(words))
+        elif (r < 0.7):
+            rows.append("X{:.1f} Y{:.1f}".format(rng.uniform(-20, 20),
+                                                 rng.uniform(-20, 20)))
+        elif (r < 0.8):
+            rows.append("G80")
+        else:
+            rows.append("G90 G00 X{:.1f} Y{:.1f} Z{:.1f}".format(
+                rng.uniform(-20, 20), rng.uniform(-20, 20),
+                rng.uniform(-5, 15)))
+    return rows
+
+
+def test_templates():
+    assert (make_template(Opcode.G81, 5.0, 1.0, 2.0) == ((-5.0, False, 0.0),))
+    assert (make_template(Opcode.G82, 5.0, None, 0.5)
+            == ((-5.0, False, 0.5),))
+    assert (make_template(Opcode.G85, 5.0)
+            == ((-5.0, False, 0.0), (0.0, False, 0.0)))
+    assert (make_template(Opcode.G89, 5.0, None, 1.0)
+            == ((-5.0, False, 1.0), (0.0, False, 0.0)))
+    assert (make_template(Opcode.G83, 6.0, 2.5) == (
+        (-2.5, False, 0.0), (0.0, True, 0.0),
+        (-2.5 + CLEARANCE, True, 0.0), (-5.0, False, 0.0), (0.0, True, 0.0),
+        (-5.0 + CLEARANCE, True, 0.0), (-6.0, False, 0.0)))
+    assert (make_template(Opcode.G73, 4.0, 1.5) == (
+        (-1.5, False, 0.0), (-1.5 + CLEARANCE, True, 0.0),
+        (-3.0, False, 0.0), (-3.0 + CLEARANCE, True, 0.0),
+        (-4.0, False, 0.0)))
+    # A hole at the R plane has no depth to drill.
+    assert (make_template(Opcode.G83, 0.0, 1.0) == ())
+    assert (template_dwell(make_template(Opcode.G89, 3.0, 2.0, 1.5)) == 1.5)
+    assert (template_dwell(make_template(Opcode.G85, 3.0, 2.0, 1.5)) == 0.0)
+
+
+@pytest.mark.parametrize("op", [Opcode.G73, Opcode.G83])
+@pytest.mark.parametrize("seed", range(4))
+def test_pecks(op, seed):
+    rng = random.Random(seed)
+    depth = rng.uniform(0.01, 20.0)
+    peck = rng.uniform(0.05, 5.0)
+    steps = make_template(op, depth, peck)
+    feeds = [dz for dz, rapid, dwell in steps if (not rapid)]
+
+    assert (feeds[-1] == -round(depth, cycles.KEY_DECIMALS))
+    assert (len(feeds) == -(-round(depth, 9) // round(peck, 9)))
+    last_feed = None
+    for dz, rapid, dwell in steps:
+        # Out to the R plane, or back by the clearance from the last peck.
+        if (not rapid):
+            last_feed = dz
+        elif ((op != Opcode.G83) or (dz != 0.0)):
+            assert (dz == min(last_feed + CLEARANCE, 0.0))
+    previous = 0.0
+    for dz in feeds:
+        assert (previous - peck - 1e-9 <= dz < previous)
+        previous = dz
+    for dz, rapid, dwell in steps:
+        # No step goes above the R plane or below the bottom.
+        assert (-depth - 1e-9 <= dz <= 0.0)
+
+
+@pytest.mark.parametrize("op, depth, peck, message", [
+    (Opcode.G81, -1.0, None, "above the R plane"),
+    (Opcode.G83, 5.0, None, "must be positive"),
+    (Opcode.G73, 5.0, 0.0, "must be positive"),
+    (Opcode.G83, 5.0, 5.0 / (MAX_PECKS + 1), "more than"),
+])
+def test_invalid_templates(op, depth, peck, message):
+    with pytest.raises(ValueError, match=message):
+        make_template(op, depth, peck)
+
+
+def test_template_cache():
+    steps = make_template(Opcode.G83, 7.25, 1.125)
+    hits = cache_info().hits
+
+    # The same template, whatever the words that do not apply.
+    assert (make_template(Opcode.G83, 7.25 + 1e-12, 1.125, 3.0) is steps)
+    assert (make_template(Opcode.G81, 7.25, 1.0, 1.0)
+            is make_template(Opcode.G81, 7.25, 2.0, 2.0))
+    assert (make_template(Opcode.G82, 7.25, None, -1.0)
+            is make_template(Opcode.G82, 7.25, None, 0.0))
+    assert (cache_info().hits >= hits + 3)
+
+
+def test_hole_levels():
+    # G90: the words as such, retract to the start (G98) or R (G99).
+    assert (hole_levels(False, 10.0, 2.0, -5.0) == (2.0, -5.0, 10.0))
+    assert (hole_levels(False, 10.0, 2.0, -5.0, retract_r=True)
+            == (2.0, -5.0, 2.0))
+    assert (hole_levels(False, 1.0, 2.0, -5.0) == (2.0, -5.0, 2.0))
+    assert (hole_levels(False, 0.0, 1.0, -1.0, 2.0, 3.0)
+            == (5.0, 1.0, 5.0))
+    # G91: R from the start, Z from R.
+    assert (hole_levels(True, 10.0, -3.0, -4.0) == (7.0, 3.0, 10.0))
+    assert (hole_levels(True, 10.0, -3.0, -4.0, 2.0, 99.0, True)
+            == (4.0, -4.0, 4.0))
+
+
+def test_hole_moves():
+    steps = make_template(Opcode.G85, 7.0)
+
+    assert (list(hole_moves((0.0, 0.0, 10.0), 10.0, 20.0, 2.0, 10.0, steps))
+            == [(10.0, 20.0, 10.0, True, 0.0), (10.0, 20.0, 2.0, True, 0.0),
+                (10.0, 20.0, -5.0, False, 0.0), (10.0, 20.0, 2.0, False, 0.0),
+                (10.0, 20.0, 10.0, True, 0.0)])
+    # Starting below the R plane: up first, no move down to it.
+    assert (list(hole_moves((1.0, 2.0, 0.0), 3.0, 4.0, 2.0, 2.0, steps))[:3]
+            == [(1.0, 2.0, 2.0, True, 0.0), (3.0, 4.0, 2.0, True, 0.0),
+                (3.0, 4.0, -5.0, False, 0.0)])
+
+
+def single_axis_moves(start, moves, min_move):
+    """ Splits the moves of hole_moves() into moves of X, then Y, then Z,
+    as the machine makes them. """
+    points = list()
+    rapids = list()
+    pos = list(start)
+    for x, y, z, rapid, dwell in moves:
+        for axis, value in enumerate((x, y, z)):
+            if (abs(value - pos[axis]) > 0.0
+                    and abs(value - pos[axis]) >= min_move):
+                pos[axis] = value
+                points.append(tuple(pos))
+                rapids.append(rapid if (axis == 2) else True)
+    return points, rapids
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_expand_batch(seed):
+    np = pytest.importorskip("numpy")
+    rng = random.Random(seed)
+    op = rng.choice(sorted(cycles.CYCLE_OPS))
+    steps = make_template(op, rng.uniform(0, 10), rng.uniform(0.5, 3), 1.0)
+    num = 20
+    begins = np.array([(rng.uniform(-5, 5), rng.uniform(-5, 5),
+                        rng.choice((0.0, 1.0, rng.uniform(-5, 10))))
+                       for i in range(num)])
+    r_levels = np.array([rng.choice((1.0, rng.uniform(-2, 4)))
+                         for i in range(num)])
+    ends = np.array([(rng.choice((begins[i, 0], rng.uniform(-5, 5))),
+                      rng.uniform(-5, 5),
+                      max(begins[i, 2], r_levels[i]))
+                     for i in range(num)])
+    min_move = rng.choice((0.0, 0.001))
+
+    points, hole, rapid = expand_batch(begins, ends, r_levels, steps,
+                                       min_move)
+
+    for i in range(num):
+        moves = hole_moves(tuple(begins[i]), ends[i, 0], ends[i, 1],
+                           r_levels[i], ends[i, 2], steps)
+        expected, rapids = single_axis_moves(begins[i], moves, min_move)
+        assert (points[hole == i].tolist() == [list(p) for p in expected])
+        assert (rapid[hole == i].tolist() == rapids)
+
+
+def test_machine_moves():
+    points = run(["G21 G90 G94 G17", "G00 X0 Y0 Z10",
+                  "G98 G81 X10 Y10 R2 Z-5 F100", "G99", "X20", "Y20",
+                  "G91 G83 X5 R-1 Z-2 Q1 L2"])
+
+    assert (points[2:] == [
+        # The first hole, back to the start level.
+        (10.0, 0.0, 10.0), (10.0, 10.0, 10.0), (10.0, 10.0, 2.0),
+        (10.0, 10.0, -5.0), (10.0, 10.0, 10.0),
+        # At the R plane.
+        (20.0, 10.0, 10.0), (20.0, 10.0, 2.0), (20.0, 10.0, -5.0),
+        (20.0, 10.0, 2.0),
+        (20.0, 20.0, 2.0), (20.0, 20.0, -5.0), (20.0, 20.0, 2.0),
+        # Incremental: R at 1, the bottom at -1, in two pecks.
+        (25.0, 20.0, 2.0), (25.0, 20.0, 1.0), (25.0, 20.0, 0.0),
+        (25.0, 20.0, 1.0), (25.0, 20.0, CLEARANCE), (25.0, 20.0, -1.0),
+        (25.0, 20.0, 1.0),
+        (30.0, 20.0, 1.0), (30.0, 20.0, 0.0),
+        (30.0, 20.0, 1.0), (30.0, 20.0, CLEARANCE), (30.0, 20.0, -1.0),
+        (30.0, 20.0, 1.0),
+    ])
+
+
+def test_machine_errors():
+    sink = EventListSink()
+    run(["G21 G94 G81 X1", "G81 X1 R1 Z-1", "G90 G81 X1 R1 Z2",
+         "G83 X1 R1 Z-1", "G73 X1 Q-1"], sink)
+
+    errors = [template.format(*args) for kind, (template, args)
+              in sink.events if (kind == "status") and ("Error" in template)]
+    assert (errors == [
+        "drill(): Error, R and Z of the cycle not set.",
+        "drill(): Error, distance mode not set.",
+        "drill(): Error, bottom of the hole (Z) above the R plane.",
+        "drill(): Error, peck depth (Q) must be positive.",
+        "drill(): Error, peck depth (Q) must be positive.",
+    ])
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3, 4])
+def test_toolpath_matches_machine(seed):
+    np = pytest.importorskip("numpy")
+    from toolpath import build_toolpath
+
+    rows = random_program(random.Random(seed), 300)
+    blocks = [compile_block(txt_row, n) for n, txt_row in enumerate(rows, 1)]
+    toolpath = build_toolpath(blocks)
+    points = run(rows)
+    # The toolpath has no moves that stay in place.
+    kept = [point for point, prev in zip(points[1:], points)
+            if (point != prev)]
+
+    assert (np.allclose(toolpath["points"], np.array(points[:1] + kept),
+                        rtol=0.0, atol=1e-9))
@@ -0,0 +1,130 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_cycletime.py
+# Description: Checks of the cycle time estimate of cycletime.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The expected times are worked out by hand: the machine moves one axis
+# at a time, rapid moves at RAPID_RATE and feed moves at the feed rate
+# in effect.
+#
+
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from main import parse_file
+from block import pack_blocks
+from cycletime import (RAPID_RATE, TOOL_CHANGE_TIME, estimate_blocks,
+    estimate_records, format_report, format_minutes)
+from tests.programs import PROGRAMS
+
+
+def estimate_text(rows, **kwargs):
+    text = "%\nO0001\n" + rows + "%\n"
+    return estimate_blocks(list(parse_file(io.StringIO(text), dict())),
+                           **kwargs)
+
+
+def test_rapid_feed_and_tool_change():
+    result = estimate_text("G21 G90 G94\n"
+                           "G00 X30 Y40\n"
+                           "G01 X0 F600\n"
+                           "T2 M06\n"
+                           "G01 Y0 F300\n")
+
+    assert (result["rapid_length"] == 70.0)
+    assert (result["feed_length"] == 70.0)
+    assert (result["rapid"] == pytest.approx(70.0 / RAPID_RATE))
+    assert (result["feed"] == pytest.approx(30.0 / 600.0 + 40.0 / 300.0))
+    assert (result["tool_change"] == TOOL_CHANGE_TIME)
+    assert (result["total"] == pytest.approx(result["rapid"] + result["feed"]
+                                             + TOOL_CHANGE_TIME))
+    assert (sorted(result["per_tool"]) == [0, 2])
+    assert (result["per_tool"][0]["feed"] == pytest.approx(0.05))
+    assert (result["per_tool"][2]["total"]
+            == pytest.approx(40.0 / 300.0 + TOOL_CHANGE_TIME))
+    assert (result["per_block"].tolist()
+            == pytest.approx([0.0, 70.0 / RAPID_RATE, 0.05, TOOL_CHANGE_TIME,
+                              40.0 / 300.0]))
+    assert (result["block_lines"].tolist() == [3, 4, 5, 6, 7])
+
+
+@pytest.mark.parametrize("rows, minutes", [
+    # Inverse time: the move takes 1/F minutes.
+    ("G21 G90 G93\nG01 X10 F2\n", 0.5),
+    # Per revolution: 0.1 mm/rev at 1000 rpm.
+    ("G21 G90 S1000 M03 G95\nG01 X10 F0.1\n", 0.1),
+    # Inches per minute: 25.4 mm at 10 in/min.
+    ("G90 G94 G20\nG01 X1 F10\n", 0.1),
+])
+def test_feed_modes(rows, minutes):
+    assert (estimate_text(rows)["feed"] == pytest.approx(minutes))
+
+
+def test_moves_without_feed_rate():
+    result = estimate_text("G21 G90 G94\nG01 X1\nG01 X2 F100\n")
+
+    assert (result["no_feed_moves"] == 1)
+    assert (result["feed"] == pytest.approx(1.0 / 100.0))
+    assert ("1 feed moves without a feed rate" in format_report(result))
+
+
+def test_canned_cycle_with_dwell():
+    # Each hole: rapid 10 along X, 8 down to R, 13 back up to the initial
+    # level; feed 5 at 60 mm/min and a dwell of 0.5 s.
+    result = estimate_text("G21 G90 G94\n"
+                           "G00 Z10\n"
+                           "G98 G82 X10 Y0 R2 Z-3 P0.5 F60\n"
+                           "X20\n"
+                           "G80\n")
+
+    hole = 5.0 / 60.0 + 0.5 / 60.0
+    assert (result["rapid_length"] == 10.0 + 2 * 31.0)
+    assert (result["feed_length"] == 10.0)
+    assert (result["feed"] == pytest.approx(2 * hole))
+    assert (result["per_block"][2]
+            == pytest.approx(31.0 / RAPID_RATE + hole))
+
+
+def test_rapid_rate_and_tool_change_time():
+    result = estimate_text("G21 G90 G94\nT1 M06\nG00 X100\n",
+                           rapid_rate=1000.0, tool_change_time=0.5)
+
+    assert (result["total"] == pytest.approx(0.1 + 0.5))
+
+
+@pytest.mark.parametrize("name", ["mill", "offsets", "arcs"])
+def test_records_match_blocks(name):
+    blocks = list(parse_file(io.StringIO(PROGRAMS[name]), dict()))
+    by_blocks = estimate_blocks(blocks)
+    by_records = estimate_records(*pack_blocks(blocks))
+
+    assert (by_records["total"] == by_blocks["total"])
+    assert (np.array_equal(by_records["per_block"], by_blocks["per_block"]))
+    assert (by_records["per_tool"] == by_blocks["per_tool"])
+
+
+def test_report_lists_blocks():
+    result = estimate_text("G21 G90 G94\n"
+                           "G01 X10 F100\n"
+                           "G01 X40\n"
+                           "G01 X50\n")
+
+    slowest = format_report(result, top_blocks=2).splitlines()
+    assert (slowest[-3] == "Slowest blocks:")
+    assert (slowest[-2].startswith("  block 3 (line 5): 0:00:18.0"))
+    assert (slowest[-1].startswith("  block 2 (line 4): 0:00:06.0"))
+
+    every = format_report(result, top_blocks=-1).splitlines()
+    assert (every[-5] == "Per block:")
+    assert ([line.split(" (")[0] for line in every[-4:]]
+            == ["  block 1", "  block 2", "  block 3", "  block 4"])
+
+
+def test_format_minutes():
+    assert (format_minutes(0.0) == "0:00:00.0")
+    assert (format_minutes(61.5) == "1:01:30.0")
@@ -0,0 +1,169 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_dnc.py
+# Description: Checks of the drip-feed run of dnc.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A program read from a stream must give the same blocks as parse_file()
+# and the same machine messages as run_program() of main.py, and every
+# block must run as soon as its line has arrived.
+#
+
+import io
+import asyncio
+
+import pytest
+
+from main import parse_file, run_program
+from block import ParseError, Command
+from sinks import TextSink, EventListSink
+from dnc import (LINE_LIMIT, parse_stream, run_stream, serve_connection,
+    drip_feed)
+from tests.programs import PROGRAMS, FIELDS, block_values, write_program
+
+
+def stream_of(text, limit=LINE_LIMIT):
+    reader = asyncio.StreamReader(limit=limit)
+    reader.feed_data(text.encode())
+    reader.feed_eof()
+    return reader
+
+
+async def collect(blocks):
+    return [block async for block in blocks]
+
+
+def parse_text(text):
+    pgm_data = dict()
+    blocks = block_values(parse_file(io.StringIO(text), pgm_data))
+    return blocks, pgm_data
+
+
+def plain_value(value):
+    if (isinstance(value, Command)):
+        return tuple(getattr(value, name) for name in FIELDS)
+    if (isinstance(value, Exception)):
+        return (type(value), str(value))
+    return value
+
+
+def event_values(events):
+    """ The events of an EventListSink, with the blocks, commands and
+    errors as plain values. The machine shuts down when it is garbage
+    collected, so that message is left out. """
+    values = list()
+    for kind, data in events:
+        if (data == ("CNC machine shutting down.", ())):
+            continue
+        if (kind in ("block", "block_end")):
+            data = (data[0], data[1].line)
+        elif (kind == "command"):
+            data = plain_value(data)
+        else:
+            data = (data[0], tuple(map(plain_value, data[1])))
+        values.append((kind, data))
+    return values
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_same_blocks_as_parse_file(name):
+    async def parse():
+        pgm_data = dict()
+        blocks = await collect(parse_stream(stream_of(PROGRAMS[name]),
+                                            pgm_data))
+        return block_values(blocks), pgm_data
+
+    assert (asyncio.run(parse()) == parse_text(PROGRAMS[name]))
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_same_events_as_run_program(name):
+    expected = EventListSink()
+    pgm_data = dict()
+    pgm_data["commands"] = parse_file(io.StringIO(PROGRAMS[name]), pgm_data)
+    run_program(pgm_data, expected)
+
+    sink = EventListSink()
+
+    async def run():
+        await run_stream(stream_of(PROGRAMS[name]), sink)
+
+    asyncio.run(run())
+
+    assert (event_values(sink.events) == event_values(expected.events))
+
+
+@pytest.mark.parametrize("text, message", [
+    ("O0001\n%\nG00 X1\n%\n", "outside of data markers"),
+    ("%\nO0001\nG00 X1\n", "should have 2"),
+    ("%\nO0001\nG01 X1..0\n%\n", "'X1..0' on line 3"),
+    ("%\nO0001\nG00 X1 (" + "x" * 200 + ")\n%\n", "line 3 is too long"),
+])
+def test_errors(text, message):
+    async def parse():
+        await collect(parse_stream(stream_of(text, 100), dict()))
+
+    with pytest.raises(ParseError) as err:
+        asyncio.run(parse())
+    assert (message in str(err.value))
+
+
+def test_rest_of_the_stream_is_not_read():
+    async def parse():
+        reader = stream_of("%\nO0001\nG90 G00 X1\n%\nnot G-code\n")
+        blocks = await collect(parse_stream(reader, dict()))
+        return len(blocks), await reader.readline()
+
+    assert (asyncio.run(parse()) == (1, b"not G-code\n"))
+
+
+def test_blocks_run_as_they_arrive():
+    async def feed():
+        reader = asyncio.StreamReader()
+        sink = EventListSink()
+        run = asyncio.ensure_future(run_stream(reader, sink, queue_size=1))
+
+        reader.feed_data(b"%\nO0001\nG21 G90 G94\nG01 X5 F100\n")
+        for i in range(100):
+            await asyncio.sleep(0)
+        # The second block has run before the end marker is sent.
+        ran = [data[1].line for kind, data in sink.events
+               if (kind == "block_end")]
+
+        reader.feed_data(b"%\n")
+        reader.feed_eof()
+        pgm_data = await run
+        return ran, pgm_data
+
+    ran, pgm_data = asyncio.run(feed())
+    assert (ran == [3, 4])
+    assert (pgm_data["pgm_num"] == 1)
+    assert (pgm_data["num_commands"] == 4)
+
+
+def test_drip_feed_over_a_socket(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    output = io.StringIO()
+
+    async def demo():
+        server = await asyncio.start_server(
+            lambda reader, writer: serve_connection(reader, writer, "text"),
+            "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            await drip_feed(file_name, port, output=output)
+
+    asyncio.run(demo())
+
+    expected = io.StringIO()
+    pgm_data = dict()
+    pgm_data["commands"] = parse_file(io.StringIO(PROGRAMS["mill"]),
+                                      pgm_data)
+    sink = TextSink(expected)
+    run_program(pgm_data, sink)
+    sink.flush()
+
+    received = output.getvalue().splitlines()
+    assert (received[-1] == "----> CNC machine shutting down.")
+    assert (received[:-1] == expected.getvalue().splitlines())
@@ -0,0 +1,178 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_export.py
+# Description: Checks of the toolpath export of export.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# What a writer writes, in either format and in any chunk size, the
+# reader must give back as it was recorded; and an export of a run must
+# have the positions the machine reaches.
+#
+
+import io
+import os
+import random
+
+import pytest
+
+import main
+import export
+from export import COLUMNS, HEADER, MAGIC, FORMATS, ToolpathReader
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+from tests.programs import PROGRAMS, write_program
+
+NAMES = [name for name, code, dtype in COLUMNS]
+
+
+def random_rows(rng, num):
+    """ Records of a run: (block, line) and the arguments of record(). """
+    rows = list()
+    block = 0
+    for i in range(num):
+        if (rng.random() < 0.3):
+            block += 1
+        rows.append(((block, block * 2 + 3),
+                     (rng.uniform(-1e3, 1e3), rng.uniform(-1e3, 1e3),
+                      rng.uniform(-1e3, 1e3), rng.choice((10, 11, 19, 21)),
+                      rng.choice((0, 6000.0, 1234.5)),
+                      rng.choice(("", "TOOL #01", "TOOL #12")))))
+    return rows
+
+
+def write_rows(writer, rows):
+    for (block, line), args in rows:
+        writer.set_block(block, line)
+        writer.record(*args)
+    writer.close(program=7)
+
+
+def expected_columns(rows, tools):
+    values = [(x, y, z, motion, feed, tools.index(tool), block, line)
+              for (block, line), (x, y, z, motion, feed, tool) in rows]
+    return dict(zip(NAMES, map(list, zip(*values))))
+
+
+def read_columns(reader):
+    return {name: [value for part in reader.chunks(name) for value in part]
+            for name in NAMES}
+
+
+def open_files():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 1000])
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_round_trip(tmp_path, fmt, chunk_rows):
+    rows = random_rows(random.Random(chunk_rows), 100)
+    path = str(tmp_path / "toolpath")
+    writer = FORMATS[fmt](path, chunk_rows)
+    write_rows(writer, rows)
+    assert (writer.rows == len(rows))
+
+    with ToolpathReader(path) as reader:
+        assert (reader.rows == len(rows))
+        assert (reader.meta["program"] == 7)
+        assert (sorted(reader.tools) == ["", "TOOL #01", "TOOL #12"])
+        assert (len(reader.meta["chunks"]) == -(-len(rows) // chunk_rows))
+        columns = read_columns(reader)
+        assert (columns == expected_columns(rows, reader.tools))
+
+
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_numpy_columns(tmp_path, fmt):
+    np = pytest.importorskip("numpy")
+    rows = random_rows(random.Random(1), 50)
+    path = str(tmp_path / "toolpath")
+    write_rows(FORMATS[fmt](path, 16), rows)
+
+    with ToolpathReader(path) as reader:
+        expected = expected_columns(rows, reader.tools)
+        for name, code, dtype in COLUMNS:
+            column = reader.column(name)
+            assert (column.dtype == np.dtype(dtype))
+            assert (column.tolist() == expected[name])
+        if (fmt == "npy"):
+            # The files are plain .npy files.
+            chunk = reader.meta["chunks"][1]
+            loaded = np.load(os.path.join(path, chunk["files"][0]),
+                             mmap_mode="r")
+            assert (loaded.tolist() == expected["x"][16:32])
+
+
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_without_numpy(tmp_path, monkeypatch, fmt):
+    rows = random_rows(random.Random(2), 40)
+    path = str(tmp_path / "toolpath")
+    write_rows(FORMATS[fmt](path, 16), rows)
+    monkeypatch.setattr(export, "np", None)
+
+    reader = ToolpathReader(path)
+    parts = reader.chunks("line")
+    assert (all(isinstance(part, memoryview) for part in parts))
+    assert (read_columns(reader) == expected_columns(rows, reader.tools))
+    del parts
+    reader.close()
+
+
+@pytest.mark.parametrize("fmt", sorted(FORMATS))
+def test_empty_toolpath(tmp_path, fmt):
+    np = pytest.importorskip("numpy")
+    path = str(tmp_path / "toolpath")
+    FORMATS[fmt](path).close()
+
+    with ToolpathReader(path) as reader:
+        assert (reader.rows == 0)
+        assert (reader.chunks("x") == [])
+        assert (reader.column("block").dtype == np.int64)
+        assert (len(reader.column("block")) == 0)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"CNCPATH",
+    b"not a toolpath at all, but long enough for a header",
+    HEADER.pack(MAGIC, 99, 0, HEADER.size, 0),
+])
+def test_not_a_toolpath(tmp_path, data):
+    path = tmp_path / "bad.bin"
+    path.write_bytes(data)
+    files = open_files()
+
+    with pytest.raises(ValueError, match="not a toolpath file"):
+        ToolpathReader(str(path))
+    assert (open_files() == files)
+
+
+def test_main_export(tmp_path):
+    np = pytest.importorskip("numpy")
+    text = PROGRAMS["subprograms"]
+    file_name = write_program(tmp_path, "program.gcode", text)
+    path = str(tmp_path / "toolpath.bin")
+
+    assert (main.main(["main.py", "-q", "--no-cache", "--export", path,
+                       file_name]) == 0)
+
+    positions = list()
+
+    class Recorder:
+        def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+            positions.append((x, y, z, motion_mode))
+
+    machine = MachineClient(NullSink())
+    machine.set_recorder(Recorder())
+    Interpreter(machine).run(parse_file(io.StringIO(text), dict()))
+
+    with ToolpathReader(path) as reader:
+        assert (reader.meta["program"] == 1000)
+        points = np.stack([reader.column(name)
+                           for name in ("x", "y", "z", "motion")], axis=1)
+        assert (points.tolist() == [list(row) for row in positions])
+        # The moves of the subprograms are at the lines of the calls
+        # (the machine is at X0 Y0 Z0 already at line 4).
+        assert (sorted(set(reader.column("line").tolist())) == [6, 7, 8])
+        assert (np.all(np.diff(reader.column("block")) >= 0))
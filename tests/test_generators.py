@@ -0,0 +1,120 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_generators.py
+# Description: Checks of the benchmark programs and the benchmark suite.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The synthetic programs must only depend on the seed, and run without
+# any errors: a benchmark of a program that fails measures nothing.
+#
+
+import io
+import json
+import copy
+
+import pytest
+
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import QuietSink
+from benchmarks.generators import GENERATORS, HEADER, FOOTER, generate
+from benchmarks.suite import (PHASES, bench_file, run_suite, format_results,
+    main_suite)
+
+LINES = 300
+
+
+def read(file_name):
+    with open(file_name) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", sorted(GENERATORS))
+def test_same_seed_same_program(tmp_path, name):
+    first = str(tmp_path / "first.gcode")
+    second = str(tmp_path / "second.gcode")
+    other = str(tmp_path / "other.gcode")
+    generate(name, first, LINES, seed=5)
+    generate(name, second, LINES, seed=5)
+    generate(name, other, LINES, seed=6)
+
+    assert (read(first) == read(second))
+    assert (read(first) != read(other))
+
+
+@pytest.mark.parametrize("name", sorted(GENERATORS))
+def test_programs_run_without_errors(tmp_path, name):
+    file_name = str(tmp_path / "program.gcode")
+    generate(name, file_name, LINES)
+    text = read(file_name)
+
+    assert (text.startswith(HEADER))
+    assert (text.endswith(FOOTER))
+    num_lines = text.count("\n") - HEADER.count("\n") - FOOTER.count("\n")
+    assert (LINES <= num_lines <= LINES + 3)
+
+    pgm_data = dict()
+    blocks = list(parse_file(io.StringIO(text), pgm_data))
+    sink = QuietSink(io.StringIO())
+    Interpreter(MachineClient(sink)).run(blocks)
+    assert (pgm_data["pgm_num"] == 1000)
+    assert (sink.num_errors == 0)
+
+
+def test_bench_file(tmp_path):
+    file_name = str(tmp_path / "program.gcode")
+    generate("long_lines", file_name, LINES)
+    pgm_data = dict()
+    blocks = list(parse_file(io.StringIO(read(file_name)), pgm_data))
+
+    result = bench_file(file_name, 1)
+    assert (result["lines"] == read(file_name).count("\n"))
+    assert (result["blocks"] == len(blocks))
+    assert (result["commands"] == pgm_data["num_commands"])
+    for phase in PHASES:
+        assert (result[phase]["time_s"] > 0.0)
+        assert (result[phase]["us_per_line"] == pytest.approx(
+            result[phase]["time_s"] / result["lines"] * 1e6))
+
+
+def test_regressions_against_a_baseline():
+    report = run_suite(["pocketing", "drilling"], 100, 1)
+    assert (list(report["results"]) == ["pocketing", "drilling"])
+    assert (report["meta"]["num_lines"] == 100)
+
+    txt, regressions = format_results(report)
+    assert (regressions == 0)
+    assert (len(txt.splitlines()) == 1 + 2 * len(PHASES))
+
+    baseline = copy.deepcopy(report)
+    entry = baseline["results"]["drilling"]["execute"]
+    entry["us_per_line"] = entry["us_per_line"] / 2.0
+    # Not in the baseline: not compared.
+    del baseline["results"]["pocketing"]
+
+    txt, regressions = format_results(report, baseline)
+    assert (regressions == 1)
+    marked = [line.split()[:2] for line in txt.splitlines()
+              if (line.endswith("REGRESSION"))]
+    assert (marked == [["drilling", "execute"]])
+
+
+def test_main_suite(tmp_path, capsys):
+    output = str(tmp_path / "results.json")
+
+    assert (main_suite(["suite", "-n", "100", "-r", "1", "-o", output,
+                        "tool_changes"]) == 0)
+    report = json.loads(read(output))
+    assert (list(report["results"]) == ["tool_changes"])
+    assert (report["meta"]["repeat"] == 1)
+    capsys.readouterr()
+
+    for phase in PHASES:
+        report["results"]["tool_changes"][phase]["us_per_line"] = 1e-9
+    with open(output, "w") as f:
+        json.dump(report, f)
+    assert (main_suite(["suite", "-n", "100", "-r", "1", "--compare", output,
+                        "tool_changes"]) == 2)
+    assert (capsys.readouterr().out.count("REGRESSION") == len(PHASES))
@@ -0,0 +1,99 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_interpreter.py
+# Description: Checks of the dispatch of interpreter.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+
+import io
+
+from main import parse_file
+from block import Opcode, ModalGroup, Command, compile_block
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink, EventListSink
+from tests.programs import MILL
+
+
+def new_interpreter(sink=None):
+    machine = MachineClient(NullSink() if (sink is None) else sink)
+    return Interpreter(machine)
+
+
+def test_every_opcode_has_a_handler():
+    interpreter = new_interpreter()
+
+    missing = [op for op in Opcode if (interpreter._handlers[op] is None)]
+    assert (missing == [Opcode.UNKNOWN, Opcode.O])
+
+
+def test_run_mill():
+    interpreter = new_interpreter()
+    blocks = list(parse_file(io.StringIO(MILL), dict()))
+
+    assert (interpreter.run(blocks) == sum(len(block) for block in blocks))
+    assert (interpreter.machine.get_position() == (-10.0, -12.0, 0.0))
+    modal = interpreter.modal
+    assert (modal[ModalGroup.MOTION] == Opcode.G00)
+    assert (modal[ModalGroup.DISTANCE] == Opcode.G91)
+    assert (modal[ModalGroup.COORD_SYSTEM] == Opcode.G54)
+    assert (modal[ModalGroup.SPINDLE] == Opcode.M05)
+    assert (modal[ModalGroup.COOLANT] == Opcode.M09)
+
+
+def test_modal_groups_follow_the_commands():
+    interpreter = new_interpreter()
+    for txt_row in ("G21 G90 G94 G17", "G01 X1 F100", "G02 X2 Y1 R1",
+                    "G18", "G91 G00 X1"):
+        interpreter.run([compile_block(txt_row)])
+
+    modal = interpreter.modal
+    assert (modal[ModalGroup.MOTION] == Opcode.G00)
+    assert (modal[ModalGroup.PLANE] == Opcode.G18)
+    assert (modal[ModalGroup.DISTANCE] == Opcode.G91)
+    assert (modal[ModalGroup.UNITS] == Opcode.G21)
+
+
+def test_register_word():
+    interpreter = new_interpreter()
+    calls = list()
+    interpreter.register("g04", calls.append, ModalGroup.NONE)
+    interpreter.register("G64", calls.append, ModalGroup.CUTTER_COMP)
+
+    dwell, path, other = compile_block("G04 P1.5 G64 G123").commands
+    for cmd in (dwell, path, other):
+        interpreter.execute(cmd)
+
+    assert (calls == [dwell, path])
+    assert (dwell.p == 1.5)
+    assert (interpreter.modal[ModalGroup.CUTTER_COMP] == "G64")
+
+
+def test_register_replaces_a_handler():
+    interpreter = new_interpreter()
+    calls = list()
+    interpreter.register(Opcode.G00, calls.append)
+    interpreter.register("G01", calls.append)
+
+    interpreter.run([compile_block("G00 X5 G01 Y5 F100")])
+    assert (len(calls) == 2)
+    assert (interpreter.machine.get_position() == (0.0, 0.0, 0.0))
+    assert (interpreter.modal[ModalGroup.MOTION] == Opcode.G01)
+
+
+def test_tool_and_spindle_arguments():
+    sink = EventListSink()
+    interpreter = new_interpreter(sink)
+    interpreter.run([compile_block("T7 M06 S1500 M03")])
+
+    messages = sink.messages()
+    assert (any("TOOL #07" in txt for txt in messages))
+    assert (any("1500" in txt for txt in messages))
+
+
+def test_program_numbers_are_not_executed():
+    interpreter = new_interpreter()
+    interpreter.execute(Command(Opcode.O, 100))
+
+    assert (interpreter.modal == [None] * len(ModalGroup))
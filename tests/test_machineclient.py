@@ -0,0 +1,100 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_machineclient.py
+# Description: Checks of the machine state of machineclient.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Every machine keeps its own state, and a snapshot put back into any
+# machine must make it continue exactly as the machine it was taken
+# from.
+#
+
+import io
+import json
+import pickle
+
+import pytest
+
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink, EventListSink
+from tests.programs import PROGRAMS
+
+
+def parse_text(text):
+    return list(parse_file(io.StringIO(text), dict()))
+
+
+def run(blocks, machine=None):
+    machine = MachineClient(NullSink()) if (machine is None) else machine
+    Interpreter(machine).run(blocks)
+    return machine
+
+
+def test_state_is_per_instance():
+    first = MachineClient(NullSink())
+    second = MachineClient(NullSink())
+    run(parse_text(PROGRAMS["mill"]), first)
+
+    assert (not hasattr(first, "__dict__"))
+    assert (first.get_position() == (-10.0, -12.0, 0.0))
+    assert (second.get_position() == (0.0, 0.0, 0.0))
+    assert (second.get_state() == MachineClient(NullSink()).get_state())
+
+
+def test_state_is_plain_values():
+    state = run(parse_text(PROGRAMS["offsets"])).get_state()
+
+    assert (json.loads(json.dumps(state)) == state)
+    assert (state["unit"] == "MILLIMETRES")
+    assert (state["dist_mode"] == "ABSOLUTE")
+
+
+@pytest.mark.parametrize("name", ["mill", "mixed", "cycles", "offsets",
+                                  "arcs"])
+def test_restore_continues_the_run(name):
+    blocks = parse_text(PROGRAMS[name])
+    expected = run(blocks).get_state()
+
+    for split in range(len(blocks) + 1):
+        first = run(blocks[:split])
+        snapshot = first.snapshot()
+        # Through a pickle, as between processes.
+        second = MachineClient(NullSink())
+        second.restore(pickle.loads(pickle.dumps(snapshot)))
+        assert (second.snapshot() == snapshot)
+        assert (second.get_state() == first.get_state())
+
+        assert (run(blocks[split:], second).get_state() == expected)
+
+
+def test_restore_outputs_nothing():
+    sink = EventListSink()
+    machine = MachineClient(sink)
+    del sink.events[:]
+    machine.restore(run(parse_text(PROGRAMS["mill"])).snapshot())
+
+    assert (sink.events == [])
+
+
+def test_snapshot_is_not_changed_by_the_run():
+    blocks = parse_text(PROGRAMS["offsets"])
+    machine = run(blocks[:4])
+    snapshot = machine.snapshot()
+    saved = pickle.dumps(snapshot)
+    run(blocks[4:], machine)
+
+    assert (pickle.dumps(snapshot) == saved)
+
+
+def test_modal_snapshot_ignores_the_position():
+    first = run(parse_text("%\nO0001\nG21 G90 G94\nG01 X1 Y2 F100\n%\n"))
+    second = run(parse_text("%\nO0001\nG21 G90 G94\nG01 X5 Z3 F100\n%\n"))
+
+    assert (first.snapshot() != second.snapshot())
+    assert (first.modal_snapshot() == second.modal_snapshot())
+
+    third = run(parse_text("%\nO0001\nG21 G91 G94\nG01 X1 Y2 F100\n%\n"))
+    assert (third.modal_snapshot() != first.modal_snapshot())
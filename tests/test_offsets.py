@@ -0,0 +1,224 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_offsets.py
+# Description: Checks of the work and tool length offsets of offsets.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The transform of OffsetTable is worked out by hand; the machine must
+# move by it, and the batch toolpath, with apply_batch(), to the same
+# positions as the machine, move by move.
+#
+
+import io
+import random
+
+import pytest
+
+from main import parse_file
+from block import compile_block
+from interpreter import Interpreter
+from machineclient import MachineClient
+from offsets import IDENTITY, INCH, OffsetTable, apply_batch
+from sinks import NullSink, EventListSink
+from tests.programs import PROGRAMS
+
+
+class Positions:
+    """ Recorder of the positions of a machine, without the moves that
+    stay in place (the toolpath has none). """
+
+    def __init__(self):
+        self.points = [(0.0, 0.0, 0.0)]
+
+
+    def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+        if ((x, y, z) != self.points[-1]):
+            self.points.append((x, y, z))
+
+
+def command(txt_row):
+    return compile_block(txt_row).commands[0]
+
+
+def run(blocks, sink=None):
+    recorder = Positions()
+    machine = MachineClient(NullSink() if (sink is None) else sink)
+    machine.set_recorder(recorder)
+    Interpreter(machine).run(blocks)
+    return machine, recorder.points
+
+
+def random_program(rng, num):
+    """ Straight moves with offsets set and selected in between, in both
+    units and distance modes. """
+    rows = ["G21 G90 G94 G17 F100"]
+    for i in range(num):
+        r = rng.random()
+        if (r < 0.05):
+            rows.append("G10 L2 P{} X{:.1f} Z{:.1f}".format(
+                rng.randint(0, 6), rng.uniform(-100, 100),
+                rng.uniform(-50, 50)))
+        elif (r < 0.08):
+            rows.append("G10 L1 P{} Z{:.2f}".format(rng.randint(1, 3),
+                                                   rng.uniform(0, 50)))
+        elif (r < 0.13):
+            rows.append("G{}".format(rng.randint(54, 59)))
+        elif (r < 0.17):
+            rows.append("G43 H{}".format(rng.randint(1, 4)))
+        elif (r < 0.19):
+            rows.append("G49")
+        elif (r < 0.22):
+            rows.append(rng.choice(("G20", "G21", "G90", "G91")))
+        else:
+            words = [rng.choice(("G00", "G01", ""))]
+            for axis in "XYZ":
+                if (rng.random() < 0.6):
+                    words.append("{}{:.2f}".format(axis, rng.uniform(-5, 5)))
+            rows.append(" ".join(words))
+    blocks = [compile_block(txt_row, n) for n, txt_row in enumerate(rows, 1)]
+    return [block for block in blocks if (block is not None)]
+
+
+def test_transform():
+    table = OffsetTable()
+    assert (table.transform == IDENTITY)
+
+    table.set_from(command("G10 L2 P1 X100 Y50 Z-20"))
+    table.set_from(command("G10 L1 P3 Z12.5"))
+    assert (table.transform == (1.0, 100.0, 50.0, -20.0))
+    table.set_tool_offset(3)
+    assert (table.transform == (1.0, 100.0, 50.0, -7.5))
+
+    # Offsets are given in the current units and kept in millimetres.
+    table.set_units(INCH)
+    table.set_from(command("G10 L2 P2 X1"))
+    table.select(2)
+    assert (table.transform == (INCH, INCH, 0.0, 12.5))
+    assert (table.work_offset(2) == (INCH, 0.0, 0.0))
+    table.set_tool_offset(None)
+    table.set_units(1.0)
+    assert (table.transform == (1.0, INCH, 0.0, 0.0))
+    assert (table.tool_length(3) == 12.5)
+    assert (table.tool_length(4) == 0.0)
+
+
+def test_g10_keeps_axes():
+    table = OffsetTable()
+    table.select(3)
+    table.set_from(command("G10 L2 P0 X1 Y2 Z3"))
+    table.set_from(command("G10 L2 P0 Y5"))
+    table.set_from(command("G10 L1 P1 Z4"))
+    table.set_from(command("G10 L1 P1"))
+
+    assert (table.work_offset(3) == (1.0, 5.0, 3.0))
+    assert (table.work_offset(1) == (0.0, 0.0, 0.0))
+    assert (table.tool_length(1) == 4.0)
+
+
+@pytest.mark.parametrize("txt_row, message", [
+    ("G10 L2", "G10 needs L and P"),
+    ("G10 P1", "G10 needs L and P"),
+    ("G10 L2 P7 X1", "no coordinate system P7"),
+    ("G10 L1 P-1 Z1", "no tool length offset P-1"),
+    ("G10 L3 P1", "G10 L3 not implemented"),
+])
+def test_invalid_g10(txt_row, message):
+    table = OffsetTable()
+    table.set_from(command("G10 L2 P1 X1"))
+
+    with pytest.raises(ValueError, match=message):
+        table.set_from(command(txt_row))
+    assert (table.transform == (1.0, 1.0, 0.0, 0.0))
+
+
+def test_snapshot_and_restore():
+    table = OffsetTable()
+    table.set_from(command("G10 L2 P4 X1 Y2 Z3"))
+    table.set_from(command("G10 L1 P2 Z10"))
+    table.select(4)
+    table.set_tool_offset(2)
+    snapshot = table.snapshot()
+    transform = table.transform
+
+    table.set_from(command("G10 L2 P4 X9"))
+    table.set_from(command("G10 L1 P2 Z1"))
+    table.select(1)
+    table.set_units(INCH)
+    table.restore(snapshot)
+
+    assert (table.transform == transform == (1.0, 1.0, 2.0, 13.0))
+    assert (table.snapshot() == snapshot)
+    hash(snapshot)
+
+
+def test_machine_moves():
+    machine, points = run(list(parse_file(io.StringIO(PROGRAMS["offsets"]),
+                                          dict())))
+
+    # G54 X100 Y50 Z-20, then tool length 12.5 in Z.
+    assert (points[1:5] == [(100.0, 0.0, 0.0), (100.0, 50.0, 0.0),
+                            (100.0, 50.0, -15.0), (100.0, 50.0, -2.5)])
+    assert (points[5] == (110.0, 50.0, -2.5))
+    assert (points[-5] == (120.0, 60.0, -2.5))
+    # G55 X200, without the tool length, then inches.
+    assert (points[-4:] == [(200.0, 60.0, -2.5), (225.4, 60.0, -2.5),
+                            (225.4, 25.4, -2.5), (250.8, 25.4, -2.5)])
+    assert (machine.get_state()["coord_system"] == 1)
+
+
+def test_machine_errors():
+    sink = EventListSink()
+    run([compile_block(txt_row) for txt_row in
+         ("G21 G90", "G10 L3 P1", "G10 L2 P9 X1", "G43", "G00 X1")], sink)
+
+    errors = [template.format(*args) for kind, (template, args)
+              in sink.events if (kind == "status") and ("Error" in template)]
+    assert (errors == [
+        "set_offset(): Error, G10 L3 not implemented.",
+        "set_offset(): Error, no coordinate system P9.",
+        "set_tool_length_comp(): Error, tool length offset number (H) "
+        "missing.",
+    ])
+
+
+def test_apply_batch():
+    np = pytest.importorskip("numpy")
+    rng = random.Random(1)
+    transforms = [IDENTITY] + [(rng.choice((1.0, INCH)), rng.uniform(-9, 9),
+                                rng.uniform(-9, 9), rng.uniform(-9, 9))
+                               for i in range(5)]
+    rows = list()
+    expected = list()
+    for i in range(200):
+        index = rng.randrange(len(transforms))
+        inc = (rng.random() < 0.3)
+        xyz = [rng.uniform(-5, 5) if (rng.random() < 0.7) else float("nan")
+               for axis in range(3)]
+        scale = transforms[index][0]
+        expected.append([value * scale + (0.0 if inc else offset)
+                         for value, offset in zip(xyz, transforms[index][1:])])
+        rows.append((xyz, inc, index))
+
+    result = apply_batch(np.array([xyz for xyz, inc, index in rows]),
+                         np.array([inc for xyz, inc, index in rows]),
+                         np.array(transforms),
+                         np.array([index for xyz, inc, index in rows]))
+
+    assert (result.dtype == np.float64)
+    assert (np.allclose(result, np.array(expected), rtol=0.0, atol=1e-12,
+                        equal_nan=True))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3, 4])
+def test_toolpath_matches_machine(seed):
+    np = pytest.importorskip("numpy")
+    from toolpath import build_toolpath
+
+    blocks = random_program(random.Random(seed), 1500)
+    toolpath = build_toolpath(blocks)
+    machine, points = run(blocks)
+
+    assert (toolpath["points"].shape == (len(points), 3))
+    assert (np.allclose(toolpath["points"], np.array(points), rtol=0.0,
+                        atol=1e-9))
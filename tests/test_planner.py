@@ -0,0 +1,222 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_planner.py
+# Description: Checks of the lookahead motion planner of planner.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The times of single segments are worked out by hand. With a buffer
+# large enough for the whole program, the planner must give the time of
+# a plan of the whole program at once; a smaller buffer can only make
+# the time longer. The machine must pass the planner the same moves the
+# cycle time estimate measures.
+#
+
+import io
+import math
+import random
+
+import pytest
+
+import main
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+from planner import Planner, format_report
+from tests.programs import PROGRAMS, write_program
+
+
+def plan(points, feeds, **kwargs):
+    planner = Planner(**kwargs)
+    for (x, y, z), feed in zip(points, feeds):
+        planner.add(x, y, z, False, feed)
+    planner.flush()
+    return planner
+
+
+def reference_time(points, feeds, acceleration, deviation):
+    """ Plans the whole program at once: the largest junction speeds,
+    then a reverse and a forward pass over all segments [min]. """
+    segments = list()
+    pos = (0.0, 0.0, 0.0)
+    unit = None
+    last_nominal2 = 0.0
+    for point, feed in zip(points, feeds):
+        delta = [point[i] - pos[i] for i in range(3)]
+        length = math.sqrt(sum(d * d for d in delta))
+        if (length < 1e-6):
+            continue
+        pos = point
+        direction = [d / length for d in delta]
+        nominal2 = (feed / 60.0) ** 2
+        if (unit is None):
+            max_entry2 = 0.0
+        else:
+            cos_theta = -sum(direction[i] * unit[i] for i in range(3))
+            if (cos_theta > 0.999999):
+                max_entry2 = 0.0
+            elif (cos_theta < -0.999999):
+                max_entry2 = min(nominal2, last_nominal2)
+            else:
+                sin_half = math.sqrt(0.5 * (1.0 - cos_theta))
+                max_entry2 = min(nominal2, last_nominal2,
+                                 acceleration * deviation * sin_half
+                                 / (1.0 - sin_half))
+        unit = direction
+        last_nominal2 = nominal2
+        segments.append((length, nominal2, max_entry2))
+
+    num = len(segments)
+    entry2 = [0.0] * (num + 1)
+    for i in range(num - 1, -1, -1):
+        entry2[i] = min(segments[i][2],
+                        entry2[i + 1] + 2.0 * acceleration * segments[i][0])
+    for i in range(num):
+        entry2[i + 1] = min(entry2[i + 1],
+                            entry2[i] + 2.0 * acceleration * segments[i][0])
+
+    seconds = 0.0
+    for i, (length, nominal2, max_entry2) in enumerate(segments):
+        v0 = math.sqrt(entry2[i])
+        v1 = math.sqrt(entry2[i + 1])
+        accel_dist = (nominal2 - entry2[i]) / (2.0 * acceleration)
+        decel_dist = (nominal2 - entry2[i + 1]) / (2.0 * acceleration)
+        if (accel_dist + decel_dist <= length):
+            nominal = math.sqrt(nominal2)
+            seconds += ((nominal - v0) / acceleration
+                        + (nominal - v1) / acceleration
+                        + (length - accel_dist - decel_dist) / nominal)
+        else:
+            peak = math.sqrt(max((2.0 * acceleration * length + entry2[i]
+                                  + entry2[i + 1]) / 2.0,
+                                 entry2[i], entry2[i + 1]))
+            seconds += (peak - v0) / acceleration + (peak - v1) / acceleration
+    return seconds / 60.0
+
+
+def random_path(rng, num, turning):
+    points = list()
+    x = y = z = 0.0
+    angle = 0.0
+    for i in range(num):
+        angle += rng.gauss(0.0, turning)
+        length = rng.choice((0.01, 0.1, 1.0, 10.0)) * rng.random()
+        x += length * math.cos(angle)
+        y += length * math.sin(angle)
+        z += rng.gauss(0.0, 0.01)
+        points.append((x, y, z))
+    feeds = [rng.choice((300.0, 1000.0, 3000.0)) for point in points]
+    return points, feeds
+
+
+def test_trapezoid():
+    # 10 units/s reached in 0.02 s over 0.1 units, both ends.
+    planner = plan([(100.0, 0.0, 0.0)], [600.0], acceleration=500.0)
+
+    assert (planner.time * 60.0 == pytest.approx(0.04 + 99.8 / 10.0))
+    assert (planner.feed_time == planner.time)
+    assert (planner.distance == 100.0)
+    assert (planner.segments == 1)
+
+
+def test_triangle():
+    # Too short to reach the feed rate: half the way accelerating.
+    planner = plan([(0.0, 0.01, 0.0)], [3000.0], acceleration=500.0)
+
+    assert (planner.time * 60.0
+            == pytest.approx(2.0 * math.sqrt(0.01 / 500.0)))
+
+
+def test_junctions():
+    single = plan([(100.0, 0.0, 0.0)], [600.0])
+    straight = plan([(50.0, 0.0, 0.0), (100.0, 0.0, 0.0)], [600.0, 600.0])
+    back = plan([(50.0, 0.0, 0.0), (0.0, 0.0, 0.0)], [600.0, 600.0])
+    corner = plan([(50.0, 0.0, 0.0), (50.0, 50.0, 0.0)], [600.0, 600.0])
+
+    # Straight on keeps the speed, a reversal stops (twice 0.1 units at
+    # half the speed), and a corner is in between.
+    assert (straight.time == pytest.approx(single.time))
+    assert (back.time == pytest.approx(single.time + 0.02 / 60.0))
+    assert (single.time < corner.time < back.time)
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_lookahead_matches_whole_program(seed):
+    rng = random.Random(seed)
+    points, feeds = random_path(rng, rng.randint(1, 300),
+                                0.3 if (seed % 2) else 2.0)
+    expected = reference_time(points, feeds, 500.0, 0.01)
+
+    assert (plan(points, feeds, lookahead=1000).time
+            == pytest.approx(expected, rel=1e-9, abs=1e-12))
+    for lookahead in (2, 8, 32):
+        assert (plan(points, feeds, lookahead=lookahead).time
+                >= expected - 1e-12)
+
+
+def test_overrides():
+    feed = plan([(100.0, 0.0, 0.0)], [300.0], feed_override=2.0)
+    expected = plan([(100.0, 0.0, 0.0)], [600.0])
+    assert (feed.time == pytest.approx(expected.time))
+
+    rapid = Planner(rapid_override=0.5)
+    rapid.add(100.0, 0.0, 0.0, True, 0.0)
+    rapid.flush()
+    speed = 2500.0 / 60.0
+    assert (rapid.rapid_time == rapid.time)
+    assert (rapid.rapid_time * 60.0
+            == pytest.approx(100.0 / speed + speed / 500.0))
+
+
+def test_no_feed_and_dwell():
+    planner = Planner()
+    planner.add(10.0, 0.0, 0.0, False, 600.0)
+    planner.add(20.0, 0.0, 0.0, False, 0.0)
+    planner.dwell(1.5)
+    planner.add(30.0, 0.0, 0.0, False, 600.0)
+    planner.flush()
+
+    assert (planner.no_feed == 1)
+    assert (planner.segments == 2)
+    assert (planner.dwell_time * 60.0 == pytest.approx(1.5))
+    assert (planner.time == pytest.approx(
+        planner.feed_time + planner.dwell_time))
+    assert ("1 feed moves without a feed rate" in format_report(planner))
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_moves_of_the_machine(name):
+    # The estimate needs NumPy.
+    pytest.importorskip("numpy")
+    from cycletime import estimate_blocks
+
+    blocks = list(parse_file(io.StringIO(PROGRAMS[name]), dict()))
+    planner = Planner()
+    machine = MachineClient(NullSink())
+    machine.set_planner(planner)
+    Interpreter(machine).run(blocks)
+    planner.flush()
+    estimate = estimate_blocks(blocks)
+
+    assert (planner.axis_distance == pytest.approx(
+        estimate["rapid_length"] + estimate["feed_length"]))
+    assert (planner.no_feed == estimate["no_feed_moves"])
+    # Straight lines are never longer than one axis at a time.
+    assert (planner.distance <= planner.axis_distance + 1e-9)
+
+
+def test_main_plan(tmp_path, capsys):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+
+    main.main(["main.py", "--plan", "--no-cache", file_name])
+    normal = capsys.readouterr().out.splitlines()
+    main.main(["main.py", "--plan", "--no-cache", "--feed-override", "50",
+               file_name])
+    slow = capsys.readouterr().out.splitlines()
+
+    assert ("Program #1 (26 commands):" in normal)
+    assert (not any("Moving" in line for line in normal))
+    times = [line for line in normal if ("feed segments" in line)]
+    slow_times = [line for line in slow if ("feed segments" in line)]
+    assert (times != slow_times)
@@ -0,0 +1,173 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_profiler.py
+# Description: Checks of the instrumentation of profiler.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The percentiles read from the histogram are compared to the exact
+# nearest-rank percentiles of the sorted durations, and an instrumented
+# run must give the same result as a plain one.
+#
+
+import io
+import json
+import random
+
+import pytest
+
+import main
+import reader
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+from profiler import SUB_BUCKETS, NUM_BUCKETS, Stats, Profiler
+from tests.programs import PROGRAMS, write_program
+
+
+def exact_percentile(durations, percent):
+    ordered = sorted(durations)
+    return ordered[int(round(percent / 100.0 * (len(ordered) - 1)))]
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_percentiles_match_sorted_durations(seed):
+    rng = random.Random(seed)
+    durations = [int(rng.lognormvariate(8, 3)) for i in range(5000)]
+    stats = Stats()
+    for duration in durations:
+        stats.record(duration)
+
+    for percent in (0, 1, 10, 50, 90, 99, 99.9, 100):
+        exact = exact_percentile(durations, percent)
+        assert (abs(stats.percentile(percent) - exact)
+                <= exact / (2.0 * SUB_BUCKETS))
+    assert (stats.calls == len(durations))
+    assert (stats.total == sum(durations))
+    assert (stats.longest == max(durations))
+    assert (sum(stats.counts) == len(durations))
+
+
+def test_short_durations_are_exact():
+    durations = list(range(2 * SUB_BUCKETS)) * 3
+    stats = Stats()
+    for duration in durations:
+        stats.record(duration)
+
+    for percent in range(0, 101, 5):
+        assert (stats.percentile(percent)
+                == exact_percentile(durations, percent))
+
+
+def test_bucket_limits():
+    stats = Stats()
+    for shift in range(64):
+        stats.record((1 << shift) - 1)
+        stats.record(1 << shift)
+    stats.record((1 << 64) - 1)
+    assert (len(stats.counts) == NUM_BUCKETS)
+    assert (stats.counts[-1] == 1)
+    assert (stats.percentile(100) == (1 << 64) - 1)
+
+
+def test_summary():
+    stats = Stats()
+    assert (stats.summary() == {"calls": 0, "total_s": 0.0, "mean_us": 0.0,
+                                "p50_us": 0.0, "p99_us": 0.0, "max_us": 0.0,
+                                "alloc_blocks": 0})
+
+    for duration in (1000, 2000, 6000):
+        stats.record(duration)
+    summary = stats.summary()
+    assert (summary["calls"] == 3)
+    assert (summary["total_s"] == pytest.approx(9e-6))
+    assert (summary["mean_us"] == pytest.approx(3.0))
+    assert (summary["max_us"] == pytest.approx(6.0))
+    assert (summary["p50_us"] == pytest.approx(2.0, rel=0.5 / SUB_BUCKETS))
+
+
+def test_wrap_counts_calls_and_errors():
+    profiler = Profiler()
+
+    def half(value):
+        """ Halves an even number. """
+        if (value % 2):
+            raise ValueError("odd")
+        return value // 2
+
+    wrapped = profiler.wrap(half, "half")
+    assert (wrapped.__name__ == "half")
+    assert ([wrapped(value) for value in (2, 4, 6)] == [1, 2, 3])
+    with pytest.raises(ValueError):
+        wrapped(3)
+
+    assert (profiler.stats["half"].calls == 4)
+
+
+def test_wrap_iter_passes_the_items():
+    profiler = Profiler()
+
+    items = list(profiler.wrap_iter(iter("abc"), "letters"))
+    assert (items == ["a", "b", "c"])
+    # The end of the iteration is timed too.
+    assert (profiler.stats["letters"].calls == 4)
+
+
+def test_instrumented_run_gives_the_same_result():
+    blocks = list(parse_file(io.StringIO(PROGRAMS["mill"]), dict()))
+    plain = MachineClient(NullSink())
+    Interpreter(plain).run(blocks)
+
+    profiler = Profiler()
+    machine = MachineClient(NullSink())
+    profiler.instrument_machine(machine)
+    execute = profiler.wrap_execute(Interpreter(machine).execute)
+    for block in blocks:
+        for command in block.commands:
+            execute(command)
+
+    assert (machine.get_state() == plain.get_state())
+    assert (isinstance(machine, MachineClient))
+    assert (type(plain) is MachineClient)
+
+    summary = profiler.summary()
+    assert (summary["execute"]["calls"]
+            == sum(len(block) for block in blocks))
+    assert (summary["execute G01"]["calls"] == 6)
+    # Also the M30 sets the linear motion mode.
+    assert (summary["MachineClient.lin_move"]["calls"] == 7)
+    assert (summary["MachineClient.move"]["calls"] >= 6)
+    assert ("MachineClient.get_state" not in summary)
+    totals = [entry["total_s"] for entry in summary.values()]
+    assert (totals == sorted(totals, reverse=True))
+
+
+def test_patch_and_restore():
+    profiler = Profiler()
+    compile_tokens = reader.compile_tokens
+    profiler.patch(reader, "compile_tokens", "compile")
+
+    assert (reader.compile_tokens is not compile_tokens)
+    profiler.restore()
+    assert (reader.compile_tokens is compile_tokens)
+
+
+def test_main_profile_report(tmp_path, capsys):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    compile_block = main.compile_block
+
+    status = main.main(["main.py", "-q", "--no-cache", "--profile",
+                        "--profile-format", "json", file_name])
+    assert (status == 0)
+    assert (main.compile_block is compile_block)
+
+    report = json.loads(capsys.readouterr().err)
+    for name in ("parse", "execute", "execute G01", "MachineClient.move"):
+        assert (report[name]["calls"] > 0)
+
+    main.main(["main.py", "-q", "--no-cache", "--profile", file_name])
+    table = capsys.readouterr().err.splitlines()
+    assert (table[0].split() == ["name", "calls", "total", "ms", "mean",
+                                 "us", "p50", "us", "p99", "us", "allocs"])
+    assert (len(table) == len(report) + 1)
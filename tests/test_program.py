@@ -0,0 +1,263 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_program.py
+# Description: Checks of the random access to the blocks of program.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A Program must give the blocks the parsers give, at any index; and a
+# restart from any block must leave the machine in the state a run from
+# the beginning leaves it in before that block, with or without
+# checkpoints, saved or not.
+#
+
+import gc
+import io
+import os
+import random
+
+import pytest
+
+import main
+from main import parse_file
+from block import ParseError
+from interpreter import Interpreter
+from machineclient import MachineClient
+from subprogram import Subprograms
+from sinks import NullSink
+from program import Program
+from benchmarks.generators import generate
+from tests.programs import PROGRAMS, SUBPROGRAMS, write_program
+
+
+def text_of(block):
+    return (block.line, [str(cmd) for cmd in block.commands])
+
+
+def states_of(file_name):
+    """ Runs a program from the beginning, returning the state before
+    every block and at the end. """
+    with open(file_name) as f:
+        program = Subprograms(list(parse_file(f, dict())))
+    machine = MachineClient(NullSink())
+    interpreter = Interpreter(machine, program)
+    states = list()
+    for block in program:
+        states.append((machine.snapshot(), tuple(interpreter.modal)))
+        for cmd in block.commands:
+            interpreter.execute(cmd)
+    states.append((machine.snapshot(), tuple(interpreter.modal)))
+    return states
+
+
+def generated(tmp_path, name, num_lines=400):
+    file_name = str(tmp_path / (name + ".gcode"))
+    generate(name, file_name, num_lines)
+    return file_name
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_same_blocks_as_parse_file(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", PROGRAMS[name])
+    pgm_data = dict()
+    expected = Subprograms(parse_file(io.StringIO(PROGRAMS[name]), pgm_data))
+    blocks = [text_of(block) for block in expected]
+
+    with Program(file_name) as program:
+        assert (program.pgm_num == pgm_data["pgm_num"])
+        assert ([text_of(block) for block in program] == blocks)
+        assert ([text_of(block) for block in program[:]] == blocks)
+        assert (sorted(program.subprograms.bodies) == sorted(expected.bodies))
+        bodies = program.subprograms.bodies
+        for num, body in expected.bodies.items():
+            assert ([text_of(block) for block in bodies[num]]
+                    == [text_of(block) for block in body])
+
+
+def test_indexing(tmp_path):
+    file_name = write_program(tmp_path, "program.gcode",
+                              "%\nO0001\n(a comment)\nN10 G21 G90\n\n"
+                              "N20 G00 X1\nN30 X2\nN20 X3\n%\n")
+
+    with Program(file_name) as program:
+        assert (len(program) == 4)
+        assert (text_of(program[0]) == (4, ["G21", "G90"]))
+        assert (text_of(program[-1]) == (8, ["X3.000"]))
+        assert ([block.line for block in program[1:3]] == [6, 7])
+        assert ([block.line for block in program[::-2]] == [8, 6])
+        with pytest.raises(IndexError):
+            program[4]
+        with pytest.raises(IndexError):
+            program[-5]
+        # The first block with a number, and its source line.
+        assert (program.find(20) == 1)
+        assert (program.find(40) is None)
+        assert (program.line(2) == 7)
+        assert (program.index_of_line(5) == 1)
+        assert (program.index_of_line(99) == 4)
+
+
+def test_block_cache(tmp_path):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+
+    with Program(file_name, cache_size=2) as program:
+        first = program[0]
+        assert (program[0] is first)
+        program[1]
+        program[0]
+        program[2]
+        # Block 1 was used least recently.
+        assert (program.cache_info()[:2] == (2, 3))
+        assert (program[0] is first)
+        program[1]
+        assert (program.cache_info() == (3, 4, 2, 2))
+        # Runs do not go through the cache.
+        list(program.blocks(3))
+        assert (program.cache_info() == (3, 4, 2, 2))
+
+    # The blocks compiled stay valid after closing.
+    assert (text_of(first) == text_of(program[0]))
+
+
+@pytest.mark.parametrize("text, message", [
+    ("O0001\nG00 X1\n%\n", "outside of data markers"),
+    ("%\nO0001\nG00 X1\n", "invalid number of data markers"),
+    ("%\n%\n%\n", "more than 2"),
+    ("", "invalid number of data markers"),
+])
+def test_invalid_files(tmp_path, text, message):
+    file_name = write_program(tmp_path, "bad.gcode", text)
+
+    with pytest.raises(ParseError, match=message):
+        Program(file_name)
+
+
+@pytest.mark.parametrize("name", ["mill", "mixed", "cycles", "offsets",
+                                  "arcs"])
+def test_state_of_every_block(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", PROGRAMS[name])
+    states = states_of(file_name)
+
+    with Program(file_name, interval=3) as program:
+        # Backwards, so most are not from a checkpoint of the way.
+        for index in reversed(range(len(program) + 1)):
+            assert (program.state(index) == states[index])
+        with pytest.raises(IndexError):
+            program.state(len(program) + 1)
+
+
+@pytest.mark.parametrize("name", ["tool_changes", "drilling",
+                                  "hole_pattern", "long_lines"])
+def test_restart_runs_on_as_from_the_beginning(tmp_path, name):
+    file_name = generated(tmp_path, name)
+    states = states_of(file_name)
+    rng = random.Random(name)
+
+    with Program(file_name, interval=7) as program:
+        for index in [rng.randrange(len(program)) for i in range(10)]:
+            assert (program.state(index) == states[index])
+            interpreter = program.restart(index, MachineClient(NullSink()))
+            for block in program.blocks(index):
+                for cmd in block.commands:
+                    interpreter.execute(cmd)
+            assert ((interpreter.machine.snapshot(),
+                     tuple(interpreter.modal)) == states[-1])
+
+
+def test_replayed_subprograms(tmp_path):
+    file_name = write_program(tmp_path, "sub.gcode", SUBPROGRAMS)
+    states = states_of(file_name)
+
+    with Program(file_name, interval=2) as program:
+        for index in range(len(program) + 1):
+            snapshot, modal = program.state(index)
+            # The calls replayed differ in the last bits of the position.
+            assert (snapshot[1:4] == pytest.approx(states[index][0][1:4],
+                                                   abs=1e-9))
+            assert (snapshot[4:] == states[index][0][4:])
+            assert (modal == states[index][1])
+
+
+def test_checkpoints(tmp_path):
+    file_name = generated(tmp_path, "tool_changes")
+    path = str(tmp_path / "cache" / "program.ckpt")
+    states = states_of(file_name)
+
+    with Program(file_name, interval=16) as program:
+        # Only the initial state is known before a run.
+        assert (not program.save_checkpoints(path))
+        program.state(len(program))
+        count = len(program._checkpoints)
+        assert (count == len(program) // 16 + 1)
+        assert (program.save_checkpoints(path))
+        assert (not program.save_checkpoints(path))
+
+    with Program(file_name, interval=16) as program:
+        assert (program.load_checkpoints(path))
+        assert (len(program._checkpoints) == count)
+        # From the saved checkpoint, without running the blocks before.
+        index = (count - 1) * 16
+        program.blocks = None
+        assert (program.state(index) == states[index])
+
+    # A different interval, fewer checkpoints or not a checkpoint file.
+    with Program(file_name, interval=8) as program:
+        assert (not program.load_checkpoints(path))
+    with Program(file_name, interval=16) as program:
+        program.state(len(program))
+        assert (not program.load_checkpoints(path))
+    with open(path, "wb") as f:
+        f.write(b"not a checkpoint file")
+    with Program(file_name, interval=16) as program:
+        assert (not program.load_checkpoints(path))
+        assert (not program.load_checkpoints(str(tmp_path / "missing")))
+    assert (os.listdir(str(tmp_path / "cache")) == ["program.ckpt"])
+
+
+def output_from_block(out, num):
+    """ The output of a run from a block on, to the end of the run. """
+    lines = out.splitlines()
+    for first, line in enumerate(lines):
+        if (line.startswith("Executing code block #{} ".format(num))):
+            break
+    for last, line in enumerate(lines):
+        if (line.startswith("Program #")):
+            break
+    return lines[first:last]
+
+
+def run_main(capsys, args):
+    """ Runs main.main(), returning the exit status and the output. """
+    status = main.main(["main.py"] + args)
+    # The machine of the run is shut down by the garbage collector.
+    gc.collect()
+    captured = capsys.readouterr()
+    return status, captured.out + captured.err
+
+
+@pytest.mark.parametrize("start", ["1", "10", "N14", "13"])
+def test_main_start(tmp_path, monkeypatch, capsys, start):
+    monkeypatch.setenv("CNC_SIM_CACHE_DIR", str(tmp_path / "cache"))
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    num = 10 if (start == "N14") else int(start)
+
+    status, out = run_main(capsys, ["--no-cache", file_name])
+    full = output_from_block(out, num)
+    for i in range(2):
+        # Without and with the saved checkpoints.
+        status, out = run_main(capsys, ["--start", start, file_name])
+        assert (status == 0)
+        assert (output_from_block(out, num) == full)
+        if (num == 10):
+            assert ("Now running the G-code program #1 from block 10 "
+                    "(line 13)." in out)
+
+
+def test_main_start_not_found(tmp_path, capsys):
+    file_name = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+
+    for start in ("0", "14", "N99", "x"):
+        status, out = run_main(capsys, ["--no-cache", "--start", start,
+                                        file_name])
+        assert (status == 1)
+        assert ("Error: block {} not found.".format(start) in out)
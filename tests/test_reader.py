@@ -0,0 +1,106 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_reader.py
+# Description: Checks of the memory mapped reader of reader.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# parse_mapped() must give the same blocks, program number and command
+# count as parse_file(). A ParseError raised while the file is mapped
+# must reach the caller as such, also through the program cache, and
+# not as a BufferError from closing the map.
+#
+
+import io
+
+import pytest
+
+import reader
+from main import parse_file
+from block import ParseError
+from reader import parse_mapped, parse_buffer
+from cache import parse_cached
+from tests.programs import PROGRAMS, block_values, write_program
+
+MALFORMED = {
+    "bad_value": "%\nO0001\nG90 G01 X- F100\n%\n",
+    "after_end": "%\nO0001\nG01 X1\n%\nG01 X2\n",
+    "bad_word": "%\nO0001\nG00 X1.0\nG02 X2 Y1 R1..5\n%\n",
+}
+
+
+def parse_text(text):
+    pgm_data = dict()
+    blocks = block_values(parse_file(io.StringIO(text), pgm_data))
+    return blocks, pgm_data
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_same_blocks_as_parse_file(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", PROGRAMS[name])
+    pgm_data = dict()
+    blocks = block_values(parse_mapped(file_name, pgm_data))
+
+    assert ((blocks, pgm_data) == parse_text(PROGRAMS[name]))
+
+
+def test_fast_path_lines():
+    # The G00/G01 lines matched in one go, and ones that look like them
+    # but are compiled word by word.
+    rows = ["G01 X1 Y2 Z3 F4", "N5 G0 X.5", "g1 y-2.", "G01 Z1 X2",
+            "G01 X1 F4 M08", "G010 X1", "G1\tX+1\r", "G00 X1 (NOTE)",
+            "G00"]
+    for txt_row in rows:
+        text = "%\nO0001\n" + txt_row + "\n%\n"
+        pgm_data = dict()
+        blocks = block_values(parse_buffer(text.encode(), pgm_data))
+        assert ((blocks, pgm_data) == parse_text(text))
+
+    with pytest.raises(ParseError, match="'X1..0' on line 3"):
+        list(parse_buffer(b"%\nO0001\nG01 X1..0 Y2\n%\n", dict()))
+
+
+def test_release_pages(tmp_path, monkeypatch):
+    # Releasing the parsed pages after every line changes nothing.
+    text = PROGRAMS["mill"]
+    file_name = write_program(tmp_path, "mill.gcode", text)
+    monkeypatch.setattr(reader, "RELEASE_LINES", 0)
+
+    assert (block_values(parse_mapped(file_name, dict()))
+            == parse_text(text)[0])
+
+
+def test_empty_file(tmp_path):
+    file_name = write_program(tmp_path, "empty.gcode", "")
+
+    with pytest.raises(ParseError, match="should have 2"):
+        list(parse_mapped(file_name, dict()))
+
+
+@pytest.mark.parametrize("name", sorted(MALFORMED))
+def test_mapped_parse_error(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", MALFORMED[name])
+
+    with pytest.raises(ParseError):
+        list(parse_mapped(file_name, dict()))
+
+
+@pytest.mark.parametrize("name", sorted(MALFORMED))
+def test_cached_parse_error(tmp_path, name):
+    file_name = write_program(tmp_path, name + ".gcode", MALFORMED[name])
+    directory = str(tmp_path / "cache")
+
+    for i in range(2):
+        with pytest.raises(ParseError):
+            list(parse_cached(file_name, dict(), parse_mapped, directory))
+    # A failed parse leaves no entry behind.
+    assert (list((tmp_path / "cache").iterdir()) == [])
+
+
+def test_mapped_early_close(tmp_path):
+    # A consumer stopping early (e.g. on a machine error) closes the map.
+    file_name = write_program(tmp_path, "ok.gcode",
+                      "%\nO0001\nG00 X1\nG01 X2 F100\nG01 X3\n%\n")
+    blocks = parse_mapped(file_name, dict())
+    next(blocks)
+    blocks.close()
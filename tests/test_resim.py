@@ -0,0 +1,164 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_resim.py
+# Description: Checks of the incremental re-simulation of resim.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# After any edit, a Session must have the same machine messages, line by
+# line, and the same end state as a new Session of the edited program,
+# whether it converged with the previous run or not.
+#
+
+import io
+import random
+
+import pytest
+
+import resim
+from resim import Session, diff_hunks
+from main import parse_file
+from block import ParseError
+from interpreter import Interpreter
+from machineclient import MachineClient
+from sinks import NullSink
+from benchmarks.generators import generate
+from tests.programs import PROGRAMS, SUBPROGRAMS
+
+
+def lines_of(text):
+    return text.splitlines(True)
+
+
+def check(session, lines):
+    """ Compares a session to a full run of its program. """
+    assert (session.lines == lines)
+    full = Session(lines, 10 ** 9)
+    assert (session.messages() == full.messages())
+    assert (session.state() == full.state())
+
+
+def random_edit(rng, lines, first, last):
+    """ Deletes, inserts or changes a random line between first and last,
+    copying lines of the program. """
+    index = rng.randrange(first, last)
+    new = list(lines)
+    source = rng.choice(lines[first:last])
+    op = rng.choice(("delete", "insert", "change"))
+    if (op == "delete"):
+        del new[index]
+    elif (op == "insert"):
+        new.insert(index, source)
+    else:
+        new[index] = source
+    return new
+
+
+@pytest.mark.parametrize("name", ["pocketing", "tool_changes", "drilling",
+                                  "hole_pattern"])
+def test_random_edits_match_full_run(tmp_path, name):
+    file_name = str(tmp_path / "program.gcode")
+    generate(name, file_name, 600)
+    with open(file_name) as f:
+        lines = f.readlines()
+    rng = random.Random(name)
+    session = Session(lines, 16)
+    converged = 0
+
+    for trial in range(15):
+        lines = random_edit(rng, lines, 8, len(lines) - 4)
+        result = session.update(lines)
+        converged += result["converged"]
+        check(session, lines)
+
+    if (name != "pocketing"):
+        # Pocketing is mostly incremental after a changed line.
+        assert (converged > 0)
+
+
+def test_state_matches_machine():
+    lines = lines_of(PROGRAMS["mill"])
+    session = Session(lines, 2)
+
+    machine = MachineClient(NullSink())
+    Interpreter(machine).run(parse_file(io.StringIO(PROGRAMS["mill"]),
+                                        dict()))
+    assert (session.state() == machine.get_state())
+    assert (session.messages(errors_only=True) == [])
+
+
+def test_edit_converges():
+    rows = ["%", "O0001", "G21 G90 G94"]
+    rows += ["G01 X{} Y{} F100".format(i % 7, i % 5) for i in range(200)]
+    rows += ["M30", "%"]
+    lines = [row + "\n" for row in rows]
+    session = Session(lines, 8)
+
+    new = list(lines)
+    new[100] = "G01 X50 Y50 F100\n"
+    result = session.update(new)
+    check(session, new)
+    assert (result["converged"])
+    assert (result["resumed"] <= 101)
+    assert (result["executed"] < 20)
+
+    # An incremental move moves everything after it.
+    newer = list(new)
+    newer[100] = "G91 G01 X1\n"
+    result = session.update(newer)
+    check(session, newer)
+    assert (not result["converged"])
+    assert (result["stopped"] == len(newer) + 1)
+
+
+@pytest.mark.parametrize("index, txt", [
+    # A data marker, a program number and a subprogram body.
+    (0, "\n"),
+    (1, "O0002\n"),
+    (10, "G01 X20.000 F300.\n"),
+])
+def test_full_run(index, txt):
+    lines = lines_of(SUBPROGRAMS)
+    session = Session(lines, 2)
+    new = list(lines)
+    new[index] = txt
+
+    if (index == 0):
+        with pytest.raises(ParseError):
+            session.update(new)
+        check(session, lines)
+        return
+    result = session.update(new)
+    check(session, new)
+    assert (result["resumed"] == 1)
+
+
+def test_invalid_edit_changes_nothing():
+    lines = lines_of(PROGRAMS["mill"])
+    session = Session(lines, 2)
+    new = list(lines)
+    new[8] = "G01 X1..0\n"
+
+    with pytest.raises(ParseError):
+        session.update(new)
+    check(session, lines)
+    with pytest.raises(ValueError):
+        session.replace(len(lines), 2, [])
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_diff_hunks(monkeypatch, seed):
+    monkeypatch.setattr(resim, "COMPARE_CHUNK", 4)
+    monkeypatch.setattr(resim, "DIFF_LIMIT", 50 if (seed % 2) else 5)
+    rng = random.Random(seed)
+    old = [str(rng.randrange(10)) for i in range(60)]
+    new = list(old)
+    for i in range(rng.randint(0, 6)):
+        new = random_edit(rng, new, 0, len(new))
+
+    rebuilt = list(old)
+    shift = 0
+    for index, count, lines in diff_hunks(old, new):
+        rebuilt[index + shift : index + shift + count] = lines
+        shift += len(lines) - count
+    assert (rebuilt == new)
@@ -0,0 +1,124 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_sinks.py
+# Description: Checks of the output sinks of sinks.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A quiet run must output the same machine errors as a full text run,
+# also for the subprogram calls it replays, and the same end state.
+#
+
+import io
+
+import main
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from subprogram import Subprograms
+from sinks import QuietSink, EventListSink, JsonLinesSink
+
+PROGRAM = """%
+O0001
+G21 G17 G94
+G02 X10 Y0 R5 F100
+G91
+M98 P2000 L3
+M98 P3000 L4
+M30
+O2000
+G01 X1 F100
+G02 X1 Y1
+M99
+O3000
+G01 X2.5 Y-1 F200
+M99
+%
+"""
+
+
+class Output:
+    """ Output stream of a sink. Unlike io.StringIO it is not closed
+    when collected, so the machine can still write its last message
+    whenever it is collected. """
+
+    def __init__(self):
+        self.parts = list()
+
+
+    def write(self, txt):
+        self.parts.append(txt)
+
+
+    def flush(self):
+        pass
+
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+def compile_program(text):
+    return list(parse_file(io.StringIO(text), dict()))
+
+
+def run(sink, replay):
+    """ Runs PROGRAM the way main.run_program() does. """
+    machine = MachineClient(sink)
+    program = Subprograms(compile_program(PROGRAM))
+    interpreter = Interpreter(machine, program, replay=replay)
+    for num, block in enumerate(program, 1):
+        sink.block_begin(num, block)
+        for cmd in block.commands:
+            sink.command(cmd)
+            interpreter.execute(cmd)
+        sink.block_end(num, block)
+    sink.close()
+    return machine
+
+
+def test_quiet_errors_match_text_run():
+    events = EventListSink()
+    full = run(events, replay=False)
+    expected = [text for text in events.messages() if ("Error" in text)]
+
+    stream = Output()
+    quiet = run(QuietSink(stream), replay=True)
+    lines = stream.getvalue().splitlines()
+
+    # One error in the main program, one for every call of O2000.
+    assert (len(expected) == 4)
+    assert ([line.split(": ", 1)[1] for line in lines] == expected)
+    assert ([line.split(":")[0] for line in lines]
+            == ["----> line 4"] + ["----> line 6"] * 3)
+    assert (quiet.snapshot() == full.snapshot())
+
+
+def test_quiet_replays_error_free_bodies():
+    stream = Output()
+    machine = MachineClient(QuietSink(stream))
+    interpreter = Interpreter(machine, replay=True)
+    interpreter.run(compile_program(PROGRAM))
+
+    replayed = {key[0] for key in interpreter.subprograms.replays}
+    assert (replayed == {3000})
+
+
+def test_main_quiet_outputs_errors(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv("CNC_SIM_CACHE_DIR", str(tmp_path / "cache"))
+    file_name = tmp_path / "errors.gcode"
+    file_name.write_text(PROGRAM)
+
+    assert (main.main(["main.py", "-q", str(file_name)]) == 0)
+    lines = capsys.readouterr().out.splitlines()
+    assert (len(lines) == 4)
+    assert (all("Error" in line for line in lines))
+
+
+def test_json_lines_events():
+    stream = Output()
+    run(JsonLinesSink(stream), replay=False)
+    text = stream.getvalue()
+
+    assert (text.count('"event": "status"') > 4)
+    assert (text.count("Error") == 4)
@@ -0,0 +1,115 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_stock.py
+# Description: Brute-force reference checks of stock.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# Stock.cut() must give the same heightmap as cutting every segment into
+# every grid point, one at a time in plain Python. The grid is split into
+# tiles that do not divide it evenly, and the segments into chunks of a
+# few grid points, so the boundaries of both are crossed.
+#
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import stock
+from stock import Stock
+
+ORIGIN = (-3.0, 2.0)
+SIZE = (24.5, 19.0)
+RESOLUTION = 0.5
+TOP = 0.0
+
+
+def reference_surface(p0, p1, radius):
+    """ Heightmap of the segments, one grid point and segment at a time. """
+    rows = int(SIZE[1] / RESOLUTION) + 1
+    cols = int(SIZE[0] / RESOLUTION) + 1
+    heights = [[TOP] * cols for i in range(rows)]
+    for a, b, r in zip(p0, p1, radius):
+        dx = b[0] - a[0]
+        dy = b[1] - a[1]
+        length2 = dx * dx + dy * dy
+        # A plunge cuts to its lowest point.
+        az = a[2] if (length2 > 0.0) else min(a[2], b[2])
+        for i in range(rows):
+            y = ORIGIN[1] + i * RESOLUTION
+            for j in range(cols):
+                x = ORIGIN[0] + j * RESOLUTION
+                t = 0.0
+                if (length2 > 0.0):
+                    t = ((x - a[0]) * dx + (y - a[1]) * dy) / length2
+                    t = min(max(t, 0.0), 1.0)
+                ex = a[0] + t * dx - x
+                ey = a[1] + t * dy - y
+                if (ex * ex + ey * ey <= r * r):
+                    z = float(np.float32(az + t * (b[2] - a[2])))
+                    heights[i][j] = min(heights[i][j], z)
+    return np.array(heights, dtype=np.float32)
+
+
+def random_segments(rng, num):
+    """ Feed moves partly outside the stock, with some plunges. """
+    p0 = list()
+    p1 = list()
+    for i in range(num):
+        start = [rng.uniform(-8.0, 26.0), rng.uniform(-3.0, 26.0),
+                 rng.uniform(-4.0, 1.0)]
+        if (i % 5 == 0):
+            end = [start[0], start[1], rng.uniform(-4.0, 1.0)]
+        else:
+            end = [rng.uniform(-8.0, 26.0), rng.uniform(-3.0, 26.0),
+                   rng.uniform(-4.0, 1.0)]
+        p0.append(start)
+        p1.append(end)
+    radius = [rng.uniform(0.2, 4.0) for i in range(num)]
+    return p0, p1, radius
+
+
+def cut_stock(p0, p1, radius, tile):
+    result = Stock(ORIGIN, SIZE, RESOLUTION, TOP, tile)
+    result.cut(p0, p1, radius)
+    return result
+
+
+@pytest.mark.parametrize("tile", [1, 3, 7, 256])
+def test_tiles_match_reference(tile):
+    p0, p1, radius = random_segments(random.Random(1), 30)
+    expected = reference_surface(p0, p1, radius)
+    result = cut_stock(p0, p1, radius, tile)
+
+    surface = result.surface()
+    assert (surface.shape == expected.shape == (39, 50))
+    assert (np.abs(surface - expected).max() <= 1e-5)
+    volume = float(np.sum(TOP - expected, dtype=np.float64)) \
+        * RESOLUTION * RESOLUTION
+    assert (result.removed_volume() == pytest.approx(volume, rel=1e-6))
+
+
+@pytest.mark.parametrize("max_pairs", [1, 5, 50, 400])
+def test_chunks_match_reference(monkeypatch, max_pairs):
+    # The first segment covers far more than max_pairs grid points.
+    p0, p1, radius = random_segments(random.Random(2), 20)
+    p0[0] = [-5.0, 0.0, -1.0]
+    p1[0] = [22.0, 21.0, -2.0]
+    radius[0] = 3.0
+    expected = reference_surface(p0, p1, radius)
+
+    monkeypatch.setattr(stock, "MAX_PAIRS", max_pairs)
+    surface = cut_stock(p0, p1, radius, 7).surface()
+    assert (np.abs(surface - expected).max() <= 1e-5)
+
+
+def test_segments_outside_stock():
+    p0 = [[-20.0, -20.0, -1.0], [40.0, 5.0, -1.0]]
+    p1 = [[-20.0, 40.0, -1.0], [40.0, 5.0, -5.0]]
+    result = cut_stock(p0, p1, [1.0, 2.0], 3)
+
+    assert (result.cut(p0, p1, [1.0, 2.0]) == 0)
+    assert (result.removed_volume() == 0.0)
+    assert ((result.surface() == TOP).all())
@@ -0,0 +1,201 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_subprogram.py
+# Description: Checks of the subprogram calls of subprogram.py and
+#   interpreter.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# A subprogram call must move the machine exactly as the body written
+# out in place of the call, and a replayed call exactly as a call that
+# is run.
+#
+
+import io
+import random
+
+import pytest
+
+from main import parse_file
+from block import Opcode
+from interpreter import Interpreter
+from machineclient import MachineClient
+from subprogram import MAX_DEPTH, Subprograms
+from sinks import NullSink, EventListSink
+from tests.programs import SUBPROGRAMS
+
+# SUBPROGRAMS with the calls written out.
+EXPANDED = """%
+O1000
+G90 G94 G21 G17
+G00 X0 Y0 Z0
+G91
+G01 X10.000 F300.
+G01 Y5.000
+G02 X2 Y0 R1
+G02 X2 Y0 R1
+G01 X10.000 F300.
+G01 Y5.000
+G02 X2 Y0 R1
+G02 X2 Y0 R1
+G01 X10.000 F300.
+G01 Y5.000
+G02 X2 Y0 R1
+G02 X2 Y0 R1
+G90 G00 X100
+G01 Y1
+M30
+%
+"""
+
+
+class Positions:
+    """ Recorder of every position of a machine. """
+
+    def __init__(self):
+        self.points = list()
+
+
+    def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+        self.points.append((x, y, z))
+
+
+def compile_program(text):
+    return list(parse_file(io.StringIO(text), dict()))
+
+
+def run(text, replay=False, sink=None):
+    recorder = Positions()
+    machine = MachineClient(NullSink() if (sink is None) else sink)
+    machine.set_recorder(recorder)
+    interpreter = Interpreter(machine, replay=replay)
+    interpreter.run(compile_program(text))
+    return interpreter, recorder.points
+
+
+def errors(sink):
+    return [template.format(*args) for kind, (template, args)
+            in sink.events if (kind == "status") and ("Error" in template)]
+
+
+def test_definitions_are_split_off():
+    program = Subprograms(compile_program(SUBPROGRAMS))
+    main_lines = [block.line for block in program]
+
+    assert (main_lines == [3, 4, 5, 6, 7, 8, 9])
+    assert (sorted(program.bodies) == [2000, 2100, 3000])
+    assert ([block.line for block in program.bodies[2000]]
+            == [11, 12, 13, 14])
+    assert (program.bodies[2100][-1].commands[0].op == Opcode.M99)
+
+
+def test_call_reads_ahead():
+    program = Subprograms(compile_program(SUBPROGRAMS))
+    blocks = iter(program)
+    next(blocks)
+
+    assert (program.missing(program.bodies.values()) is None)
+    assert (len(program.get(3000)) == 2)
+    # The main program blocks read past are still given in order.
+    assert ([block.line for block in blocks] == [4, 5, 6, 7, 8, 9])
+    assert (program.get(4000) is None)
+
+
+def test_call_moves_as_the_written_out_body():
+    interpreter, points = run(SUBPROGRAMS)
+    expanded, expanded_points = run(EXPANDED)
+
+    assert (points == expanded_points)
+    assert (interpreter.machine.get_state()
+            == expanded.machine.get_state())
+
+
+def random_program(rng):
+    """ A main program calling incremental subprograms in both distance
+    modes and in other modal states. """
+    rows = ["%", "O1", "G21 G94 G17 F200"]
+    for i in range(40):
+        r = rng.random()
+        if (r < 0.3):
+            rows.append("G91 M98 P{} L{}".format(rng.choice((10, 20, 30)),
+                                                 rng.randint(1, 4)))
+        elif (r < 0.4):
+            rows.append("G90 M98 P10")
+        elif (r < 0.5):
+            rows.append(rng.choice(("G17", "G18", "G20", "G21", "S100 M03")))
+        else:
+            rows.append("G90 G01 X{:.1f} Y{:.1f}".format(
+                rng.uniform(-20, 20), rng.uniform(-20, 20)))
+    rows += ["M30",
+             "O10", "G01 X1.5 Y-0.5", "G00 Z0.25", "M99",
+             "O20", "G02 X2 Y0 R1", "M98 P10 L2", "M99",
+             "O30", "G01 X1", "G03 X0 Y1 R1", "M05", "M99", "%"]
+    return "\n".join(rows) + "\n"
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3, 4])
+def test_replay_matches_the_run(seed):
+    text = random_program(random.Random(seed))
+    interpreter, points = run(text)
+    replayed, replayed_points = run(text, replay=True)
+
+    state = interpreter.machine.get_state()
+    replayed_state = replayed.machine.get_state()
+    for axis in "xyz":
+        assert (replayed_state["pos"][axis]
+                == pytest.approx(state["pos"][axis], abs=1e-9))
+    del state["pos"], replayed_state["pos"]
+    assert (replayed_state == state)
+    assert (replayed.modal == interpreter.modal)
+    assert (len(replayed.subprograms.replays) > 0)
+    # The replayed calls skip the moves.
+    assert (len(replayed_points) < len(points))
+
+
+def test_absolute_bodies_are_not_replayed():
+    text = ("%\nO1\nG21 G91 G94 F100\nM98 P10 L5\nM98 P20 L5\nM30\n"
+            "O10\nG90 G01 X1\nM99\n"
+            "O20\nG01 X1\nM98 P10\nM99\n%\n")
+    interpreter, points = run(text, replay=True)
+    program = interpreter.subprograms
+
+    assert (not program.is_relative(10))
+    assert (not program.is_relative(20))
+    assert (program.replays == dict())
+    assert (interpreter.machine.get_position() == (1.0, 0.0, 0.0))
+
+
+def test_nesting_limit():
+    sink = EventListSink()
+    text = "%\nO1\nG21 G91 G94 F100\nM98 P10\nG01 X1\nM30\n" \
+           "O10\nG01 X1\nM98 P10\nM99\n%\n"
+    interpreter, points = run(text, sink=sink)
+
+    assert (errors(sink) == ["call_subprogram(): Error, more than {} nested "
+                             "subprogram calls.".format(MAX_DEPTH)])
+    assert (interpreter.machine.get_position()
+            == (MAX_DEPTH + 1.0, 0.0, 0.0))
+    assert (interpreter._depth == 0)
+    assert (not interpreter.subprograms.is_relative(10))
+
+
+def test_missing_subprogram_and_return():
+    sink = EventListSink()
+    text = "%\nO1\nG21 G91 G94\nM98 P9999\nM98\nM99\nM30\n%\n"
+    run(text, sink=sink)
+
+    assert (errors(sink) == [
+        "call_subprogram(): Error, subprogram O9999 not found.",
+        "call_subprogram(): Error, subprogram ONone not found.",
+        "return_subprogram(): Error, not in a subprogram.",
+    ])
+
+
+def test_definition_without_return():
+    # Ends at the next definition or at the end of the program.
+    text = "%\nO1\nG21 G91 G94 F100\nM98 P10 L2\nM98 P20\nM30\n" \
+           "O10\nG01 X1\nO20\nG01 Y1\n%\n"
+    interpreter, points = run(text)
+
+    assert (sorted(interpreter.subprograms.bodies) == [10, 20])
+    assert (interpreter.machine.get_position() == (2.0, 1.0, 0.0))
@@ -0,0 +1,158 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_toolpath.py
+# Description: Checks of the batch toolpath of toolpath.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The waypoints of build_toolpath() must be the positions MachineClient
+# reaches, move by move, when it runs the same program: these are taken
+# from the recorder of the machine (see MachineClient.set_recorder()).
+#
+
+import io
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient, MOTION_MODE_RAPID
+from sinks import NullSink
+from block import compile_block, pack_blocks
+from subprogram import Subprograms
+from toolpath import (build_toolpath, build_toolpath_records, extract_moves,
+    extract_records, pack_program)
+from tests.programs import PROGRAMS
+
+
+class Positions:
+    """ Recorder of the positions of a machine. Homing (G28) records the
+    axes it homes even when they are there already; the toolpath has no
+    such zero-length moves, so they are left out. """
+
+    def __init__(self):
+        self.points = [(0.0, 0.0, 0.0)]
+        self.modes = list()
+
+
+    def record(self, x, y, z, motion_mode, feed_rate, tool_name):
+        if ((x, y, z) == self.points[-1]):
+            return
+        self.points.append((x, y, z))
+        self.modes.append(motion_mode)
+
+
+def machine_positions(blocks):
+    recorder = Positions()
+    machine = MachineClient(NullSink())
+    machine.set_recorder(recorder)
+    Interpreter(machine).run(blocks)
+    return np.array(recorder.points), np.array(recorder.modes)
+
+
+def same_moves(a, b):
+    """ Compares two results of extract_moves(), arrays by value. """
+    if (isinstance(a, dict)):
+        return ((set(a) == set(b)) and all(same_moves(a[key], b[key])
+                                            for key in a))
+    if (isinstance(a, np.ndarray)):
+        b = np.asarray(b)
+        return ((a.dtype == b.dtype) and np.array_equal(a, b,
+            equal_nan=(a.dtype.kind == "f")))
+    if (isinstance(a, list)):
+        return (len(a) == len(b))
+    return (a == b)
+
+
+def random_program(rng, num):
+    """ Straight moves in both distance modes, with homing and unit
+    changes in between. """
+    rows = ["G21 G94 G17", "G90"]
+    for i in range(num):
+        r = rng.random()
+        if (r < 0.05):
+            rows.append("G91")
+        elif (r < 0.1):
+            rows.append("G90")
+        elif (r < 0.12):
+            rows.append("G28 Z0")
+        elif (r < 0.13):
+            rows.append(rng.choice(["G20", "G21"]))
+        else:
+            words = [rng.choice(["G00", "G01", ""])]
+            for axis in "XYZ":
+                if (rng.random() < 0.6):
+                    words.append("{}{:.1f}".format(axis,
+                                                   rng.uniform(-50, 50)))
+            if (rng.random() < 0.1):
+                words.append("F100")
+            rows.append(" ".join(words))
+    blocks = [compile_block(txt_row, n) for n, txt_row in enumerate(rows, 1)]
+    return [block for block in blocks if (block is not None)]
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_points_match_machine(name):
+    blocks = list(parse_file(io.StringIO(PROGRAMS[name]), dict()))
+    toolpath = build_toolpath(blocks)
+    points, modes = machine_positions(blocks)
+
+    assert (toolpath["points"].shape == points.shape)
+    assert (np.allclose(toolpath["points"], points, rtol=0.0, atol=1e-9))
+    assert (len(toolpath["index"]) == len(points) - 1)
+    if (name != "cycles"):
+        # The rapid parts of a cycle are recorded in the cycle mode.
+        assert ((toolpath["rapid"] == (modes == MOTION_MODE_RAPID)).all())
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_random_points_match_machine(seed):
+    blocks = random_program(random.Random(seed), 2000)
+    toolpath = build_toolpath(blocks)
+    points, modes = machine_positions(blocks)
+
+    assert (np.allclose(toolpath["points"], points, rtol=0.0, atol=1e-9))
+
+
+def test_subprograms_given_as_such():
+    text = PROGRAMS["subprograms"]
+    blocks = list(parse_file(io.StringIO(text), dict()))
+    toolpath = build_toolpath(Subprograms(iter(blocks)))
+
+    assert (np.array_equal(toolpath["points"],
+                           build_toolpath(blocks)["points"]))
+
+
+def test_start_position():
+    blocks = [compile_block("G91 G01 X1 F100"), compile_block("Y2")]
+    toolpath = build_toolpath(blocks, start=(10.0, 20.0, 30.0))
+
+    assert (toolpath["points"].tolist()
+            == [[10.0, 20.0, 30.0], [11.0, 20.0, 30.0], [11.0, 22.0, 30.0]])
+
+
+@pytest.mark.parametrize("name", ["mill", "mixed", "offsets", "arcs"])
+def test_records_match_blocks(name):
+    # Programs without subprograms or cycles are extracted from the
+    # packed records in batch; the result must be the same.
+    blocks = [block for block
+              in parse_file(io.StringIO(PROGRAMS[name]), dict())
+              if (name != "mixed") or (block.line != 17)]
+    data, words, rest = pack_program(blocks)
+    assert (rest is None)
+
+    assert (same_moves(extract_moves(blocks), extract_records(data, words)))
+
+    assert (np.array_equal(build_toolpath_records(data, words)["points"],
+                           build_toolpath(blocks)["points"]))
+
+
+def test_records_leave_serial_programs():
+    blocks = list(parse_file(io.StringIO(PROGRAMS["cycles"]), dict()))
+    data, words, rest = pack_program(blocks)
+    assert (rest is not None)
+
+    assert (extract_records(*pack_blocks(blocks)) is None)
@@ -0,0 +1,172 @@
+#
+# Title: G-code interpreter program
+# File: tests/test_validator.py
+# Description: Checks of the static modal check of validator.py.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The validator must report the errors the machine reports when it runs
+# the program, at the same lines, without running it; and the errors
+# the machine does not see, like two motion commands in one block.
+#
+
+import io
+
+import pytest
+
+import main
+from main import parse_file
+from interpreter import Interpreter
+from machineclient import MachineClient
+from subprogram import Subprograms
+from sinks import EventListSink
+from validator import ERROR, WARNING, validate_blocks, format_problems
+from tests.programs import PROGRAMS, write_program
+
+# Bodies of programs with errors the machine finds too.
+MODAL_ERRORS = [
+    # Moves and arcs before the distance mode.
+    "G21 G94\nG00 X1\nG02 X2 Y1 R1 F100\n",
+    # Feed rates without a feed rate mode and in inverse time.
+    "G21 G90\nG01 X1 F100\nG93\nG01 X2 F5\n",
+    # Axis words before any motion mode and after a canned cycle; G80
+    # leaves a move as the motion mode.
+    "G21 G90 G94\nX1\nG01 X2 F100\nG80\nY3\nG81 X1 R1 Z-1\nG80\nX2\n",
+    "G21 G90 G94 F100\nG02 X1 Y1\n",
+    "G21 G90 G94\nG43 Z1\nG10 L3 P1\nM99\nM98 P77\n",
+    "G21 G90 G94\nG81 X1 Y1 F100\nG83 X2 R2 Z-5\nG73 X3 R1 Z-2 Q-1\n",
+]
+
+
+def compile_program(text):
+    return list(parse_file(io.StringIO(text), dict()))
+
+
+def program(rows):
+    return "%\nO0001\n" + rows + "%\n"
+
+
+def machine_errors(blocks):
+    """ Runs a program, returning the lines and the messages of the
+    errors of the machine. """
+    sink = EventListSink()
+    program = Subprograms(blocks)
+    interpreter = Interpreter(MachineClient(sink), program)
+    for num, block in enumerate(program, 1):
+        sink.block_begin(num, block)
+        for cmd in block.commands:
+            interpreter.execute(cmd)
+
+    errors = list()
+    line = None
+    for kind, data in sink.events:
+        if (kind == "block"):
+            line = data[1].line
+        elif ((kind == "status") and ("Error" in data[0])):
+            errors.append((line, data[0].format(*data[1])))
+    return errors
+
+
+def error_lines(found):
+    return [line for line, kind, message in found if (kind == ERROR)]
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_sample_programs(name):
+    blocks = compile_program(PROGRAMS[name])
+    found = validate_blocks(blocks)
+
+    assert (error_lines(found)
+            == [line for line, message in machine_errors(blocks)])
+    assert ([kind for line, kind, message in found] == [ERROR] * len(found))
+
+
+@pytest.mark.parametrize("rows", MODAL_ERRORS)
+def test_same_errors_as_the_machine(rows):
+    blocks = compile_program(program(rows))
+    found = validate_blocks(blocks)
+    errors = machine_errors(blocks)
+
+    assert (len(errors) > 0)
+    assert (error_lines(found) == [line for line, message in errors])
+
+
+def test_subprogram_errors():
+    # Reported once at the line of the body, where the machine reports
+    # them at every call.
+    blocks = compile_program(program("G21 G94\nM98 P10 L3\nG90\nM98 P10\n"
+                                     "M30\nO10\nG01 X1 F100\nM99\n"))
+    assert (validate_blocks(blocks) == [(9, ERROR, "distance mode not set")])
+    assert (machine_errors(blocks)
+            == [(4, "move(): Error, distance mode not set.")] * 3)
+
+    blocks = compile_program(program("G21 G90 G94\nM98 P10\nM30\nO10\n"
+                                     "G91 G01 X1 F100\nM98 P10\nM99\n"))
+    assert (validate_blocks(blocks)
+            == [(8, ERROR, "more than 8 nested subprogram calls")])
+    assert (machine_errors(blocks)
+            == [(4, "call_subprogram(): Error, more than 8 nested "
+                    "subprogram calls.")])
+
+
+def test_known_modal_errors():
+    blocks = compile_program(program("G21\n"
+                                     "G01 X1 F100\n"
+                                     "G90 G91 G00 X1\n"
+                                     "G02 X2 Y1 R1\n"
+                                     "G20 G21\n"
+                                     "G00 G01 G80 X1\n"))
+
+    assert (validate_blocks(blocks) == [
+        (4, ERROR, "unknown feed rate mode"),
+        (4, ERROR, "distance mode not set"),
+        (5, ERROR, "G90 and G91 in the same block (distance group)"),
+        (6, WARNING, "plane not selected, arc in the X/Y plane"),
+        (7, ERROR, "G20 and G21 in the same block (units group)"),
+        (8, ERROR, "G00 and G01 in the same block (motion group)"),
+    ])
+
+
+def test_warnings():
+    blocks = compile_program(program("G90 G94\nG01 X1 F100\nX2\n"
+                                     "G21 G02 X3 Y1 R1\n"))
+
+    assert (validate_blocks(blocks) == [
+        (4, WARNING, "units not set, move in undefined units"),
+        (5, WARNING, "units not set, move in undefined units"),
+        (6, WARNING, "plane not selected, arc in the X/Y plane"),
+    ])
+
+
+def test_compatible_commands():
+    blocks = compile_program(program("G21 G90 G94 G80 G00 X1\nM07 M08\n"
+                                     "G17 G01 X2 F100\nM30\nG01 X1\n"))
+
+    assert (validate_blocks(blocks) == [])
+
+
+def test_format_problems():
+    assert (format_problems([(3, ERROR, "distance mode not set"),
+                             (5, WARNING, "plane not selected")])
+            == ["line 3: Error, distance mode not set.",
+                "line 5: Warning, plane not selected."])
+
+
+def test_main_check(tmp_path, capsys):
+    good = write_program(tmp_path, "mill.gcode", PROGRAMS["mill"])
+    bad = write_program(tmp_path, "bad.gcode",
+                        program("G21 G94\nG00 X1\nG90 G91\n"))
+
+    assert (main.main(["main.py", "--check", "--no-cache", good]) == 0)
+    out = capsys.readouterr().out.splitlines()
+    assert ("Program #1 (26 commands): 0 errors, 0 warnings." in out)
+
+    assert (main.main(["main.py", "--check", "--no-cache", bad]) == 4)
+    out = capsys.readouterr().out.splitlines()
+    assert (out[-3:] == [
+        "Program #1 (5 commands): 2 errors, 0 warnings.",
+        "line 4: Error, distance mode not set.",
+        "line 5: Error, G90 and G91 in the same block (distance group).",
+    ])
+    # Nothing was run.
+    assert (not any("Moving" in line for line in out))
@@ -0,0 +1,1032 @@
+#
+# Title: G-code interpreter program
+# File: toolpath.py
+# Description: Batch (NumPy) evaluation of the rapid, linear and arc
+#   moves of a compiled program.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# MachineClient runs a program one axis move at a time. For long programs
+# the same toolpath can be computed here in batch: one pass collects the
+# moves of the compiled blocks into arrays, and the absolute positions
+# and the axis ordering of MachineClient.move() are then resolved with
+# array operations. Arcs (G02/G03) are split into the same chords as
+# MachineClient.arc_move() makes (see arcs.py); the chords of repeated
+# arcs come from the cache of arcs.py. Every hole of a canned cycle is a
+# move to its retract level, expanded into the moves of the cycle by
+# template (see cycles.py). Subprogram calls add the moves of
+# the subprogram, incremental ones as copies of the rows of an earlier
+# call, which the cumulative sums then place where the call starts.
+#
+# Programs without subprograms or canned cycles, the long generated ones
+# mostly, skip the pass: their blocks are packed into the records of
+# block.pack_blocks() (or read as such from the program cache) and the
+# moves picked out of the records by extract_records(), each mode filled
+# forward from the commands that set it.
+#
+# The coordinates are kept as written, with the work offset, tool length
+# offset and units in effect for every move (see offsets.py); the
+# positions are turned into machine coordinates in one go by
+# resolve_positions().
+#
+# Requires NumPy.
+#
+
+import itertools
+from array import array
+
+import numpy as np
+
+from block import (Opcode, FLAG_X, FLAG_Y, FLAG_Z, FLAG_F, FLAG_I,
+    FLAG_J, FLAG_K, FLAG_R, FLAG_H, pack_blocks, unpack_blocks)
+from machineclient import (MOTION_MODE_RAPID, MOTION_MODE_LINEAR, UNDEFINED,
+    MOTION_MODE_ARC_CW, MOTION_MODE_ARC_CCW, MOTION_MODE_CYCLE, PLANE_XY,
+    PLANE_ZX, PLANE_YZ, PLANE_AXES, FEED_MODE_INVTIME, FEED_MODE_UPMIN,
+    FEED_MODE_UPREV)
+from arcs import arc_center, segment_arc
+from cycles import CYCLE_OPS, make_template, expand_batch
+from subprogram import Subprograms, MAX_DEPTH, call_params
+from offsets import OffsetTable, IDENTITY, INCH, apply_batch
+
+# Smallest axis movement that is carried out (same as MachineClient).
+MIN_MOVE = 0.001
+# The packed records of block.pack_blocks() as a NumPy type. The values
+# are X, Y, Z, F, I, J, K, R, P, L, H and Q.
+RECORD_DTYPE = np.dtype([("line", "<u4"), ("op", "u1"), ("flags", "<u2"),
+                         ("arg", "<i8"), ("values", "<f8", (12,))])
+# Commands that extract_records() leaves to extract_moves(): subprograms
+# and canned cycles.
+SERIAL_OPS = frozenset((Opcode.O, Opcode.M98) + tuple(CYCLE_OPS))
+# Commands that change the work offset, tool length offset or units.
+OFFSET_OPS = (Opcode.G54, Opcode.G55, Opcode.G56, Opcode.G57, Opcode.G58,
+              Opcode.G59, Opcode.G20, Opcode.G21, Opcode.G49, Opcode.G10,
+              Opcode.G43, Opcode.M30)
+# Number of blocks packed at a time by pack_program().
+PACK_BLOCKS = 4096
+
+
+def extract_moves(blocks):
+    """ Collects the moves of compiled blocks into arrays. The distance
+    mode (G90/G91), the plane, the motion mode, the canned cycle, the 
+    feed rate and its mode, the spindle speed, the tool and the offsets
+    and units are tracked; moves made while the distance mode is not set
+    are skipped, like MachineClient.move() does.
+    Subprogram calls (M98) add the moves of the subprogram. The rows of
+    an incremental subprogram started in the same state as before are
+    copied from its earlier call instead of going through its blocks
+    again (see subprogram.py).
+    Args:
+      blocks (iterable): compiled Block objects, or a Subprograms of 
+        them.
+    Returns:
+      A dict of NumPy arrays, one row per move:
+        "xyz" (N x 3 float64): coordinates as written, NaN if not given.
+        "inc" (bool): True for incremental (G91) moves.
+        "motion" (int8): MOTION_MODE_RAPID, MOTION_MODE_LINEAR,
+          MOTION_MODE_ARC_CW, MOTION_MODE_ARC_CCW or MOTION_MODE_CYCLE.
+        "block" (int64): index of the main program block the move is in
+          (for subprograms, the block of the call).
+        "line" (int64): source line of the move.
+        "feed" (float64): F value in effect (0 if none).
+        "feed_mode" (int8): FEED_MODE_* in effect, or UNDEFINED.
+        "speed" (float64): spindle speed in effect [rpm].
+        "tool" (int64): number of the tool in the spindle (0 if none).
+        "transform" (int64): row of "transforms" in effect.
+      and in addition:
+        "transforms" (K x 4 float64): the (scale, x, y, z) transforms
+          from program to machine coordinates (see offsets.py), the
+          first one the identity.
+        "tool_changes" (dict): "block" and "tool" arrays, one row per
+          M06 tool change.
+        "arcs" (dict): one row per arc move: "move" (int64) the row of
+          the move, "ijk" (K x 3 float64) the center offsets, NaN if not
+          given, "radius" (float64) the R value or NaN, and "plane"
+          (int8) the PLANE_* in effect.
+        "cycles" (dict): one row per hole of a canned cycle: "move"
+          (int64) the row of the move, "first" (int64) the row of the
+          first hole of its block, "r" (float64) the R word, "retract_r"
+          (bool) True for G99 and "template" (int64) the index of its
+          steps in "templates". The move of a hole goes to the X/Y of
+          the hole and, when it is known before the block starts, to 
+          the retract level, see resolve_positions().
+        "templates" (list): steps of the cycles (see cycles.py).
+        "num_blocks" (int): number of main program blocks read.
+        "block_lines" (int64): source line of every main program block.
+    """
+    nan = float("nan")
+    xyz = array("d")
+    inc = array("b")
+    motion = array("b")
+    block_index = array("q")
+    line_num = array("q")
+    feed = array("d")
+    feed_mode = array("b")
+    speed = array("d")
+    tool = array("q")
+    transform = array("q")
+    change_block = array("q")
+    change_tool = array("q")
+    block_lines = array("q")
+    arc_move = array("q")
+    arc_ijk = array("d")
+    arc_radius = array("d")
+    arc_plane = array("b")
+    cycle_move = array("q")
+    cycle_first = array("q")
+    cycle_r = array("d")
+    cycle_retract_r = array("b")
+    cycle_template = array("q")
+    templates = list()
+    # Templates by their steps and by the words of the cycle.
+    template_ids = dict()
+    template_keys = dict()
+
+    if (not isinstance(blocks, Subprograms)):
+        blocks = Subprograms(blocks)
+    program = blocks
+    # Distance mode (None if not set), feed rate, feed mode, spindle
+    # speed, selected tool, tool in the spindle, plane, motion opcode,
+    # transform, canned cycle words (opcode, R, Z, Q, P) and the G99 
+    # flag, passed between the main program and the subprograms.
+    state = [None, 0.0, UNDEFINED, 0.0, 0, 0, UNDEFINED, None, 0, None,
+             False]
+    offsets = OffsetTable()
+    transforms = [IDENTITY]
+    transform_ids = {IDENTITY: 0}
+    # Number of offset and unit changes, see call().
+    offset_changes = [0]
+
+    def set_transform():
+        # Returns the row of the transform of the offsets.
+        offset_changes[0] += 1
+        key = offsets.transform
+        num = transform_ids.get(key)
+        if (num is None):
+            num = len(transforms)
+            transform_ids[key] = num
+            transforms.append(key)
+        return num
+    # Rows added by incremental subprograms: (number, state at the call)
+    # -> (first row, end row, first arc row, end arc row, first cycle
+    # row, end cycle row, end state).
+    replays = dict()
+
+    def run(blocks, call_block, depth):
+        # Extracts the moves of the main program (call_block is None) or
+        # of a subprogram body called from the block call_block. Returns
+        # the number of blocks read.
+        (dist_inc, cur_feed, cur_feed_mode, cur_speed, selected_tool,
+         cur_tool, cur_plane, cur_motion, cur_transform, cur_cycle,
+         retract_r) = state
+        i_block = call_block
+        num_blocks = 0
+
+        for block in blocks:
+            if (call_block is None):
+                i_block = num_blocks
+                block_lines.append(block.line)
+            num_blocks += 1
+            for cmd in block.commands:
+                op = cmd.op
+                if (op == Opcode.AXES):
+                    # Axis words repeat the motion mode.
+                    if (cur_motion is None):
+                        continue
+                    op = cur_motion
+
+                if (op == Opcode.G90):
+                    dist_inc = False
+                elif (op == Opcode.G91):
+                    dist_inc = True
+                elif (op == Opcode.G17):
+                    cur_plane = PLANE_XY
+                elif (op == Opcode.G18):
+                    cur_plane = PLANE_ZX
+                elif (op == Opcode.G19):
+                    cur_plane = PLANE_YZ
+                elif (op == Opcode.G93):
+                    cur_feed_mode = FEED_MODE_INVTIME
+                elif (op == Opcode.G94):
+                    cur_feed_mode = FEED_MODE_UPMIN
+                elif (op == Opcode.G95):
+                    cur_feed_mode = FEED_MODE_UPREV
+                elif (op == Opcode.S):
+                    cur_speed = float(cmd.arg)
+                elif (op == Opcode.T):
+                    selected_tool = cmd.arg
+                elif (op == Opcode.M06):
+                    cur_tool = selected_tool
+                    change_block.append(i_block)
+                    change_tool.append(cur_tool)
+                elif (op == Opcode.M30):
+                    dist_inc = False
+                    cur_feed_mode = FEED_MODE_UPMIN
+                    cur_plane = PLANE_XY
+                    cur_motion = Opcode.G01
+                    cur_cycle = None
+                    offsets.select(1)
+                    cur_transform = set_transform()
+                elif ((op >= Opcode.G54) and (op <= Opcode.G59)):
+                    offsets.select(op - Opcode.G54 + 1)
+                    cur_transform = set_transform()
+                elif (op == Opcode.G20):
+                    offsets.set_units(INCH)
+                    cur_transform = set_transform()
+                elif (op == Opcode.G21):
+                    offsets.set_units(1.0)
+                    cur_transform = set_transform()
+                elif (op == Opcode.G49):
+                    offsets.set_tool_offset(None)
+                    cur_transform = set_transform()
+                elif (op == Opcode.G10):
+                    try:
+                        offsets.set_from(cmd)
+                    except ValueError:
+                        continue
+                    cur_transform = set_transform()
+                elif (op == Opcode.G43):
+                    if ((cmd.h is None) or (cmd.h < 0)):
+                        continue
+                    offsets.set_tool_offset(int(cmd.h))
+                    cur_transform = set_transform()
+                    if ((dist_inc is None) or ((cmd.x is None) 
+                            and (cmd.y is None) and (cmd.z is None))):
+                        continue
+                    # A move in the current motion mode, as in
+                    # MachineClient.set_tool_length_comp().
+                    xyz.append(nan if (cmd.x is None) else cmd.x)
+                    xyz.append(nan if (cmd.y is None) else cmd.y)
+                    xyz.append(nan if (cmd.z is None) else cmd.z)
+                    inc.append(dist_inc)
+                    motion.append(MOTION_MODE_RAPID 
+                                  if (cur_motion == Opcode.G00)
+                                  else MOTION_MODE_LINEAR)
+                    block_index.append(i_block)
+                    line_num.append(block.line)
+                    feed.append(cur_feed)
+                    feed_mode.append(cur_feed_mode)
+                    speed.append(cur_speed)
+                    tool.append(cur_tool)
+                    transform.append(cur_transform)
+                elif ((op == Opcode.G02) or (op == Opcode.G03)):
+                    cur_motion = op
+                    if ((cmd.f is not None) and (cur_feed_mode != UNDEFINED)):
+                        cur_feed = cmd.f
+                    if ((dist_inc is None) or (not cmd.has_arc_params())):
+                        # Not a valid arc, MachineClient does not move.
+                        continue
+
+                    arc_move.append(len(inc))
+                    arc_ijk.append(nan if (cmd.i is None) else cmd.i)
+                    arc_ijk.append(nan if (cmd.j is None) else cmd.j)
+                    arc_ijk.append(nan if (cmd.k is None) else cmd.k)
+                    arc_radius.append(nan if (cmd.r is None) else cmd.r)
+                    arc_plane.append(cur_plane)
+                    xyz.append(nan if (cmd.x is None) else cmd.x)
+                    xyz.append(nan if (cmd.y is None) else cmd.y)
+                    xyz.append(nan if (cmd.z is None) else cmd.z)
+                    inc.append(dist_inc)
+                    motion.append(MOTION_MODE_ARC_CW if (op == Opcode.G02)
+                                  else MOTION_MODE_ARC_CCW)
+                    block_index.append(i_block)
+                    line_num.append(block.line)
+                    feed.append(cur_feed)
+                    feed_mode.append(cur_feed_mode)
+                    speed.append(cur_speed)
+                    tool.append(cur_tool)
+                    transform.append(cur_transform)
+                elif ((op == Opcode.G00) or (op == Opcode.G01)):
+                    cur_motion = op
+                    if ((cmd.f is not None) and (op == Opcode.G01)
+                            and (cur_feed_mode != UNDEFINED)):
+                        cur_feed = cmd.f
+                    if ((dist_inc is None) or (not cmd.has_params())):
+                        continue
+                    if ((cmd.x is None) and (cmd.y is None)
+                            and (cmd.z is None)):
+                        # Feed rate only, the machine stays in place.
+                        continue
+
+                    xyz.append(nan if (cmd.x is None) else cmd.x)
+                    xyz.append(nan if (cmd.y is None) else cmd.y)
+                    xyz.append(nan if (cmd.z is None) else cmd.z)
+                    inc.append(dist_inc)
+                    motion.append(MOTION_MODE_RAPID if (op == Opcode.G00)
+                                  else MOTION_MODE_LINEAR)
+                    block_index.append(i_block)
+                    line_num.append(block.line)
+                    feed.append(cur_feed)
+                    feed_mode.append(cur_feed_mode)
+                    speed.append(cur_speed)
+                    tool.append(cur_tool)
+                    transform.append(cur_transform)
+                elif (op in CYCLE_OPS):
+                    if (cur_motion not in CYCLE_OPS):
+                        cur_cycle = (op, None, None, None, None)
+                    cur_motion = op
+                    cur_cycle = (op,
+                        cur_cycle[1] if (cmd.r is None) else cmd.r,
+                        cur_cycle[2] if (cmd.z is None) else cmd.z,
+                        cur_cycle[3] if (cmd.q is None) else cmd.q,
+                        cur_cycle[4] if (cmd.p is None) else cmd.p)
+                    if ((cmd.f is not None) and (cur_feed_mode != UNDEFINED)):
+                        cur_feed = cmd.f
+                    r, z, q, p = cur_cycle[1:]
+                    if ((dist_inc is None) or (r is None) or (z is None)):
+                        continue
+                    # The holes of a cycle mostly share the words, so the
+                    # template is looked up by them first.
+                    scale = offsets.transform[0]
+                    key = (cur_cycle, dist_inc, scale)
+                    template = template_keys.get(key)
+                    if (template is None):
+                        try:
+                            steps = make_template(op,
+                                (-z if (dist_inc) else r - z) * scale,
+                                None if (q is None) else q * scale, p)
+                        except ValueError:
+                            continue
+                        template = template_ids.get(steps)
+                        if (template is None):
+                            template = len(templates)
+                            template_ids[steps] = template
+                            templates.append(steps)
+                        template_keys[key] = template
+
+                    # The retract level of the holes when it does not
+                    # depend on where the block starts: the R plane, 
+                    # incrementally from the start for the first hole.
+                    # G98 in absolute mode retracts to the start unless
+                    # it is below the R plane, see resolve_positions().
+                    if (dist_inc):
+                        z_first = r if (retract_r) else max(0.0, r)
+                    else:
+                        z_first = r if (retract_r) else nan
+                    first = len(inc)
+                    for n in range(1 if (cmd.l is None) else int(cmd.l)):
+                        cycle_move.append(len(inc))
+                        cycle_first.append(first)
+                        cycle_r.append(r)
+                        cycle_retract_r.append(retract_r)
+                        cycle_template.append(template)
+                        xyz.append(nan if (cmd.x is None) else cmd.x)
+                        xyz.append(nan if (cmd.y is None) else cmd.y)
+                        xyz.append(z_first if ((n == 0) or (not dist_inc))
+                                   else 0.0)
+                        inc.append(dist_inc)
+                        motion.append(MOTION_MODE_CYCLE)
+                        block_index.append(i_block)
+                        line_num.append(block.line)
+                        feed.append(cur_feed)
+                        feed_mode.append(cur_feed_mode)
+                        speed.append(cur_speed)
+                        tool.append(cur_tool)
+                        transform.append(cur_transform)
+                elif (op == Opcode.G80):
+                    cur_cycle = None
+                    if (cur_motion in CYCLE_OPS):
+                        cur_motion = None
+                elif (op == Opcode.G98):
+                    retract_r = False
+                elif (op == Opcode.G99):
+                    retract_r = True
+                elif (op == Opcode.G28):
+                    # Homing: the given axes move to the machine origin.
+                    xyz.append(nan if (cmd.x is None) else 0.0)
+                    xyz.append(nan if (cmd.y is None) else 0.0)
+                    xyz.append(nan if (cmd.z is None) else 0.0)
+                    inc.append(False)
+                    motion.append(MOTION_MODE_RAPID)
+                    block_index.append(i_block)
+                    line_num.append(block.line)
+                    feed.append(cur_feed)
+                    feed_mode.append(cur_feed_mode)
+                    speed.append(cur_speed)
+                    tool.append(cur_tool)
+                    transform.append(0)
+                elif (op == Opcode.M98):
+                    state[:] = (dist_inc, cur_feed, cur_feed_mode, cur_speed,
+                                selected_tool, cur_tool, cur_plane,
+                                cur_motion, cur_transform, cur_cycle,
+                                retract_r)
+                    call(cmd, i_block, depth)
+                    (dist_inc, cur_feed, cur_feed_mode, cur_speed,
+                     selected_tool, cur_tool, cur_plane, cur_motion,
+                     cur_transform, cur_cycle, retract_r) = state
+                elif ((op == Opcode.M99) and (call_block is not None)):
+                    state[:] = (dist_inc, cur_feed, cur_feed_mode, cur_speed,
+                                selected_tool, cur_tool, cur_plane,
+                                cur_motion, cur_transform, cur_cycle,
+                                retract_r)
+                    return num_blocks
+
+        state[:] = (dist_inc, cur_feed, cur_feed_mode, cur_speed,
+                    selected_tool, cur_tool, cur_plane, cur_motion,
+                    cur_transform, cur_cycle, retract_r)
+        return num_blocks
+
+    def call(cmd, i_block, depth):
+        # Adds the moves of a subprogram call.
+        num, count = call_params(cmd)
+        body = None if (num is None) else program.get(num)
+        if ((body is None) or (depth >= MAX_DEPTH)):
+            return
+
+        relative = ((state[0] is True) and program.is_relative(num))
+        for i in range(count):
+            if (relative):
+                key = (num, tuple(state))
+                entry = replays.get(key)
+                if (entry is not None):
+                    (first, end, arc_first, arc_end, cycle_first_row,
+                     cycle_end, after) = entry
+                    offset = len(inc) - first
+                    xyz.extend(xyz[3 * first : 3 * end])
+                    inc.extend(inc[first:end])
+                    motion.extend(motion[first:end])
+                    block_index.extend(array("q", [i_block]) * (end - first))
+                    line_num.extend(line_num[first:end])
+                    feed.extend(feed[first:end])
+                    feed_mode.extend(feed_mode[first:end])
+                    speed.extend(speed[first:end])
+                    tool.extend(tool[first:end])
+                    transform.extend(transform[first:end])
+                    rows = arc_move[arc_first:arc_end]
+                    arc_move.extend(array("q", [row + offset for row in rows]))
+                    arc_ijk.extend(arc_ijk[3 * arc_first : 3 * arc_end])
+                    arc_radius.extend(arc_radius[arc_first:arc_end])
+                    arc_plane.extend(arc_plane[arc_first:arc_end])
+                    rows = cycle_move[cycle_first_row:cycle_end]
+                    cycle_move.extend(array("q", [row + offset
+                                                  for row in rows]))
+                    rows = cycle_first[cycle_first_row:cycle_end]
+                    cycle_first.extend(array("q", [row + offset
+                                                   for row in rows]))
+                    cycle_r.extend(cycle_r[cycle_first_row:cycle_end])
+                    cycle_retract_r.extend(
+                        cycle_retract_r[cycle_first_row:cycle_end])
+                    cycle_template.extend(
+                        cycle_template[cycle_first_row:cycle_end])
+                    state[:] = after
+                    continue
+                first = len(inc)
+                arc_first = len(arc_move)
+                cycle_first_row = len(cycle_move)
+                changes = len(change_block)
+                set_offsets = offset_changes[0]
+
+            run(body, i_block, depth + 1)
+
+            # Tool changes and offset changes are not copied, so bodies
+            # with them are always gone through.
+            if (relative and (len(change_block) == changes)
+                    and (offset_changes[0] == set_offsets)):
+                replays[key] = (first, len(inc), arc_first, len(arc_move),
+                                cycle_first_row, len(cycle_move),
+                                tuple(state))
+
+    num_blocks = run(program, None, 0)
+
+    return {
+        "xyz": np.frombuffer(xyz, dtype=np.float64).reshape(-1, 3),
+        "inc": np.frombuffer(inc, dtype=np.int8).astype(bool),
+        "motion": np.frombuffer(motion, dtype=np.int8),
+        "block": np.frombuffer(block_index, dtype=np.int64),
+        "line": np.frombuffer(line_num, dtype=np.int64),
+        "feed": np.frombuffer(feed, dtype=np.float64),
+        "feed_mode": np.frombuffer(feed_mode, dtype=np.int8),
+        "speed": np.frombuffer(speed, dtype=np.float64),
+        "tool": np.frombuffer(tool, dtype=np.int64),
+        "transform": np.frombuffer(transform, dtype=np.int64),
+        "transforms": np.array(transforms, dtype=np.float64),
+        "tool_changes": {
+            "block": np.frombuffer(change_block, dtype=np.int64),
+            "tool": np.frombuffer(change_tool, dtype=np.int64),
+        },
+        "arcs": {
+            "move": np.frombuffer(arc_move, dtype=np.int64),
+            "ijk": np.frombuffer(arc_ijk, dtype=np.float64).reshape(-1, 3),
+            "radius": np.frombuffer(arc_radius, dtype=np.float64),
+            "plane": np.frombuffer(arc_plane, dtype=np.int8),
+        },
+        "cycles": {
+            "move": np.frombuffer(cycle_move, dtype=np.int64),
+            "first": np.frombuffer(cycle_first, dtype=np.int64),
+            "r": np.frombuffer(cycle_r, dtype=np.float64),
+            "retract_r": np.frombuffer(cycle_retract_r,
+                                       dtype=np.int8).astype(bool),
+            "template": np.frombuffer(cycle_template, dtype=np.int64),
+        },
+        "templates": templates,
+        "num_blocks": num_blocks,
+        "block_lines": np.frombuffer(block_lines, dtype=np.int64),
+    }
+
+
+def pack_program(blocks):
+    """ Packs compiled blocks for extract_records() until a block needs
+    extract_moves() (see SERIAL_OPS).
+    Args:
+      blocks (iterable): compiled Block objects of a program.
+    Returns:
+      Tuple (data, words, rest): the records and the unknown command
+      words of block.pack_blocks(), and None if all blocks were packed,
+      otherwise an iterator of the blocks from the first one not packed.
+    """
+    data = bytearray()
+    words = list()
+    pending = list()
+    serial = SERIAL_OPS
+    blocks = iter(blocks)
+
+    for block in blocks:
+        for cmd in block.commands:
+            if (cmd.op in serial):
+                data += pack_blocks(pending, words)[0]
+                return data, words, itertools.chain((block,), blocks)
+        pending.append(block)
+        if (len(pending) >= PACK_BLOCKS):
+            data += pack_blocks(pending, words)[0]
+            pending.clear()
+
+    data += pack_blocks(pending, words)[0]
+    return data, words, None
+
+
+def fill_forward(num, rows, values, initial):
+    """ Gives the value of a mode at every record: the value set by the
+    last of the rows at or before the record.
+    Args:
+      num (int): number of records.
+      rows (int array): the records that set the mode, ascending.
+      values (array): the value set by each of them.
+      initial: the value before the first of them.
+    Returns:
+      An array of num values.
+    """
+    last = np.full(num, -1, dtype=np.int64)
+    last[rows] = np.arange(len(rows))
+    np.maximum.accumulate(last, out=last)
+    values = np.asarray(values)
+    if (len(values) == 0):
+        return np.full(num, initial, dtype=values.dtype)
+
+    return np.where(last >= 0, values[np.maximum(last, 0)], initial)
+
+
+def extract_records(data, words):
+    """ Collects the moves of a packed program into arrays like
+    extract_moves(), with array operations instead of a pass over the
+    commands: every mode (distance mode, plane, motion, feed rate and
+    its mode, spindle speed, tool) is filled forward from the commands
+    that set it. Only the offset commands, which are few, are gone
+    through one by one.
+    Args:
+      data (bytes-like): records of block.pack_blocks() of a whole
+        program.
+      words (list): unknown command words of the records.
+    Returns:
+      The dict of extract_moves(), or None if the program has
+      subprograms or canned cycles (see SERIAL_OPS).
+    """
+    records = np.frombuffer(data, dtype=RECORD_DTYPE)
+    op = records["op"]
+    if (np.any(np.isin(op, list(SERIAL_OPS)))):
+        return None
+
+    num = len(records)
+    flags = records["flags"]
+    values = records["values"]
+    is_op = lambda *ops: np.isin(op, ops)
+    m30 = (op == Opcode.M30)
+
+    # The modes at every record, after the record.
+    rows = np.flatnonzero(is_op(Opcode.G00, Opcode.G01, Opcode.G02,
+                                Opcode.G03) | m30)
+    cur_motion = fill_forward(num, rows,
+        np.where(m30[rows], Opcode.G01, op[rows]).astype(np.int16), -1)
+    # Axis words repeat the motion mode.
+    eff_op = np.where(op == Opcode.AXES, cur_motion, op)
+
+    rows = np.flatnonzero(is_op(Opcode.G90, Opcode.G91) | m30)
+    dist = fill_forward(num, rows,
+        (op[rows] == Opcode.G91).astype(np.int8), -1)
+    rows = np.flatnonzero(is_op(Opcode.G93, Opcode.G94, Opcode.G95) | m30)
+    mode_of = {Opcode.G93: FEED_MODE_INVTIME, Opcode.G94: FEED_MODE_UPMIN,
+               Opcode.G95: FEED_MODE_UPREV, Opcode.M30: FEED_MODE_UPMIN}
+    cur_feed_mode = fill_forward(num, rows, np.array(
+        [mode_of[code] for code in op[rows].tolist()], dtype=np.int8),
+        UNDEFINED)
+    rows = np.flatnonzero(is_op(Opcode.G17, Opcode.G18, Opcode.G19) | m30)
+    plane_of = {Opcode.G17: PLANE_XY, Opcode.G18: PLANE_ZX,
+                Opcode.G19: PLANE_YZ, Opcode.M30: PLANE_XY}
+    cur_plane = fill_forward(num, rows, np.array(
+        [plane_of[code] for code in op[rows].tolist()], dtype=np.int8),
+        UNDEFINED)
+    rows = np.flatnonzero(np.isin(eff_op, (Opcode.G01, Opcode.G02, 
+                                           Opcode.G03))
+                          & ((flags & FLAG_F) != 0)
+                          & (cur_feed_mode != UNDEFINED))
+    cur_feed = fill_forward(num, rows, values[rows, 3], 0.0)
+    rows = np.flatnonzero(op == Opcode.S)
+    cur_speed = fill_forward(num, rows,
+        records["arg"][rows].astype(np.float64), 0.0)
+    rows = np.flatnonzero(op == Opcode.T)
+    selected_tool = fill_forward(num, rows, records["arg"][rows], 0)
+    change_rows = np.flatnonzero(op == Opcode.M06)
+    change_tool = selected_tool[change_rows]
+    cur_tool = fill_forward(num, change_rows, change_tool, 0)
+
+    # Offsets and units.
+    offsets = OffsetTable()
+    transforms = [IDENTITY]
+    transform_ids = {IDENTITY: 0}
+    set_rows = list()
+    set_values = list()
+    rows = np.flatnonzero(is_op(*OFFSET_OPS))
+    commands = [cmd for block in unpack_blocks(records[rows].tobytes(), words)
+                for cmd in block.commands]
+    for row, cmd in zip(rows.tolist(), commands):
+        code = cmd.op
+        if ((code >= Opcode.G54) and (code <= Opcode.G59)):
+            offsets.select(code - Opcode.G54 + 1)
+        elif (code == Opcode.G20):
+            offsets.set_units(INCH)
+        elif (code == Opcode.G21):
+            offsets.set_units(1.0)
+        elif (code == Opcode.G49):
+            offsets.set_tool_offset(None)
+        elif (code == Opcode.G10):
+            try:
+                offsets.set_from(cmd)
+            except ValueError:
+                continue
+        elif (code == Opcode.G43):
+            if ((cmd.h is None) or (cmd.h < 0)):
+                continue
+            offsets.set_tool_offset(int(cmd.h))
+        else:
+            offsets.select(1)
+        key = offsets.transform
+        transform_id = transform_ids.get(key)
+        if (transform_id is None):
+            transform_id = len(transforms)
+            transform_ids[key] = transform_id
+            transforms.append(key)
+        set_rows.append(row)
+        set_values.append(transform_id)
+    cur_transform = fill_forward(num, np.array(set_rows, dtype=np.int64),
+        np.array(set_values, dtype=np.int64), 0)
+
+    # Main program blocks: a new block starts where the line changes.
+    line = records["line"].astype(np.int64)
+    new_block = np.ones(num, dtype=bool)
+    new_block[1:] = (line[1:] != line[:-1])
+    block_index = np.cumsum(new_block) - 1
+
+    # The moves, as extract_moves() makes them.
+    has_xyz = (flags & (FLAG_X | FLAG_Y | FLAG_Z)) != 0
+    dist_set = (dist >= 0)
+    linear = (np.isin(eff_op, (Opcode.G00, Opcode.G01)) & dist_set 
+              & has_xyz)
+    arc = (np.isin(eff_op, (Opcode.G02, Opcode.G03)) & dist_set
+           & ((flags & (FLAG_I | FLAG_J | FLAG_K | FLAG_R)) != 0))
+    tool_length = ((op == Opcode.G43) & ((flags & FLAG_H) != 0)
+                   & (values[:, 10] >= 0.0) & dist_set & has_xyz)
+    home = (op == Opcode.G28)
+    rows = np.flatnonzero(linear | arc | tool_length | home)
+
+    given = np.column_stack(((flags[rows] & FLAG_X) != 0,
+                             (flags[rows] & FLAG_Y) != 0,
+                             (flags[rows] & FLAG_Z) != 0))
+    is_home = home[rows]
+    xyz = np.where(given, np.where(is_home[:, np.newaxis], 0.0,
+                                   values[rows, 0:3]), np.nan)
+    row_op = eff_op[rows]
+    motion = np.select(
+        [is_home, tool_length[rows], row_op == Opcode.G00,
+         row_op == Opcode.G01, row_op == Opcode.G02],
+        [MOTION_MODE_RAPID,
+         np.where(cur_motion[rows] == Opcode.G00, MOTION_MODE_RAPID,
+                  MOTION_MODE_LINEAR),
+         MOTION_MODE_RAPID, MOTION_MODE_LINEAR, MOTION_MODE_ARC_CW],
+        MOTION_MODE_ARC_CCW).astype(np.int8)
+
+    arc_rows = rows[arc[rows]]
+    arc_flags = flags[arc_rows]
+    ijk = np.where(np.column_stack(((arc_flags & FLAG_I) != 0,
+                                    (arc_flags & FLAG_J) != 0,
+                                    (arc_flags & FLAG_K) != 0)),
+                   values[arc_rows, 4:7], np.nan)
+
+    return {
+        "xyz": xyz,
+        "inc": (dist[rows] == 1) & ~is_home,
+        "motion": motion,
+        "block": block_index[rows],
+        "line": line[rows],
+        "feed": cur_feed[rows],
+        "feed_mode": cur_feed_mode[rows].astype(np.int8),
+        "speed": cur_speed[rows],
+        "tool": cur_tool[rows].astype(np.int64),
+        "transform": np.where(is_home, 0, cur_transform[rows]),
+        "transforms": np.array(transforms, dtype=np.float64),
+        "tool_changes": {
+            "block": block_index[change_rows],
+            "tool": change_tool.astype(np.int64),
+        },
+        "arcs": {
+            "move": np.flatnonzero(arc[rows]),
+            "ijk": ijk,
+            "radius": np.where((arc_flags & FLAG_R) != 0,
+                               values[arc_rows, 7], np.nan),
+            "plane": cur_plane[arc_rows].astype(np.int8),
+        },
+        "cycles": {
+            "move": np.empty(0, dtype=np.int64),
+            "first": np.empty(0, dtype=np.int64),
+            "r": np.empty(0, dtype=np.float64),
+            "retract_r": np.empty(0, dtype=bool),
+            "template": np.empty(0, dtype=np.int64),
+        },
+        "templates": list(),
+        "num_blocks": int(block_index[-1]) + 1 if (num > 0) else 0,
+        "block_lines": line[new_block],
+    }
+
+
+def resolve_positions(moves, start=(0.0, 0.0, 0.0)):
+    """ Computes the absolute end position of every move in machine
+    coordinates. The coordinates are first transformed in batch with the
+    transform of every move (see offsets.apply_batch()). Incremental 
+    coordinates are then summed with a cumulative sum. Every absolute
+    coordinate resets the sum of its axis, and an axis that is not given
+    keeps its position.
+    The first hole of a G98 canned cycle block in absolute mode retracts
+    to where the block starts, or to the R plane if that is higher. The 
+    holes that start below their R plane are found after the sums, one 
+    at a time as raising one can raise the ones after it, and are summed
+    again with the R plane as their Z. Programs rarely have any.
+    Args:
+      moves (dict): moves from extract_moves().
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      N x 3 float64 array of end positions.
+    """
+    xyz = apply_batch(moves["xyz"], moves["inc"], moves["transforms"],
+                      moves["transform"])
+    ends = accumulate(xyz, moves["inc"], start)
+
+    cycles = moves["cycles"]
+    rows = cycles["move"]
+    pending = ((cycles["first"] == rows) & ~cycles["retract_r"]
+               & ~moves["inc"][rows])
+    if (not np.any(pending)):
+        return ends
+
+    rows = rows[pending]
+    used = moves["transforms"][moves["transform"][rows]]
+    r_levels = cycles["r"][pending] * used[:, 0] + used[:, 3]
+    while (True):
+        z_start = np.where(rows > 0, ends[rows - 1, 2], start[2])
+        low = np.flatnonzero(z_start < r_levels)
+        if (len(low) == 0):
+            return ends
+        n = low[0]
+        xyz[rows[n], 2] = r_levels[n]
+        ends = accumulate(xyz, moves["inc"], start)
+        rows = rows[n + 1:]
+        r_levels = r_levels[n + 1:]
+
+
+def accumulate(xyz, inc, start=(0.0, 0.0, 0.0)):
+    """ Sums the machine coordinates of moves into end positions, see
+    resolve_positions().
+    Args:
+      xyz (N x 3 array): machine coordinates, NaN if not given.
+      inc (N bool array): True for incremental moves.
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      N x 3 float64 array of end positions.
+    """
+    inc = inc[:, np.newaxis]
+    given = ~np.isnan(xyz)
+    rows = np.arange(len(xyz))[:, np.newaxis]
+
+    total = np.cumsum(np.where(given & inc, xyz, 0.0), axis=0)
+
+    # Absolute coordinates anchor the sum: position = anchor + total.
+    is_anchor = given & ~inc
+    anchor = np.where(is_anchor, xyz - total, 0.0)
+    last = np.maximum.accumulate(np.where(is_anchor, rows, -1), axis=0)
+    base = np.take_along_axis(anchor, np.maximum(last, 0), axis=0)
+    base = np.where(last >= 0, base, np.asarray(start, dtype=np.float64))
+
+    return base + total
+
+
+def order_axes(ends, start=(0.0, 0.0, 0.0)):
+    """ Splits every move into single-axis moves the way
+    MachineClient.move() does: when Z rises it moves first (then X, Y),
+    otherwise X and Y move first and Z last. Axis moves shorter than
+    MIN_MOVE are left out.
+    Note: unlike MachineClient, an axis whose move is left out still
+    ends up exactly at its target coordinate.
+    Args:
+      ends (N x 3 array): end positions from resolve_positions().
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      Tuple (points, index): points is an (M + 1) x 3 float64 array of
+      waypoints starting with the start position, index is an M array
+      with the move number each waypoint after the start belongs to.
+    """
+    num = len(ends)
+    if (num == 0):
+        return (np.asarray(start, dtype=np.float64).reshape(1, 3),
+                np.empty(0, dtype=np.int64))
+
+    begins = np.empty_like(ends)
+    begins[0:1] = start
+    begins[1:] = ends[:-1]
+
+    x0, y0, z0 = begins[:, 0], begins[:, 1], begins[:, 2]
+    x1, y1, z1 = ends[:, 0], ends[:, 1], ends[:, 2]
+    raising = (z1 >= z0)
+
+    # Three intermediate points per move, each moving a single axis.
+    steps = np.empty((num, 3, 3))
+    steps[:, 0] = np.where(raising[:, np.newaxis],
+                           np.column_stack((x0, y0, z1)),
+                           np.column_stack((x1, y0, z0)))
+    steps[:, 1] = np.where(raising[:, np.newaxis],
+                           np.column_stack((x1, y0, z1)),
+                           np.column_stack((x1, y1, z0)))
+    steps[:, 2] = ends
+
+    axis_delta = np.empty((num, 3))
+    axis_delta[:, 0] = np.where(raising, z1 - z0, x1 - x0)
+    axis_delta[:, 1] = np.where(raising, x1 - x0, y1 - y0)
+    axis_delta[:, 2] = np.where(raising, y1 - y0, z1 - z0)
+
+    keep = (np.abs(axis_delta) >= MIN_MOVE).reshape(-1)
+    points = np.concatenate((np.asarray(start, dtype=np.float64)[np.newaxis],
+                             steps.reshape(-1, 3)[keep]))
+    index = np.repeat(np.arange(num), 3)[keep]
+
+    return points, index
+
+
+def expand_arcs(moves, ends, points, index, start=(0.0, 0.0, 0.0)):
+    """ Replaces the single-axis moves of the arcs with their chords.
+    An arc that is not valid (see arcs.arc_sweep()) is taken as a
+    straight move to its end point.
+    Args:
+      moves (dict): moves from extract_moves().
+      ends (N x 3 array): end positions from resolve_positions().
+      points, index (arrays): waypoints from order_axes().
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      Tuple (points, index) like order_axes() returns.
+    """
+    arcs = moves["arcs"]
+    rows = arcs["move"]
+    if (len(rows) == 0):
+        return points, index
+
+    begins = np.where((rows > 0)[:, np.newaxis], ends[rows - 1],
+                      np.asarray(start, dtype=np.float64))
+    # Center offsets and radii are lengths: only scaled.
+    scale = moves["transforms"][moves["transform"][rows], 0]
+    ijk = arcs["ijk"]
+    has_offsets = ~np.all(np.isnan(ijk), axis=1)
+    offsets = np.nan_to_num(ijk) * scale[:, np.newaxis]
+    radius = arcs["radius"] * scale
+    chords = list()
+
+    for n, row in enumerate(rows.tolist()):
+        begin = tuple(begins[n].tolist())
+        end = tuple(ends[row].tolist())
+        axes = PLANE_AXES[int(arcs["plane"][n])]
+        clockwise = bool(moves["motion"][row] == MOTION_MODE_ARC_CW)
+        try:
+            center = arc_center(begin, end, axes, clockwise,
+                tuple(offsets[n].tolist()) if (has_offsets[n]) else None,
+                float(radius[n]))
+            chords.append(segment_arc(begin, end, center, axes, clockwise))
+        except ValueError:
+            chords.append(ends[row : row + 1])
+
+    counts = np.array([len(chord) for chord in chords], dtype=np.int64)
+    keep = ~np.isin(index, rows)
+    steps = np.concatenate((points[1:][keep], np.concatenate(chords)))
+    steps_index = np.concatenate((index[keep], np.repeat(rows, counts)))
+    order = np.argsort(steps_index, kind="stable")
+
+    return (np.concatenate((points[:1], steps[order])), steps_index[order])
+
+
+def expand_cycles(moves, ends, points, index, rapid, start=(0.0, 0.0, 0.0)):
+    """ Replaces the single-axis moves of the canned cycle holes with the
+    moves of their cycles (see cycles.py). The holes of a template are
+    expanded together.
+    Args:
+      moves (dict): moves from extract_moves().
+      ends (N x 3 array): end positions from resolve_positions().
+      points, index (arrays): waypoints from order_axes().
+      rapid (bool array): True for the rapid waypoints.
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      Tuple (points, index, rapid) like the arguments.
+    """
+    cycles = moves["cycles"]
+    rows = cycles["move"]
+    if (len(rows) == 0):
+        return points, index, rapid
+
+    start = np.asarray(start, dtype=np.float64)
+    begins = np.where((rows > 0)[:, np.newaxis], ends[rows - 1], start)
+    first = cycles["first"]
+    z_start = np.where(first > 0, ends[first - 1, 2], start[2])
+    used = moves["transforms"][moves["transform"][rows]]
+    r = cycles["r"] * used[:, 0]
+    r_levels = np.where(moves["inc"][rows], z_start + r, r + used[:, 3])
+
+    new_points = list()
+    new_index = list()
+    new_rapid = list()
+    templates = cycles["template"]
+    for template in np.unique(templates).tolist():
+        holes = np.flatnonzero(templates == template)
+        steps, hole, hole_rapid = expand_batch(begins[holes],
+            ends[rows[holes]], r_levels[holes],
+            moves["templates"][template], MIN_MOVE)
+        new_points.append(steps)
+        new_index.append(rows[holes][hole])
+        new_rapid.append(hole_rapid)
+
+    keep = ~np.isin(index, rows)
+    steps = np.concatenate([points[1:][keep]] + new_points)
+    steps_index = np.concatenate([index[keep]] + new_index)
+    steps_rapid = np.concatenate([rapid[keep]] + new_rapid)
+    order = np.argsort(steps_index, kind="stable")
+
+    return (np.concatenate((points[:1], steps[order])), steps_index[order],
+            steps_rapid[order])
+
+
+def build_toolpath(blocks, start=(0.0, 0.0, 0.0)):
+    """ Computes the toolpath of compiled blocks in batch. The blocks are
+    packed and extracted with extract_records() up to the first
+    subprogram call or canned cycle, and with extract_moves() if there
+    is one.
+    Args:
+      blocks (iterable): compiled Block objects, or a Subprograms of
+        them.
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      A dict with the "moves" from extract_moves(), the "ends" from
+      resolve_positions() and the "points" and "index" from
+      order_axes(), with the arcs split into chords by expand_arcs() and
+      the canned cycles expanded by expand_cycles(), and "rapid", True 
+      for the waypoints reached with a rapid move.
+    """
+    if (isinstance(blocks, Subprograms)):
+        return build_moves(extract_moves(blocks), start)
+
+    data, words, rest = pack_program(blocks)
+    if (rest is None):
+        moves = extract_records(data, words)
+    else:
+        moves = extract_moves(itertools.chain(unpack_blocks(data, words),
+                                              rest))
+    return build_moves(moves, start)
+
+
+def build_toolpath_records(data, words, start=(0.0, 0.0, 0.0)):
+    """ Computes the toolpath of a packed program in batch, e.g. the
+    records of the compiled program cache (see cache.load_records()).
+    Args:
+      data (bytes-like): records of block.pack_blocks().
+      words (list): unknown command words of the records.
+      start (tuple): X, Y, Z position before the first move.
+    Returns:
+      See build_toolpath().
+    """
+    moves = extract_records(data, words)
+    if (moves is None):
+        moves = extract_moves(unpack_blocks(data, words))
+    return build_moves(moves, start)
+
+
+def build_moves(moves, start=(0.0, 0.0, 0.0)):
+    """ Computes the toolpath of the moves of extract_moves() or
+    extract_records(), see build_toolpath(). """
+    ends = resolve_positions(moves, start)
+    points, index = order_axes(ends, start)
+    points, index = expand_arcs(moves, ends, points, index, start)
+    rapid = (moves["motion"][index] == MOTION_MODE_RAPID)
+    points, index, rapid = expand_cycles(moves, ends, points, index, rapid,
+                                         start)
+
+    return {"moves": moves, "ends": ends, "points": points, "index": index,
+            "rapid": rapid}
@@ -0,0 +1,278 @@
+#
+# Title: G-code interpreter program
+# File: validator.py
+# Description: Static check of the modal state of a compiled program.
+# Author: Arttu Räsänen (arttu.rasanen@protonmail.com
+# Date: 2022-02-01
+#
+# The errors that MachineClient reports during a run, such as a move
+# before the distance mode is set or a feed rate without a feed rate
+# mode, only depend on the modal commands before them. The validator
+# follows the active command of every modal group through the blocks in
+# one pass, without a machine and without output, and reports:
+#
+#  - Errors: the problems the machine would report at the same line
+#    (distance mode not set, unknown or unimplemented feed rate mode,
+#    negative spindle speed, arc without a radius or center offsets,
+#    unknown subprogram, too deep subprogram calls, M99 outside of a
+#    subprogram, G43 without H, G10 that cannot be carried out, canned
+#    cycle without R and Z or with a bad depth or peck, axis words
+#    without a motion mode), and two different commands of the same
+#    modal group in one block.
+#  - Warnings: moves before the units or arcs before the plane are
+#    selected, which the machine runs with a default.
+#
+# Problems that depend on the positions, like an arc radius too small for
+# its end point, are only found by running the program.
+#
+# Subprogram bodies are checked where they are called. A body only sets
+# modes, so a second run of it starts in the state it ends in: repeated
+# calls (L) are checked at most twice.
+#
+
+from block import Opcode, ModalGroup, MODAL_GROUPS
+from subprogram import Subprograms, MAX_DEPTH, call_params
+from offsets import OffsetTable
+from cycles import CYCLE_OPS, make_template
+
+# Kinds of the problems.
+ERROR = "Error"
+WARNING = "Warning"
+
+# Modal group of every opcode, indexed by the opcode.
+GROUPS = [MODAL_GROUPS.get(op, ModalGroup.NONE) for op in Opcode]
+# Commands of the same group that can be in one block: mist and flood
+# coolant, and G80 written in the safe start line with a motion command.
+COMPATIBLE = frozenset(
+    [(Opcode.M07, Opcode.M08), (Opcode.M08, Opcode.M07)]
+    + [pair for op in (Opcode.G00, Opcode.G01, Opcode.G02, Opcode.G03)
+       for pair in ((op, Opcode.G80), (Opcode.G80, op))])
+# Modes set by the program end (see MachineClient.program_end()).
+PROGRAM_END = (
+    (ModalGroup.COORD_SYSTEM, Opcode.G54),
+    (ModalGroup.PLANE, Opcode.G17),
+    (ModalGroup.DISTANCE, Opcode.G90),
+    (ModalGroup.FEED_MODE, Opcode.G94),
+    (ModalGroup.SPINDLE, Opcode.M05),
+    (ModalGroup.MOTION, Opcode.G01),
+    (ModalGroup.COOLANT, Opcode.M09),
+)
+# What the checks do with every opcode, indexed by the opcode.
+OTHER = 0
+MOVE = 1
+ARC = 2
+SPEED = 3
+END = 4
+CALL = 5
+RETURN = 6
+TOOL_LENGTH = 7
+OFFSET = 8
+CYCLE = 9
+REPEAT = 10
+ACTIONS = [OTHER] * len(Opcode)
+for _op, _action in ((Opcode.G00, MOVE), (Opcode.G01, MOVE),
+                     (Opcode.G02, ARC), (Opcode.G03, ARC),
+                     (Opcode.S, SPEED), (Opcode.M30, END),
+                     (Opcode.M98, CALL), (Opcode.M99, RETURN),
+                     (Opcode.G43, TOOL_LENGTH), (Opcode.G10, OFFSET),
+                     (Opcode.AXES, REPEAT)):
+    ACTIONS[_op] = _action
+for _op in CYCLE_OPS:
+    ACTIONS[_op] = CYCLE
+
+
+def validate_blocks(blocks):
+    """ Checks the modal state of a compiled program.
+    Args:
+      blocks (iterable): compiled Block objects of a program, with the
+        subprogram definitions (or a Subprograms).
+    Returns:
+      A list of (line, kind, message) tuples in the order of the lines
+      run, kind is ERROR or WARNING. A problem in a subprogram is
+      reported once, at the line of the body.
+    """
+    if (not isinstance(blocks, Subprograms)):
+        blocks = Subprograms(blocks)
+
+    groups = GROUPS
+    actions = ACTIONS
+    NONE = ModalGroup.NONE
+    DISTANCE = ModalGroup.DISTANCE
+    UNITS = ModalGroup.UNITS
+    FEED_MODE = ModalGroup.FEED_MODE
+    PLANE = ModalGroup.PLANE
+    MOTION = ModalGroup.MOTION
+    G00 = Opcode.G00
+    G80 = Opcode.G80
+    # Active opcode of every modal group, indexed by the group.
+    modal = [None] * len(ModalGroup)
+    # Only for checking the G10 commands.
+    offsets = OffsetTable()
+    # R, Z and Q words of the active canned cycle.
+    cycle = [None, None, None]
+    found = list()
+    seen = set()
+
+    def report(line, kind, message, *args):
+        key = (line, message, args)
+        if (key not in seen):
+            seen.add(key)
+            found.append((line, kind, message.format(*args)))
+
+    def check_feed(line):
+        feed_mode = modal[FEED_MODE]
+        if (feed_mode is None):
+            report(line, ERROR, "unknown feed rate mode")
+        elif (feed_mode != Opcode.G94):
+            report(line, ERROR, "feed rate mode {} not implemented",
+                   feed_mode.name)
+
+    def check_move(line):
+        if (modal[DISTANCE] is None):
+            report(line, ERROR, "distance mode not set")
+        if (modal[UNITS] is None):
+            report(line, WARNING, "units not set, move in undefined units")
+
+    def check_block(line, commands):
+        in_block = dict()
+        for cmd in commands:
+            group = groups[cmd.op]
+            if (group == NONE):
+                continue
+            other = in_block.setdefault(group, cmd.op)
+            if ((other != cmd.op) and ((other, cmd.op) not in COMPATIBLE)):
+                report(line, ERROR, "{} and {} in the same block ({} "
+                       "group)", other.name, cmd.op.name,
+                       group.name.lower().replace("_", " "))
+
+    def run(blocks, depth):
+        for block in blocks:
+            commands = block.commands
+            if (len(commands) > 1):
+                check_block(block.line, commands)
+
+            for cmd in commands:
+                op = cmd.op
+                group = groups[op]
+                action = actions[op]
+                if (group != NONE):
+                    if ((action == CYCLE) and (modal[group] not in CYCLE_OPS)):
+                        cycle[:] = (None, None, None)
+                    # G80 only ends a canned cycle, as in the machine; a
+                    # move or an arc stays the motion mode.
+                    if ((op != G80) or (modal[group] is None)
+                            or (modal[group] in CYCLE_OPS)):
+                        modal[group] = op
+                if (action == OTHER):
+                    continue
+
+                if (action == REPEAT):
+                    # Axis words: a command of the motion mode.
+                    op = modal[MOTION]
+                    if ((op is None) or (op == G80)):
+                        report(block.line, ERROR, "axis words without a "
+                               "motion mode")
+                        continue
+                    action = actions[op]
+
+                if (action == MOVE):
+                    if (not cmd.has_params()):
+                        continue
+                    if ((cmd.f is not None) and (op != G00)
+                            and (modal[FEED_MODE] != Opcode.G94)):
+                        check_feed(block.line)
+                    if ((modal[DISTANCE] is None) or (modal[UNITS] is None)):
+                        check_move(block.line)
+
+                elif (action == ARC):
+                    if ((not cmd.has_params()) and (not cmd.has_arc_params())):
+                        continue
+                    line = block.line
+                    if (cmd.f is not None):
+                        check_feed(line)
+                    if ((cmd.x is None) and (cmd.y is None)
+                            and (cmd.z is None)
+                            and (not cmd.has_arc_params())):
+                        continue
+                    check_move(line)
+                    if ((cmd.i is None) and (cmd.j is None)
+                            and (cmd.k is None) and (cmd.r is None)):
+                        report(line, ERROR, "arc needs a radius or center "
+                               "offsets")
+                    if (modal[PLANE] is None):
+                        report(line, WARNING, "plane not selected, arc in "
+                               "the X/Y plane")
+
+                elif (action == CYCLE):
+                    line = block.line
+                    if (cmd.f is not None):
+                        check_feed(line)
+                    check_move(line)
+                    if (cmd.r is not None):
+                        cycle[0] = cmd.r
+                    if (cmd.z is not None):
+                        cycle[1] = cmd.z
+                    if (cmd.q is not None):
+                        cycle[2] = cmd.q
+                    r, z, q = cycle
+                    if ((r is None) or (z is None)):
+                        report(line, ERROR, "canned cycle needs R and Z")
+                        continue
+                    try:
+                        make_template(op, (-z if (modal[DISTANCE] == Opcode.G91)
+                                           else r - z), q)
+                    except ValueError as e:
+                        report(line, ERROR, "{}", e)
+
+                elif (action == SPEED):
+                    if (cmd.arg < 0):
+                        report(block.line, ERROR, "spindle speed must be "
+                               "non-negative")
+
+                elif (action == END):
+                    for end_group, end_op in PROGRAM_END:
+                        modal[end_group] = end_op
+
+                elif (action == CALL):
+                    num, count = call_params(cmd)
+                    body = None if (num is None) else blocks_of(num)
+                    if (body is None):
+                        report(block.line, ERROR, "subprogram O{} not "
+                               "found", num)
+                    elif (depth >= MAX_DEPTH):
+                        report(block.line, ERROR, "more than {} nested "
+                               "subprogram calls", MAX_DEPTH)
+                    else:
+                        for i in range(min(count, 2)):
+                            run(body, depth + 1)
+
+                elif (action == TOOL_LENGTH):
+                    if ((cmd.h is None) or (cmd.h < 0)):
+                        report(block.line, ERROR, "tool length offset "
+                               "number (H) missing")
+                    elif ((cmd.x is not None) or (cmd.y is not None)
+                            or (cmd.z is not None)):
+                        check_move(block.line)
+
+                elif (action == OFFSET):
+                    try:
+                        offsets.set_from(cmd)
+                    except ValueError as e:
+                        report(block.line, ERROR, "{}", e)
+
+                elif (action == RETURN):
+                    if (depth == 0):
+                        report(block.line, ERROR, "M99 outside of a "
+                               "subprogram")
+                    else:
+                        return
+
+    blocks_of = blocks.get
+    run(blocks, 0)
+    return found
+
+
+def format_problems(found):
+    """ Formats the result of validate_blocks() as text lines. """
+    return ["line {}: {}, {}.".format(line, kind, message)
+            for line, kind, message in found]